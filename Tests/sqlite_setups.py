@@ -0,0 +1,33 @@
+import logging
+
+from text2network.classes.neo4jnw import neo4j_network
+from text2network.classes.sqlitedb import sqlite_database
+
+GRAPH_TYPES = ["networkx", "sparse"]
+
+
+def sqlite_network(tmp_path, graph_type, tokens, token_ids, ties):
+    """
+    Yields a semantic network on a SQLite database holding the given ties, and closes it afterwards.
+    Use with yield from in a fixture parametrized over GRAPH_TYPES.
+
+    Parameters
+    ----------
+    tmp_path: pathlib.Path
+        Folder of the database
+    graph_type: str
+        "networkx" or "sparse"
+    tokens: list of str
+    token_ids: list of int
+    ties: list of tuples (ego, alter, time, tie_dict), as passed to insert_edges
+    """
+    db = sqlite_database(str(tmp_path / "graph.sqlite"))
+    db.setup_neo_db(tokens, token_ids)
+    for tie in ties:
+        db.insert_edges(tie[0], [tie])
+    db.write_queue()
+    db.close()
+    nw = neo4j_network(backend="sqlite", database_path=str(tmp_path / "graph.sqlite"), graph_type=graph_type,
+                       logging_level=logging.NOTSET, neo_batch_size=10)
+    yield nw
+    nw.db.close()
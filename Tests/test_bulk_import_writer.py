@@ -0,0 +1,112 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+from text2network.processing.bulk_import_writer import bulk_import_writer
+from text2network.processing.edge_batch import edge_batch
+
+TOKENS = ["manager", "leader", "boss", "company"]
+TOKEN_IDS = [10, 11, 12, 13]
+
+# Writes the first query completely, then is killed while writing the second one
+KILLED_RUN = """
+import os, sys
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {tests!r})
+from test_bulk_import_writer import TOKENS, TOKEN_IDS, create_batch
+from text2network.processing.bulk_import_writer import bulk_import_writer
+writer = bulk_import_writer({folder!r}, shard_size=3)
+writer.setup_neo_db(TOKENS, TOKEN_IDS)
+writer.insert_edge_batch(create_batch(0))
+writer.write_queue()
+writer.checkpoint("query0")
+writer.setup_neo_db(TOKENS + ["team"], TOKEN_IDS + [14])
+writer.insert_edge_batch(create_batch(1))
+writer.write_queue()
+os._exit(1)
+"""
+
+
+def create_batch(query):
+    """Four ties of two sentences of a query"""
+    return edge_batch(ego=[10, 10, 11, 12], alter=[11, 12, 13, 10], time=[2000 + query] * 4,
+                      weight=[0.5, 0.25, 1.0, 0.75], seq_id=[1, 1, 2, 2], pos=[0, 0, 1, 1],
+                      run_index=[2 * query, 2 * query, 2 * query + 1, 2 * query + 1],
+                      part_of_speech=["NOUN", "NOUN", "VERB", "NOUN"], p1=["a", "a", "b", "b"])
+
+
+def read_group(folder, name):
+    with open(os.path.join(folder, "{}_header.csv".format(name)), "r", encoding="utf-8") as f:
+        header = f.read().strip().split(",")
+    files = sorted(x for x in os.listdir(folder) if x.startswith("{}_part".format(name)))
+    frames = [pd.read_csv(os.path.join(folder, x), header=None, keep_default_na=False) for x in files]
+    data = pd.concat(frames) if frames else pd.DataFrame(columns=range(len(header)))
+    # Every data row has one column per header entry
+    assert data.shape[1] == len(header)
+    data.columns = header
+    return data
+
+
+def test_header_and_columns(tmp_path):
+    folder = str(tmp_path / "import")
+    writer = bulk_import_writer(folder, shard_size=3, compress=False)
+    writer.setup_neo_db(TOKENS, TOKEN_IDS)
+    writer.insert_edge_batch(create_batch(0))
+    writer.close()
+
+    words = read_group(folder, "word")
+    assert words["token"].tolist() == TOKENS
+    db_ids = dict(zip(TOKEN_IDS, words[":ID(word)"].tolist()))
+    edges = read_group(folder, "edge")
+    assert list(edges.columns) == bulk_import_writer.headers['edge']
+    assert edges[":ID(edge)"].tolist() == [0, 1, 2, 3]
+    assert edges["weight:float"].tolist() == [0.5, 0.25, 1.0, 0.75]
+    assert edges["part_of_speech"].tolist() == ["NOUN", "NOUN", "VERB", "NOUN"]
+    assert edges["p1"].tolist() == ["a", "a", "b", "b"]
+    assert read_group(folder, "onto_ego")[":START_ID(word)"].tolist() == [db_ids[x] for x in [10, 10, 11, 12]]
+    assert read_group(folder, "onto_alter")[":END_ID(word)"].tolist() == [db_ids[x] for x in [11, 12, 13, 10]]
+    assert read_group(folder, "seq")[":END_ID(sequence)"].tolist() == [0, 0, 1, 1]
+    assert read_group(folder, "sequence")[":ID(sequence)"].tolist() == [0, 1]
+    assert read_group(folder, "part_of_speech")[":ID(part_of_speech)"].tolist() == ["NOUN", "VERB"]
+    # Shards hold at most shard_size rows
+    assert len([x for x in os.listdir(folder) if x.startswith("edge_part")]) == 2
+
+    with open(os.path.join(folder, "import_command.txt"), "r") as f:
+        command = f.read()
+    assert command.startswith("neo4j-admin database import full")
+    assert os.path.join(folder, "edge_part00001.csv") in command
+    with open(os.path.join(folder, "post_import.cypher"), "r") as f:
+        assert "ASSERT" not in f.read()
+
+
+def test_resume_after_kill(tmp_path):
+    folder = str(tmp_path / "import")
+    script = KILLED_RUN.format(root=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               tests=os.path.dirname(os.path.abspath(__file__)), folder=folder)
+    assert subprocess.run([sys.executable, "-c", script]).returncode == 1
+    # Rows of the second query were written, but not committed
+    assert len(read_group(folder, "edge")) == 8
+
+    writer = bulk_import_writer(folder, shard_size=3)
+    assert writer.has_step("query0") and not writer.has_step("query1")
+    assert len(read_group(folder, "edge")) == 4
+    writer.setup_neo_db(TOKENS + ["team"], TOKEN_IDS + [14])
+    writer.insert_edge_batch(create_batch(1))
+    writer.write_queue()
+    writer.checkpoint("query1")
+    writer.close()
+
+    edges = read_group(folder, "edge")
+    assert edges[":ID(edge)"].tolist() == list(range(8))
+    assert np.unique(edges["time:long"]).tolist() == [2000, 2001]
+    sequences = read_group(folder, "sequence")
+    assert sequences[":ID(sequence)"].tolist() == [0, 1, 2, 3]
+    words = read_group(folder, "word")
+    assert sorted(words["token"].tolist()) == sorted(TOKENS + ["team"])
+    assert len(np.unique(words[":ID(word)"])) == 5
+    assert read_group(folder, "part_of_speech")[":ID(part_of_speech)"].tolist() == ["NOUN", "VERB"]
+    for name in ["onto_ego", "onto_alter", "seq", "pos"]:
+        assert len(read_group(folder, name)) == 8
@@ -0,0 +1,39 @@
+import pytest
+
+from Tests.sqlite_setups import GRAPH_TYPES, sqlite_network as create_sqlite_network
+
+TOKENS = ["t_manager", "t_leader", "t_boss", "t_company", "t_team"]
+TOKEN_IDS = [1, 2, 3, 4, 5]
+
+
+def window_ties():
+    """Ties of single token sequences over four years"""
+    tie_dict = {'run_index': 1, 'pos': 0, 'part_of_speech': 'NOUN', 'sentiment': 0.1, 'subjectivity': 0.2}
+    ties = [(1, 2, 2000, 0.5), (1, 3, 2000, 0.25), (2, 4, 2001, 1.0), (1, 2, 2002, 0.5), (4, 5, 2002, 0.75),
+            (3, 5, 2003, 1.0), (1, 2, 2003, 0.25)]
+    return [(ego, alter, year, dict(tie_dict, weight=weight, seq_id=seq_id))
+            for seq_id, (ego, alter, year, weight) in enumerate(ties)]
+
+
+@pytest.fixture(params=GRAPH_TYPES)
+def sqlite_network(tmp_path, request):
+    yield from create_sqlite_network(tmp_path, request.param, TOKENS, TOKEN_IDS, window_ties())
+
+
+@pytest.mark.parametrize("arguments", [{}, {'tokens': ["t_leader"], 'depth': 1},
+                                       {'tokens': ["t_manager", "t_leader", "t_company"], 'keep_only_tokens': True}])
+def test_condition_windows(sqlite_network, arguments):
+    years = [2000, 2001, 2002, 2003]
+    windows = []
+    for year, window in sqlite_network.condition_windows(years, (1, 1), **arguments):
+        graph = sqlite_network.get_networkx_graph()
+        windows.append((year, window, sorted(graph.nodes), dict(((u, v), w) for u, v, w in graph.edges(data="weight"))))
+    assert [x[0:2] for x in windows] == [(2000, [2000, 2001]), (2001, [2000, 2001, 2002]),
+                                         (2002, [2001, 2002, 2003]), (2003, [2002, 2003])]
+
+    for year, window, nodes, ties in windows:
+        sqlite_network.decondition()
+        sqlite_network.condition(times=window, cond_type="subset", **arguments)
+        graph = sqlite_network.get_networkx_graph()
+        assert nodes == sorted(graph.nodes)
+        assert ties == pytest.approx(dict(((u, v), w) for u, v, w in graph.edges(data="weight")))
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from text2network.processing.edge_batch import edge_batch, encode_categories
+from text2network.processing.neo4j_insertion_interface import Neo4j_Insertion_Interface
+
+# Tokenizer ids and the database ids they translate to
+DB_ID_DICT = {10: 1, 11: 2, 12: 3, 13: 4, 14: 5}
+
+
+def create_batch():
+    return edge_batch(ego=[10, 10, 11, 12, 12, 12], alter=[11, 12, 10, 13, 14, 10], time=[2000] * 3 + [2001] * 3,
+                      weight=[0.5, 0.25, 1.0, 0.6, 0.3, 0.1], seq_id=[1, 1, 2, 3, 3, 3], pos=[0, 0, 1, 0, 0, 0],
+                      run_index=[5, 5, 5, 6, 6, 6], sentiment=[0.1, 0.1, 0.2, 0.0, 0.0, 0.0],
+                      subjectivity=[0.5, 0.5, 0.5, 0.0, 0.0, 0.0],
+                      part_of_speech=["NOUN", "NOUN", "VERB", "NOUN", "NOUN", "NOUN"],
+                      p1=["journal_a", "journal_a", "journal_a", "journal_b", "journal_b", "journal_b"])
+
+
+def create_interface():
+    """Insertion interface without database connection"""
+    interface = Neo4j_Insertion_Interface.__new__(Neo4j_Insertion_Interface)
+    interface.creation_statement = "CREATE"
+    interface.neo_queue = []
+    interface.queue_size = 100000
+    interface.unwind_size = 4
+    interface.db_id_dict = dict(DB_ID_DICT)
+    interface.update_translation_arrays()
+    return interface
+
+
+def test_encode_categories():
+    categories, codes = encode_categories(["b", "a", "b", 3])
+    assert categories.tolist() == ["3", "a", "b"]
+    assert codes.dtype == np.int32
+    assert categories[codes].tolist() == ["b", "a", "b", "3"]
+    categories, codes = encode_categories([])
+    assert len(categories) == len(codes) == 0
+
+
+def test_edge_batch_encoding():
+    batch = create_batch()
+    assert len(batch) == 6
+    assert batch.get_categories("part_of_speech").tolist() == ["NOUN", "VERB"]
+    assert batch.get_codes("part_of_speech").tolist() == [0, 0, 1, 0, 0, 0]
+    assert batch.get_values("p1").tolist() == ["journal_a"] * 3 + ["journal_b"] * 3
+    # Missing string columns are encoded as "0"
+    assert batch.get_categories("p2").tolist() == ["0"]
+    assert batch.get_values("p2").tolist() == ["0"] * 6
+
+    subset = batch.subset(batch.time == 2001)
+    assert subset.ego.tolist() == [12, 12, 12]
+    assert subset.get_values("p1").tolist() == ["journal_b"] * 3
+    assert subset.to_edgelist() == batch.to_edgelist()[3:]
+
+    merged = edge_batch.concatenate([batch.subset(slice(0, 2)), None, subset])
+    assert merged.get_categories("part_of_speech").tolist() == ["NOUN"]
+    assert merged.to_edgelist() == batch.to_edgelist()[0:2] + batch.to_edgelist()[3:]
+    assert len(edge_batch.concatenate([])) == 0
+
+    with pytest.raises(AssertionError):
+        edge_batch(ego=[1, 2], alter=[1], time=[1, 1], weight=[1, 1], seq_id=[1, 1], pos=[1, 1], run_index=[1, 1])
+
+
+def test_from_token_rows():
+    token_ids = np.array([10, 11, 12])
+    batch = edge_batch.from_token_rows(np.array([0, 0, 2]), np.array([11, 12, 13]), np.array([0.75, 0.25, 1.0]),
+                                       token_ids, np.array([2000, 2000, 2001]), np.array([7, 7, 8]),
+                                       np.array([0, 1, 0]), np.array([3, 3, 4]), np.array([0.12346, 0.0, 0.5]),
+                                       np.array([0.2, 0.0, 0.1]), np.array(["NOUN", "VERB", "ADJ"]),
+                                       np.array(["a", "a", "b"]), np.array(["0"] * 3), np.array(["0"] * 3),
+                                       np.array(["0"] * 3))
+    assert batch.ego.tolist() == [10, 10, 12]
+    assert batch.alter.tolist() == [11, 12, 13]
+    assert batch.time.tolist() == [2000, 2000, 2001]
+    assert batch.run_index.tolist() == [3, 3, 4]
+    assert batch.sentiment.tolist() == [0.1235, 0.1235, 0.5]
+    assert batch.get_values("part_of_speech").tolist() == ["NOUN", "NOUN", "ADJ"]
+    assert batch.get_values("p1").tolist() == ["a", "a", "b"]
+
+
+def test_translate_token_id_array():
+    interface = create_interface()
+    ids = [12, 10, 14, 10]
+    assert interface.translate_token_id_array(np.array(ids)).tolist() == interface.translate_token_ids(ids)
+    assert len(interface.translate_token_id_array([])) == 0
+    with pytest.raises(ValueError):
+        interface.translate_token_id_array([10, 99])
+    with pytest.raises(ValueError):
+        interface.translate_token_id_array([9])
+
+
+def unwind_ties(statement):
+    """Ties of an insert_edge_batch statement, as dicts in the format of the insert_edges parameters"""
+    params = statement['parameters']
+    ties = []
+    for i in range(len(params['ego'])):
+        tie = {name: params[name][i] for name in ["ego", "alter", "time", "weight", "seq_id", "pos", "run_index",
+                                                  "sentiment", "subjectivity"]}
+        tie.update({name: params["{}_categories".format(name)][params[name][i]] for name in
+                    edge_batch.categorical_columns})
+        ties.append(tie)
+    return ties
+
+
+def test_insert_edge_batch_parameters():
+    batch = create_batch()
+    interface = create_interface()
+    interface.insert_edge_batch(batch)
+    batch_statements = interface.neo_queue
+    # Ties are split into UNWIND statements of at most unwind_size ties
+    assert [len(x['parameters']['ego']) for x in batch_statements] == [4, 2]
+
+    interface = create_interface()
+    edgelist = batch.to_edgelist()
+    for ego in [10, 11, 12]:
+        interface.insert_edges(ego, [x for x in edgelist if x[0] == ego])
+    expected = [dict(tie, ego=x['parameters']['ego']) for x in interface.neo_queue for tie in
+                x['parameters']['ties']]
+
+    ties = [tie for x in batch_statements for tie in unwind_ties(x)]
+    assert [{name: tie[name] for name in expected[0]} for tie in ties] == expected
+    # The same optional parameters are written
+    for name in ["p1", "p2", "p3", "p4"]:
+        in_batch = "{}:".format(name) in batch_statements[0]['statement']
+        assert all([("{}:".format(name) in x['statement']) == in_batch for x in interface.neo_queue])
+    assert "p1:" in batch_statements[0]['statement'] and "p2:" not in batch_statements[0]['statement']
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from Tests.sqlite_setups import GRAPH_TYPES, sqlite_network as create_sqlite_network
+
+
+@pytest.fixture(params=GRAPH_TYPES)
+def sqlite_network(tmp_path, request):
+    random.seed(0)
+    tie_dict = {'weight': 0.5, 'pos': 0, 'part_of_speech': 'NOUN', 'sentiment': 0.1, 'subjectivity': 0.2}
+    ties = []
+    for seq_id in range(150):
+        ego = random.randint(1, 100)
+        ties.append((ego, random.randint(1, 100), 2000 + seq_id % 2, dict(tie_dict, run_index=seq_id, seq_id=seq_id)))
+    yield from create_sqlite_network(tmp_path, request.param, ["t{}".format(x) for x in range(100)],
+                                     list(range(1, 101)), ties)
+
+
+def count_queried_ids(network):
+    queried = []
+    query_multiple_nodes = network.db.query_multiple_nodes_columns
+
+    def counting_query(ids, *args, **kwargs):
+        queried.extend(ids)
+        return query_multiple_nodes(ids, *args, **kwargs)
+
+    network.db.query_multiple_nodes_columns = counting_query
+    return queried
+
+
+def conditioned_ties(network, **arguments):
+    network.decondition()
+    network.condition(**arguments)
+    graph = network.get_networkx_graph()
+    return sorted(graph.nodes), dict(((u, v), w) for u, v, w in graph.edges(data="weight"))
+
+
+def test_planned_search(sqlite_network):
+    arguments = {'times': [2000, 2001], 'tokens': ["t{}".format(x) for x in range(6)], 'depth': 1}
+    expected = conditioned_ties(sqlite_network, cond_type="subset", **arguments)
+    queried = count_queried_ids(sqlite_network)
+    assert conditioned_ties(sqlite_network, **arguments) == expected
+    # Six sparse ego networks are searched instead of querying the full vocabulary
+    assert 0 < len(queried) < 100
+
+
+def test_subset_reuses_year_graph(sqlite_network):
+    first = conditioned_ties(sqlite_network, times=[2000, 2001], tokens=["t1"], depth=2, cond_type="subset")
+    queried = count_queried_ids(sqlite_network)
+    second = conditioned_ties(sqlite_network, times=[2000, 2001], tokens=["t2", "t3"], depth=1, cond_type="subset")
+    assert len(queried) == 0
+    full = conditioned_ties(sqlite_network, times=[2000, 2001], tokens=["t2"], depth=None, cond_type="subset")
+    assert len(queried) == 0
+    assert conditioned_ties(sqlite_network, times=[2000, 2001], tokens=["t1"], depth=2, cond_type="search") == first
+    assert conditioned_ties(sqlite_network, times=[2000, 2001], tokens=["t2", "t3"], depth=1,
+                            cond_type="search") == second
+    assert conditioned_ties(sqlite_network, times=[2000, 2001]) == full
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import tables
+
+from text2network.utils import get_uniques as get_uniques_module
+from text2network.utils.get_uniques import get_uniques
+
+
+def create_database(db_file, years, sources):
+    class sequence(tables.IsDescription):
+        run_index = tables.UInt32Col()
+        text = tables.StringCol(40)
+        year = tables.UInt32Col()
+        p1 = tables.StringCol(40)
+
+    with tables.open_file(db_file, mode="w") as hdf:
+        table = hdf.create_table(hdf.create_group("/", "textdata"), "table", sequence)
+        rows = np.zeros(len(years), dtype=table.description._v_dtype)
+        rows['run_index'] = np.arange(len(years))
+        rows['year'] = years
+        rows['p1'] = sources
+        table.append(rows)
+
+
+def test_get_uniques(tmp_path):
+    db_file = str(tmp_path / "db.h5")
+    create_database(db_file, [2001, 2000, 2001, 2000, 2002], [b"a", b"b", b"a", b"a", b"b"])
+
+    uniques = get_uniques(["year"], db_file, chunk_size=2)
+    assert uniques["year"] == [2000, 2001, 2002]
+    assert uniques["query_filename"] == [("(year == 2000)", "2000"), ("(year == 2001)", "2001"),
+                                         ("(year == 2002)", "2002")]
+
+    uniques = get_uniques(["year", "p1"], db_file, chunk_size=2)
+    assert uniques["p1"] == [b"a", b"b"]
+    assert uniques["query"] == ["(year == 2000) & (p1 == b'a')", "(year == 2000) & (p1 == b'b')",
+                                "(year == 2001) & (p1 == b'a')", "(year == 2002) & (p1 == b'b')"]
+    assert uniques["file"] == ["2000-a", "2000-b", "2001-a", "2002-b"]
+
+    # Cached next to the database until it changes
+    assert len([x for x in os.listdir(str(tmp_path)) if x.startswith("db.h5.uniques")]) == 2
+    assert get_uniques(["year"], db_file)["year"] == [2000, 2001, 2002]
+    create_database(db_file, [1999], [b"c"])
+    assert get_uniques(["year"], db_file)["year"] == [1999]
+
+
+def test_split_index_cache_stamp(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "db.h5")
+    create_database(db_file, [2001, 2000], [b"a", b"b"])
+    reads = []
+    read_split_index = get_uniques_module.read_split_index
+
+    def counted_read(*args, **kwargs):
+        reads.append(args)
+        return read_split_index(*args, **kwargs)
+
+    monkeypatch.setattr(get_uniques_module, "read_split_index", counted_read)
+
+    assert get_uniques(["year"], db_file)["year"] == [2000, 2001]
+    assert get_uniques(["year"], db_file)["year"] == [2000, 2001]
+    assert len(reads) == 1
+    # A touched database is read once more, then the cache holds its new modification time
+    stat = os.stat(db_file)
+    os.utime(db_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert get_uniques(["year"], db_file)["year"] == [2000, 2001]
+    assert get_uniques(["year"], db_file)["year"] == [2000, 2001]
+    assert len(reads) == 2
@@ -0,0 +1,116 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import networkx as nx
+
+from text2network.classes.sparse_graph import sparse_graph
+from text2network.utils.graph_cache import graph_cache, graph_to_arrays, arrays_to_graph
+
+
+def get_graph():
+    graph = nx.DiGraph()
+    graph.add_nodes_from([(5, {'token': 't_manager', 'freq': 3}), (2, {'token': 't_leader'}), (7, {'token': 't_boss'})])
+    graph.add_edge(5, 2, weight=0.5, time=2000, pos="None", sentiment=0.1)
+    graph.add_edge(2, 5, weight=1.5, time=2000, pos="None", sentiment=0.2)
+    graph.add_edge(5, 7, weight=0.25, time=2001, pos="NOUN")
+    return graph
+
+
+def assert_equal_graphs(graph, other):
+    assert dict(graph.nodes(data=True)) == dict(other.nodes(data=True))
+    assert {(u, v): d for u, v, d in graph.edges(data=True)} == {(u, v): d for u, v, d in other.edges(data=True)}
+
+
+def test_graph_arrays():
+    graph = get_graph()
+    arrays = graph_to_arrays(graph)
+    assert arrays['indptr'].tolist() == [0, 2, 3, 3]
+    assert_equal_graphs(graph, arrays_to_graph(arrays))
+
+
+def test_graph_cache(tmp_path):
+    cache = graph_cache(str(tmp_path))
+    graph = get_graph()
+    key = cache.make_key({'times': [2000], 'tokens': None}, ("db", "1"))
+    assert key == cache.make_key({'tokens': None, 'times': [2000]}, ("db", "1"))
+    assert key != cache.make_key({'times': [2000], 'tokens': None}, ("db", "2"))
+    assert cache.get(key) is None
+
+    cache.put(key, graph, ("db", "1"), {'cond_dict': {'years': [2000]}})
+    cached_graph, metadata = cache.get(key)
+    assert_equal_graphs(graph, cached_graph)
+    assert metadata['cond_dict']['years'] == [2000]
+
+    # A newer version of the database removes outdated entries
+    new_key = cache.make_key({'times': [2000], 'tokens': None}, ("db", "2"))
+    cache.put(new_key, graph, ("db", "2"))
+    assert cache.get(key) is None
+    assert cache.get(new_key) is not None
+
+
+def test_graph_cache_eviction(tmp_path):
+    cache = graph_cache(str(tmp_path), max_size=1)
+    graph = get_graph()
+    keys = [cache.make_key({'times': [x]}, ("db", "1")) for x in range(3)]
+    for key in keys:
+        cache.put(key, graph, ("db", "1"))
+    # The most recent entry is always kept
+    assert [cache.get(key) is not None for key in keys] == [False, False, True]
+
+
+def test_graph_cache_sparse(tmp_path):
+    cache = graph_cache(str(tmp_path))
+    graph = sparse_graph.from_networkx(get_graph())
+    key = cache.make_key({'times': [2000], 'graph_type': "sparse"}, ("db", "1"))
+    cache.put(key, graph, ("db", "1"))
+    cached_graph, _ = cache.get(key)
+    assert isinstance(cached_graph, sparse_graph)
+    assert_equal_graphs(get_graph(), cached_graph.to_networkx())
+
+
+def test_graph_cache_index(tmp_path):
+    graph = get_graph()
+    key = graph_cache.make_key({'times': [2000]}, ("db", "1"))
+    graph_cache(str(tmp_path)).put(key, graph, ("db", "1"))
+    # The index is read from the folder, and not kept by the instance
+    cache = graph_cache(str(tmp_path))
+    assert cache.load_index() == {key: {'database': "db", 'version': "1"}}
+    cache.put(graph_cache.make_key({'times': [2000]}, ("db", "2")), graph, ("db", "2"))
+    assert cache.get(key) is None
+    assert key not in cache.load_index()
+    cache.clear()
+    assert cache.load_index() == {}
+
+
+def test_graph_cache_concurrent_put(tmp_path):
+    graph = get_graph()
+
+    def put(key, version):
+        # Each worker has its own instance, as processes mapping over years do
+        graph_cache(str(tmp_path)).put(key, graph, ("db", version))
+
+    for version in ["1", "2"]:
+        keys = [graph_cache.make_key({'times': [x]}, ("db", version)) for x in range(64)]
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(lambda key: put(key, version), keys))
+        # No entry is lost, and entries of the previous version are removed
+        cache = graph_cache(str(tmp_path))
+        assert sorted(cache.load_index()) == sorted(keys)
+        assert all([cache.get(key) is not None for key in keys])
+        assert sorted(x.stem for x in tmp_path.iterdir() if x.suffix == ".npz") == sorted(keys)
+        assert not [x for x in tmp_path.iterdir() if x.suffix == ".tmp"]
+
+
+def test_graph_cache_evict_keep(tmp_path):
+    cache = graph_cache(str(tmp_path), max_size=1)
+    graph = get_graph()
+    keys = [cache.make_key({'times': [x]}, ("db", "1")) for x in range(2)]
+    cache.put(keys[0], graph, ("db", "1"))
+    cache.put(keys[1], graph, ("db", "1"))
+    # An entry added by another process is more recent than the one just added
+    cache.max_size = 10 ** 9
+    cache.put(keys[0], graph, ("db", "1"))
+    os.utime(cache.filename(keys[0]), (0, 0))
+    cache.max_size = 1
+    cache.evict(keep=keys[0])
+    assert list(cache.load_index()) == [keys[0]]
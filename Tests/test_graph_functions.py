@@ -1,3 +1,114 @@
+import networkx as nx
+import numpy as np
 import pytest
 
+from text2network.classes.sparse_graph import sparse_graph
+from text2network.functions import graph_clustering
+from text2network.functions.backout_measure import backout_measure
+from text2network.functions.graph_clustering import consensus_louvain, cluster_distances
+from text2network.functions.network_tools import make_symmetric
 from text2network.utils.file_helpers import check_create_folder
+
+
+def get_directed_graph():
+    graph = nx.DiGraph()
+    graph.add_edge(1, 2, weight=0.5, time=2000)
+    graph.add_edge(2, 1, weight=1.5, time=2000)
+    graph.add_edge(1, 3, weight=0.25, time=2001)
+    graph.add_edge(3, 3, weight=1.0, time=2001)
+    return graph
+
+
+@pytest.mark.parametrize("technique,expected", [
+    ("avg-sym", {(1, 2): 1.0, (1, 3): 0.125, (3, 3): 1.0}),
+    ("sum", {(1, 2): 2.0, (1, 3): 0.25, (3, 3): 1.0}),
+    ("min-sym", {(1, 2): 0.5, (3, 3): 1.0}),
+    ("max-sym", {(1, 2): 1.5, (1, 3): 0.25, (3, 3): 1.0}),
+    ("min-sym-avg", {(1, 2): 1.0, (3, 3): 1.0})])
+def test_make_symmetric(technique, expected):
+    for graph in [get_directed_graph(), sparse_graph.from_networkx(get_directed_graph())]:
+        symmetric = make_symmetric(graph, technique)
+        if isinstance(symmetric, sparse_graph):
+            symmetric = symmetric.to_networkx()
+        assert not nx.is_directed(symmetric)
+        assert {tuple(sorted((u, v))): w for u, v, w in symmetric.edges(data="weight")} == pytest.approx(expected)
+        # Other edge attributes are retained
+        assert all(['time' in d for u, v, d in symmetric.edges(data=True)])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_consensus_louvain(workers):
+    graph = nx.planted_partition_graph(4, 20, 0.5, 0.01, seed=2, directed=True)
+    nx.set_edge_attributes(graph, 1.0, "weight")
+    clusters = consensus_louvain(graph, iterations=4, workers=workers, seed=1)
+    assert sorted([sorted(x) for x in clusters]) == [list(range(i * 20, (i + 1) * 20)) for i in range(4)]
+
+
+def test_consensus_louvain_sequential_default(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("Process pool created")
+
+    monkeypatch.setattr(graph_clustering, "ProcessPoolExecutor", no_pool)
+    graph = nx.planted_partition_graph(2, 10, 0.8, 0.01, seed=2)
+    nx.set_edge_attributes(graph, 1.0, "weight")
+    clusters = consensus_louvain(graph, iterations=4, seed=1)
+    assert sorted([sorted(x) for x in clusters]) == [list(range(0, 10)), list(range(10, 20))]
+    with pytest.raises(AssertionError):
+        consensus_louvain(graph, iterations=4, workers=2, seed=1)
+
+
+@pytest.mark.parametrize("block_size", [1, None])
+def test_cluster_distances(block_size):
+    graph = get_directed_graph()
+    graph.add_node(4)
+    clusters = cluster_distances(graph, {'a': [1, 4], 'b': [2, 3]}, block_size=block_size)
+    assert sorted(clusters.edges) == [('a', 'b'), ('b', 'a')]
+    ties = clusters['a']['b']
+    # Ties from 1 to 2 and 3, missing ties from 4 count as zero
+    assert ties['weight'] == pytest.approx(0.1875)
+    assert (ties['min'], ties['max']) == (0, 0.5)
+    assert ties['std0'] == pytest.approx((0.5 + 0.25) / 2 ** 0.5 / 2)
+    assert ties['std1'] == pytest.approx(0.125 * 2 ** 0.5 / 2)
+    assert (ties['min_dyad'], ties['max_dyad']) == ((4, 2), (1, 2))
+    ties = clusters['b']['a']
+    assert ties['weight'] == pytest.approx(0.375)
+    assert ties['std0'] == pytest.approx(ties['std1']) == pytest.approx(1.5 / 2 ** 0.5 / 2)
+    assert (ties['min_dyad'], ties['max_dyad']) == ((2, 4), (2, 1))
+
+
+@pytest.mark.parametrize("method", ["invert", "series", "gmres", "bicgstab"])
+def test_backout_measure(method):
+    graph = sparse_graph.from_networkx(get_directed_graph())
+    adjacency = graph.adjacency().toarray()
+    expected = np.linalg.inv(np.eye(3) - 0.2 * adjacency)
+    np.fill_diagonal(expected, 0)
+    backout = backout_measure(graph, decay=0.2, method=method, stopping=100, tol=1e-10)
+    assert isinstance(backout, sparse_graph)
+    assert backout.adjacency().toarray() == pytest.approx(expected, abs=1e-8)
+
+    # Strongest tie of the first node only
+    backout = backout_measure(graph, decay=0.2, method=method, stopping=100, tol=1e-10, rows=[1], top_k=1)
+    assert backout.number_of_edges() == 1 and backout.has_edge(1, 2)
+    assert backout[1][2]['weight'] == pytest.approx(expected[0, 1], abs=1e-8)
+
+
+@pytest.mark.parametrize("method", ["invert", "series", "gmres", "bicgstab"])
+@pytest.mark.parametrize("directed", [True, False])
+def test_backout_measure_networkx(method, directed):
+    graph = get_directed_graph()
+    if not directed:
+        graph = make_symmetric(graph, "sum")
+    adjacency = nx.to_numpy_array(graph, nodelist=[1, 2, 3])
+    expected = np.linalg.inv(np.eye(3) - 0.2 * adjacency)
+    np.fill_diagonal(expected, 0)
+    for nodelist in [None, [1, 2, 3]]:
+        backout = backout_measure(graph, nodelist=nodelist, decay=0.2, method=method, stopping=100, tol=1e-10)
+        assert nx.is_directed(backout) == directed
+        assert nx.to_numpy_array(backout, nodelist=[1, 2, 3]) == pytest.approx(expected, abs=1e-8)
+
+    # Subgraph of the first two nodes
+    expected = np.linalg.inv(np.eye(2) - 0.2 * adjacency[0:2, 0:2])
+    np.fill_diagonal(expected, 0)
+    backout = backout_measure(graph, nodelist=[1, 2], decay=0.2, method=method, stopping=100, tol=1e-10)
+    assert sorted(backout.nodes) == [1, 2]
+    assert nx.to_numpy_array(backout, nodelist=[1, 2]) == pytest.approx(expected, abs=1e-8)
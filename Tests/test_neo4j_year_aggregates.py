@@ -0,0 +1,108 @@
+import threading
+
+from text2network.classes.neo4db import neo4j_database
+
+
+class recording_database(neo4j_database):
+    """
+    neo4j_database without server, which keeps the edge times and year_aggregate nodes written by its queries
+    """
+
+    def __init__(self):
+        self.aggregate_operator = "SUM"
+        self.year_aggregates = None
+        self.year_aggregate_checks = {}
+        self.neo4j_connection = "bolt://recording"
+        self.neo_queue = []
+        self.queue_size = 100000
+        self.queue_lock = threading.RLock()
+        self.db_id_dict = {1: 1, 2: 2, 3: 3}
+        self.creation_statement = "CREATE"
+        self.edge_times = []
+        self.aggregate_nodes = {}
+        self.rebuilt = []
+        self.edge_counts = 0
+
+    def write_queue(self):
+        for statement in self.neo_queue:
+            params = statement.get('parameters', {})
+            if "UNWIND $ties" in statement['statement']:
+                self.edge_times.extend([x['time'] for x in params['ties']])
+            elif statement['statement'].startswith("MERGE (y:year_aggregate"):
+                self.aggregate_nodes[params['time']] = params['nr']
+            elif "CREATE (a)-[:year_tie" in statement['statement']:
+                self.rebuilt.append(params['time'])
+        self.neo_queue = []
+
+    def receive_query(self, query, params=None):
+        if query.startswith("MATCH (y:year_aggregate)"):
+            return [{'time': x, 'nr': y} for x, y in self.aggregate_nodes.items()]
+        if query == "MATCH (r:edge) RETURN count(r) AS nr":
+            return [{'nr': len(self.edge_times)}]
+        if query == "MATCH (w:word) RETURN count(w) AS nr":
+            return [{'nr': len(self.db_id_dict)}]
+        if query.startswith("MATCH (r:edge) WHERE r.time IN $times"):
+            self.edge_counts += 1
+            return [{'time': x, 'nr': self.edge_times.count(x)} for x in set(self.edge_times) if x in params['times']]
+        raise NotImplementedError(query)
+
+
+def insert(db, time, alters):
+    tie_dict = {'weight': 0.5, 'seq_id': 1, 'pos': 0, 'run_index': 1}
+    db.insert_edges(1, [(1, x, time, tie_dict) for x in alters])
+
+
+def test_insert_after_build():
+    db = recording_database()
+    insert(db, 2000, [2, 3])
+    insert(db, 2001, [2])
+    db.write_queue()
+    assert not db.has_year_aggregates([2000, 2001])
+
+    db.build_year_aggregates([2000, 2001])
+    assert db.aggregate_nodes == {2000: 2, 2001: 1}
+    assert db.has_year_aggregates([2000, 2001])
+
+    # Ties queued in this process
+    insert(db, 2001, [3])
+    assert db.has_year_aggregates([2000])
+    assert not db.has_year_aggregates([2001])
+    db.write_queue()
+    assert not db.has_year_aggregates([2000, 2001])
+
+    # Ties inserted by another process, after the aggregates were loaded
+    db.build_year_aggregates([2000, 2001])
+    assert db.rebuilt == [2000, 2001, 2001]
+    assert db.has_year_aggregates([2000, 2001])
+    db.edge_times.append(2000)
+    assert not db.has_year_aggregates([2000, 2001])
+    assert db.has_year_aggregates([2001])
+
+    db.build_year_aggregates([2000, 2001])
+    assert db.rebuilt == [2000, 2001, 2001, 2000]
+    assert db.aggregate_nodes == {2000: 3, 2001: 2}
+    assert db.has_year_aggregates([2000, 2001])
+
+
+def test_no_aggregates_for_operator():
+    db = recording_database()
+    insert(db, 2000, [2])
+    db.build_year_aggregates([2000])
+    db.aggregate_operator = "MAX"
+    assert not db.has_year_aggregates([2000])
+
+
+def test_check_cached_by_version():
+    db = recording_database()
+    insert(db, 2000, [2, 3])
+    db.build_year_aggregates([2000])
+    counts = db.edge_counts
+    # Queried once per batch of ids, but only counted once per database version
+    for i in range(5):
+        assert db.has_year_aggregates([2000])
+    assert db.edge_counts == counts + 1
+
+    db.edge_times.append(2000)
+    assert not db.has_year_aggregates([2000])
+    assert not db.has_year_aggregates([2000])
+    assert db.edge_counts == counts + 2
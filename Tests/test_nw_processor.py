@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+import torch
+from transformers import BertConfig, BertForMaskedLM
+
+from text2network.processing.nw_processor import nw_processor
+
+PAD, CLS, SEP, MASK = 0, 1, 2, 3
+VOCAB_SIZE = 40
+DELWORDS = [4, 5]
+# Sentences of different lengths, padded to the longest one
+SENTENCES = [[CLS, 6, 7, 4, 8, 9, SEP], [CLS, 10, 11, SEP], [CLS, 12, 6, 7, 5, SEP], [CLS, 13, 14, 15, 16, 17, SEP]]
+CUTOFFS = [(100, 100, 0), (100, 5, 0), (80, 100, 0), (60, 4, 0), (90, 100, 0.05), (100, 8, 0.1)]
+
+
+@pytest.fixture(scope="module")
+def bert():
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=VOCAB_SIZE, hidden_size=16, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=32, max_position_embeddings=16, pad_token_id=PAD)
+    bert = BertForMaskedLM(config).eval()
+    # Peaked distributions, such that cutoffs retain few ties
+    with torch.no_grad():
+        bert.cls.predictions.decoder.weight.mul_(20)
+    return bert
+
+
+def create_tokens(sentences):
+    tokens = torch.full([len(sentences), max(len(x) for x in sentences)], PAD, dtype=torch.long)
+    for i, sentence in enumerate(sentences):
+        tokens[i, :len(sentence)] = torch.tensor(sentence)
+    return tokens
+
+
+def token_ids_of(sentences):
+    return torch.tensor([x for sentence in sentences for x in sentence[1:-1]])
+
+
+def sequence_predictions(bert, tokens):
+    """Probabilities of each masked token, running BERT separately for each sentence and token"""
+    predictions = []
+    with torch.no_grad():
+        for text in tokens:
+            seq_length = int(torch.sum(text != PAD))
+            for position in range(1, seq_length - 1):
+                inputs = text[:seq_length].clone()
+                inputs[position] = MASK
+                logits = bert(inputs.unsqueeze(0))[0][0, position, :]
+                predictions.append(torch.softmax(logits, dim=-1))
+    return torch.stack(predictions)
+
+
+def sequence_ties(predictions, token_ids, delwords, id_mask=None, own_tie=True, percent=100, max_degree=100,
+                  min_probability=0, zero_min=True):
+    """Ties as created token by token with calculate_cutoffs and get_weighted_edgelist"""
+    processor = nw_processor.__new__(nw_processor)
+    processor.normalize_ties = True
+    ties = []
+    for row, token in enumerate(token_ids.tolist()):
+        if token in delwords:
+            continue
+        replacement = predictions[row, :].numpy().astype(np.float64).flatten()
+        if not own_tie:
+            replacement[token] = 0
+        if zero_min:
+            replacement[replacement == np.min(replacement)] = 0
+        replacement[delwords] = 0
+        if id_mask is not None:
+            replacement[id_mask] = 0
+        replacement = processor.norm(replacement, min_zero=False)
+        cutoff_number, cutoff_probability = processor.calculate_cutoffs(replacement, method="percent",
+                                                                        percent=percent, max_degree=max_degree)
+        edges = processor.get_weighted_edgelist(token, replacement, 2000, cutoff_number, cutoff_probability,
+                                                max_degree=max_degree, min_probability=min_probability)
+        ties.extend([(row, x[1], x[3]['weight']) for x in edges if x[3]['weight'] > 0])
+    return ties
+
+
+def assert_same_ties(edges, expected):
+    rows, alters, weights = edges
+    assert [(x, y) for x, y in zip(rows.tolist(), alters.tolist())] == [(x[0], x[1]) for x in expected]
+    assert weights.tolist() == pytest.approx([x[2] for x in expected], abs=1e-5)
+
+
+@pytest.mark.parametrize("token_budget", [0, 10])
+def test_bucketed_predictions(bert, token_budget):
+    tokens = create_tokens(SENTENCES)
+    predictions = nw_processor.get_bert_tensor_bucketed(bert, tokens, PAD, MASK, token_budget=token_budget)
+    assert predictions.shape == (len(token_ids_of(SENTENCES)), VOCAB_SIZE)
+    assert torch.allclose(predictions, sequence_predictions(bert, tokens), atol=1e-6)
+    predictions, attn = nw_processor.get_bert_tensor(0, bert, tokens, PAD, MASK, inference_mode=True,
+                                                     token_budget=token_budget)
+    assert attn is None
+    assert torch.allclose(predictions, sequence_predictions(bert, tokens), atol=1e-6)
+
+
+@pytest.mark.parametrize("percent,max_degree,min_probability", CUTOFFS)
+@pytest.mark.parametrize("own_tie", [True, False])
+def test_extract_ties_batch(bert, percent, max_degree, min_probability, own_tie):
+    tokens = create_tokens(SENTENCES)
+    token_ids = token_ids_of(SENTENCES)
+    predictions = sequence_predictions(bert, tokens)
+    id_mask = np.array([30, 31, 32])
+
+    edges = nw_processor.extract_ties_batch(predictions, token_ids, DELWORDS, id_mask=id_mask, own_tie=own_tie,
+                                            percent=percent, max_degree=max_degree,
+                                            min_probability=min_probability)
+    expected = sequence_ties(predictions, token_ids, DELWORDS, id_mask=id_mask, own_tie=own_tie, percent=percent,
+                             max_degree=max_degree, min_probability=min_probability)
+    assert len(expected) > 0
+    assert_same_ties(edges, expected)
+    # Stopwords are no egos
+    assert not np.isin(token_ids.numpy()[edges[0]], DELWORDS).any()
+
+
+@pytest.mark.parametrize("percent,max_degree,min_probability", CUTOFFS)
+@pytest.mark.parametrize("own_tie", [True, False])
+def test_extract_ties_topk(bert, percent, max_degree, min_probability, own_tie):
+    tokens = create_tokens(SENTENCES)
+    token_ids = token_ids_of(SENTENCES)
+    id_mask = np.array([30, 31, 32])
+    exclude_ids = np.union1d(DELWORDS, id_mask)
+
+    topk = nw_processor.get_bert_tensor_topk(bert, tokens, PAD, MASK, k=max_degree, exclude_ids=exclude_ids,
+                                             own_tie=own_tie, token_budget=10)
+    assert topk[0].shape == (len(token_ids), min(max_degree, VOCAB_SIZE))
+    edges = nw_processor.extract_ties_topk(*topk, token_ids, DELWORDS, percent=percent, max_degree=max_degree,
+                                           min_probability=min_probability)
+    # Top-k output does not zero out the least likely token before normalization
+    expected = sequence_ties(sequence_predictions(bert, tokens), token_ids, DELWORDS, id_mask=id_mask,
+                             own_tie=own_tie, percent=percent, max_degree=max_degree,
+                             min_probability=min_probability, zero_min=False)
+    assert len(expected) > 0
+    assert_same_ties(edges, expected)
+
+
+def test_extract_ties_without_egos():
+    predictions = torch.softmax(torch.randn(2, VOCAB_SIZE), dim=-1)
+    rows, alters, weights = nw_processor.extract_ties_batch(predictions, torch.tensor(DELWORDS), DELWORDS)
+    assert len(rows) == len(alters) == len(weights) == 0
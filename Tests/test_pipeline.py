@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+from contextlib import closing
+
+import pytest
+
+from text2network.utils.pipeline import run_pipeline
+
+
+def jitter(function):
+    """Stage that sleeps for a random time before calling function"""
+
+    def stage(x):
+        time.sleep(random.random() / 1000)
+        return function(x)
+
+    return stage
+
+
+def consume(generator, timeout=10):
+    """Collects the items of generator in a thread, failing instead of hanging if the pipeline deadlocks"""
+    results = {"items": []}
+
+    def run():
+        try:
+            for item in generator:
+                results["items"].append(item)
+        except BaseException as e:
+            results["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "Pipeline did not finish"
+    return results
+
+
+def pipeline_threads():
+    return [x for x in threading.enumerate() if x.name.startswith("pipeline-")]
+
+
+@pytest.mark.parametrize("queue_size", [1, 2, 10])
+def test_order(queue_size):
+    stages = [jitter(lambda x: x * 2), jitter(lambda x: x + 1), jitter(str)]
+    results = consume(run_pipeline(range(200), stages, queue_size=queue_size))
+    assert "error" not in results
+    assert results["items"] == [str(x * 2 + 1) for x in range(200)]
+    assert pipeline_threads() == []
+
+
+def test_no_stages():
+    assert consume(run_pipeline(iter(range(5)), []))["items"] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("failing_stage", [0, 1, 2])
+def test_stage_exception(failing_stage):
+    def fail(x):
+        if x == 50:
+            raise ValueError("Stage failed on {}".format(x))
+        return x
+
+    stages = [lambda x: x, lambda x: x, lambda x: x]
+    stages[failing_stage] = fail
+    # Small queues, such that the other stages are blocked on full queues when the stage fails
+    results = consume(run_pipeline(range(100000), stages, queue_size=1))
+    assert isinstance(results["error"], ValueError)
+    assert str(results["error"]) == "Stage failed on 50"
+    assert results["items"] == list(range(len(results["items"])))
+    assert len(results["items"]) <= 50
+    assert pipeline_threads() == []
+
+
+def test_source_exception():
+    def source():
+        yield from range(10)
+        raise KeyError("source")
+
+    results = consume(run_pipeline(source(), [lambda x: x], queue_size=1))
+    assert isinstance(results["error"], KeyError)
+    assert results["items"] == list(range(len(results["items"])))
+    assert pipeline_threads() == []
+
+
+def test_close_early():
+    with closing(run_pipeline(range(100000), [lambda x: x], queue_size=1)) as results:
+        for item in results:
+            if item == 10:
+                break
+    assert pipeline_threads() == []
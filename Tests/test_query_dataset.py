@@ -0,0 +1,142 @@
+import collections
+import os
+
+import numpy as np
+import pytest
+import tables
+import torch
+from transformers import BertTokenizer, BertTokenizerFast
+
+from text2network.datasets import text_dataset_old
+from text2network.datasets.text_dataset_old import query_dataset
+
+VOCAB = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "the", "cat", "dog", "sat", "on", "mat", "ran", "a", ".", "##s"]
+
+
+def create_database(db_file, texts, years):
+    class sequence(tables.IsDescription):
+        run_index = tables.UInt32Col()
+        seq_id = tables.UInt32Col()
+        text = tables.StringCol(80)
+        year = tables.UInt32Col()
+        p1 = tables.StringCol(40)
+        p2 = tables.StringCol(40)
+        p3 = tables.StringCol(40)
+        p4 = tables.StringCol(40)
+
+    with tables.open_file(db_file, mode="w") as hdf:
+        table = hdf.create_table(hdf.create_group("/", "textdata"), "table", sequence)
+        rows = np.zeros(len(texts), dtype=table.description._v_dtype)
+        rows['run_index'] = np.arange(len(texts))
+        rows['seq_id'] = np.arange(len(texts)) + 100
+        rows['text'] = [x.encode("utf-8") for x in texts]
+        rows['year'] = years
+        rows['p1'] = [b"source%d" % x for x in range(len(texts))]
+        table.append(rows)
+
+
+def create_tokenizer(folder, tokenizer_class=BertTokenizer):
+    vocab_file = os.path.join(folder, "vocab.txt")
+    with open(vocab_file, "w") as f:
+        f.write("\n".join(VOCAB))
+    return tokenizer_class(vocab_file)
+
+
+def test_query_dataset(tmp_path):
+    db_file = str(tmp_path / "db.h5")
+    texts = ["the cat sat on the mat.", "a", "the dog ran.", "the cat ran on a mat.", "the dog sat."]
+    create_database(db_file, texts, [2000, 2000, 2001, 2000, 2000])
+    tokenizer = create_tokenizer(str(tmp_path))
+
+    dataset = query_dataset(db_file, tokenizer, fixed_seq_length=4, query="(year == 2000)", pos=False,
+                            sentiment=False, chunk_size=2)
+    # Short sentence is dropped
+    assert dataset.nitems == len(dataset) == 3
+    assert dataset.coordinates.tolist() == [0, 3, 4]
+    # Tokens that do not appear in the selected sentences
+    assert dataset.id_mask.tolist() == [0, 1, 2, 3, 4, 14]
+
+    batch = dataset[[0, 2]]
+    token_input_vec, token_id_vec, index_vec, seq_vec, runindex_vec, year_vec, p1_vec = batch[0:7]
+    cls, sep = tokenizer.cls_token_id, tokenizer.sep_token_id
+    assert token_input_vec.tolist() == [[cls, 5, 6, 8, 9, sep], [cls, 5, 7, 8, 13, sep]]
+    assert token_id_vec.tolist() == [5, 6, 8, 9, 5, 7, 8, 13]
+    assert index_vec.tolist() == [0] * 4 + [2] * 4
+    assert seq_vec.tolist() == [100] * 4 + [104] * 4
+    assert year_vec.tolist() == [2000] * 8
+    assert p1_vec.tolist() == ["source0"] * 4 + ["source4"] * 4
+    assert [len(x) for x in batch[7:]] == [8, 8, 8, 8, 8, 8]
+    dataset.close()
+
+    # Token ids are cached next to the database until it changes
+    assert len([x for x in os.listdir(str(tmp_path)) if x.startswith("db.h5.tokens")]) == 3
+    dataset = query_dataset(db_file, tokenizer, fixed_seq_length=4, query="(year == 2000)", pos=False,
+                            sentiment=False)
+    assert torch.equal(dataset[1][1], torch.tensor([5, 6, 11, 9]))
+    dataset.close()
+    create_database(db_file, ["the dog sat on a mat."], [2000])
+    dataset = query_dataset(db_file, tokenizer, fixed_seq_length=4, query="(year == 2000)", pos=False,
+                            sentiment=False)
+    assert dataset.nitems == 1
+    assert dataset[0][1].tolist() == [5, 7, 8, 9]
+    dataset.close()
+
+
+def test_query_dataset_word_ids(tmp_path):
+    db_file = str(tmp_path / "db.h5")
+    create_database(db_file, ["the cats sat.", "a dog ran on the mat."], [2000, 2000])
+    tokenizer = create_tokenizer(str(tmp_path), BertTokenizerFast)
+
+    dataset = query_dataset(db_file, tokenizer, fixed_seq_length=3, query="(year == 2000)", pos=False,
+                            sentiment=False)
+    assert dataset.offsets.tolist() == [0, 5, 12]
+    # Word pieces of cats belong to the same word
+    assert dataset.get_ids()[0:5].tolist() == [5, 6, 14, 8, 13]
+    assert dataset.get_word_ids()[0:5].tolist() == [0, 1, 1, 2, 3]
+    assert dataset.get_word_ids()[5:12].tolist() == [0, 1, 2, 3, 4, 5, 6]
+    # Batches are cut to the fixed sequence length
+    assert dataset[[0, 1]][0].shape == (2, 5)
+    assert dataset[[0, 1]][1].tolist() == [5, 6, 14, 12, 7, 11]
+    dataset.close()
+
+
+class FakeTextBlob:
+    def __init__(self, text):
+        self.sentiment = collections.namedtuple("Sentiment", ["polarity", "subjectivity"])(len(text) / 100, 0.5)
+
+
+def test_query_dataset_annotations(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_pos_tag(tokens):
+        calls.append(tokens)
+        return [(x, "." if x == "." else "NN") for x in tokens]
+
+    monkeypatch.setattr(text_dataset_old, "pos_tag", fake_pos_tag)
+    monkeypatch.setattr(text_dataset_old, "map_tag", lambda source, target, tag: "NOUN" if tag == "NN" else tag)
+    monkeypatch.setattr(text_dataset_old, "TextBlob", FakeTextBlob)
+    monkeypatch.setattr(text_dataset_old, "textblob_available", True)
+    db_file = str(tmp_path / "db.h5")
+    create_database(db_file, ["the cat sat.", "the dog ran on the mat.", "a cat."], [2000, 2000, 2000])
+    tokenizer = create_tokenizer(str(tmp_path))
+
+    dataset = query_dataset(db_file, tokenizer, fixed_seq_length=5, query="(year == 2000)",
+                            annotation_batch_size=2)
+    # Sequences are annotated as cut to the fixed length
+    assert calls == [["the", "cat", "sat", "."], ["the", "dog", "ran", "on", "the"], ["a", "cat", "."]]
+    batch = dataset[[0, 2]]
+    assert batch[10].tolist() == ["NOUN", "NOUN", "NOUN", "UNKNOWN", "NOUN", "NOUN", "UNKNOWN"]
+    assert batch[11].tolist() == pytest.approx([0.13] * 4 + [0.07] * 3)
+    assert batch[12].tolist() == [0.5] * 7
+    assert dataset[1][10].tolist() == ["NOUN"] * 5
+    dataset.close()
+
+    # Annotations are cached for the fixed length
+    query_dataset(db_file, tokenizer, fixed_seq_length=5, query="(year == 2000)").close()
+    query_dataset(db_file, tokenizer, fixed_seq_length=5, query="(year == 2000)", sentiment=False).close()
+    assert len(calls) == 3
+    dataset = query_dataset(db_file, tokenizer, fixed_seq_length=3, query="(year == 2000)", sentiment=False)
+    assert len(calls) == 6
+    assert dataset[1][10].tolist() == ["NOUN"] * 3
+    assert dataset[1][11].tolist() == [0] * 3
+    dataset.close()
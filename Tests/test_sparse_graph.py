@@ -0,0 +1,116 @@
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from text2network.classes.sparse_graph import sparse_graph, ego_reach
+
+
+def get_graph():
+    random.seed(1)
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(10, 30))
+    for _ in range(80):
+        u, v = random.randrange(10, 30), random.randrange(10, 30)
+        graph.add_edge(u, v, weight=random.random(), time=2000 + random.randrange(3), pos="NOUN")
+    return graph
+
+
+def edge_weights(graph):
+    return {(u, v): pytest.approx(w) for u, v, w in graph.edges(data="weight")}
+
+
+def test_networkx_conversion():
+    graph = get_graph()
+    new_graph = sparse_graph.from_networkx(graph).to_networkx()
+    assert {(u, v): d for u, v, d in graph.edges(data=True)} == {(u, v): d for u, v, d in new_graph.edges(data=True)}
+    assert sparse_graph.from_networkx(graph)[10] == dict(graph[10])
+
+
+def test_buffered_edges():
+    graph = sparse_graph([1, 2, 3])
+    graph.add_edges_from([(1, 2, {'weight': 1.0, 'time': 2000})])
+    graph.add_edges_from([(2, 5, {'weight': 2.0, 'pos': "NOUN"}), (1, 2, {'weight': 0.5, 'time': 2001})])
+    assert list(graph.nodes) == [1, 2, 3, 5]
+    assert graph[1] == {2: {'weight': 0.5, 'time': 2001}}
+    assert graph.degree == {1: 1, 2: 2, 3: 0, 5: 1}
+    graph.remove_nodes_from([3, 5])
+    assert list(graph.nodes) == [1, 2] and graph.number_of_edges() == 1
+
+
+def test_edge_columns():
+    graph = sparse_graph([1, 2, 3])
+    graph.add_edges_from([(1, 2, {'weight': 1.0, 'time': 2000})])
+    graph.add_edge_columns(np.array([2, 1, 6]), np.array([5, 2, 1]), np.array([2.0, 0.5, 0.25]),
+                           {'time': 2001, 'sentiment': np.array([0.1, 0.2, 0.3])})
+    assert list(graph.nodes) == [1, 2, 3, 6, 5]
+    assert graph[1] == {2: {'weight': 0.5, 'time': 2001, 'sentiment': 0.2}}
+    assert graph[6] == {1: {'weight': 0.25, 'time': 2001, 'sentiment': 0.3}}
+    assert graph.number_of_edges() == 3
+
+
+@pytest.mark.parametrize("technique", ["avg-sym", "sum", "min-sym", "max-sym", "min-sym-avg"])
+def test_symmetric(technique):
+    graph = get_graph()
+    expected = {}
+    for u, v in graph.edges:
+        a, b = min(u, v), max(u, v)
+        w1 = graph[a][b]['weight'] if graph.has_edge(a, b) else None
+        w2 = graph[b][a]['weight'] if graph.has_edge(b, a) else None
+        bidirectional = w1 is not None and w2 is not None
+        weights = [x for x in [w1, w2] if x is not None]
+        if u == v:
+            expected[(a, b)] = w1
+        elif technique == "avg-sym":
+            expected[(a, b)] = sum(weights) / 2
+        elif technique == "sum":
+            expected[(a, b)] = sum(weights)
+        elif technique == "max-sym":
+            expected[(a, b)] = max(weights)
+        elif bidirectional:
+            expected[(a, b)] = min(weights) if technique == "min-sym" else sum(weights) / 2
+    symmetric = sparse_graph.from_networkx(graph).to_symmetric(technique).to_networkx()
+    assert not nx.is_directed(symmetric)
+    assert {(min(u, v), max(u, v)): w for u, v, w in symmetric.edges(data="weight")} == pytest.approx(expected)
+
+
+def test_sparsify_and_reverse():
+    graph = sparse_graph.from_networkx(get_graph())
+    reversed_graph = graph.reverse().to_networkx()
+    assert edge_weights(reversed_graph) == edge_weights(get_graph().reverse())
+    graph.sparsify(50)
+    for node in graph.nodes:
+        weights = sorted([x['weight'] for x in get_graph()[node].values()], reverse=True)
+        kept = sorted([x['weight'] for x in graph[node].values()], reverse=True)
+        assert kept == weights[0:len(kept)]
+        if len(weights) > 0:
+            assert sum(kept) >= sum(weights) / 2
+
+
+def test_ego_graph():
+    graph = get_graph()
+    expected = nx.compose_all([nx.ego_graph(graph, x, radius=1) for x in [10, 11]])
+    ego_graph = sparse_graph.from_networkx(graph).ego_graph([10, 11], radius=1).to_networkx()
+    assert set(ego_graph.nodes) == set(expected.nodes)
+    assert set(ego_graph.edges) == set(expected.edges)
+
+
+def test_ego_reach():
+    graph = get_graph()
+    nodes = list(graph.nodes)
+    rows, cols = np.array([[nodes.index(u), nodes.index(v)] for u, v in graph.edges]).T
+    reached = ego_reach(rows, cols, len(nodes), [0, 5], radius=2)
+    for column, center in enumerate([nodes[0], nodes[5]]):
+        expected = set(nx.single_source_shortest_path_length(graph, center, cutoff=2))
+        assert {nodes[x] for x in np.flatnonzero(reached[:, column])} == expected
+
+
+def test_measures():
+    graph = get_graph()
+    new_graph = sparse_graph.from_networkx(graph)
+    assert new_graph.pagerank() == pytest.approx(nx.pagerank(graph))
+    assert new_graph.clustering(weighted=True) == pytest.approx(nx.clustering(graph, weight="weight"))
+    assert new_graph.clustering() == pytest.approx(nx.clustering(graph))
+    proximities = new_graph.proximities([10])[10]
+    assert list(proximities.values()) == sorted([x['weight'] for x in graph[10].values()], reverse=True)
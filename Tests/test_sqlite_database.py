@@ -0,0 +1,168 @@
+import pytest
+
+from text2network.classes.sqlitedb import sqlite_database
+
+
+def get_token_list():
+    tokens = ["t_manager", "t_leader", "t_boss", "t_company", "t_team", "t_employee"]
+    token_ids = [1, 2, 3, 4, 5, 6]
+    return tokens, token_ids
+
+
+@pytest.fixture()
+def sqlite_db(tmp_path):
+    db = sqlite_database(str(tmp_path / "graph.sqlite"))
+    tokens, token_ids = get_token_list()
+    db.setup_neo_db(tokens, token_ids)
+
+    # sentence 1: manager (leader, boss) company (team)
+    tie_dict = {'weight': 0.5, 'run_index': 1, 'seq_id': 1, 'pos': 0, 'part_of_speech': 'NOUN', 'sentiment': 0.1,
+                'subjectivity': 0.2}
+    db.insert_edges(1, [(1, 2, 2000, tie_dict), (1, 3, 2000, tie_dict)])
+    tie_dict = dict(tie_dict, weight=1.0, pos=1)
+    db.insert_edges(4, [(4, 5, 2000, tie_dict)])
+    # sentence 2: manager (leader) employee (team)
+    tie_dict = {'weight': 1.0, 'run_index': 2, 'seq_id': 2, 'pos': 0, 'part_of_speech': 'NOUN', 'sentiment': 0.3,
+                'subjectivity': 0.2}
+    db.insert_edges(1, [(1, 2, 2001, tie_dict)])
+    tie_dict = dict(tie_dict, pos=1)
+    db.insert_edges(6, [(6, 5, 2001, tie_dict)])
+    db.write_queue()
+    yield db
+    db.close()
+
+
+def test_token_translation(sqlite_db):
+    ids, tokens = sqlite_db.init_tokens()
+    assert tokens == get_token_list()[0]
+    assert sqlite_db.translate_token_ids([1, 4]) == [0, 3]
+
+
+def test_query_multiple_nodes(sqlite_db):
+    ties = sqlite_db.query_multiple_nodes([1], times=[2000, 2001])
+    assert len(ties) == 1
+    sender, receiver, attributes = ties[0]
+    assert (sender, receiver) == (1, 0)
+    assert attributes['weight'] == pytest.approx(1.5)
+    assert attributes['start'] == 2000 and attributes['end'] == 2001
+
+    ties = sqlite_db.query_multiple_nodes([1, 2, 4], times=2000, return_sentiment=False)
+    assert sorted([(x[0], x[1]) for x in ties]) == [(1, 0), (2, 0), (4, 3)]
+
+
+def test_query_multiple_nodes_columns(sqlite_db):
+    columns = sqlite_db.query_multiple_nodes_columns([1, 2, 4], times=[2000, 2001])
+    assert sorted(columns['sender'].tolist()) == [1, 2, 4, 4]
+    assert (columns['start'], columns['end'], columns['pos']) == (2000, 2001, "None")
+    ties = sqlite_db.query_multiple_nodes([1, 2, 4], times=[2000, 2001])
+    assert sqlite_db.columns_to_ties(columns) == ties
+    assert sqlite_db.columns_to_ties(sqlite_db.ties_to_columns(ties, [2000, 2001])) == ties
+
+    columns = sqlite_db.query_multiple_nodes_columns([1], times=2000, return_sentiment=False)
+    assert set(columns.keys()) == {'sender', 'receiver', 'weight', 'time', 'start', 'end', 'pos'}
+    assert columns['weight'].tolist() == [pytest.approx(0.5)]
+
+
+def test_query_multiple_nodes_context(sqlite_db):
+    # Only sentence 1 has team as substitute of company
+    ties = sqlite_db.query_multiple_nodes([1], context=[3], context_mode="occuring")
+    assert len(ties) == 1
+    assert ties[0][2]['weight'] == pytest.approx(0.5)
+
+    # Team is a substitute in both sentences
+    ties = sqlite_db.query_multiple_nodes([1], context=[4], context_mode="substitution")
+    assert ties[0][2]['weight'] == pytest.approx(1.5)
+
+
+def test_query_occurrences(sqlite_db):
+    assert sqlite_db.query_occurrences([0, 3, 5], times=[2000, 2001]) == [(0, 2.0), (3, 1.0), (5, 1.0)]
+    assert sqlite_db.query_occurrences([0], context=[4], times=[2001]) == [(0, 1.0)]
+
+
+def test_query_tie_context(sqlite_db):
+    res = sqlite_db.query_tie_context(occurring=[0], replacing=[1], times=[2000, 2001], scale=1)
+    weights = {x['idx']: x['weight'] for x in res}
+    assert weights[3] == pytest.approx(0.5)
+    assert weights[4] == pytest.approx(1.5)
+    assert weights[5] == pytest.approx(1.0)
+
+
+def test_query_context_of_node(sqlite_db):
+    # leader replaces at position 0, team at position 1 of both sentences
+    ties = sqlite_db.query_context_of_node([1], times=[2000, 2001])
+    assert [(x[0], x[1]) for x in ties] == [(1, 4)]
+    assert ties[0][2]['weight'] == pytest.approx(1.0)
+    assert ties[0][2]['start'] == 2000 and ties[0][2]['end'] == 2001
+
+    # manager occurs at position 0, company and employee at position 1
+    ties = sqlite_db.query_context_of_node([0], occurrence=True)
+    assert sorted((x[0], x[1], x[2]['weight']) for x in ties) == [(0, 3, 0.5), (0, 5, 0.5)]
+    ties = sqlite_db.query_context_of_node([0], times=[2000], occurrence=True)
+    assert [(x[0], x[1], x[2]['weight'], x[2]['time']) for x in ties] == [(0, 3, 1.0, 2000)]
+
+
+def test_query_substitution_in_dyadic_context(sqlite_db):
+    # team replaces company and employee in the sentences in which leader replaces manager
+    ties = sqlite_db.query_substitution_in_dyadic_context([4], occurring=[0], replacing=[1], times=[2000, 2001])
+    assert [(x[0], x[1]) for x in ties] == [(4, 3), (4, 5)]
+    assert [x[2]['weight'] for x in ties] == pytest.approx([0.5, 1.0])
+    assert [x[2]['sentiment'] for x in ties] == pytest.approx([0.1, 0.3])
+    assert ties[0][2]['dyad'] == "[0, 0]"
+
+    ties = sqlite_db.query_substitution_in_dyadic_context([4], occurring=[0], replacing=[1], scale=40,
+                                                          return_sentiment=False, add_dyad=True,
+                                                          normalize_seq_length=True)
+    assert [x[2]['weight'] for x in ties] == pytest.approx([20.0, 40.0])
+    assert ties[0][2]['dyad'] == "[[1], [0]]"
+    assert 'sentiment' not in ties[0][2]
+    assert sqlite_db.query_substitution_in_dyadic_context([4], occurring=[0], replacing=[2], times=2001) == []
+
+
+def test_query_context_in_dyadic_context(sqlite_db):
+    # company and team are at position 1 of the sentence in which leader replaces manager, boss at position 0
+    for ids in [[3], [4]]:
+        ties = sqlite_db.query_context_in_dyadic_context(ids, occurring=[0], replacing=[1])
+        assert [(x[0], x[1]) for x in ties] == [(ids[0], 2)]
+        assert ties[0][2]['weight'] == pytest.approx(0.25)
+    assert len(sqlite_db.query_context_in_dyadic_context([3], occurring=[0], replacing=[1],
+                                                         context_mode="occurring")) == 1
+    assert sqlite_db.query_context_in_dyadic_context([4], occurring=[0], replacing=[1],
+                                                     context_mode="occurring") == []
+    assert sqlite_db.query_context_in_dyadic_context([3], occurring=[0], replacing=[1], times=2001) == []
+
+
+def test_query_parts_of_speech(sqlite_db):
+    assert sqlite_db.query_parts_of_speech() == ["NOUN"]
+
+
+def test_year_aggregates(sqlite_db):
+    sqlite_db.build_year_aggregates()
+    assert sqlite_db.has_year_aggregates([2000, 2001])
+    for times in [[2000], [2000, 2001], None]:
+        assert sqlite_db.query_year_aggregates([1, 4], times=times) == sqlite_db.query_multiple_nodes([1, 4],
+                                                                                                      times=times)
+
+    # Aggregates are updated with ties inserted afterwards
+    tie_dict = {'weight': 0.25, 'run_index': 3, 'seq_id': 3, 'pos': 0, 'part_of_speech': 'NOUN', 'sentiment': 0.0,
+                'subjectivity': 0.0}
+    sqlite_db.insert_edges(1, [(1, 2, 2001, tie_dict)])
+    ties = sqlite_db.query_year_aggregates([1], times=[2001])
+    assert ties[0][2]['weight'] == pytest.approx(1.25)
+    assert ties == sqlite_db.query_multiple_nodes([1], times=[2001])
+
+
+def test_version_stamp(sqlite_db):
+    version = sqlite_db.version_stamp()
+    assert version == sqlite_db.version_stamp()
+    tie_dict = {'weight': 0.25, 'run_index': 3, 'seq_id': 3, 'pos': 0}
+    sqlite_db.insert_edges(1, [(1, 2, 2001, tie_dict)])
+    sqlite_db.write_queue()
+    assert version != sqlite_db.version_stamp()
+
+
+def test_query_degrees(sqlite_db):
+    assert sorted(sqlite_db.query_degrees(times=[2000, 2001])) == [(1, 1), (2, 1), (4, 2)]
+    assert sorted(sqlite_db.query_degrees(times=[2000])) == [(1, 1), (2, 1), (4, 1)]
+    sqlite_db.build_year_aggregates()
+    assert sorted(sqlite_db.query_degrees(times=[2000, 2001])) == [(1, 1), (2, 1), (4, 2)]
+    assert sorted(sqlite_db.query_degrees()) == [(1, 1), (2, 1), (4, 2)]
@@ -0,0 +1,89 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from text2network.preprocessing.nw_preprocessor import ShardWriter, TextPreprocessor
+
+TEXTS = {
+    "2020/vol1_a.txt": "A good leader is a good communicator. Leaders listen.\n\nThey decide.",
+    "2020/vol2_b.txt": "Managers plan. Managers control.",
+    "2021/vol1_c.txt": "A leader leads.",
+}
+
+
+def create_texts(folder):
+    for file, text in TEXTS.items():
+        os.makedirs(os.path.join(folder, os.path.dirname(file)), exist_ok=True)
+        with open(os.path.join(folder, file), "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def read_year(folder):
+    with open(os.path.join(folder, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    rows = []
+    for shard in manifest["files"]:
+        file = os.path.join(folder, shard["file"])
+        if manifest["format"] == "json":
+            with open(file, "r", encoding="utf-8") as f:
+                shard_rows = json.load(f)
+        elif manifest["format"] == "jsonl":
+            with gzip.open(file, "rt", encoding="utf-8") as f:
+                shard_rows = [json.loads(x) for x in f]
+        else:
+            import pyarrow.parquet as pq
+            shard_rows = pq.read_table(file).to_pylist()
+        assert len(shard_rows) == shard["rows"]
+        assert shard_rows[0]["index"] == shard["first_index"]
+        rows.extend(shard_rows)
+    assert len(rows) == manifest["len_year"]
+    return rows
+
+
+@pytest.mark.parametrize("output_format", ["jsonl", "parquet"])
+def test_parallel_preprocess(tmp_path, output_format):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    input_folder = str(tmp_path / "raw")
+    create_texts(input_folder)
+
+    TextPreprocessor(128, "_", input_folder=input_folder, output_folder=str(tmp_path / "json"),
+                     max_json_length=2).preprocess()
+    TextPreprocessor(128, "_", input_folder=input_folder, output_folder=str(tmp_path / output_format),
+                     max_json_length=2, workers=2, output_format=output_format).preprocess()
+
+    for year in ["2020", "2021"]:
+        expected = read_year(str(tmp_path / "json" / year))
+        rows = read_year(str(tmp_path / output_format / year))
+        assert rows == expected
+        assert all(x.endswith(output_format.replace("jsonl", "jsonl.gz"))
+                   for x in os.listdir(str(tmp_path / output_format / year)) if x != "manifest.json")
+
+    rows = read_year(str(tmp_path / output_format / "2021"))
+    assert rows[0]["parameters"] == ["vol1", "c"]
+    assert rows[0]["file_index"] == 0 and rows[0]["year_index"] == 0
+    assert rows[0]["index"] == len(read_year(str(tmp_path / output_format / "2020")))
+
+
+def test_shard_writer_format(tmp_path):
+    with pytest.raises(ValueError):
+        ShardWriter(str(tmp_path), output_format="csv")
+
+
+def test_data_files_manifest(tmp_path):
+    pytest.importorskip("datasets")
+    from text2network.datasets.text_datasets import PreTrainDataSet
+    input_folder = str(tmp_path / "raw")
+    create_texts(input_folder)
+    TextPreprocessor(128, "_", input_folder=input_folder, output_folder=str(tmp_path / "jsonl"),
+                     max_json_length=2, output_format="jsonl").preprocess()
+    year_folder = str(tmp_path / "jsonl" / "2020")
+    with open(os.path.join(year_folder, "manifest.json"), "r", encoding="utf-8") as f:
+        shards = [x["file"] for x in json.load(f)["files"]]
+    assert len(shards) > 1
+    # Files not listed in the manifest, such as those of an earlier run, are not loaded
+    with open(os.path.join(year_folder, "old.json"), "w", encoding="utf-8") as f:
+        json.dump([], f)
+    assert PreTrainDataSet._data_files(year_folder) == shards
@@ -0,0 +1,88 @@
+import os
+import random
+
+import pandas as pd
+import pytest
+
+from Tests.sqlite_setups import GRAPH_TYPES, sqlite_network as create_sqlite_network
+from text2network.measures.centrality import yearly_centralities
+from text2network.measures.extract_networks import extract_temporal_adjacency_matrices, extract_yearly_networks
+from text2network.measures.proximity import yearly_proximities
+from text2network.utils.year_pool import map_years
+
+YEARS = [2000, 2001, 2002]
+TOKENS = ["t{}".format(x) for x in range(1, 9)]
+
+
+class counting_network():
+    def __init__(self, offset=0):
+        self.init_arguments = {'offset': offset}
+        self.offset = offset
+        self.conditioned = False
+
+    def decondition(self):
+        self.conditioned = False
+
+
+def condition_year(snw, year, scale):
+    assert not snw.conditioned
+    snw.conditioned = True
+    return (year + snw.offset) * scale, os.getpid()
+
+
+def test_map_years():
+    snw = counting_network(offset=1)
+    years = [2003, 2000, 2002, 2001]
+    sequential = list(map_years(snw, condition_year, years, scale=2))
+    assert [x[0] for x in sequential] == years
+    assert [x[1][0] for x in sequential] == [(x + 1) * 2 for x in years]
+    assert all([x[1][1] == os.getpid() for x in sequential])
+
+    parallel = list(map_years(snw, condition_year, years, workers=2, scale=2))
+    assert [(x[0], x[1][0]) for x in parallel] == [(x[0], x[1][0]) for x in sequential]
+    assert all([x[1][1] != os.getpid() for x in parallel])
+
+
+@pytest.fixture(params=GRAPH_TYPES)
+def sqlite_network(tmp_path, request):
+    random.seed(1)
+    tie_dict = {'pos': 0, 'part_of_speech': 'NOUN', 'sentiment': 0.1, 'subjectivity': 0.2}
+    ties = []
+    for seq_id in range(60):
+        ego = random.randint(1, 8)
+        ties.append((ego, random.randint(1, 8), YEARS[seq_id % 3],
+                     dict(tie_dict, weight=random.random(), run_index=seq_id, seq_id=seq_id)))
+    yield from create_sqlite_network(tmp_path, request.param, TOKENS, list(range(1, 9)), ties)
+
+
+@pytest.mark.parametrize("moving_average", [None, (1, 0)])
+def test_yearly_measures_workers(sqlite_network, moving_average):
+    # PageRank is not available with networkx 3
+    types = ["frequency", "weighted_local_clustering", "constraint"]
+    results = [yearly_centralities(sqlite_network, YEARS, focal_tokens=["t1", "t2"], types=types,
+                                   moving_average=moving_average, workers=workers) for workers in [1, 2]]
+    assert list(results[0]['yearly_centrality']) == YEARS
+    assert results[1] == results[0]
+
+    results = [yearly_proximities(sqlite_network, YEARS, focal_tokens=["t1"], moving_average=moving_average,
+                                  workers=workers) for workers in [1, 2]]
+    assert list(results[0]['yearly_proximity']) == YEARS
+    assert results[1] == results[0]
+
+
+def test_extract_networks_workers(sqlite_network, tmp_path):
+    results = [extract_temporal_adjacency_matrices(sqlite_network, TOKENS[0:5], times=YEARS, workers=workers)
+               for workers in [1, 2]]
+    assert list(results[1]) == YEARS
+    for year in YEARS:
+        pd.testing.assert_frame_equal(results[1][year], results[0][year])
+
+    folders = [str(tmp_path / "export{}".format(workers)) for workers in [1, 2]]
+    for workers, folder in zip([1, 2], folders):
+        os.makedirs(folder)
+        extract_yearly_networks(sqlite_network, folder, times=YEARS, workers=workers)
+    files = sorted(os.listdir(folders[0]))
+    assert len(files) > 0 and files == sorted(os.listdir(folders[1]))
+    for file in files:
+        with open(os.path.join(folders[0], file), "rb") as f, open(os.path.join(folders[1], file), "rb") as g:
+            assert f.read() == g.read()
@@ -13,6 +13,8 @@ class PreProcessConfig:
     max_json_length: int = 20000  # Max length of json file in terms of rows
     input_folder: str = "data/raw"
     output_folder: str = "data/preprocessed"
+    workers: int = 1  # Processes reading files, None for the number of CPUs
+    output_format: str = "json"  # json, jsonl (gzip-compressed lines) or parquet
 
 
 @dataclass
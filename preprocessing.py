@@ -33,6 +33,8 @@ def main(args):
             other_loggers=args.other_loggers if args.other_loggers else logging.WARNING,
             input_folder=args.folder if args.folder else "data/raw",
             output_folder=args.output_folder if args.output_folder else "data/preprocessed",
+            workers=args.workers if args.workers else 1,
+            output_format=args.output_format if args.output_format else "json",
         )
     setup_logger(logging_path = config.logging_folder ,logging_level=config.logging_level)
 
@@ -55,6 +57,8 @@ if __name__ == "__main__":
     )
     parser.add_argument("--logging_level", type=int, help="Logging level for t2n logger")
     parser.add_argument("--other_loggers", type=int, help="Logging level for other loggers")
+    parser.add_argument("--workers", type=int, help="Number of processes reading files")
+    parser.add_argument("--output_format", help="Output format: json, jsonl or parquet")
 
     args = parser.parse_args()
     main(args)
@@ -2,39 +2,62 @@
 # TODO: Take out context element fragments
 
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 
 import numpy as np
 
+from text2network.classes.storage_backend import storage_backend, records_to_columns, TIE_COLUMNS, SENTIMENT_COLUMNS
+
 try:
     from neo4j import GraphDatabase
 except:
     GraphDatabase = None
 
 
-class neo4j_database():
+class neo4j_database(storage_backend):
     def __init__(self, neo4j_creds, agg_operator="SUM",
                  write_before_query=True,
                  neo_batch_size=10000, queue_size=100000, tie_query_limit=100000, tie_creation="UNSAFE",
                  context_tie_creation="SAFE",
                  logging_level=logging.NOTSET, connection_type="bolt", cache_yearly_occurrences=False,
-                 consume_type=None):
+                 consume_type=None, pool_size=4, fetch_size=1000):
+        """
+        Graph store on a Neo4j server.
+
+        Read queries are run on sessions of one driver, which pools up to pool_size connections.
+        Each thread uses its own session, such that queries can be sent concurrently by
+        receive_queries_async and map_queries, with at most pool_size queries in flight.
+
+        Parameters
+        ----------
+        pool_size: int
+            Maximum number of connections, and of concurrently running read queries
+        fetch_size: int
+            Number of records fetched from the server at once
+        """
         # Set logging level
         # logging.disable(logging_level)
 
         self.neo4j_connection, self.neo4j_credentials = neo4j_creds
         self.write_before_query = write_before_query
-        oldlevel = logging.getLogger().getEffectiveLevel()
-        logging.getLogger().setLevel(30)
+        # The driver logs each query at debug level
+        logging.getLogger("neo4j").setLevel(logging.WARNING)
+        self.pool_size = max(1, int(pool_size))
+        self.fetch_size = fetch_size
         # Set up Neo4j driver
         if connection_type == "bolt" and GraphDatabase is not None:
-            self.driver = GraphDatabase.driver(self.neo4j_connection, auth=self.neo4j_credentials)
+            self.driver = GraphDatabase.driver(self.neo4j_connection, auth=self.neo4j_credentials,
+                                               max_connection_pool_size=max(self.pool_size, 2))
             self.connection_type = "bolt"
-            self.read_session = None
+            # Sessions are not thread safe, so each thread opens its own
+            self.sessions = threading.local()
+            self.executor = None
+            self.queue_lock = threading.RLock()
 
         else:  # Fallback custom HTTP connector for Neo4j <= 4.02
             raise NotImplementedError("HTTP connection is no longer supported!")
-        logging.getLogger().setLevel(oldlevel)
         # Neo4J Internals
         # Pick Merge or Create. Create will double ties but Merge becomes very slow for large networks
         if tie_creation == "SAFE":
@@ -62,6 +85,10 @@ class neo4j_database():
         # Occurrence Cache
         self.cache_yearly_occurrences = cache_yearly_occurrences
         self.occ_cache = {}
+        # Number of occurrence ties of each time with yearly aggregates, loaded when first needed
+        self.year_aggregates = None
+        # Results of has_year_aggregates, by times and database version
+        self.year_aggregate_checks = {}
         # Init parent class
         super().__init__()
 
@@ -177,6 +204,14 @@ class neo4j_database():
             nr_nodes = self.receive_query("MATCH (n:edge) RETURN count(n) AS nodes")[0]['nodes']
             logging.info("Network has %i edge-nodes", (nr_nodes))
 
+        # Yearly aggregates of deleted ties need to be rebuilt
+        if time is not None:
+            self.add_query("MATCH (y:year_aggregate {time:$time}) DELETE y", {"time": int(time)}, run=True)
+        else:
+            self.add_query("MATCH (y:year_aggregate) DELETE y", run=True)
+        self.year_aggregates = None
+        self.year_aggregate_checks = {}
+
         # DEBUG
         nr_nodes = self.receive_query("MATCH (n:edge) RETURN count(n) AS nodes")[0]['nodes']
         logging.info("After cleaning: Network has %i nodes and %i ties", (nr_nodes))
@@ -360,28 +395,7 @@ class neo4j_database():
             res_tfidf = self.receive_query(tfidfmatch, params)
             df_tfidf = pd.DataFrame(res_tfidf)
 
-            total_df = pd.merge(left=df, right=df_tfidf, how="inner", on="context", validate="one_to_one")
-            total_df.tweight = total_df.tweight / total_df.tweight.sum()
-            total_df["nweight"] = total_df.weight / total_df.weight.sum()
-            total_df["pmi"] = -np.log(total_df.tweight) + np.log(total_df.nweight)
-            total_df["cond_entropy"] = np.log(total_df.nweight/total_df.tweight)
-            total_df["cond_entropy_weight"] = total_df.nweight*np.log(total_df.nweight / total_df.tweight)
-            total_df["pmi_weight"] = total_df["weight"] * total_df["pmi"]
-            total_df["rel_weight"] = total_df.nweight / total_df.tweight
-            total_df["diff"] = np.abs(total_df.nweight - total_df.tweight)
-            total_df["diffw"] = total_df.nweight/np.exp(- np.square(total_df["diff"]))
-
-            if return_sentiment:
-                ret = [{'substitute': x['substitute'], 'occurrence': x['occurrence'], 'idx': x['context'],
-                        'weight': x['weight'], 'sentiment': x['sentiment'], 'subjectivity': x['subjectivity'],
-                        'pos': pos, 'reg_weight': x['weight'], 'nweight': x['nweight'], 'pmi': x['pmi'], 'diff': x['diff'], 'diffw': x['diffw'],
-                        'pmi_weight': x['pmi_weight'], 'rel_weight': x['rel_weight'], 'cond_entropy': x['cond_entropy'], 'cond_entropy_weight': x['cond_entropy_weight']}
-                       for index, x in total_df.iterrows()]
-            else:
-                ret = [{'substitute': x['substitute'], 'occurrence': x['occurrence'], 'idx': x['context'],
-                        'weight': x['weight'], 'pos': pos, 'reg_weight': x['weight'], 'nweight': x['nweight'],'diff': x['diff'], 'diffw': x['diffw'],
-                        'pmi': x['pmi'], 'pmi_weight': x['pmi_weight'], 'rel_weight': x['rel_weight'], 'cond_entropy': x['cond_entropy'], 'cond_entropy_weight': x['cond_entropy_weight']} for index, x in
-                       total_df.iterrows()]
+            ret = self.tfidf_tie_context(df, df_tfidf, pos, return_sentiment)
         else:
             if return_sentiment:
                 ret = [{'substitute': x['substitute'], 'occurrence': x['occurrence'], 'idx': x['context'],
@@ -451,15 +465,7 @@ class neo4j_database():
         # CHANGE NOTE, changed sum(qweight) * sum(rweight)
         return_query = "Return DISTINCT(idx) as alter, ego, sum(qweight*rweight) as weight order by ego"
         # Format time to set for network
-        if isinstance(times, int):
-            nw_time = {"s": times, "e": times, "m": times}
-        elif isinstance(times, dict):
-            nw_time = {"s": times['start'], "e": times['end'], "m": int((times['end'] + times['start']) / 2)}
-        elif isinstance(times, list):
-            sort_times = np.sort(times)
-            nw_time = {"s": sort_times[0], "e": sort_times[-1], "m": int((sort_times[0] + sort_times[-1]) / 2)}
-        else:
-            nw_time = {"s": 0, "e": 0, "m": 0}
+        nw_time = self.network_time(times)
 
         # Create params with or without time
         if isinstance(times, (dict, int, list)):
@@ -542,15 +548,7 @@ class neo4j_database():
             times = [times]
 
         # Format time to set for network
-        if isinstance(times, int):
-            nw_time = {"s": times, "e": times, "m": times}
-        elif isinstance(times, dict):
-            nw_time = {"s": times['start'], "e": times['end'], "m": int((times['end'] + times['start']) / 2)}
-        elif isinstance(times, list):
-            sort_times = np.sort(times)
-            nw_time = {"s": sort_times[0], "e": sort_times[-1], "m": int((sort_times[0] + sort_times[-1]) / 2)}
-        else:
-            nw_time = {"s": 0, "e": 0, "m": 0}
+        nw_time = self.network_time(times)
 
         # Create params with or without time
         if isinstance(times, (dict, int, list)):
@@ -698,15 +696,7 @@ class neo4j_database():
             times = [times]
 
         # Format time to set for network
-        if isinstance(times, int):
-            nw_time = {"s": times, "e": times, "m": times}
-        elif isinstance(times, dict):
-            nw_time = {"s": times['start'], "e": times['end'], "m": int((times['end'] + times['start']) / 2)}
-        elif isinstance(times, list):
-            sort_times = np.sort(times)
-            nw_time = {"s": sort_times[0], "e": sort_times[-1], "m": int((sort_times[0] + sort_times[-1]) / 2)}
-        else:
-            nw_time = {"s": 0, "e": 0, "m": 0}
+        nw_time = self.network_time(times)
 
         # Create params with or without time
         if isinstance(times, (dict, int, list)):
@@ -798,10 +788,44 @@ class neo4j_database():
 
         return ties
 
+    def query_parts_of_speech(self):
+        res = self.receive_query("MATCH (n:part_of_speech) RETURN DISTINCT n.part_of_speech as pos")
+        return [x['pos'] for x in res]
+
+    def version_stamp(self):
+        # Node counts are read from the count store and are therefore cheap
+        nr_edges = self.receive_query("MATCH (r:edge) RETURN count(r) AS nr")[0]['nr']
+        nr_words = self.receive_query("MATCH (w:word) RETURN count(w) AS nr")[0]['nr']
+        return self.neo4j_connection, "{}-{}".format(nr_edges, nr_words)
+
+    def query_times(self):
+        res = self.receive_query("MATCH (n) WHERE EXISTS(n.time) RETURN DISTINCT  n.time AS time ORDER BY time")
+        return [x['time'] for x in res]
+
+    def query_nr_sequences(self, times):
+        query = "MATCH(r: edge) WHERE r.time in " + str(times) + " RETURN count(DISTINCT r.run_index) as nrs"
+        return [x['nrs'] for x in self.receive_query(query)][0]
+
+    def query_nr_occurrences(self, times):
+        query = "MATCH(r: edge) WHERE r.time in " + str(times) + " RETURN round(sum(r.weight)) as nrs"
+        return [x['nrs'] for x in self.receive_query(query)][0]
+
     def query_multiple_nodes(self, ids, times=None, weight_cutoff=None, context=None, pos=None, return_sentiment=True,
                              context_mode="bidirectional", context_weight=True):
         """
-        Query multiple nodes by ID and over a set of time intervals
+        Query multiple nodes by ID and over a set of time intervals, see query_multiple_nodes_columns
+        :return: list of tuples (u,v,Time,{weight:x})
+        """
+        return self.columns_to_ties(
+            self.query_multiple_nodes_columns(ids, times=times, weight_cutoff=weight_cutoff, context=context, pos=pos,
+                                              return_sentiment=return_sentiment, context_mode=context_mode,
+                                              context_weight=context_weight))
+
+    def query_multiple_nodes_columns(self, ids, times=None, weight_cutoff=None, context=None, pos=None,
+                                     return_sentiment=True, context_mode="bidirectional", context_weight=True):
+        """
+        Query multiple nodes by ID and over a set of time intervals.
+        Records are streamed from the session into numpy columns.
 
 
         // Neo4j example query replicated here WITH CONTEXT
@@ -831,7 +855,7 @@ class neo4j_database():
             a substitution distribution, or "bidirectional" if either
         :param pos: String/List indicating the Part Of Speech
         :param return_sentiment: Return sentiment and objectivity scores
-        :return: list of tuples (u,v,Time,{weight:x})
+        :return: dict of arrays sender, receiver, weight (sentiment, subjectivity) and values time, start, end, pos
         """
         logging.debug("Querying {} nodes in Neo4j database.".format(len(ids)))
 
@@ -847,17 +871,6 @@ class neo4j_database():
         if isinstance(pos, str):
             pos = [pos]
 
-        # Format time to set for network
-        if isinstance(times, int):
-            nw_time = {"s": times, "e": times, "m": times}
-        elif isinstance(times, dict):
-            nw_time = {"s": times['start'], "e": times['end'], "m": int((times['end'] + times['start']) / 2)}
-        elif isinstance(times, list):
-            sort_times = np.sort(times)
-            nw_time = {"s": sort_times[0], "e": sort_times[-1], "m": int((sort_times[0] + sort_times[-1]) / 2)}
-        else:
-            nw_time = {"s": 0, "e": 0, "m": 0}
-
         # Create params with or without time
         if isinstance(times, (dict, list)):
             params = {"ids": ids, "times": times}
@@ -961,26 +974,8 @@ class neo4j_database():
         else:
             query = "".join([match_query, where_query, with_query, c_match, c_where_query, c_with, return_query])
         logging.debug("Tie Query: {}".format(query))
-        res = self.receive_query(query, params)
-
-        if pos is not None:
-            pos = "-".join([str(x) for x in pos])
-        else:
-            pos = "None"
-
-        if return_sentiment:
-            ties = [(x['sender'], x['receiver'],
-                     {'weight': np.float(x['agg_weight']), 'time': nw_time['m'], 'start': nw_time['s'],
-                      'end': nw_time['e'], 'pos': pos, 'sentiment': np.float(x['sentiment']),
-                      'subjectivity': np.float(x['subjectivity'])}) for
-                    x in res]
-        else:
-            ties = [(x['sender'], x['receiver'],
-                     {'weight': np.float(x['agg_weight']), 'time': nw_time['m'], 'start': nw_time['s'],
-                      'end': nw_time['e'], 'pos': pos}) for
-                    x in res]
-
-        return ties
+        dtypes = dict(TIE_COLUMNS, **SENTIMENT_COLUMNS) if return_sentiment else TIE_COLUMNS
+        return self.tie_columns(self.receive_query_columns(query, params, dtypes), times, pos)
 
     def query_occurrences(self, ids, times=None, weight_cutoff=None, context=None):
         """
@@ -1059,6 +1054,163 @@ class neo4j_database():
 
         return ties
 
+    # %% Yearly aggregates
+    def build_year_aggregates(self, times=None):
+        """
+        Creates (a:word)-[:year_tie]->(b:word) relationships holding, per time, the sum of weights, count,
+        and sum of sentiment and subjectivity of the occurrence ties a->r->b.
+
+        A (:year_aggregate) node records the number of occurrence ties of each aggregated time. Times whose
+        number of occurrence ties has changed since are aggregated again, such that this function should be
+        called after inserting ties.
+
+        :param times: list of times to aggregate, None for all
+        """
+        if times is None:
+            times = self.query_times()
+        elif isinstance(times, int):
+            times = [times]
+        # Count queued ties as well
+        self.write_queue()
+        aggregated = self.load_year_aggregates()
+        nr_edges_dict = self.count_edges(times)
+        for time in times:
+            nr_edges = nr_edges_dict.get(time, 0)
+            if aggregated.get(time, None) == nr_edges:
+                continue
+            logging.info("Aggregating {} occurrence ties of time {}".format(nr_edges, time))
+            params = {"time": int(time), "nr": nr_edges}
+            self.add_query("MATCH (:word)-[y:year_tie {time:$time}]->(:word) DELETE y", params, run=True)
+            self.add_query("MATCH (a:word)-[:onto]->(r:edge {time:$time})-[:onto]->(b:word) "
+                           "WITH a, b, sum(r.weight) AS weight_sum, count(r) AS count, "
+                           "sum(r.sentiment) AS sentiment_sum, sum(r.subjectivity) AS subjectivity_sum "
+                           "CREATE (a)-[:year_tie {time:$time, weight_sum:weight_sum, count:count, "
+                           "sentiment_sum:sentiment_sum, subjectivity_sum:subjectivity_sum}]->(b)", params, run=True)
+            self.add_query("MERGE (y:year_aggregate {time:$time}) SET y.nr_edges=$nr", params, run=True)
+            aggregated[time] = nr_edges
+        self.year_aggregate_checks = {}
+
+    def load_year_aggregates(self):
+        """
+        :return: dict of aggregated times and their number of occurrence ties
+        """
+        if self.year_aggregates is None:
+            res = self.receive_query("MATCH (y:year_aggregate) RETURN y.time AS time, y.nr_edges AS nr")
+            self.year_aggregates = {x['time']: x['nr'] for x in res}
+        return self.year_aggregates
+
+    def count_edges(self, times):
+        """
+        :param times: list of times
+        :return: dict of times and their number of occurrence ties, times without ties are omitted
+        """
+        res = self.receive_query("MATCH (r:edge) WHERE r.time IN $times RETURN r.time AS time, count(r) AS nr",
+                                 {"times": [int(x) for x in times]})
+        return {x['time']: x['nr'] for x in res}
+
+    def has_year_aggregates(self, times=None):
+        """
+        Checks whether the yearly aggregates of all times are up to date, that is, whether the number of
+        occurrence ties of each time is still the number that was aggregated. Ties may have been inserted by
+        another process, so the result is cached by the version stamp of the database, and the ties are only
+        counted again once it changes.
+
+        :param times: list of times or None for all
+        :return: bool
+        """
+        if self.aggregate_operator not in self.year_aggregate_operators:
+            return False
+        if isinstance(times, int):
+            times = [times]
+        elif times is not None and not isinstance(times, list):
+            return False
+        key = (str(times), self.version_stamp())
+        if key not in self.year_aggregate_checks:
+            self.year_aggregate_checks[key] = self.__check_year_aggregates(times)
+        return self.year_aggregate_checks[key]
+
+    def __check_year_aggregates(self, times):
+        """
+        Compares the number of occurrence ties of each time with the number that was aggregated
+
+        :param times: list of times or None for all
+        :return: bool
+        """
+        if times is None:
+            times = self.query_times()
+        aggregated = self.load_year_aggregates()
+        if len(aggregated) == 0 or not all([x in aggregated for x in times]):
+            return False
+        nr_edges = self.count_edges(times)
+        stale = [x for x in times if nr_edges.get(x, 0) != aggregated[x]]
+        if len(stale) > 0:
+            logging.info("Yearly aggregates of times {} are out of date, call build_year_aggregates".format(stale))
+            return False
+        return True
+
+    def query_degrees(self, times=None):
+        """
+        Number of distinct receivers of the ties of each sender, from the yearly aggregates.
+        Counting the occurrence ties would take as long as querying them, so without aggregates
+        for all times, None is returned.
+
+        :param times: list of times or None for all
+        :return: list of tuples (sender, degree)
+        """
+        if isinstance(times, int):
+            times = [times]
+        if not self.has_year_aggregates(times):
+            return None
+        params = {}
+        where_query = ""
+        if isinstance(times, list):
+            params["times"] = times
+            where_query = " WHERE y.time in $times "
+        query = "".join(["MATCH (a:word)-[y:year_tie]->(b:word) ", where_query,
+                         "RETURN b.token_id AS sender, count(DISTINCT a) AS degree"])
+        return [(x['sender'], x['degree']) for x in self.receive_query(query, params)]
+
+    def query_year_aggregates(self, ids, times=None, return_sentiment=True):
+        """
+        Same as query_multiple_nodes without context, part of speech or weight cutoff,
+        but summing the yearly aggregates instead of the occurrence ties.
+
+        :param ids: list of id's
+        :param times: list of times or None for all
+        :param return_sentiment: Return sentiment and objectivity scores
+        :return: list of tuples (u,v,Time,{weight:x})
+        """
+        return self.columns_to_ties(self.query_year_aggregates_columns(ids, times=times,
+                                                                       return_sentiment=return_sentiment))
+
+    def query_year_aggregates_columns(self, ids, times=None, return_sentiment=True):
+        """
+        Same as query_year_aggregates, but returns the ties as columns, see query_multiple_nodes_columns
+        """
+        logging.debug("Querying {} nodes from yearly aggregates.".format(len(ids)))
+        if isinstance(times, int):
+            times = [times]
+
+        params = {"ids": ids}
+        where_query = " WHERE b.token_id in $ids "
+        if isinstance(times, list):
+            params["times"] = times
+            where_query = where_query + " AND y.time in $times "
+        query = "".join(["MATCH (a:word)-[y:year_tie]->(b:word) ", where_query,
+                         "RETURN b.token_id AS sender, a.token_id AS receiver, sum(y.weight_sum) AS weight_sum, ",
+                         "sum(y.count) AS count, sum(y.sentiment_sum) AS sentiment_sum, ",
+                         "sum(y.subjectivity_sum) AS subjectivity_sum order by receiver"])
+        res = self.receive_query_columns(query, params, {'sender': np.int64, 'receiver': np.int64,
+                                                         'weight_sum': np.float64, 'count': np.int64,
+                                                         'sentiment_sum': np.float64,
+                                                         'subjectivity_sum': np.float64})
+        columns = {'sender': res['sender'], 'receiver': res['receiver'],
+                   'weight': np.asarray(self.year_aggregate_weight(res['weight_sum'], res['count']), dtype=np.float64)}
+        if return_sentiment:
+            columns['sentiment'] = res['sentiment_sum'] / res['count']
+            columns['subjectivity'] = res['subjectivity_sum'] / res['count']
+        return self.tie_columns(columns, times)
+
     # %% Insert functions
     def insert_edges(self, ego, ties):
 
@@ -1081,6 +1233,12 @@ class neo4j_database():
         # Delte just to make sure translation is taken
         del ties
 
+        # Yearly aggregates of these times need to be rebuilt
+        if self.year_aggregates is not None:
+            for time in np.unique(times).tolist():
+                self.year_aggregates.pop(time, None)
+        self.year_aggregate_checks = {}
+
         unique_egos = np.unique(egos)
         if len(unique_egos) == 1:
             ties_formatted = [{"alter": int(x[0]), "time": int(x[1]), "weight": float(x[2]['weight']),
@@ -1203,7 +1361,7 @@ class neo4j_database():
         if params is not None:
             if not isinstance(params, list):
                 raise AssertionError
-            statements = [{'statement': p, 'parameters': q} for (q, p) in zip(query, params)]
+            statements = [{'statement': q, 'parameters': p} for (q, p) in zip(query, params)]
             self.neo_queue.extend(statements)
         else:
             statements = [{'statement': q} for (q) in query]
@@ -1218,21 +1376,22 @@ class neo4j_database():
         If called will run queries in the queue and empty it.
         :return:
         """
-        if len(self.neo_queue) > 0:
-            if self.connection_type == "bolt":
-                with self.driver.session() as session:
-                    with session.begin_transaction() as tx:
-                        for statement in self.neo_queue:
-                            if 'parameters' in statement:
-                                tx.run(statement['statement'], statement['parameters'])
-                            else:
-                                tx.run(statement['statement'])
-                        tx.commit()
-                        tx.close()
-            else:
-                raise NotImplementedError("HTTP connector no longer supported")
-
-            self.neo_queue = []
+        with self.queue_lock:
+            if len(self.neo_queue) > 0:
+                if self.connection_type == "bolt":
+                    with self.driver.session() as session:
+                        with session.begin_transaction() as tx:
+                            for statement in self.neo_queue:
+                                if 'parameters' in statement:
+                                    tx.run(statement['statement'], statement['parameters'])
+                                else:
+                                    tx.run(statement['statement'])
+                            tx.commit()
+                            tx.close()
+                else:
+                    raise NotImplementedError("HTTP connector no longer supported")
+
+                self.neo_queue = []
 
     def non_con_write_queue(self):
         """
@@ -1250,32 +1409,103 @@ class neo4j_database():
         else:
             return [dict(x) for x in result]
 
-    def open_session(self, fetch_size=50):
+    @property
+    def read_session(self):
+        """Read session opened by the current thread, or None"""
+        return getattr(self.sessions, "session", None)
+
+    @read_session.setter
+    def read_session(self, session):
+        self.sessions.session = session
+
+    def open_session(self, fetch_size=None):
         logging.debug("Opening Session!")
+        if fetch_size is None:
+            fetch_size = self.fetch_size
         self.read_session = self.driver.session(fetch_size=fetch_size)
 
     def close_session(self):
-        self.read_session.close()
-        self.read_session = None
+        if self.read_session is not None:
+            self.read_session.close()
+            self.read_session = None
 
     def receive_query(self, query, params=None):
-        clean_up = False
+        """
+        Runs a read query on the session of the current thread. Without open session, a temporary session
+        is used, which borrows a connection from the pool of the driver.
+        :return: list of dicts
+        """
+        if self.read_session is None:
+            with self.driver.session(fetch_size=self.fetch_size) as session:
+                return [dict(x) for x in session.run(query, params)]
+        return [dict(x) for x in self.read_session.run(query, params)]
+
+    def receive_query_columns(self, query, params, dtypes):
+        """
+        Runs a read query as receive_query, but streams the records into numpy columns, fetch_size records
+        at a time, instead of creating a dict per record.
+        :param dtypes: dict of name and dtype of the returned values, in the order of the query's RETURN clause
+        :return: dict of np.ndarray
+        """
         if self.read_session is None:
-            logging.debug("Session was closed, opening temporary one")
-            self.open_session()
-            clean_up = True
-        oldlevel = logging.getLogger().getEffectiveLevel()
-        logging.getLogger().setLevel(30)
-        result = self.read_session.run(query, params)
-        res = [dict(x) for x in result]
-        logging.getLogger().setLevel(oldlevel)
-        if clean_up:
-            self.close_session()
-        return res
+            with self.driver.session(fetch_size=self.fetch_size) as session:
+                return records_to_columns(session.run(query, params), dtypes, chunk_size=self.fetch_size)
+        return records_to_columns(self.read_session.run(query, params), dtypes, chunk_size=self.fetch_size)
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="neo4j_query")
+        return self.executor
+
+    def receive_queries_async(self, queries, params=None):
+        """
+        Sends read queries concurrently, each on a session of a worker thread.
+
+        :param queries: list of queries
+        :param params: list of parameter dicts corresponding to queries, optional
+        :return: list of futures, in the order of queries, whose results are as of receive_query
+        """
+        if params is None:
+            params = [None] * len(queries)
+        if len(params) != len(queries):
+            msg = "Received {} queries, but {} parameter dicts".format(len(queries), len(params))
+            logging.error(msg)
+            raise ValueError(msg)
+        if self.write_before_query:
+            self.write_queue()
+        executor = self.get_executor()
+        return [executor.submit(self.receive_query, query, param) for query, param in zip(queries, params)]
+
+    def receive_queries(self, queries, params=None):
+        """
+        Same as receive_queries_async, but waits for and returns the results, in the order of queries
+        """
+        return [future.result() for future in self.receive_queries_async(queries, params)]
+
+    def map_queries(self, function, arguments):
+        """
+        Calls function for each element of arguments concurrently on pool_size threads, keeping at most
+        two calls per thread pending, and yields the results in the order of arguments.
+        """
+        if self.pool_size == 1:
+            yield from super().map_queries(function, arguments)
+            return
+        if self.write_before_query:
+            self.write_queue()
+        executor = self.get_executor()
+        pending = []
+        for argument in arguments:
+            pending.append(executor.submit(function, argument))
+            if len(pending) >= 2 * self.pool_size:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
 
     def close(self):
-        if self.read_session is not None:
-            self.read_session.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.close_session()
 
         if self.connection_type == "bolt":
             self.driver.close()
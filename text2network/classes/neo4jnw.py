@@ -2,14 +2,18 @@ import copy
 import inspect
 import random
 from collections.abc import Sequence
+from functools import partial
 
 import pandas as pd
-from networkx import compose_all
+import scipy.sparse
 from tqdm import tqdm
 
 # import neo4j utilities and classes
 from text2network.classes.neo4db import neo4j_database
-from text2network.functions.backout_measure import backout_measure
+from text2network.classes.sparse_graph import sparse_graph, ego_reach
+from text2network.classes.sqlitedb import sqlite_database
+from text2network.classes.storage_backend import storage_backend
+from text2network.functions.backout_measure import backout_measure, top_k_rows
 from text2network.functions.format import pd_format
 # Clustering
 from text2network.functions.graph_clustering import *
@@ -17,6 +21,7 @@ from text2network.functions.network_tools import make_reverse, sparsify_graph, r
 from text2network.measures.centrality import centralities
 from text2network.measures.proximity import proximities
 from text2network.utils.file_helpers import check_create_folder
+from text2network.utils.graph_cache import graph_cache as conditioned_graph_cache
 from text2network.utils.input_check import input_check
 from text2network.utils.twowaydict import TwoWayDict
 
@@ -52,7 +57,42 @@ class neo4j_network(Sequence):
     def __init__(self, config=None, neo4j_creds=None, graph_type="networkx", agg_operator="SUM",
                  write_before_query=True,
                  neo_batch_size=None, queue_size=100000, tie_query_limit=100000, tie_creation="UNSAFE",
-                 logging_level=None, connection_type=None, consume_type=None, seed=100):
+                 logging_level=None, connection_type=None, consume_type=None, seed=100, backend=None,
+                 database_path=None, graph_cache=None, graph_cache_size=2 * 1024 ** 3, neo_pool_size=None,
+                 neo_fetch_size=None):
+        """
+        Parameters
+        ----------
+        graph_type: str
+            "networkx" to hold conditioned networks as networkx DiGraph, or "sparse" to hold them as
+            sparse_graph, a CSR matrix with attribute arrays. Use get_networkx_graph to convert the latter.
+        backend: str or storage_backend
+            Graph store to condition networks from: "neo4j" (default) for a Neo4j server, "sqlite" for an
+            embedded database file, or a storage_backend instance
+        database_path: str
+            Database file of the sqlite backend. Defaults to config['Paths']['sqlite_database']
+        graph_cache: str
+            If given, graphs created by condition() are cached in this folder and loaded when conditioning
+            again with the same arguments, as long as the database has not changed
+        graph_cache_size: int
+            Maximum size of the graph cache in bytes
+        neo_pool_size: int
+            Number of connections to Neo4j, and therefore of batches queried concurrently when conditioning.
+            Defaults to config['NeoConfig']['pool_size'], or 4
+        neo_fetch_size: int
+            Number of records fetched from Neo4j at once. Defaults to config['NeoConfig']['fetch_size'], or 1000
+        """
+        # Arguments to create copies of this network with their own database connection, e.g. in worker processes
+        self.init_arguments = {'config': config, 'neo4j_creds': neo4j_creds, 'graph_type': graph_type,
+                               'agg_operator': agg_operator, 'write_before_query': write_before_query,
+                               'neo_batch_size': neo_batch_size, 'queue_size': queue_size,
+                               'tie_query_limit': tie_query_limit, 'tie_creation': tie_creation,
+                               'logging_level': logging_level, 'connection_type': connection_type,
+                               'consume_type': consume_type, 'seed': seed, 'backend': backend,
+                               'database_path': database_path, 'graph_cache': graph_cache,
+                               'graph_cache_size': graph_cache_size, 'neo_pool_size': neo_pool_size,
+                               'neo_fetch_size': neo_fetch_size}
+
         # Fill parameters from configuration file
         if logging_level is not None:
             self.logging_level = logging_level
@@ -76,39 +116,80 @@ class neo4j_network(Sequence):
                 logging.error(msg)
                 raise AttributeError(msg)
 
-        if connection_type is not None:
-            self.connection_type = connection_type
-        else:
+        if backend is None:
             if config is not None:
-                self.connection_type = config['NeoConfig']['protocol']
+                backend = config['NeoConfig'].get('backend', 'neo4j')
             else:
-                msg = "Please provide valid protocol."
-                logging.error(msg)
-                raise AttributeError(msg)
-
-        if neo4j_creds is not None:
-            self.neo4j_creds = neo4j_creds
-        else:
-            if config is not None:
-                if self.connection_type == "http":
-                    self.neo4j_creds = (
-                        config['NeoConfig']["http_uri"], (config['NeoConfig']["db_db"], config['NeoConfig']["db_pwd"]))
+                backend = "neo4j"
+
+        if isinstance(backend, storage_backend):
+            self.db = backend
+        elif backend == "sqlite":
+            if database_path is None:
+                if config is not None and config.has_option('Paths', 'sqlite_database'):
+                    database_path = config['Paths']['sqlite_database']
                 else:
-                    self.neo4j_creds = (
-                        config['NeoConfig']["db_uri"], (config['NeoConfig']["db_db"], config['NeoConfig']["db_pwd"]))
+                    msg = "Please provide valid database_path for the sqlite backend."
+                    logging.error(msg)
+                    raise AttributeError(msg)
+            self.db = sqlite_database(database_path, agg_operator=agg_operator,
+                                      write_before_query=write_before_query, queue_size=queue_size,
+                                      logging_level=logging_level)
+        elif backend == "neo4j":
+            if connection_type is not None:
+                self.connection_type = connection_type
             else:
-                msg = "Please provide valid neo4j_creds."
-                logging.error(msg)
-                raise AttributeError(msg)
+                if config is not None:
+                    self.connection_type = config['NeoConfig']['protocol']
+                else:
+                    msg = "Please provide valid protocol."
+                    logging.error(msg)
+                    raise AttributeError(msg)
 
-        self.db = neo4j_database(neo4j_creds=self.neo4j_creds, agg_operator=agg_operator,
-                                 write_before_query=write_before_query, neo_batch_size=self.neo_batch_size,
-                                 queue_size=queue_size,
-                                 tie_query_limit=tie_query_limit, tie_creation=tie_creation,
-                                 logging_level=logging_level, connection_type=self.connection_type,
-                                 consume_type=consume_type)
+            if neo4j_creds is not None:
+                self.neo4j_creds = neo4j_creds
+            else:
+                if config is not None:
+                    if self.connection_type == "http":
+                        self.neo4j_creds = (
+                            config['NeoConfig']["http_uri"], (config['NeoConfig']["db_db"], config['NeoConfig']["db_pwd"]))
+                    else:
+                        self.neo4j_creds = (
+                            config['NeoConfig']["db_uri"], (config['NeoConfig']["db_db"], config['NeoConfig']["db_pwd"]))
+                else:
+                    msg = "Please provide valid neo4j_creds."
+                    logging.error(msg)
+                    raise AttributeError(msg)
+
+            if neo_pool_size is None:
+                neo_pool_size = config['NeoConfig'].getint('pool_size', fallback=4) if config is not None else 4
+            if neo_fetch_size is None:
+                neo_fetch_size = config['NeoConfig'].getint('fetch_size', fallback=1000) if config is not None else 1000
+            self.db = neo4j_database(neo4j_creds=self.neo4j_creds, agg_operator=agg_operator,
+                                     write_before_query=write_before_query, neo_batch_size=self.neo_batch_size,
+                                     queue_size=queue_size,
+                                     tie_query_limit=tie_query_limit, tie_creation=tie_creation,
+                                     logging_level=logging_level, connection_type=self.connection_type,
+                                     consume_type=consume_type, pool_size=neo_pool_size, fetch_size=neo_fetch_size)
+        else:
+            msg = "Backend must be neo4j, sqlite or a storage_backend, not {}".format(backend)
+            logging.error(msg)
+            raise AttributeError(msg)
+
+        # Cache of conditioned graphs
+        if graph_cache is not None:
+            self.graph_cache = conditioned_graph_cache(graph_cache, max_size=graph_cache_size)
+        else:
+            self.graph_cache = None
+        # Degree statistics by times, used to plan ego conditioning, and the last year graph pulled for a subset
+        self.degree_statistics = {}
+        self.year_graph_cache = None
 
         # Conditioned graph information
+        if graph_type not in ["networkx", "sparse"]:
+            msg = "Graph type must be networkx or sparse, not {}".format(graph_type)
+            logging.error(msg)
+            raise AttributeError(msg)
         self.graph_type = graph_type
         self.graph = None
         self.conditioned = False
@@ -137,10 +218,7 @@ class neo4j_network(Sequence):
     # %% Interface
 
     def get_times_list(self):
-        query = "MATCH (n) WHERE EXISTS(n.time) RETURN DISTINCT  n.time AS time ORDER BY time"
-        res = self.db.receive_query(query)
-        times = [x['time'] for x in res]
-        return times
+        return self.db.query_times()
 
     def pd_format(self, output: Union[List, Dict], ids_to_tokens: bool = True) -> List:
         """
@@ -491,7 +569,8 @@ class neo4j_network(Sequence):
             If given, queries of this size are sent to the database.
 
         cond_type: str, optional
-            Manually set how the queries are sent. If not set, heuristically determined.
+            Manually set how the queries are sent. If not set, planned from the degree statistics of the database,
+            or, if the database does not provide them, heuristically determined.
                 "subset": queries the entire network into memory and uses network x to find the ego networks
                 "search": queries the ego networks in a "beam search" fashion. Slower for high depths.
 
@@ -537,6 +616,15 @@ class neo4j_network(Sequence):
 
         self.cond_dict = self.__make_condition_dict(tokens, times, cond_dict_list)
 
+        cache_key = self.__graph_cache_key(
+            {'call': "condition", 'times': times, 'tokens': tokens, 'weight_cutoff': weight_cutoff, 'depth': depth,
+             'context': context, 'compositional': compositional, 'reverse': reverse, 'max_degree': max_degree,
+             'prune_min_frequency': prune_min_frequency, 'keep_only_tokens': keep_only_tokens,
+             'cond_type': cond_type, 'return_sentiment': return_sentiment, 'post_cutoff': post_cutoff,
+             'post_norm': post_norm})
+        if self.__load_cached_graph(cache_key):
+            return
+
         if tokens is None:
             logging.debug("Conditioning dispatch: Yearly")
             self.__year_condition(years=times, weight_cutoff=weight_cutoff, context=context, batchsize=batchsize,
@@ -548,12 +636,15 @@ class neo4j_network(Sequence):
             else:
                 checkdepth = depth
             if cond_type is None:
-                if checkdepth <= 5 and nr_tokens <= 5:
-                    cond_type = "search"
-                elif checkdepth == 0:  # just need proximities
+                if checkdepth == 0:  # just need proximities
                     cond_type = "search"
-                else:
-                    cond_type = "subset"
+                elif depth is not None:
+                    cond_type = self.__plan_ego_condition(tokens, times=times, depth=depth, max_degree=max_degree)
+                if cond_type is None:
+                    if checkdepth <= 5 and nr_tokens <= 5:
+                        cond_type = "search"
+                    else:
+                        cond_type = "subset"
             if cond_type == "subset":
                 logging.debug("Conditioning dispatch: Ego, subset, depth {}".format(depth))
                 self.__ego_condition_subset(years=times, token_ids=tokens, weight_cutoff=weight_cutoff, depth=depth,
@@ -582,6 +673,122 @@ class neo4j_network(Sequence):
         if reverse:
             self.to_reverse()
 
+        self.__save_cached_graph(cache_key)
+
+    def condition_windows(self, year_list: list, moving_average: Optional[tuple] = None,
+                          tokens: Optional[Union[int, str, list]] = None, weight_cutoff: Optional[float] = None,
+                          depth: Optional[int] = None, context: Optional[Union[int, str, list]] = None,
+                          compositional: Optional[bool] = False, reverse: Optional[bool] = False,
+                          max_degree: Optional[int] = None, prune_min_frequency: Optional[int] = None,
+                          keep_only_tokens: Optional[bool] = False, batchsize: Optional[int] = None):
+        """
+        Condition the network, one window after the other, on the moving-average window around each year.
+
+        Each year is conditioned once, and its ties are kept as sparse matrix while it is part of the window.
+        The network of a window is the running sum of these matrices, updated by adding the years entering
+        and subtracting the years leaving the window. This requires an additive aggregate operator (SUM or COUNT),
+        otherwise each window is conditioned from the database.
+
+        Ego networks (tokens with depth > 0) are derived from the whole network of the window,
+        as with cond_type "subset". max_degree is applied to the aggregated ties of each sender in the window.
+        Ties do not carry sentiment and subjectivity.
+
+        Parameters
+        ----------
+        year_list: list
+            Focal years
+        moving_average: tuple, optional
+            Pass as (a,b), where for a focal year x the window will be [x-a,x+b], limited to the years in year_list.
+            If None, each year is its own window.
+
+        Other parameters as condition()
+
+        Yields
+        -------
+        tuple (year, list of years in window), with the network conditioned on the window
+        """
+        if batchsize is None:
+            batchsize = self.neo_batch_size
+        year_list = list(year_list)
+        windows = []
+        for year in year_list:
+            if moving_average is not None:
+                start_year = max(year_list[0], year - moving_average[0])
+                end_year = min(year_list[-1], year + moving_average[1])
+                windows.append((year, [int(x) for x in np.arange(start_year, end_year + 1)]))
+            else:
+                windows.append((year, [year]))
+
+        tokens = input_check(tokens=tokens)
+        context = input_check(tokens=context)
+        tokens = self.ensure_ids(tokens)
+        context = self.ensure_ids(context)
+        if keep_only_tokens:
+            depth = 0
+
+        if self.db.aggregate_operator not in ["SUM", "COUNT"]:
+            logging.warning("Aggregate operator {} is not additive across years, conditioning each window".format(
+                self.db.aggregate_operator))
+            for year, window in windows:
+                self.decondition()
+                self.condition(times=window, tokens=tokens, weight_cutoff=weight_cutoff, depth=depth, context=context,
+                               compositional=compositional, reverse=reverse, max_degree=max_degree,
+                               prune_min_frequency=prune_min_frequency, keep_only_tokens=keep_only_tokens,
+                               batchsize=batchsize, cond_type="subset")
+                yield year, window
+            return
+
+        self.decondition()
+        all_ids = list(self.ids)
+        index = {x: i for i, x in enumerate(all_ids)}
+        n = len(all_ids)
+        year_ties = {}
+        window_ties = scipy.sparse.csr_matrix((n, n))
+        window_counts = scipy.sparse.csr_matrix((n, n))
+        window_nodes = np.zeros(n, dtype=np.int64)
+        for year, window in windows:
+            # Remove years leaving the window, add years entering it
+            for leaving in [x for x in year_ties if x not in window]:
+                nodes, ties = year_ties.pop(leaving)
+                window_ties = window_ties - ties
+                window_counts = window_counts - (ties != 0).astype(np.float64)
+                window_nodes = window_nodes - nodes
+            for entering in [x for x in window if x not in year_ties]:
+                logging.info("Conditioning year {} for windows".format(entering))
+                self.decondition()
+                self.condition(times=entering, tokens=tokens if keep_only_tokens else None, weight_cutoff=weight_cutoff,
+                               context=context, keep_only_tokens=keep_only_tokens, batchsize=batchsize,
+                               return_sentiment=False)
+                nodes, ties = self.__graph_to_matrix(index)
+                year_ties[entering] = (nodes, ties)
+                window_ties = window_ties + ties
+                window_counts = window_counts + (ties != 0).astype(np.float64)
+                window_nodes = window_nodes + nodes
+            # Ties of all years have left
+            window_ties = window_ties.multiply(window_counts > 0.5).tocsr()
+            window_ties.eliminate_zeros()
+            window_counts.eliminate_zeros()
+
+            logging.info("Conditioning window {} of year {}".format(window, year))
+            self.decondition()
+            ties = top_k_rows(window_ties, max_degree) if max_degree is not None else window_ties
+            self.__graph_from_matrix(ties, [all_ids[x] for x in np.flatnonzero(window_nodes > 0)], all_ids, window)
+            if tokens is not None and depth is not None and depth > 0:
+                self.graph = self.__ego_graph(tokens, radius=depth)
+            if keep_only_tokens:
+                self.__prune_by_tokens(tokens)
+            self.__prune_by_frequency(prune_min_frequency, times=window, context=context)
+            self.cond_dict = self.__make_condition_dict(tokens, window, [('type', "replacement"),
+                                                                         ('cutoff', weight_cutoff),
+                                                                         ('context', context), ('depth', depth),
+                                                                         ('max_degree', max_degree)])
+            self.__complete_conditioning()
+            if compositional:
+                self.to_compositional(times=window, context=context)
+            if reverse:
+                self.to_reverse()
+            yield year, window
+
     def decondition(self):
         # Reset token lists to original state.
         if self.conditioned:
@@ -657,7 +864,7 @@ class neo4j_network(Sequence):
             self.__condition_error(call=inspect.stack()[1][3])
 
         # Prepare base cluster
-        base_cluster = return_cluster(self.graph, name, "", 0, to_measure, metadata_new)
+        base_cluster = return_cluster(self.get_networkx_graph(), name, "", 0, to_measure, metadata_new)
         cluster_list = []
         step_list = []
         prior_list = [base_cluster]
@@ -680,7 +887,7 @@ class neo4j_network(Sequence):
                 base, new_list, cluster_dict = cluster_graph(base, to_measure, algorithm, add_ego_tokens=add_ego_tokens)
                 base_step_list.append(base)
                 # Add assignment (level) to graph of snw
-                nx.set_node_attributes(self.graph, cluster_dict, 'clusterl' + str(t))
+                self.__set_node_attributes(cluster_dict, 'clusterl' + str(t))
                 if interest_list is not None:  # We want to proceed only on clusters of interest.
                     for cl in new_list:
                         cl_nodes = self.ensure_ids(list(cl['graph'].nodes))
@@ -884,11 +1091,14 @@ class neo4j_network(Sequence):
             self.add_frequencies(times=times, context=context)
 
         # Normalize per in degree
-        for (u, v, wt) in self.graph.edges.data('weight'):
-            if self.graph.nodes[v]['freq'] > 0:
-                self.graph[u][v]['weight'] = wt / self.graph.nodes[v]['freq']
-            else:
-                self.graph[u][v]['weight'] = 0
+        if isinstance(self.graph, sparse_graph):
+            self.graph.divide_by_receiver(self.graph.node_attribute('freq'))
+        else:
+            for (u, v, wt) in self.graph.edges.data('weight'):
+                if self.graph.nodes[v]['freq'] > 0:
+                    self.graph[u][v]['weight'] = wt / self.graph.nodes[v]['freq']
+                else:
+                    self.graph[u][v]['weight'] = 0
 
         self.is_compositional = True
 
@@ -927,13 +1137,11 @@ class neo4j_network(Sequence):
             else:
                 raise AttributeError("Please provide a list of ints, or an int as time variable")
 
-        query = "MATCH(r: edge) WHERE r.time in " + str(times) + " RETURN count(DISTINCT r.run_index) as nrs"
         try:
-            res = self.db.receive_query(query)
+            nrs = self.db.query_nr_sequences(times) / 1000
         except:
             logging.error("Could not retrieve number of sequences")
             raise
-        nrs = [x['nrs'] for x in res][0] / 1000
         logging.info("Normalizing graph by dividing by {} sequences".format(nrs))
         self.graph = renorm_graph(self.graph, nrs)
 
@@ -964,14 +1172,11 @@ class neo4j_network(Sequence):
             else:
                 raise AttributeError("Please provide a list of ints, or an int as time variable")
 
-        query = "MATCH(r: edge) WHERE r.time in " + str(times) + " RETURN round(sum(r.weight)) as nrs"
-
         try:
-            res = self.db.receive_query(query)
+            nrs = self.db.query_nr_occurrences(times) / 1000
         except:
             logging.error("Could not retrieve number of occurrences")
             raise
-        nrs = [x['nrs'] for x in res][0] / 1000
         logging.info("Normalizing graph by dividing by {} sequences".format(nrs))
         self.graph = renorm_graph(self.graph, nrs)
 
@@ -995,7 +1200,7 @@ class neo4j_network(Sequence):
 
         self.graph = sparsify_graph(self.graph, percentage)
 
-    def to_backout(self, decay=None, method="invert", stopping=25):
+    def to_backout(self, decay=None, method="invert", stopping=25, tol=1e-6, top_k=None):
         """
         If each node is defined by the ties to its neighbors, and neighbors
         are equally defined in this manner, what is the final composition
@@ -1013,11 +1218,17 @@ class neo4j_network(Sequence):
         ----------
         decay : float, optional
             Decay parameter determining the weight of higher order ties. The default is None.
-        method : "invert" or "series", optional
+        method : "invert", "series", "gmres" or "bicgstab", optional
             "invert" tries to invert the adjacency matrix.
-            "series" uses a series computation. The default is "invert".
+            "series" uses a series computation.
+            "gmres" and "bicgstab" solve for the ties of each node iteratively, without the dense inverse.
+            The default is "invert".
         stopping : int, optional
             Used if method is "series". Determines the maximum order of series computation. The default is 25.
+        tol : float, optional
+            Relative tolerance of the series computation and iterative solvers. The default is 1e-6.
+        top_k : int, optional
+            Keep only the top_k strongest ties of each node. The default is None.
 
 
         Returns
@@ -1031,7 +1242,7 @@ class neo4j_network(Sequence):
             self.__condition_error(call=inspect.stack()[1][3])
 
         self.graph = backout_measure(
-            self.graph, decay=decay, method=method, stopping=stopping)
+            self.graph, decay=decay, method=method, stopping=stopping, tol=tol, top_k=top_k)
 
         if self.cond_dict['backout']:
             # Graph was already reversed - update state
@@ -1165,18 +1376,15 @@ class neo4j_network(Sequence):
             # Add all tokens to graph
             self.graph.add_nodes_from(worklist)
 
-            # Loop batched over all tokens to condition
+            # Loop batched over all tokens to condition, batches may be queried concurrently
             if weight_cutoff is not None:
                 logging.warning("Weight cutoff {}".format(weight_cutoff))
-            for i in tqdm(range(0, len(worklist), batchsize), leave=False, position=0,
-                          desc="Querying {} nodes in batches of {}".format(len(worklist), batchsize)):
-                token_ids = worklist[i:i + batchsize]
-                logging.debug(
-                    "Conditioning by query batch {} of {} tokens.".format(i, len(token_ids)))
-                # Query Neo4j
-                self.__add_edges(
-                    self.query_nodes(token_ids, context=context, times=years, weight_cutoff=weight_cutoff, return_sentiment=return_sentiment),
-                    max_degree=max_degree)
+            batches = [worklist[i:i + batchsize] for i in range(0, len(worklist), batchsize)]
+            query = partial(self.query_node_columns, context=context, times=years, weight_cutoff=weight_cutoff,
+                            return_sentiment=return_sentiment)
+            for ties in tqdm(self.db.map_queries(query, batches), total=len(batches), leave=False, position=0,
+                             desc="Querying {} nodes in batches of {}".format(len(worklist), batchsize)):
+                self.__add_edge_columns(ties, max_degree=max_degree)
             try:
                 all_ids = list(self.graph.nodes)
             except:
@@ -1188,7 +1396,7 @@ class neo4j_network(Sequence):
             # Add final properties
             att_list = [{"token": x} for x in all_ids]
             att_dict = dict(list(zip(all_ids, att_list)))
-            nx.set_node_attributes(self.graph, att_dict)
+            self.__set_node_attributes(att_dict)
 
 
         else:  # Remove conditioning and recondition
@@ -1203,26 +1411,84 @@ class neo4j_network(Sequence):
         if batchsize is None:
             batchsize = self.neo_batch_size
 
-        # First, do a year conditioning
-        logging.debug("Full year conditioning before ego subsetting.")
-        self.__year_condition(years=years, weight_cutoff=weight_cutoff, context=context, batchsize=batchsize,
-                              max_degree=max_degree, return_sentiment=return_sentiment)
+        # First, do a year conditioning, or reuse the last one with the same parameters
+        key = (years, weight_cutoff, context, max_degree, return_sentiment, self.db.version_stamp())
+        if self.year_graph_cache is not None and self.year_graph_cache[0] == key:
+            logging.debug("Reusing full year conditioning for ego subsetting.")
+            if self.conditioned:
+                self.decondition()
+            self.graph = self.year_graph_cache[1]
+        else:
+            logging.debug("Full year conditioning before ego subsetting.")
+            self.year_graph_cache = None
+            self.__year_condition(years=years, weight_cutoff=weight_cutoff, context=context, batchsize=batchsize,
+                                  max_degree=max_degree, return_sentiment=return_sentiment)
+            if key[-1] is not None:
+                self.year_graph_cache = (key, self.graph)
 
-        if depth is not None:
-            if depth > 0:
-                # Create ego graph for each node
-                graph_list = []
-                if isinstance(token_ids, (list, np.ndarray)):
-                    for focal_token in token_ids:
-                        temp_graph = nx.generators.ego.ego_graph(self.graph, self.ensure_ids(focal_token), radius=depth,
-                                                                 center=True,
-                                                                 undirected=False)
-                        graph_list.append(temp_graph)
-                    # Compose ego graphs
-                    self.graph = compose_all(graph_list)
-                else:
-                    self.graph = nx.generators.ego.ego_graph(self.graph, self.ensure_ids(token_ids), radius=depth,
-                                                             center=True, undirected=False)
+        if depth is not None and depth > 0:
+            # Create ego graph for each node and compose
+            self.graph = self.__ego_graph(token_ids, radius=depth)
+        else:
+            # The cached graph must not be changed by further conditioning steps
+            self.graph = self.graph.copy()
+
+    def __plan_ego_condition(self, token_ids, times, depth, max_degree=None):
+        """
+        Chooses between search and subset conditioning of ego networks by estimating, from the degree statistics
+        of the database, the number of ties the search queries up to depth + 1.
+
+        Starting from the ties of the focal tokens, each level reaches as many new tokens as ties, up to the
+        tokens not yet queried, and each of those has the mean degree of a token at the end of a tie.
+        Search is chosen if it is expected to query less than half of the ties of the full network.
+
+        Returns
+        -------
+        "search", "subset", or None if the database does not provide degree statistics
+        """
+        statistics = self.__degree_statistics(times)
+        if statistics is None:
+            return None
+        ids, degrees = statistics
+        if max_degree is not None:
+            degrees = np.minimum(degrees, max_degree)
+        total_ties = degrees.sum()
+        if total_ties == 0:
+            return "search"
+        if not isinstance(token_ids, (list, np.ndarray)):
+            token_ids = [token_ids]
+        # Tokens at the end of a tie are picked proportional to their degree
+        tie_degree = (degrees ** 2).sum() / total_ties
+        queried = len(set(token_ids))
+        frontier_ties = degrees[np.isin(ids, token_ids)].sum()
+        search_ties = frontier_ties
+        for level in range(depth):
+            frontier = min(frontier_ties, len(ids) - queried)
+            if frontier <= 0:
+                break
+            queried += frontier
+            frontier_ties = frontier * tie_degree
+            search_ties += frontier_ties
+        cond_type = "search" if search_ties < 0.5 * total_ties else "subset"
+        logging.debug("Estimated {} of {} ties queried by search up to depth {}, choosing {} conditioning".format(
+            int(min(search_ties, total_ties)), int(total_ties), depth, cond_type))
+        return cond_type
+
+    def __degree_statistics(self, times):
+        """
+        Returns arrays of token ids and the number of their ties, cached by times and database version,
+        or None if the database does not provide degree statistics
+        """
+        key = (str(times), self.db.version_stamp())
+        if key not in self.degree_statistics:
+            degrees = self.db.query_degrees(times=times)
+            if degrees is None:
+                return None
+            degrees = np.array(degrees, dtype=np.int64).reshape(-1, 2)
+            if key[-1] is None:
+                return degrees[:, 0], degrees[:, 1]
+            self.degree_statistics[key] = (degrees[:, 0], degrees[:, 1])
+        return self.degree_statistics[key]
 
     def __ego_condition_search(self, years, token_ids, weight_cutoff=None, depth=None, context=None,
                                batchsize=None, max_degree: Optional[int] = None,return_sentiment:Optional[bool] = True):
@@ -1238,95 +1504,53 @@ class neo4j_network(Sequence):
             if depth is None:
                 logging.debug("Depth is None, but search conditioning is requested. Setting depth to 1.")
                 depth = 1
-            # Check one level deeper
-            or_depth = depth
-            depth += 1
-            # Create a dict to hold previously queried ids
-            prev_queried_ids = []
-            # ids to check
-            ids_to_check = token_ids
+            if not isinstance(token_ids, (list, np.ndarray)):
+                token_ids = [token_ids]
+            # Work from ID list, give error if tokens are not in database
+            token_ids = self.ensure_ids(list(token_ids))
+            # Add starting nodes
+            self.graph.add_nodes_from(token_ids)
+            # Ids queried so far, and ids to query at the current depth, in descending order
+            queried_ids = set()
+            ids_to_check = sorted(set(token_ids), reverse=True)
             logging.debug(
-                "Start of Depth {} conditioning".format(or_depth))
+                "Start of Depth {} conditioning".format(depth))
             if weight_cutoff is not None:
                 logging.warning("Weight cutoff {}".format(weight_cutoff))
-            while depth > 0:
-                if not isinstance(ids_to_check, (list, np.ndarray)):
-                    ids_to_check = [ids_to_check]
-
-                # Work from ID list, give error if tokens are not in database
-                ids_to_check = self.ensure_ids(ids_to_check)
-                # Do not consider already added tokens
-                ids_to_check = np.setdiff1d(ids_to_check, prev_queried_ids)
-                logging.debug(
-                    "Depth {} conditioning: {} new found tokens, where {} already added.".format(depth,
-                                                                                                 len(ids_to_check),
-                                                                                                 len(prev_queried_ids) - len(
-                                                                                                     ids_to_check)))
-                # Add ids_to_check to list since they will be queried this iteration
-                prev_queried_ids.extend(ids_to_check)
-                if isinstance(ids_to_check, (np.ndarray)):
-                    ids_to_check = list(ids_to_check)
-                ids_to_check.reverse()
-                # Add starting nodes
-                self.graph.add_nodes_from(ids_to_check)
-
-                for i in tqdm(range(0, len(ids_to_check), batchsize), leave=False, position=0,
-                              desc="Depth {} conditioning: {} new found tokens, where {} already added.".format(depth,
-                                                                                                                len(ids_to_check),
-                                                                                                                len(prev_queried_ids) - len(
-                                                                                                                    ids_to_check))):
-
-                    id_batch = ids_to_check[i:i + batchsize]
-
-                    logging.debug(
-                        "Conditioning by query batch {} of {} tokens.".format(i, len(ids_to_check)))
+            # Check one level deeper
+            for level in range(depth + 1, 0, -1):
+                if len(ids_to_check) == 0:
+                    break
+                queried_ids.update(ids_to_check)
+                # Query the frontier, in batches if it exceeds the batch size
+                found_ids = set()
+                batches = [ids_to_check[i:i + batchsize] for i in range(0, len(ids_to_check), batchsize)]
+                query = partial(self.query_node_columns, context=context, times=years, weight_cutoff=weight_cutoff,
+                                return_sentiment=return_sentiment)
+                for ties in tqdm(self.db.map_queries(query, batches), total=len(batches), leave=False, position=0,
+                                 desc="Depth {} conditioning: {} new found tokens, where {} already added.".format(
+                                     level, len(ids_to_check), len(queried_ids) - len(ids_to_check))):
                     # Query Neo4j
                     try:
-                        self.__add_edges(
-                            self.query_nodes(id_batch, context=context, times=years, weight_cutoff=weight_cutoff, return_sentiment=return_sentiment),
-                            max_degree=max_degree)
+                        edges = self.__add_edge_columns(ties, max_degree=max_degree)
                     except:
                         logging.error("Could not condition graph by query method.")
                         raise
-
-                # Delete disconnected nodes
-                remove = [node for node, degree in dict(self.graph.degree).items() if degree <= 0]
-                remove = list(np.setdiff1d(remove, token_ids))  # Do not remove focal tokens
-                self.graph.remove_nodes_from(remove)
-
-                # Update IDs and Tokens to reflect conditioning
-                all_ids = list(self.graph.nodes)
-                all_tokens = [self.get_token_from_id(x) for x in all_ids]
+                    found_ids.update(edges['sender'].tolist())
+                    found_ids.update(edges['receiver'].tolist())
 
                 # Set the next set of tokens as those that have not been previously queried
-                ids_to_check = np.setdiff1d(all_ids, prev_queried_ids)
-
-                # print("{} tokens post setdiff: {}".format(len(token_ids),token_ids))
-                # Set additional attributes
-                att_list = [{"token": x} for x in all_tokens]
-                att_dict = dict(list(zip(all_ids, att_list)))
-                nx.set_node_attributes(self.graph, att_dict)
-
-                # decrease depth
-                depth = depth - 1
-                # No more ids to check
-                if not ids_to_check.size > 0:
-                    depth = 0
+                ids_to_check = sorted(found_ids.difference(queried_ids), reverse=True)
 
             # Close session
             self.db.close_session()
 
+            # Set additional attributes
+            self.__set_node_attributes({x: {"token": self.get_token_from_id(x)} for x in self.graph.nodes})
+
             # Create ego graph for each node and compose
-            if or_depth > 0:
-                if isinstance(token_ids, (list, np.ndarray)):
-                    self.graph = compose_all([nx.generators.ego.ego_graph(self.graph, x, radius=or_depth, center=True,
-                                                                          undirected=False) for x in
-                                              self.ensure_ids(token_ids) if
-                                              x in self.graph.nodes])
-                else:
-                    self.graph = nx.generators.ego.ego_graph(self.graph, self.ensure_ids(token_ids), radius=or_depth,
-                                                             center=True,
-                                                             undirected=False)
+            if depth > 0:
+                self.graph = self.__ego_graph(token_ids, radius=depth)
 
         else:  # Remove conditioning and recondition
             self.decondition()
@@ -1378,7 +1602,7 @@ class neo4j_network(Sequence):
             # Add final properties
             att_list = [{"token": x} for x in all_ids]
             att_dict = dict(list(zip(all_ids, att_list)))
-            nx.set_node_attributes(self.graph, att_dict)
+            self.__set_node_attributes(att_dict)
 
 
         else:  # Remove conditioning and recondition
@@ -1465,7 +1689,7 @@ class neo4j_network(Sequence):
                     # Set additional attributes
                     att_list = [{"token": x} for x in all_tokens]
                     att_dict = dict(list(zip(all_ids, att_list)))
-                    nx.set_node_attributes(self.graph, att_dict)
+                    self.__set_node_attributes(att_dict)
 
                     # decrease depth
                     depth = depth - 1
@@ -1483,20 +1707,7 @@ class neo4j_network(Sequence):
             # Create ego graph for each node and compose
             if or_depth is not None:
                 if or_depth > 0:
-                    # Create ego graph for each node
-                    graph_list = []
-                    if isinstance(tokens, (list, np.ndarray)):
-                        for focal_token in tokens:
-                            temp_graph = nx.generators.ego.ego_graph(self.graph, self.ensure_ids(focal_token),
-                                                                     radius=or_depth,
-                                                                     center=True,
-                                                                     undirected=False)
-                            graph_list.append(temp_graph)
-                        # Compose ego graphs
-                        self.graph = compose_all(graph_list)
-                    else:
-                        self.graph = nx.generators.ego.ego_graph(self.graph, self.ensure_ids(tokens), radius=or_depth,
-                                                                 center=True, undirected=False)
+                    self.graph = self.__ego_graph(tokens, radius=or_depth)
 
 
         else:  # Remove conditioning and recondition
@@ -1519,12 +1730,120 @@ class neo4j_network(Sequence):
         self.conditioned = True
         self.filename = self.__create_filename(self.cond_dict)
 
-    # %% Graph abstractions - for now only networkx
+    def __graph_cache_key(self, arguments: dict) -> Optional[tuple]:
+        """
+        Returns the cache key and database version for conditioning arguments, or None if not caching
+        """
+        if self.graph_cache is None:
+            return None
+        if self.db.write_before_query:
+            self.db.write_queue()
+        version = self.db.version_stamp()
+        if version is None:
+            return None
+        arguments = dict(arguments, graph_type=self.graph_type, agg_operator=self.db.aggregate_operator)
+        return self.graph_cache.make_key(arguments, version), version
 
-    @staticmethod
-    def create_empty_graph() -> nx.DiGraph:
+    def __load_cached_graph(self, cache_key: Optional[tuple]) -> bool:
+        """
+        Sets the conditioned graph from the cache. Returns False if not cached.
+        """
+        if cache_key is None:
+            return False
+        cached = self.graph_cache.get(cache_key[0])
+        if cached is None:
+            return False
+        graph, metadata = cached
+        if self.conditioned:
+            self.decondition()
+        self.graph = graph
+        self.cond_dict = defaultdict(lambda: False)
+        self.cond_dict.update(metadata['cond_dict'])
+        self.is_compositional = metadata['is_compositional']
+        self.__complete_conditioning()
+        return True
+
+    def __save_cached_graph(self, cache_key: Optional[tuple]):
+        if cache_key is not None:
+            metadata = {'cond_dict': dict(self.cond_dict), 'is_compositional': self.is_compositional}
+            self.graph_cache.put(cache_key[0], self.graph, cache_key[1], metadata)
+
+    # %% Graph abstractions - networkx or sparse_graph
+
+    def create_empty_graph(self) -> Union[nx.DiGraph, sparse_graph]:
+        if self.graph_type == "sparse":
+            return sparse_graph()
         return nx.DiGraph()
 
+    def get_networkx_graph(self) -> Union[nx.DiGraph, nx.Graph]:
+        """
+        Returns the conditioned graph as networkx graph, converting it if graph_type is "sparse"
+        """
+        if isinstance(self.graph, sparse_graph):
+            return self.graph.to_networkx()
+        return self.graph
+
+    def __set_node_attributes(self, values, name=None):
+        if isinstance(self.graph, sparse_graph):
+            self.graph.set_node_attributes(values, name)
+        else:
+            nx.set_node_attributes(self.graph, values, name)
+
+    def __ego_graph(self, token_ids, radius):
+        """
+        Union of the ego networks, following outgoing ties up to radius, of the tokens in the graph
+        """
+        if not isinstance(token_ids, (list, np.ndarray)):
+            token_ids = [token_ids]
+        token_ids = [x for x in self.ensure_ids(list(token_ids)) if x in self.graph.nodes]
+        if isinstance(self.graph, sparse_graph):
+            return self.graph.ego_graph(token_ids, radius=radius)
+        # Same as compose_all over nx.ego_graph of each token, with one multi-source search
+        nodes = list(self.graph.nodes)
+        index = {x: i for i, x in enumerate(nodes)}
+        edges = list(self.graph.edges)
+        rows = np.array([index[x[0]] for x in edges], dtype=np.int64)
+        cols = np.array([index[x[1]] for x in edges], dtype=np.int64)
+        reached = ego_reach(rows, cols, len(nodes), [index[x] for x in token_ids], radius)
+        edge_mask = (reached[rows] & reached[cols]).any(axis=1) if len(edges) > 0 else np.zeros(0, dtype=bool)
+        ego_graph = self.graph.__class__()
+        ego_graph.graph.update(self.graph.graph)
+        ego_graph.add_nodes_from((nodes[x], self.graph.nodes[nodes[x]]) for x in np.flatnonzero(reached.any(axis=1)))
+        ego_graph.add_edges_from((u, v, self.graph[u][v]) for (u, v), keep in zip(edges, edge_mask) if keep)
+        return ego_graph
+
+    def __graph_to_matrix(self, index: dict) -> Tuple[np.ndarray, scipy.sparse.csr_matrix]:
+        """
+        Returns the nodes of the graph as indicator vector, and its tie weights as sparse matrix,
+        with positions of token ids given by index
+        """
+        n = len(index)
+        nodes = np.zeros(n, dtype=np.int64)
+        nodes[[index[x] for x in self.graph.nodes]] = 1
+        if isinstance(self.graph, sparse_graph):
+            adjacency = self.graph.adjacency().tocoo()
+            positions = np.array([index[x] for x in self.graph.node_ids.tolist()], dtype=np.int64)
+            rows, cols, weights = positions[adjacency.row], positions[adjacency.col], adjacency.data
+        else:
+            edges = list(self.graph.edges(data='weight', default=1))
+            rows = np.array([index[x[0]] for x in edges], dtype=np.int64)
+            cols = np.array([index[x[1]] for x in edges], dtype=np.int64)
+            weights = np.array([x[2] for x in edges], dtype=np.float64)
+        return nodes, scipy.sparse.csr_matrix((weights, (rows, cols)), shape=(n, n))
+
+    def __graph_from_matrix(self, ties: scipy.sparse.csr_matrix, nodes: list, all_ids: list, times: list):
+        """
+        Sets the graph to the given nodes and the ties of a sparse matrix, whose positions correspond to all_ids
+        """
+        nw_time = self.db.network_time(times)
+        self.graph = self.create_empty_graph()
+        self.graph.add_nodes_from(nodes)
+        ties = ties.tocoo()
+        self.graph.add_edges_from([(all_ids[u], all_ids[v], {'weight': w, 'time': nw_time['m'], 'start': nw_time['s'],
+                                                            'end': nw_time['e']})
+                                   for u, v, w in zip(ties.row.tolist(), ties.col.tolist(), ties.data.tolist())])
+        self.__set_node_attributes({x: {"token": self.get_token_from_id(x)} for x in self.graph.nodes})
+
     def delete_graph(self):
         self.graph = None
 
@@ -1662,17 +1981,24 @@ class neo4j_network(Sequence):
         ids = self.ensure_ids(node_list)
 
         # Set default frequency
-        nx.set_node_attributes(self.graph, values=0, name="freq")
+        self.__set_node_attributes(0, name="freq")
 
         # Just in case, translate between node labels in graph and ids
         node_id_dict = {x[0]: x[1] for x in zip(node_list, ids)}
         # Attribute dict
         ret = {node_id_dict[x[0]]: {'freq': x[1]} for x in
                self.db.query_occurrences(ids=ids, times=times, context=context)}
-        nx.set_node_attributes(self.graph, ret)
+        self.__set_node_attributes(ret)
 
     def __cut_and_norm(self, cutoff: Optional[float] = None, norm: Optional[bool] = False):
 
+        if isinstance(self.graph, sparse_graph):
+            if cutoff is not None:
+                self.graph.cut(cutoff)
+            if norm:
+                self.graph.norm_in_degree()
+            return
+
         if cutoff is not None:
             cut_edges = [(u, v) for u, v, wt in self.graph.edges.data('weight') if wt <= cutoff]
             self.graph.remove_edges_from(cut_edges)
@@ -1685,6 +2011,33 @@ class neo4j_network(Sequence):
                 if in_deg[v] > 0:
                     self.graph[u][v]['weight'] = wt / in_deg[v]
 
+    def __add_edge_columns(self, columns: dict, max_degree: Optional[int] = None) -> dict:
+        """
+        Adds queried ties, given as columns, to the graph. If max_degree is given, only the max_degree ties
+        of largest weight of each sender are added.
+
+        Returns
+        -------
+        Columns of the added ties
+        """
+        if max_degree is not None and len(columns['sender']) > 0:
+            # Ascending weights within each sender, the last max_degree ties of each sender are retained
+            order = np.lexsort((columns['weight'], columns['sender']))
+            senders = columns['sender'][order]
+            group_end = np.searchsorted(senders, senders, side="right")
+            keep = np.sort(order[group_end - np.arange(len(senders)) <= max_degree])
+            columns = {k: v[keep] if isinstance(v, np.ndarray) else v for k, v in columns.items()}
+        try:
+            if isinstance(self.graph, sparse_graph):
+                attributes = {k: v for k, v in columns.items() if k not in ['sender', 'receiver', 'weight']}
+                self.graph.add_edge_columns(columns['sender'], columns['receiver'], columns['weight'], attributes)
+            else:
+                self.graph.add_edges_from(self.db.iterate_ties(columns))
+        except:
+            logging.error("Could not add edges from query.")
+            raise
+        return columns
+
     def __add_edges(self, edges: dict, max_degree: Optional[int] = None):
 
         try:
@@ -1808,7 +2161,7 @@ class neo4j_network(Sequence):
                 reverse_dict = dict(
                     zip([self.get_token_from_id(x) for x in self.ids], self.ids))
 
-                cleaned_graph = self.graph.copy()
+                cleaned_graph = self.get_networkx_graph().copy()
                 cleaned_graph = nx.relabel_nodes(cleaned_graph, labeldict)
                 # need to put strings on edges for gefx to write (not sure why)
                 # confirm that edge attributes are int
@@ -1820,7 +2173,7 @@ class neo4j_network(Sequence):
                         if att in d:
                             d[att] = int(d[att])
                 if delete_isolates:
-                    isolates = list(nx.isolates(self.graph))
+                    isolates = list(nx.isolates(cleaned_graph))
                     logging.debug(
                         "Found {} isolated nodes in graph, deleting.".format(len(isolates)))
                     cleaned_graph.remove_nodes_from(isolates)
@@ -1849,7 +2202,7 @@ class neo4j_network(Sequence):
                 reverse_dict = dict(
                     zip([self.get_token_from_id(x) for x in self.ids], self.ids))
 
-                cleaned_graph = self.graph.copy()
+                cleaned_graph = self.get_networkx_graph().copy()
                 cleaned_graph = nx.relabel_nodes(cleaned_graph, labeldict)
                 # need to put strings on edges for gefx to write (not sure why)
                 # confirm that edge attributes are int
@@ -1861,7 +2214,7 @@ class neo4j_network(Sequence):
                         if att in d:
                             d[att] = int(d[att])
                 if delete_isolates:
-                    isolates = list(nx.isolates(self.graph))
+                    isolates = list(nx.isolates(cleaned_graph))
                     logging.debug(
                         "Found {} isolated nodes in graph, deleting.".format(len(isolates)))
                     cleaned_graph.remove_nodes_from(isolates)
@@ -1896,6 +2249,22 @@ class neo4j_network(Sequence):
         self.tokens = tokens
         self.update_dicts()
 
+    def build_year_aggregates(self, times=None):
+        """
+        Materializes the aggregate ties of each time in the database.
+
+        Afterwards, conditioning without context, part of speech or weight_cutoff sums these yearly aggregates
+        instead of aggregating all occurrence ties. Multi-year conditioning sums the aggregates of each year.
+
+        Parameters
+        ----------
+        times: list of times, optional
+            Times to aggregate. If None, all times are aggregated.
+        """
+        if self.db.write_before_query:
+            self.db.write_queue()
+        self.db.build_year_aggregates(times)
+
     def query_context(self, ids, times=None, weight_cutoff=None, occurrence=False):
         """
         Query context of ids
@@ -1936,6 +2305,21 @@ class neo4j_network(Sequence):
         If provided with context, return under the condition that elements of context are present in the context element distribution of
         this occurrence
 
+        See query_node_columns
+
+        Returns
+        -------
+        list of tuples (sender, receiver, attribute dict)
+        """
+        return self.db.columns_to_ties(
+            self.query_node_columns(ids, context=context, times=times, weight_cutoff=weight_cutoff, pos=pos,
+                                    return_sentiment=return_sentiment, context_mode=context_mode,
+                                    context_weight=context_weight))
+
+    def query_node_columns(self, ids, context=None, times=None, weight_cutoff=None, pos=None, return_sentiment=True,
+                           context_mode="bidirectional", context_weight=True):
+        """
+        Query multiple nodes by ID and over a set of time intervals, returning the ties as numpy columns
 
         Parameters
         ----------
@@ -1947,7 +2331,7 @@ class neo4j_network(Sequence):
             either a number format YYYY, or an interval dict {"start":YYYY,"end":YYYY}
         :param weight_cutoff:
             float in 0,1
-        :return: list of tuples (u,occurrences)
+        :return: dict of arrays sender, receiver, weight (sentiment, subjectivity) and values time, start, end, pos
 
         """
 
@@ -1965,6 +2349,11 @@ class neo4j_network(Sequence):
         else:
             ids = [int(x) for x in ids]
 
+        # Without context, part of speech or occurrence-level cutoff, ties can be summed from yearly aggregates
+        if context is None and pos is None and (weight_cutoff is None or weight_cutoff <= 1e-07):
+            if self.db.has_year_aggregates(times):
+                return self.db.query_year_aggregates_columns(ids=ids, times=times, return_sentiment=return_sentiment)
+
         # Dispatch with or without context
         if context is not None:
             context = self.ensure_ids(context)
@@ -1972,13 +2361,14 @@ class neo4j_network(Sequence):
                 context = [int(context)]
             else:
                 context = [int(x) for x in context]
-            return self.db.query_multiple_nodes(ids=ids, context=context, times=times, weight_cutoff=weight_cutoff,
-                                                pos=pos, return_sentiment=return_sentiment,
-                                                context_mode=context_mode, context_weight=context_weight)
+            return self.db.query_multiple_nodes_columns(ids=ids, context=context, times=times,
+                                                        weight_cutoff=weight_cutoff, pos=pos,
+                                                        return_sentiment=return_sentiment,
+                                                        context_mode=context_mode, context_weight=context_weight)
         else:
-            return self.db.query_multiple_nodes(ids=ids, times=times, weight_cutoff=weight_cutoff,
-                                                pos=pos, return_sentiment=return_sentiment,
-                                                context_mode=context_mode, context_weight=context_weight)
+            return self.db.query_multiple_nodes_columns(ids=ids, times=times, weight_cutoff=weight_cutoff,
+                                                        pos=pos, return_sentiment=return_sentiment,
+                                                        context_mode=context_mode, context_weight=context_weight)
 
     def query_multiple_nodes(self, ids, times=None, weight_cutoff=None, ):
         """
@@ -2091,7 +2481,7 @@ class neo4j_network(Sequence):
                 # Set additional attributes
                 att_list = [{"token": x} for x in all_tokens]
                 att_dict = dict(list(zip(all_ids, att_list)))
-                nx.set_node_attributes(self.graph, att_dict)
+                self.__set_node_attributes(att_dict)
 
                 # decrease depth
                 depth = depth - 1
@@ -2104,15 +2494,7 @@ class neo4j_network(Sequence):
 
             # Create ego graph for each node and compose
             if or_depth > 0:
-                if isinstance(tokens, (list, np.ndarray)):
-                    self.graph = compose_all([nx.generators.ego.ego_graph(self.graph, x, radius=or_depth, center=True,
-                                                                          undirected=False) for x in
-                                              self.ensure_ids(tokens) if
-                                              x in self.graph.nodes])
-                else:
-                    self.graph = nx.generators.ego.ego_graph(self.graph, self.ensure_ids(tokens), radius=or_depth,
-                                                             center=True,
-                                                             undirected=False)
+                self.graph = self.__ego_graph(tokens, radius=or_depth)
 
         else:  # Remove conditioning and recondition
             self.decondition()
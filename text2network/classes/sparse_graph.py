@@ -0,0 +1,777 @@
+import logging
+
+import numpy as np
+import scipy.sparse
+
+try:
+    import networkx as nx
+except:
+    nx = None
+
+
+def attributes_to_arrays(attribute_dicts, prefix):
+    """Converts a list of attribute dicts into one array (and set mask) per attribute"""
+    arrays = {}
+    keys = set()
+    for x in attribute_dicts:
+        keys.update(x.keys())
+    for key in keys:
+        mask = np.array([key in x for x in attribute_dicts], dtype=bool)
+        values = [x[key] for x in attribute_dicts if key in x]
+        column = np.zeros(len(attribute_dicts), dtype=infer_dtype(values))
+        if column.dtype.kind == "U":
+            values = [str(x) for x in values]
+        column[mask] = values
+        arrays[prefix + key] = column
+        arrays["has_" + prefix + key] = mask
+    return arrays
+
+
+def arrays_to_attributes(arrays, prefix, length):
+    """Inverse of attributes_to_arrays"""
+    attribute_dicts = [{} for _ in range(length)]
+    for name in arrays:
+        if name.startswith(prefix):
+            key = name[len(prefix):]
+            values = arrays[name].tolist()
+            for i in np.flatnonzero(arrays["has_" + name]):
+                attribute_dicts[i][key] = values[i]
+    return attribute_dicts
+
+
+def infer_dtype(values):
+    """int64 or float64 for numbers, otherwise a str dtype long enough for all values"""
+    if all([isinstance(x, (int, np.integer)) and not isinstance(x, (bool, np.bool_)) for x in values]):
+        return np.int64
+    elif all([isinstance(x, (int, float, np.integer, np.floating)) for x in values]):
+        return np.float64
+    else:
+        return np.array([str(x) for x in values] + [""]).dtype
+
+
+def merge_columns(columns, lengths):
+    """
+    Concatenates attribute columns (values, mask) of several edge or node sets.
+    None is used for sets where the attribute is not set.
+    """
+    kinds = [x[0].dtype.kind for x in columns if x is not None]
+    if "U" in kinds and not all([x == "U" for x in kinds]):
+        columns = [(x[0].astype(str), x[1]) if x is not None else None for x in columns]
+    dtype = np.result_type(*[x[0].dtype for x in columns if x is not None])
+    values = np.concatenate([x[0].astype(dtype) if x is not None else np.zeros(n, dtype=dtype)
+                             for x, n in zip(columns, lengths)])
+    mask = np.concatenate([x[1] if x is not None else np.zeros(n, dtype=bool) for x, n in zip(columns, lengths)])
+    return values, mask
+
+
+def symmetric_weights(weights, reverse_weights, technique="avg-sym"):
+    """
+    Weights of undirected ties given the weights of both directions, see network_tools.make_symmetric
+
+    Parameters
+    ----------
+    weights: np.ndarray
+        Weights of ties u->v, nan where there is no such tie
+    reverse_weights: np.ndarray
+        Weights of ties v->u, nan where there is no such tie
+    technique: str
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        Weights of the undirected ties, and whether to retain them
+    """
+    if technique is None:
+        technique = "avg-sym"
+    weights = np.asarray(weights, dtype=np.float64)
+    reverse_weights = np.asarray(reverse_weights, dtype=np.float64)
+    bidirectional = ~np.isnan(weights) & ~np.isnan(reverse_weights)
+    keep = np.ones(len(weights), dtype=bool)
+    if technique in ["transpose", "avg-sym", "min-sym-avg"]:
+        new_weights = (np.nan_to_num(weights) + np.nan_to_num(reverse_weights)) / 2
+    elif technique == "sum":
+        new_weights = np.nan_to_num(weights) + np.nan_to_num(reverse_weights)
+    elif technique == "min-sym":
+        new_weights = np.fmin(weights, reverse_weights)
+    elif technique == "max-sym":
+        new_weights = np.fmax(weights, reverse_weights)
+    else:
+        raise AttributeError("Method parameter not recognized")
+    if technique in ["min-sym", "min-sym-avg"]:
+        keep = bidirectional
+    return new_weights, keep
+
+
+def ego_reach(rows, cols, n, centers, radius=1):
+    """
+    Multi-source breadth first search along ties, following all centers at once
+
+    Parameters
+    ----------
+    rows, cols: np.ndarray
+        Positions of senders and receivers of the ties
+    n: int
+        Number of nodes
+    centers: list
+        Positions of the center nodes
+    radius: int
+
+    Returns
+    -------
+    np.ndarray (n x len(centers)) of bool, True where a node is reachable from a center within radius ties
+    """
+    structure = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    # One column of reached nodes per center
+    reached = np.zeros((n, len(centers)), dtype=bool)
+    reached[centers, np.arange(len(centers))] = True
+    frontier = reached.copy()
+    for _ in range(radius):
+        frontier = (structure.T @ frontier.astype(np.float64) > 0) & ~reached
+        if not frontier.any():
+            break
+        reached = reached | frontier
+    return reached
+
+
+class sparse_node_view():
+    """Read-only view of the nodes of a sparse_graph, similar to the networkx NodeView"""
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __iter__(self):
+        return iter(self.graph.node_ids.tolist())
+
+    def __len__(self):
+        return len(self.graph.node_ids)
+
+    def __contains__(self, node):
+        return node in self.graph.index
+
+    def __getitem__(self, node):
+        """
+        :return: dict of node attributes. This is a copy, use sparse_graph.set_node_attributes to change attributes.
+        """
+        i = self.graph.index[node]
+        return {key: values[i].item() for key, (values, mask) in self.graph.node_attributes.items() if mask[i]}
+
+    def data(self):
+        return {node: self[node] for node in self}
+
+
+class sparse_graph():
+
+    def __init__(self, nodes=None, directed=True):
+        """
+        Conditioned network held as a scipy CSR matrix of tie weights.
+
+        Rows and columns are positions in node_ids, the token ids of the nodes, and index maps token ids to
+        positions. Further tie attributes (time, start, end, sentiment...) are kept as arrays parallel to the
+        data of the CSR matrix, and node attributes (token, freq...) as arrays parallel to node_ids.
+        Each attribute is a tuple (values, mask), where mask indicates whether it is set.
+
+        The transformations of the conditioned network are vectorized operations on these arrays.
+        Undirected graphs are stored with ties in both directions.
+
+        The class implements the parts of the networkx graph interface used during conditioning
+        (add_nodes_from, add_edges_from, nodes, degree, remove_nodes_from, graph[node]). Ties added during
+        conditioning are buffered and only assembled into the CSR matrix when the graph is read.
+        Use to_networkx for everything else.
+
+        Parameters
+        ----------
+        nodes: list
+            Token ids of the nodes
+        directed: bool
+            Whether the graph is directed
+        """
+        self.directed = directed
+        self.node_ids = np.array([], dtype=np.int64)
+        self.index = {}
+        self.matrix = scipy.sparse.csr_matrix((0, 0), dtype=np.float64)
+        self.edge_attributes = {}
+        self.node_attributes = {}
+        # Lists of edge tuples, or columns of add_edge_columns, added since the CSR matrix was last assembled
+        self.pending_edges = []
+        if nodes is not None:
+            self.add_nodes_from(nodes)
+
+    # %% Construction
+    @classmethod
+    def from_networkx(cls, graph):
+        new_graph = cls(directed=nx.is_directed(graph))
+        new_graph.add_nodes_from(list(graph.nodes))
+        new_graph.set_node_attributes({x: d for x, d in graph.nodes(data=True)})
+        edges = list(graph.edges(data=True))
+        if not new_graph.directed:
+            edges = edges + [(v, u, d) for u, v, d in edges if u != v]
+        new_graph.add_edges_from(edges)
+        return new_graph
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Creates a graph from the arrays returned by to_arrays
+        """
+        new_graph = cls(directed=bool(arrays['directed']) if 'directed' in arrays else True)
+        new_graph.node_ids = np.asarray(arrays['nodes'], dtype=np.int64)
+        new_graph.index = {x: i for i, x in enumerate(new_graph.node_ids.tolist())}
+        n = len(new_graph.node_ids)
+        data = np.asarray(arrays['edge_weight'], dtype=np.float64) if 'edge_weight' in arrays else np.ones(
+            len(arrays['indices']))
+        new_graph.matrix = scipy.sparse.csr_matrix((data, arrays['indices'], arrays['indptr']), shape=(n, n))
+        for name in arrays:
+            if name.startswith("edge_") and name != "edge_weight":
+                new_graph.edge_attributes[name[5:]] = (arrays[name], arrays["has_" + name])
+            elif name.startswith("node_"):
+                new_graph.node_attributes[name[5:]] = (arrays[name], arrays["has_" + name])
+        return new_graph
+
+    def copy(self):
+        self.__assemble()
+        new_graph = sparse_graph(directed=self.directed)
+        new_graph.node_ids = self.node_ids.copy()
+        new_graph.index = dict(self.index)
+        new_graph.matrix = self.matrix.copy()
+        new_graph.edge_attributes = {k: (v.copy(), m.copy()) for k, (v, m) in self.edge_attributes.items()}
+        new_graph.node_attributes = {k: (v.copy(), m.copy()) for k, (v, m) in self.node_attributes.items()}
+        return new_graph
+
+    def add_nodes_from(self, nodes):
+        """Adds nodes (token ids) not yet in the graph"""
+        new_nodes = []
+        for node in nodes:
+            node = int(node)
+            if node not in self.index:
+                self.index[node] = len(self.node_ids) + len(new_nodes)
+                new_nodes.append(node)
+        if len(new_nodes) > 0:
+            # Buffered ties refer to token ids and are not affected
+            self.node_ids = np.concatenate([self.node_ids, np.array(new_nodes, dtype=np.int64)])
+            n = len(self.node_ids)
+            indptr = np.concatenate([self.matrix.indptr, np.full(len(new_nodes), self.matrix.indptr[-1])])
+            self.matrix = scipy.sparse.csr_matrix((self.matrix.data, self.matrix.indices, indptr), shape=(n, n))
+            self.node_attributes = {k: merge_columns([v, None], [n - len(new_nodes), len(new_nodes)]) for k, v in
+                                    self.node_attributes.items()}
+
+    def add_edges_from(self, edges):
+        """
+        Adds ties (u, v, attribute dict). Ties already in the graph are replaced.
+        Missing nodes are added.
+        """
+        edges = list(edges)
+        if len(edges) > 0:
+            self.add_nodes_from([x[0] for x in edges] + [x[1] for x in edges])
+            self.pending_edges.append(edges)
+
+    def add_edge_columns(self, senders, receivers, weights, attributes=None):
+        """
+        Adds ties given as arrays, as add_edges_from but without a dict per tie.
+
+        Parameters
+        ----------
+        senders, receivers: np.ndarray
+            Token ids of the ties
+        weights: np.ndarray
+            Weights of the ties
+        attributes: dict, optional
+            Further tie attributes, each an array parallel to senders or a value set on all ties
+        """
+        senders = np.asarray(senders, dtype=np.int64)
+        receivers = np.asarray(receivers, dtype=np.int64)
+        if len(senders) > 0:
+            # Nodes are added in the order of their first appearance, as in add_edges_from
+            ids = np.concatenate([senders, receivers])
+            first = np.unique(ids, return_index=True)[1]
+            self.add_nodes_from(ids[np.sort(first)].tolist())
+            columns = {}
+            for key, values in (attributes if attributes is not None else {}).items():
+                values = np.asarray(values)
+                if values.ndim == 0:
+                    values = np.full(len(senders), values.item() if values.dtype.kind != "U" else str(values))
+                columns[key] = (values, np.ones(len(senders), dtype=bool))
+            self.pending_edges.append((senders, receivers, np.asarray(weights, dtype=np.float64), columns))
+
+    @staticmethod
+    def __edge_columns(edges):
+        """Converts a list of tie tuples into the column format of add_edge_columns"""
+        attribute_dicts = [x[2] if len(x) > 2 else {} for x in edges]
+        new_attributes = attributes_to_arrays([{k: v for k, v in x.items() if k != 'weight'} for x in attribute_dicts],
+                                              "")
+        return (np.array([int(x[0]) for x in edges], dtype=np.int64),
+                np.array([int(x[1]) for x in edges], dtype=np.int64),
+                np.array([x.get('weight', 1) for x in attribute_dicts], dtype=np.float64),
+                {x: (new_attributes[x], new_attributes["has_" + x]) for x in new_attributes if
+                 not x.startswith("has_")})
+
+    def __positions(self, ids):
+        """Positions of token ids in node_ids"""
+        sorter = np.argsort(self.node_ids, kind="stable")
+        return sorter[np.searchsorted(self.node_ids, ids, sorter=sorter)].astype(np.int64)
+
+    def __assemble(self):
+        """Adds the buffered ties to the CSR matrix"""
+        if len(self.pending_edges) == 0:
+            return
+        # Consecutive lists of tuples are converted together
+        chunks = []
+        edges = []
+        for entry in self.pending_edges + [None]:
+            if isinstance(entry, list):
+                edges.extend(entry)
+                continue
+            if len(edges) > 0:
+                chunks.append(self.__edge_columns(edges))
+                edges = []
+            if entry is not None:
+                chunks.append(entry)
+        self.pending_edges = []
+        rows, cols = self.__edge_positions()
+        lengths = [len(rows)] + [len(x[0]) for x in chunks]
+        attributes = {}
+        for key in set(self.edge_attributes.keys()).union(*[x[3].keys() for x in chunks]):
+            attributes[key] = merge_columns([self.edge_attributes.get(key)] + [x[3].get(key) for x in chunks],
+                                            lengths)
+        self.edge_attributes = attributes
+        self.__set_edges(np.concatenate([rows] + [self.__positions(x[0]) for x in chunks]),
+                         np.concatenate([cols] + [self.__positions(x[1]) for x in chunks]),
+                         np.concatenate([self.matrix.data] + [x[2] for x in chunks]))
+
+    def __set_edges(self, rows, cols, data, selection=None):
+        """
+        Sets the CSR matrix from coordinates, reordering the edge attributes accordingly.
+        If a tie appears several times, the last one is retained.
+
+        Parameters
+        ----------
+        rows, cols, data: np.ndarray
+            Positions and weights of ties
+        selection: np.ndarray, optional
+            Index into the current edge attribute arrays for each tie, if they are not already parallel to rows
+        """
+        n = len(self.node_ids)
+        order = np.lexsort((np.arange(len(rows)), cols, rows))
+        rows, cols = rows[order], cols[order]
+        # Retain last tie of duplicates
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        order = order[last]
+        rows, cols = rows[last], cols[last]
+        if selection is not None:
+            order_attributes = selection[order]
+        else:
+            order_attributes = order
+        self.edge_attributes = {k: (v[order_attributes], m[order_attributes]) for k, (v, m) in
+                                self.edge_attributes.items()}
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))]).astype(np.int64)
+        self.matrix = scipy.sparse.csr_matrix((data[order], cols, indptr), shape=(n, n))
+
+    def __edge_positions(self):
+        """Row and column positions of the ties, in CSR order"""
+        rows = np.repeat(np.arange(len(self.node_ids)), np.diff(self.matrix.indptr))
+        return rows, self.matrix.indices.astype(np.int64)
+
+    def __select_edges(self, edge_mask):
+        """Retains ties where edge_mask is True. CSR order is retained."""
+        self.__assemble()
+        rows, cols = self.__edge_positions()
+        self.edge_attributes = {k: (v[edge_mask], m[edge_mask]) for k, (v, m) in self.edge_attributes.items()}
+        n = len(self.node_ids)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[edge_mask], minlength=n))]).astype(np.int64)
+        self.matrix = scipy.sparse.csr_matrix((self.matrix.data[edge_mask], cols[edge_mask], indptr), shape=(n, n))
+
+    def __select_nodes(self, node_mask, edge_mask=None):
+        """Retains nodes where node_mask is True, and ties among them (where edge_mask is True)"""
+        self.__assemble()
+        rows, cols = self.__edge_positions()
+        keep = node_mask[rows] & node_mask[cols]
+        if edge_mask is not None:
+            keep = keep & edge_mask
+        new_positions = np.cumsum(node_mask) - 1
+        self.node_ids = self.node_ids[node_mask]
+        self.index = {x: i for i, x in enumerate(self.node_ids.tolist())}
+        self.node_attributes = {k: (v[node_mask], m[node_mask]) for k, (v, m) in self.node_attributes.items()}
+        self.edge_attributes = {k: (v[keep], m[keep]) for k, (v, m) in self.edge_attributes.items()}
+        n = len(self.node_ids)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(new_positions[rows[keep]], minlength=n))]).astype(np.int64)
+        self.matrix = scipy.sparse.csr_matrix((self.matrix.data[keep], new_positions[cols[keep]], indptr),
+                                              shape=(n, n))
+
+    def node_mask(self, nodes):
+        """Boolean array over node positions, True for the given token ids that are in the graph"""
+        mask = np.zeros(len(self.node_ids), dtype=bool)
+        positions = [self.index[x] for x in nodes if x in self.index]
+        mask[positions] = True
+        return mask
+
+    def remove_nodes_from(self, nodes):
+        self.__select_nodes(~self.node_mask(nodes))
+
+    def remove_edges_from(self, edges):
+        self.__assemble()
+        remove = scipy.sparse.csr_matrix((np.ones(len(edges)), (
+            [self.index[x[0]] for x in edges], [self.index[x[1]] for x in edges])), shape=self.matrix.shape)
+        rows, cols = self.__edge_positions()
+        self.__select_edges(np.asarray(remove[rows, cols]).reshape(-1) == 0)
+
+    def set_node_attributes(self, values, name=None):
+        """
+        Sets node attributes as networkx.set_node_attributes
+
+        Parameters
+        ----------
+        values: dict or scalar
+            If name is None, dict of node: {attribute: value}. Otherwise dict of node: value or a value for all nodes
+        name: str, optional
+            Name of the attribute
+        """
+        if name is None:
+            keys = set()
+            for x in values.values():
+                keys.update(x.keys())
+            for key in keys:
+                self.set_node_attributes({node: x[key] for node, x in values.items() if key in x}, key)
+            return
+        if not isinstance(values, dict):
+            values = {node: values for node in self.node_ids.tolist()}
+        nodes = [x for x in values if x in self.index]
+        if len(nodes) == 0:
+            return
+        positions = np.array([self.index[x] for x in nodes], dtype=np.int64)
+        column = attributes_to_arrays([{name: values[x]} for x in nodes], "")
+        n = len(self.node_ids)
+        if name in self.node_attributes:
+            old_values, old_mask = self.node_attributes[name]
+            merged_values, _ = merge_columns([(old_values, old_mask), (column[name], column["has_" + name])],
+                                             [n, len(nodes)])
+            new_values, new_mask = merged_values[:n], old_mask.copy()
+        else:
+            new_values, new_mask = np.zeros(n, dtype=column[name].dtype), np.zeros(n, dtype=bool)
+        new_values[positions] = column[name]
+        new_mask[positions] = True
+        self.node_attributes[name] = (new_values, new_mask)
+
+    def node_attribute(self, name, default=0):
+        """
+        :return: array of the attribute over node positions, default where not set
+        """
+        if name not in self.node_attributes:
+            return np.full(len(self.node_ids), default)
+        values, mask = self.node_attributes[name]
+        return np.where(mask, values, default)
+
+    # %% Networkx interface
+    @property
+    def nodes(self):
+        return sparse_node_view(self)
+
+    @property
+    def degree(self):
+        """
+        :return: dict of node: number of ties, as networkx graph.degree
+        """
+        self.__assemble()
+        degree = np.diff(self.matrix.indptr)
+        if self.directed:
+            degree = degree + np.bincount(self.matrix.indices, minlength=len(self.node_ids))
+        else:
+            # Self-loops count twice in undirected graphs
+            degree = degree + (self.matrix.diagonal() != 0)
+        return dict(zip(self.node_ids.tolist(), degree.tolist()))
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        self.__assemble()
+        if self.directed:
+            return self.matrix.nnz
+        return int((self.matrix.nnz + np.count_nonzero(self.matrix.diagonal())) / 2)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def __getitem__(self, node):
+        """
+        :return: dict of neighbor: {attribute: value}, as networkx graph[node]
+        """
+        self.__assemble()
+        i = self.index[node]
+        start, end = self.matrix.indptr[i], self.matrix.indptr[i + 1]
+        neighbors = {}
+        for j in range(start, end):
+            attributes = {k: v[j].item() for k, (v, m) in self.edge_attributes.items() if m[j]}
+            attributes['weight'] = self.matrix.data[j].item()
+            neighbors[self.node_ids[self.matrix.indices[j]].item()] = attributes
+        return neighbors
+
+    def has_edge(self, u, v):
+        self.__assemble()
+        if u not in self.index or v not in self.index:
+            return False
+        i = self.index[u]
+        return self.index[v] in self.matrix.indices[self.matrix.indptr[i]:self.matrix.indptr[i + 1]]
+
+    def to_arrays(self):
+        """
+        :return: dict of arrays as graph_cache.graph_to_arrays, plus graph_type and directed
+        """
+        self.__assemble()
+        arrays = {'nodes': self.node_ids, 'indptr': self.matrix.indptr.astype(np.int64),
+                  'indices': self.matrix.indices.astype(np.int64), 'edge_weight': self.matrix.data,
+                  'has_edge_weight': np.ones(self.matrix.nnz, dtype=bool),
+                  'directed': np.array(self.directed), 'graph_type': np.array("sparse")}
+        for key, (values, mask) in self.edge_attributes.items():
+            arrays["edge_" + key] = values
+            arrays["has_edge_" + key] = mask
+        for key, (values, mask) in self.node_attributes.items():
+            arrays["node_" + key] = values
+            arrays["has_node_" + key] = mask
+        return arrays
+
+    def to_networkx(self):
+        """
+        :return: nx.DiGraph, or nx.Graph if undirected
+        """
+        arrays = self.to_arrays()
+        rows, cols = self.__edge_positions()
+        graph = nx.DiGraph() if self.directed else nx.Graph()
+        graph.add_nodes_from(zip(self.node_ids.tolist(), arrays_to_attributes(arrays, "node_", len(self.node_ids))))
+        graph.add_edges_from(zip(self.node_ids[rows].tolist(), self.node_ids[cols].tolist(),
+                                 arrays_to_attributes(arrays, "edge_", len(cols))))
+        return graph
+
+    # %% Transformations
+    def cut(self, cutoff):
+        """Removes ties with weight of cutoff or less"""
+        self.__assemble()
+        self.__select_edges(self.matrix.data > cutoff)
+
+    def renorm(self, norm):
+        """Divides all tie weights by norm"""
+        self.__assemble()
+        self.matrix.data = self.matrix.data / norm
+
+    def inverse_weights(self, min=0.00001):
+        """Sets tie weights w to 1/(w+min)"""
+        self.__assemble()
+        self.matrix.data = 1 / (self.matrix.data + min)
+
+    def divide_by_receiver(self, values):
+        """
+        Divides each tie weight by the value of its receiving node. Ties to nodes with value zero are set to zero.
+
+        Parameters
+        ----------
+        values: np.ndarray
+            Value for each node position
+        """
+        self.__assemble()
+        values = np.asarray(values, dtype=np.float64)[self.matrix.indices]
+        positive = values > 0
+        data = np.zeros_like(self.matrix.data)
+        data[positive] = self.matrix.data[positive] / values[positive]
+        self.matrix.data = data
+
+    def adjacency(self):
+        """:return: CSR matrix of tie weights, rows and columns ordered as node_ids"""
+        self.__assemble()
+        return self.matrix
+
+    def in_strength(self):
+        """:return: sum of weights of incoming ties per node position"""
+        self.__assemble()
+        return np.bincount(self.matrix.indices, weights=self.matrix.data, minlength=len(self.node_ids))
+
+    def norm_in_degree(self):
+        """Normalizes ties such that the weighted in-degree of each node is one"""
+        self.divide_by_receiver(self.in_strength())
+
+    def reverse(self):
+        """
+        :return: new graph with all ties reversed
+        """
+        self.__assemble()
+        new_graph = self.copy()
+        if self.directed:
+            rows, cols = self.__edge_positions()
+            new_graph.__set_edges(cols, rows, self.matrix.data)
+        return new_graph
+
+    def sparsify(self, percentage=99):
+        """
+        For each node, keep *percentage* of aggregate tie weights of outgoing ties, as cutoff_percentage
+
+        Parameters
+        ----------
+        percentage: int
+        """
+        self.__assemble()
+        rows, cols = self.__edge_positions()
+        data = self.matrix.data
+        indptr = self.matrix.indptr
+        # Sort ties by row, then descending weight
+        order = np.lexsort((-data, rows))
+        sorted_data = data[order]
+        row_sums = np.bincount(rows, weights=data, minlength=len(self.node_ids))
+        cum_sum = np.cumsum(sorted_data)
+        row_start_sum = np.concatenate([[0], cum_sum])[indptr[:-1]]
+        cum_sum = cum_sum - row_start_sum[rows]
+        cutoff = row_sums * percentage / 100
+        # Number of ties needed to cross the cutoff, and corresponding weight
+        cutoff_degrees = np.bincount(rows, weights=(cum_sum > 0) & (cum_sum <= cutoff[rows]),
+                                     minlength=len(self.node_ids)).astype(np.int64)
+        row_lengths = np.diff(indptr)
+        has_ties = row_lengths > 0
+        cutoff_positions = indptr[:-1] + np.minimum(cutoff_degrees, row_lengths - 1)
+        cutoff_values = np.zeros(len(self.node_ids))
+        cutoff_values[has_ties] = sorted_data[cutoff_positions[has_ties]]
+        self.__select_edges((data >= cutoff_values[rows]) & (data > 0))
+
+    def to_symmetric(self, technique="avg-sym"):
+        """
+        :return: new undirected graph, see network_tools.make_symmetric for techniques
+        """
+        self.__assemble()
+        rows, cols = self.__edge_positions()
+        data = self.matrix.data
+        n = len(self.node_ids)
+        # Weight of the tie in the other direction, and whether it exists
+        positions = scipy.sparse.csr_matrix((np.arange(1, len(data) + 1), self.matrix.indices, self.matrix.indptr),
+                                            shape=(n, n))
+        other = np.asarray(positions[cols, rows]).reshape(-1) - 1
+        bidirectional = other >= 0
+        other_data = np.where(bidirectional, data[np.maximum(other, 0)], np.nan)
+        self_loop = rows == cols
+        weights, keep = symmetric_weights(data, other_data, technique)
+        # Self-loops are retained as they are, except when transposing
+        weights = np.where(self_loop, data, weights)
+        if technique == "transpose":
+            keep = ~self_loop
+        else:
+            keep = keep | self_loop
+
+        new_graph = self.copy()
+        new_graph.directed = False
+        if technique == "transpose":
+            new_graph.edge_attributes = {}
+        # Attributes of each undirected tie are taken from the tie sent by the node with the lower position
+        keep = np.flatnonzero(keep)
+        selection = np.where(bidirectional & (rows > cols), other, np.arange(len(data)))
+        selection = np.concatenate([selection[keep], selection[keep][~self_loop[keep]]])
+        new_rows = np.concatenate([rows[keep], cols[keep][~self_loop[keep]]])
+        new_cols = np.concatenate([cols[keep], rows[keep][~self_loop[keep]]])
+        new_data = np.concatenate([weights[keep], weights[keep][~self_loop[keep]]])
+        new_graph.__set_edges(new_rows, new_cols, new_data, selection=selection)
+        return new_graph
+
+    def ego_graph(self, centers, radius=1):
+        """
+        Union of the ego graphs of the center nodes, as networkx compose_all over nx.ego_graph.
+        Each ego graph includes nodes reachable within radius outgoing ties, and the ties among them.
+
+        Parameters
+        ----------
+        centers: list
+            Token ids
+        radius: int
+
+        Returns
+        -------
+        sparse_graph
+        """
+        self.__assemble()
+        centers = [x for x in centers if x in self.index]
+        rows, cols = self.__edge_positions()
+        reached = ego_reach(rows, cols, len(self.node_ids), [self.index[x] for x in centers], radius)
+        edge_mask = (reached[rows] & reached[cols]).any(axis=1)
+        new_graph = self.copy()
+        new_graph.__select_nodes(reached.any(axis=1), edge_mask)
+        return new_graph
+
+    # %% Measures
+    def proximities(self, focal_tokens=None, alter_subset=None):
+        """
+        :return: dict of focal token: {alter: tie weight}, alters sorted by descending weight
+        """
+        self.__assemble()
+        if focal_tokens is None:
+            focal_tokens = self.node_ids.tolist()
+        alter_mask = self.node_mask(alter_subset) if alter_subset is not None else None
+        proximity_dict = {}
+        for token in focal_tokens:
+            if token in self.index:
+                i = self.index[token]
+                start, end = self.matrix.indptr[i], self.matrix.indptr[i + 1]
+                alters = self.matrix.indices[start:end]
+                weights = self.matrix.data[start:end]
+                if alter_mask is not None:
+                    weights = weights[alter_mask[alters]]
+                    alters = alters[alter_mask[alters]]
+                order = np.argsort(-weights, kind="stable")
+                proximity_dict[token] = dict(zip(self.node_ids[alters[order]], weights[order]))
+        return proximity_dict
+
+    def pagerank(self, alpha=0.85, max_iter=100, tol=1.0e-6):
+        """
+        PageRank by power iteration, as networkx pagerank_scipy
+
+        :return: dict of node: PageRank
+        """
+        self.__assemble()
+        n = len(self.node_ids)
+        if n == 0:
+            return {}
+        out_strength = np.asarray(self.matrix.sum(axis=1)).reshape(-1)
+        inverse = np.zeros(n)
+        inverse[out_strength != 0] = 1.0 / out_strength[out_strength != 0]
+        transition = scipy.sparse.diags(inverse) @ self.matrix
+        dangling = out_strength == 0
+        x = np.full(n, 1.0 / n)
+        p = np.full(n, 1.0 / n)
+        for _ in range(max_iter):
+            x_last = x
+            x = alpha * (x @ transition + x[dangling].sum() * p) + (1 - alpha) * p
+            if np.abs(x - x_last).sum() < n * tol:
+                return dict(zip(self.node_ids.tolist(), x.tolist()))
+        msg = "PageRank failed to converge in {} iterations".format(max_iter)
+        logging.error(msg)
+        raise RuntimeError(msg)
+
+    def clustering(self, weighted=False, nodes=None):
+        """
+        Local clustering coefficients as networkx clustering, for directed graphs following Fagiolo (2007)
+
+        :return: dict of node: clustering
+        """
+        self.__assemble()
+        n = len(self.node_ids)
+        matrix = self.matrix.copy()
+        matrix.setdiag(0)
+        matrix.eliminate_zeros()
+        structure = matrix.copy()
+        structure.data = np.ones_like(structure.data)
+        if weighted:
+            max_weight = matrix.data.max() if matrix.nnz > 0 else 1
+            matrix.data = np.cbrt(matrix.data / max_weight)
+        else:
+            matrix = structure
+        if self.directed:
+            symmetric = (matrix + matrix.T).tocsr()
+            total_degree = np.asarray(structure.sum(axis=0) + structure.sum(axis=1).T).reshape(-1)
+            reciprocal = np.asarray(structure.multiply(structure.T).sum(axis=1)).reshape(-1)
+            denominator = 2 * (total_degree * (total_degree - 1) - 2 * reciprocal)
+        else:
+            symmetric = matrix
+            degree = np.diff(structure.indptr)
+            denominator = degree * (degree - 1)
+        triangles = np.asarray((symmetric @ symmetric).multiply(symmetric.T).sum(axis=1)).reshape(-1)
+        clustering = np.zeros(n)
+        clustering[denominator > 0] = triangles[denominator > 0] / denominator[denominator > 0]
+        clustering = dict(zip(self.node_ids.tolist(), clustering.tolist()))
+        if nodes is not None:
+            clustering = {x: clustering[x] for x in nodes if x in clustering}
+        return clustering
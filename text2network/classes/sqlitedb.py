@@ -0,0 +1,842 @@
+import json
+import logging
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from text2network.classes.storage_backend import storage_backend, records_to_columns, TIE_COLUMNS, SENTIMENT_COLUMNS
+from text2network.processing.edge_batch import edge_batch
+from text2network.processing.neo4j_insertion_interface import Neo4j_Insertion_Interface
+
+
+class sqlite_database(storage_backend):
+    # Columns of the edge table, one row per occurrence tie (the edge nodes of the Neo4j graph)
+    edge_columns = ['ego', 'alter', 'time', 'weight', 'seq_id', 'pos', 'run_index', 'part_of_speech', 'sentiment',
+                    'subjectivity', 'p1', 'p2', 'p3', 'p4']
+    aggregate_operators = ["SUM", "AVG", "MAX", "MIN", "COUNT"]
+
+    def __init__(self, database, agg_operator="SUM", write_before_query=True, queue_size=100000,
+                 logging_level=logging.NOTSET):
+        """
+        Embedded graph store holding the same occurrence ties as the Neo4j database in a single SQLite file.
+
+        Networks can be conditioned without a running server. Ties are aggregated by GROUP BY queries
+        over the edge table, which is indexed by (alter, time), (ego, time) and run_index.
+
+        Implements the methods of storage_backend used by neo4j_network, and the insertion methods
+        used by nw_processor (setup_neo_db, insert_edge_batch, write_queue).
+
+        Parameters
+        ----------
+        database: str
+            Path to database file. Created if it does not exist.
+        agg_operator: str
+            Aggregation of occurrence weights, one of SUM, AVG, MAX, MIN, COUNT
+        write_before_query: bool
+            Write queued ties before querying
+        queue_size: int
+            Number of queued ties after which the queue is written
+        """
+        if agg_operator.upper() not in self.aggregate_operators:
+            msg = "Aggregation operator {} not supported by sqlite backend".format(agg_operator)
+            logging.error(msg)
+            raise AttributeError(msg)
+        self.aggregate_operator = agg_operator.upper()
+        self.write_before_query = write_before_query
+        self.queue_size = queue_size
+        self.neo_queue = []
+
+        self.database = database
+        folder = os.path.dirname(os.path.abspath(database))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+        # Yearly aggregates are kept up to date once they have been built
+        self.year_aggregates_built = self.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='year_edge_state'").fetchone()[0] > 0
+
+        # Init tokens in the database, required since order etc. may be different
+        self.db_ids, self.db_tokens = self.init_tokens()
+        self.db_ids = np.array(self.db_ids, dtype=np.int64)
+        self.db_tokens = np.array(self.db_tokens)
+        self.db_id_dict = {}
+        self.translation_keys = np.array([], dtype=np.int64)
+        self.translation_values = np.array([], dtype=np.int64)
+        self.tokenizer_ids = []
+        self.tokens = []
+
+    # %% Setup
+    def create_tables(self):
+        self.connection.execute("CREATE TABLE IF NOT EXISTS word (token_id INTEGER PRIMARY KEY, token TEXT UNIQUE)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS edge (ego INTEGER, \"alter\" INTEGER, time INTEGER, weight REAL, "
+            "seq_id INTEGER, pos INTEGER, run_index INTEGER, part_of_speech TEXT, sentiment REAL, "
+            "subjectivity REAL, p1 TEXT, p2 TEXT, p3 TEXT, p4 TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS edge_alter_time ON edge (\"alter\", time)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS edge_ego_time ON edge (ego, time)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS edge_run_index ON edge (run_index)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS edge_time ON edge (time)")
+        # Incremented with every change of ties or tokens
+        self.connection.execute("CREATE TABLE IF NOT EXISTS db_version (id INTEGER PRIMARY KEY, version INTEGER)")
+        self.connection.execute("INSERT OR IGNORE INTO db_version (id, version) VALUES (0, 0)")
+        self.connection.commit()
+
+    def increment_version(self):
+        self.connection.execute("UPDATE db_version SET version = version + 1")
+
+    def version_stamp(self):
+        version = self.connection.execute("SELECT version FROM db_version").fetchone()[0]
+        return os.path.abspath(self.database), str(version)
+
+    def setup_neo_db(self, tokens, token_ids):
+        """
+        Creates tokens and token_ids in the database. Does not delete existing network!
+        :param tokens: list of tokens
+        :param token_ids: list of corresponding token IDs
+        :return: None
+        """
+        # Same token cleaning as in Neo4j, so that databases can be compared
+        tokens = [x.translate(x.maketrans({"\"": '#e1#', "'": '#e2#', "\\": '#e3#'})) for x in tokens]
+        self.tokenizer_ids = np.array(token_ids).copy()
+        self.tokens = np.array(tokens).copy()
+        db_id_dict, _, missing_tokens, missing_ids = Neo4j_Insertion_Interface.check_create_tokenid_dict(
+            tokenizer_tokens=tokens, tokenizer_ids=token_ids, db_ids=self.db_ids, db_tokens=self.db_tokens)
+        self.db_id_dict = db_id_dict
+        self.update_translation_arrays()
+        if len(missing_tokens) > 0:
+            self.connection.executemany("INSERT INTO word (token_id, token) VALUES (?,?)",
+                                        zip([int(x) for x in missing_ids], [str(x) for x in missing_tokens]))
+            self.increment_version()
+            self.connection.commit()
+        self.db_ids, self.db_tokens = self.init_tokens()
+        self.db_ids = np.array(self.db_ids, dtype=np.int64)
+        self.db_tokens = np.array(self.db_tokens)
+
+    def update_translation_arrays(self):
+        Neo4j_Insertion_Interface.update_translation_arrays(self)
+
+    def reset_dictionary(self):
+        """
+        Resets the translation such that token ids correspond to the database.
+        """
+        self.db_id_dict = {x[0]: x[1] for x in zip(self.db_ids, self.db_ids)}
+        self.update_translation_arrays()
+
+    def translate_token_ids(self, ids):
+        return self.translate_token_id_array(ids).tolist()
+
+    def translate_token_id_array(self, ids):
+        return Neo4j_Insertion_Interface.translate_token_id_array(self, ids)
+
+    def init_tokens(self):
+        """
+        Gets all tokens and token_ids in the database
+        :return: ids,tokens
+        """
+        logging.debug("Init tokens: Querying tokens and filling data structure.")
+        res = self.connection.execute("SELECT token_id, token FROM word ORDER BY token_id").fetchall()
+        ids = [x[0] for x in res]
+        tokens = [x[1] for x in res]
+        return ids, tokens
+
+    def delete_database(self, time=None):
+        """
+        Deletes all occurrence ties, or those of a given time
+        """
+        if time is not None:
+            self.connection.execute("DELETE FROM edge WHERE time = ?", (int(time),))
+        else:
+            self.connection.execute("DELETE FROM edge")
+        if self.year_aggregates_built:
+            if time is not None:
+                self.connection.execute("DELETE FROM year_edge WHERE time = ?", (int(time),))
+            else:
+                self.connection.execute("DELETE FROM year_edge")
+            # New ties get ids above the largest remaining one, which must not be below the aggregated ids
+            self.connection.execute("UPDATE year_edge_state SET last_rowid = MIN(last_rowid, "
+                                    "(SELECT COALESCE(MAX(rowid), 0) FROM edge))")
+        self.increment_version()
+        self.connection.commit()
+
+    def prune_database(self):
+        """
+        Deletes all tokens without ties
+        """
+        logging.debug("Pruning disconnected tokens in database.")
+        self.connection.execute("DELETE FROM word WHERE token_id NOT IN (SELECT ego FROM edge UNION "
+                                "SELECT \"alter\" FROM edge)")
+        self.increment_version()
+        self.connection.commit()
+
+    # %% Query helpers
+    @staticmethod
+    def __in_list(column, values, params):
+        """Membership condition for a list of arbitrary length"""
+        params.append(json.dumps([x if isinstance(x, str) else int(x) for x in values]))
+        return " {} IN (SELECT value FROM json_each(?)) ".format(column)
+
+    def __tie_conditions(self, table, times, weight_cutoff, params):
+        """Time interval and weight cutoff conditions on a table alias"""
+        where = ""
+        if weight_cutoff is not None:
+            where = where + " AND {}.weight >= ? ".format(table)
+            params.append(float(weight_cutoff))
+        if isinstance(times, dict):
+            where = where + " AND {}.time BETWEEN ? AND ? ".format(table)
+            params.extend([int(times['start']), int(times['end'])])
+        elif isinstance(times, list):
+            where = where + " AND" + self.__in_list("{}.time".format(table), times, params)
+        return where
+
+    @staticmethod
+    def __context_match(context_mode):
+        """Columns of a context tie q that have to be context words, as in the Neo4j direction of (q)-(e)"""
+        if context_mode == "bidirectional":
+            return ["ego", "alter"]
+        elif context_mode == "occuring":
+            return ["ego"]
+        else:
+            return ["alter"]
+
+    def read_sql(self, query, params=None):
+        if self.write_before_query:
+            self.write_queue()
+        return pd.read_sql_query(query, self.connection, params=params)
+
+    def read_columns(self, query, params, dtypes):
+        """
+        Runs a SQL query and reads the rows, in chunks, into numpy columns of the given names and dtypes
+        """
+        if self.write_before_query:
+            self.write_queue()
+        cursor = self.connection.execute(query, params if params is not None else [])
+        try:
+            return records_to_columns(cursor, dtypes)
+        finally:
+            cursor.close()
+
+    # %% Query functions
+    def query_times(self):
+        return [x['time'] for x in self.receive_query("SELECT DISTINCT time FROM edge ORDER BY time")]
+
+    def query_nr_sequences(self, times):
+        params = []
+        query = "SELECT COUNT(DISTINCT run_index) AS nrs FROM edge r WHERE 1=1 " + self.__tie_conditions(
+            "r", times, None, params)
+        return self.receive_query(query, params)[0]['nrs']
+
+    def query_nr_occurrences(self, times):
+        params = []
+        query = "SELECT ROUND(SUM(weight)) AS nrs FROM edge r WHERE 1=1 " + self.__tie_conditions("r", times, None,
+                                                                                                  params)
+        return self.receive_query(query, params)[0]['nrs']
+
+    def query_multiple_nodes(self, ids, times=None, weight_cutoff=None, context=None, pos=None, return_sentiment=True,
+                             context_mode="bidirectional", context_weight=True):
+        """
+        Query multiple nodes by ID and over a set of time intervals, see query_multiple_nodes_columns
+        :return: list of tuples (u,v,Time,{weight:x})
+        """
+        return self.columns_to_ties(
+            self.query_multiple_nodes_columns(ids, times=times, weight_cutoff=weight_cutoff, context=context, pos=pos,
+                                              return_sentiment=return_sentiment, context_mode=context_mode,
+                                              context_weight=context_weight))
+
+    def query_multiple_nodes_columns(self, ids, times=None, weight_cutoff=None, context=None, pos=None,
+                                     return_sentiment=True, context_mode="bidirectional", context_weight=True):
+        """
+        Query multiple nodes by ID and over a set of time intervals
+
+        Same semantics as neo4j_database.query_multiple_nodes: Returns the aggregated ties sender<-receiver,
+        where the sender (alter) replaces the receiver (ego). If context is given, only occurrences in sequences
+        where a context token is part of another tie are counted, weighted by the (capped) weight of the
+        context ties.
+
+        Parameters
+        ----------
+        :param ids: list of id's
+        :param times: either a number format YYYYMMDD, or an interval dict {"start":YYYYMMDD,"end":YYYYMMDD}
+        :param weight_cutoff: float in 0,1
+        :param context: Tokens which are to appear in the context of the substitution
+        :param context_mode: Choose "occurring" if contextual token should occur, "substitution" if it should appear in
+            a substitution distribution, or "bidirectional" if either
+        :param pos: String/List indicating the Part Of Speech
+        :param return_sentiment: Return sentiment and objectivity scores
+        :return: dict of arrays sender, receiver, weight (sentiment, subjectivity) and values time, start, end, pos
+        """
+        logging.debug("Querying {} nodes in sqlite database.".format(len(ids)))
+
+        if isinstance(times, (np.ndarray, tuple)):
+            times = list(times)
+        if isinstance(times, int):
+            times = [times]
+        if isinstance(pos, str):
+            pos = [pos]
+        if weight_cutoff is not None:
+            if weight_cutoff <= 1e-07:
+                weight_cutoff = None
+
+        params = []
+        r_where = " WHERE" + self.__in_list("r.\"alter\"", ids, params)
+        r_where = r_where + self.__tie_conditions("r", times, weight_cutoff, params)
+        if pos is not None:
+            r_where = r_where + " AND" + self.__in_list("r.part_of_speech", pos, params)
+
+        if context is None:
+            query = ''.join(["SELECT r.\"alter\" AS sender, r.ego AS receiver, ", self.aggregate_operator,
+                             "(r.weight) AS agg_weight, AVG(r.sentiment) AS sentiment, ",
+                             "AVG(r.subjectivity) AS subjectivity FROM edge r ", r_where,
+                             " GROUP BY r.\"alter\", r.ego ORDER BY receiver"])
+        else:
+            # Context ties q in the same sequence, where matches counts the ends of q that are context tokens
+            match_columns = self.__context_match(context_mode)
+            matches = " + ".join(["(CASE WHEN" + self.__in_list("q.\"{}\"".format(x), context, params) +
+                                  "THEN 1 ELSE 0 END)" for x in match_columns])
+            q_where = self.__tie_conditions("q", None, weight_cutoff, params)
+            weight = "cweight*rweight" if context_weight else "rweight"
+            query = ''.join(["WITH r AS (SELECT r.rowid AS rid, r.* FROM edge r ", r_where, "), ",
+                             "q AS (SELECT q.run_index, q.pos, q.weight, ", matches, " AS matches FROM edge q ",
+                             "WHERE q.run_index IN (SELECT run_index FROM r) ", q_where, "), ",
+                             "c AS (SELECT r.rid, r.\"alter\" AS sender, r.ego AS receiver, r.weight AS rweight, ",
+                             "r.sentiment, r.subjectivity, MIN(1.0, SUM(q.weight * q.matches)) AS cweight ",
+                             "FROM r JOIN q ON q.run_index = r.run_index AND q.pos <> r.pos WHERE q.matches > 0 ",
+                             "GROUP BY r.rid) ",
+                             "SELECT sender, receiver, ", self.aggregate_operator, "(", weight, ") AS agg_weight, ",
+                             "AVG(sentiment) AS sentiment, AVG(subjectivity) AS subjectivity FROM c ",
+                             "GROUP BY sender, receiver ORDER BY receiver"])
+        dtypes = dict(TIE_COLUMNS, **SENTIMENT_COLUMNS) if return_sentiment else TIE_COLUMNS
+        return self.tie_columns(self.read_columns(query, params, dtypes), times, pos)
+
+    def query_occurrences(self, ids, times=None, weight_cutoff=None, context=None):
+        """
+        Query multiple nodes by ID and over a set of time intervals, return distinct occurrences
+        :param ids: list of id's
+        :param times: either a number format YYYY, or an interval dict {"start":YYYY,"end":YYYY}
+        :param weight_cutoff: float in 0,1
+        :param context: only count occurrences in sequences where these tokens are substitutes
+        :return: list of tuples (u,occurrences)
+        """
+        logging.debug("Querying {} node occurrences".format(len(ids)))
+        if isinstance(times, int):
+            times = [times]
+
+        params = []
+        where = " WHERE" + self.__in_list("r.ego", ids, params)
+        where = where + self.__tie_conditions("r", times, weight_cutoff, params)
+        if context is not None:
+            where = where + " AND r.run_index IN (SELECT DISTINCT q.run_index FROM edge q WHERE" + self.__in_list(
+                "q.\"alter\"", context, params) + self.__tie_conditions("q", times, weight_cutoff, params) + ") "
+        query = "SELECT r.ego AS idx, ROUND(SUM(r.weight)) AS occurrences FROM edge r " + where + \
+                " GROUP BY r.ego ORDER BY idx"
+        res = self.read_sql(query, params)
+        return [(int(x[0]), float(x[1])) for x in zip(res.idx, res.occurrences)]
+
+    def query_degrees(self, times=None):
+        """
+        Number of distinct receivers of the ties of each sender, from the yearly aggregates if built
+        :param times: list of times or None for all
+        :return: list of tuples (sender, degree)
+        """
+        if isinstance(times, int):
+            times = [times]
+        if self.has_year_aggregates(times):
+            self.update_year_aggregates()
+            table = "year_edge"
+        else:
+            table = "edge"
+        params = []
+        query = "SELECT r.\"alter\" AS sender, COUNT(DISTINCT r.ego) AS degree FROM " + table + \
+                " r WHERE 1=1 " + self.__tie_conditions("r", times, None, params) + " GROUP BY r.\"alter\""
+        return [(x['sender'], x['degree']) for x in self.receive_query(query, params)]
+
+    def query_tie_context(self, occurring, replacing, times=None, pos=None, scale=40, tfidf=None,
+                          context_mode="bidirectional", return_sentiment=True, weight_cutoff=None):
+        """
+        Returns the context tokens of ties where replacing tokens substitute occurring tokens.
+
+        Same semantics as neo4j_database.query_tie_context: Per tie, the weight of each context token is the
+        (capped) weight of its ties in the same sequence, scaled by the tie weight and divided by the
+        number of other positions in the sequence. These are summed per context token.
+
+        Parameters
+        ----------
+        occurring: list of occurring token ids, or None for all
+        replacing: list of replacing token ids, or None for all
+        times: int, list or dict
+        pos: String/List indicating the Part Of Speech of the context tokens
+        scale: float
+        tfidf: bool
+            Weigh by overall weight of context tokens
+        context_mode: "bidirectional", "occuring" or "substitution"
+        return_sentiment: bool
+        weight_cutoff: float in 0,1
+
+        Returns
+        -------
+        list of dicts
+        """
+        logging.debug("Querying tie between {}->replacing->{} at {}.".format(replacing, occurring, times))
+        if weight_cutoff is not None:
+            if weight_cutoff <= 1e-07:
+                weight_cutoff = None
+        if isinstance(occurring, (int, np.integer)):
+            occurring = [occurring]
+        if isinstance(replacing, (int, np.integer)):
+            replacing = [replacing]
+        if isinstance(times, int):
+            times = [times]
+        if isinstance(pos, str):
+            pos = [pos]
+
+        params = []
+        r_where = self.__tie_filter(occurring, replacing, times, weight_cutoff, params)
+        q_where = self.__tie_conditions("q", None, weight_cutoff, params)
+        if pos is not None:
+            q_where = q_where + " AND" + self.__in_list("q.part_of_speech", pos, params)
+        contexts = " UNION ALL ".join(["SELECT q.run_index, q.pos, q.weight, q.\"{}\" AS context FROM edge q "
+                                       "WHERE q.run_index IN (SELECT run_index FROM r) {}".format(x, q_where) for x in
+                                       self.__context_match(context_mode)])
+        # The condition on q is repeated for each matched end, so are its parameters
+        params = params[:len(params) - q_where.count("?")] + params[len(params) - q_where.count("?"):] * len(
+            self.__context_match(context_mode))
+
+        query = ''.join([
+            "WITH r AS (SELECT r.* FROM edge r ", r_where, "), ",
+            "s AS (SELECT run_index, COUNT(DISTINCT pos) - 1 AS seq_length FROM edge ",
+            "WHERE run_index IN (SELECT run_index FROM r) GROUP BY run_index), ",
+            "q AS (", contexts, "), ",
+            # Per tie and context token
+            "c1 AS (SELECT r.pos AS rpos, r.run_index AS ridx, r.\"alter\" AS substitute, r.ego AS occurrence, ",
+            "q.context, MIN(1.0, SUM(q.weight)) AS cweight, MAX(r.weight) AS rweight, ",
+            "MAX(r.sentiment) AS sentiment, MAX(r.subjectivity) AS subjectivity FROM r ",
+            "JOIN q ON q.run_index = r.run_index AND q.pos <> r.pos ",
+            "WHERE q.context <> r.ego AND q.context <> r.\"alter\" ",
+            "GROUP BY r.pos, r.run_index, r.\"alter\", r.ego, q.context), ",
+            # Per sequence and context token
+            "c2 AS (SELECT ridx, context, substitute, occurrence, MIN(1.0, SUM(cweight)) AS cweight, ",
+            "MIN(1.0, SUM(DISTINCT rweight)) AS rweight, AVG(sentiment) AS sentiment, ",
+            "AVG(subjectivity) AS subjectivity FROM c1 GROUP BY ridx, context, substitute, occurrence) ",
+            "SELECT c2.context, c2.substitute, c2.occurrence, ? * c2.cweight * c2.rweight / s.seq_length AS weight, ",
+            "c2.sentiment, c2.subjectivity FROM c2 JOIN s ON s.run_index = c2.ridx WHERE s.seq_length > 0"])
+        params.append(float(scale))
+        res = self.read_sql(query, params)
+
+        df = res.groupby("context").agg(substitute=("substitute", lambda x: sorted(set(x))),
+                                        occurrence=("occurrence", lambda x: sorted(set(x))),
+                                        weight=("weight", "sum"), sentiment=("sentiment", "mean"),
+                                        subjectivity=("subjectivity", "mean")).reset_index()
+        df = df.sort_values("substitute", key=lambda x: x.map(tuple)) if len(df) > 0 else df
+
+        if pos is not None:
+            pos = "-".join([str(x) for x in pos])
+        else:
+            pos = "None"
+
+        if tfidf:
+            df_tfidf = self.__tfidf_weights(df.context.to_list(), occurring, times, weight_cutoff, context_mode)
+            return self.tfidf_tie_context(df, df_tfidf, pos, return_sentiment)
+
+        if return_sentiment:
+            ret = [{'substitute': x[1], 'occurrence': x[2], 'idx': int(x[0]), 'weight': float(x[3]),
+                    'sentiment': float(x[4]), 'subjectivity': float(x[5]), 'pos': pos}
+                   for x in zip(df.context, df.substitute, df.occurrence, df.weight, df.sentiment, df.subjectivity)]
+        else:
+            ret = [{'substitute': x[1], 'occurrence': x[2], 'idx': int(x[0]), 'weight': float(x[3]), 'pos': pos}
+                   for x in zip(df.context, df.substitute, df.occurrence, df.weight)]
+        return ret
+
+    def __tie_filter(self, occurring, replacing, times, weight_cutoff, params):
+        """Conditions of ties between occurring and replacing tokens"""
+        where = " WHERE r.ego <> r.\"alter\" "
+        if replacing is not None:
+            where = where + " AND" + self.__in_list("r.\"alter\"", replacing, params)
+        if occurring is not None:
+            where = where + " AND" + self.__in_list("r.ego", occurring, params)
+        return where + self.__tie_conditions("r", times, weight_cutoff, params)
+
+    def __tfidf_weights(self, context_words, occurring, times, weight_cutoff, context_mode):
+        """
+        Overall weight of ties between occurring tokens and context words, divided by sequence length
+        """
+        frames = []
+        # Context words replace occurring tokens, or the other way around
+        directions = {"bidirectional": [("ego", "alter"), ("alter", "ego")], "occuring": [("alter", "ego")]}
+        for occ_column, context_column in directions.get(context_mode, [("ego", "alter")]):
+            params = []
+            where = " WHERE r.ego <> r.\"alter\" AND" + self.__in_list("r.\"{}\"".format(context_column),
+                                                                        context_words, params)
+            if occurring is not None:
+                where = where + " AND" + self.__in_list("r.\"{}\"".format(occ_column), occurring, params)
+            where = where + self.__tie_conditions("r", times, weight_cutoff, params)
+            query = ''.join([
+                "WITH r AS (SELECT r.* FROM edge r ", where, "), ",
+                "s AS (SELECT run_index, COUNT(DISTINCT pos) - 1 AS seq_length FROM edge ",
+                "WHERE run_index IN (SELECT run_index FROM r) GROUP BY run_index) ",
+                "SELECT r.\"", context_column, "\" AS context, r.weight / s.seq_length AS tweight FROM r ",
+                "JOIN s ON s.run_index = r.run_index WHERE s.seq_length > 0"])
+            frames.append(self.read_sql(query, params))
+        df_tfidf = pd.concat(frames).astype({"context": np.int64, "tweight": np.float64})
+        return df_tfidf.groupby("context", as_index=False).tweight.sum()
+
+    def query_context_of_node(self, ids, times=None, weight_cutoff=None, occurrence=False):
+        """
+        Returns the context ties of nodes: Tokens replacing (or, if occurrence, occurring at) other positions
+        of the sequences in which the nodes replace (or occur), weighted by the product of both tie weights.
+
+        Same semantics as neo4j_database.query_context_of_node. Weights are normalized to sum to one per node.
+
+        Parameters
+        ----------
+        ids: list of token ids
+        times: int, list or dict
+        weight_cutoff: float in 0,1
+        occurrence: bool
+            If True, context of the occurrences of the nodes, else of their substitutions
+
+        Returns
+        -------
+        list of tuples (node, context token, {weight:x, time:x, start:x, end:x})
+        """
+        if isinstance(times, list) and len(times) == 1:
+            times = int(times[0])
+        if isinstance(times, int):
+            times = [times]
+        column = "ego" if occurrence else "alter"
+
+        params = []
+        r_where = " WHERE" + self.__in_list("r.\"{}\"".format(column), ids, params)
+        r_where = r_where + self.__tie_conditions("r", times, weight_cutoff, params)
+        q_where = self.__tie_conditions("q", None, weight_cutoff, params)
+        query = ''.join([
+            "WITH r0 AS (SELECT r.run_index, r.\"", column, "\" AS ego, r.pos, r.weight FROM edge r ", r_where, "), ",
+            "r AS (SELECT run_index, ego, SUM(weight) AS rweight FROM r0 GROUP BY run_index, ego) ",
+            "SELECT q.\"", column, "\" AS \"alter\", r.ego, SUM(q.weight * r.rweight) AS weight FROM r ",
+            "JOIN edge q ON q.run_index = r.run_index WHERE q.\"", column, "\" <> r.ego ",
+            "AND q.pos NOT IN (SELECT pos FROM r0 WHERE r0.run_index = r.run_index AND r0.ego = r.ego) ", q_where,
+            "GROUP BY q.\"", column, "\", r.ego ORDER BY r.ego"])
+        res = self.read_sql(query, params)
+
+        # Normalize
+        weights = res.weight.to_numpy(dtype=np.float64)
+        weights = weights / res.groupby("ego").weight.transform("sum").to_numpy(dtype=np.float64)
+        nw_time = self.network_time(times)
+        return [(int(x[0]), int(x[1]), {'weight': float(x[2]), 'time': nw_time['m'], 'start': nw_time['s'],
+                                        'end': nw_time['e']}) for x in zip(res.ego, res["alter"], weights)]
+
+    def query_substitution_in_dyadic_context(self, ids, occurring=None, replacing=None, times=None, scale=40,
+                                             context_mode="bidirectional", return_sentiment=True, weight_cutoff=None,
+                                             add_dyad=False, normalize_seq_length=False):
+        """
+        Returns the substitution ties of tokens at other positions of the sequences in which replacing tokens
+        substitute occurring tokens (the dyad).
+
+        Same semantics as neo4j_database.query_substitution_in_dyadic_context: Per sequence, the weight of a tie
+        is the summed weight of its occurrence ties times the weight of the dyad. If normalize_seq_length, it is
+        divided by the number of other positions in the sequence and scaled, otherwise scale is not used.
+
+        Parameters
+        ----------
+        ids: list of substitute token ids of the returned ties
+        occurring: list of occurring token ids of the dyad, or None for all
+        replacing: list of replacing token ids of the dyad, or None for all
+        times: int, list or dict
+        scale: float
+        context_mode: not used
+        return_sentiment: bool
+            Return the average sentiment and subjectivity of the dyad
+        weight_cutoff: float in 0,1
+        add_dyad: bool
+            Add the tokens of the dyads to the ties
+        normalize_seq_length: bool
+
+        Returns
+        -------
+        list of tuples (substitute, occurrence, {weight:x, dyad:x, time:x, start:x, end:x, ...})
+        """
+        logging.debug("Querying tie between {}->replacing->{}.".format(replacing, occurring))
+        if weight_cutoff is not None:
+            if weight_cutoff <= 1e-07:
+                weight_cutoff = None
+        if isinstance(ids, (int, np.integer)):
+            ids = [ids]
+        if isinstance(occurring, (int, np.integer)):
+            occurring = [occurring]
+        if isinstance(replacing, (int, np.integer)):
+            replacing = [replacing]
+        if isinstance(times, int):
+            times = [times]
+        if not normalize_seq_length:
+            scale = 1
+
+        params = []
+        r_where = self.__tie_filter(occurring, replacing, times, weight_cutoff, params)
+        q_where = " AND" + self.__in_list("q.\"alter\"", ids, params) + self.__tie_conditions("q", None,
+                                                                                              weight_cutoff, params)
+        query = ''.join([
+            "WITH r AS (SELECT r.* FROM edge r ", r_where, "), ", self.__sequence_lengths(), " ",
+            "SELECT r.run_index AS ridx, q.\"alter\" AS sub, q.ego AS occ, r.\"alter\" AS rep_dyad, ",
+            "r.ego AS occ_dyad, SUM(q.weight) * SUM(DISTINCT r.weight) AS weight, ",
+            "MAX(s.seq_length) AS seq_length, AVG(r.sentiment) AS sentiment, AVG(r.subjectivity) AS subjectivity ",
+            "FROM r JOIN edge q ON q.run_index = r.run_index AND q.pos <> r.pos ",
+            "JOIN s ON s.run_index = r.run_index ",
+            "WHERE q.ego <> q.\"alter\" AND q.\"alter\" NOT IN (r.ego, r.\"alter\") ",
+            "AND q.ego NOT IN (r.ego, r.\"alter\") ", q_where,
+            "GROUP BY r.run_index, q.\"alter\", q.ego, r.\"alter\", r.ego"])
+        res = self.read_sql(query, params)
+        if normalize_seq_length:
+            res["weight"] = scale * res.weight / res.seq_length
+        return self.__dyadic_ties(res, times, return_sentiment, add_dyad)
+
+    def query_context_in_dyadic_context(self, ids, occurring=None, replacing=None, times=None, scale=40,
+                                        context_mode="bidirectional", return_sentiment=True, weight_cutoff=None,
+                                        add_dyad=False, normalize_seq_length=False):
+        """
+        Returns ties between tokens at other positions of the sequences in which replacing tokens substitute
+        occurring tokens (the dyad), and the tokens of the remaining positions of these sequences.
+
+        Same semantics as neo4j_database.query_context_in_dyadic_context: Per sequence, the weight of a tie is the
+        product of the (capped) weights of the ties of both tokens and the weight of the dyad. If
+        normalize_seq_length, it is divided by the number of other positions in the sequence and scaled,
+        otherwise scale is not used.
+
+        Parameters
+        ----------
+        ids: list of token ids whose context is returned
+        occurring: list of occurring token ids of the dyad, or None for all
+        replacing: list of replacing token ids of the dyad, or None for all
+        times: int, list or dict
+        scale: float
+        context_mode: "occurring" if the tokens of ids are to occur, "substitution" if they are to substitute,
+            or "bidirectional" if either
+        return_sentiment: bool
+            Return the average sentiment and subjectivity of the dyad
+        weight_cutoff: float in 0,1
+        add_dyad: bool
+            Add the tokens of the dyads to the ties
+        normalize_seq_length: bool
+
+        Returns
+        -------
+        list of tuples (token, context token, {weight:x, dyad:x, time:x, start:x, end:x, ...})
+        """
+        logging.debug("Querying tie between {}->replacing->{}.".format(replacing, occurring))
+        if weight_cutoff is not None:
+            if weight_cutoff <= 1e-07:
+                weight_cutoff = None
+        if isinstance(ids, (int, np.integer)):
+            ids = [ids]
+        if isinstance(occurring, (int, np.integer)):
+            occurring = [occurring]
+        if isinstance(replacing, (int, np.integer)):
+            replacing = [replacing]
+        if isinstance(times, int):
+            times = [times]
+        if not normalize_seq_length:
+            scale = 1
+        if context_mode == "bidirectional":
+            id_columns = ["ego", "alter"]
+        elif context_mode == "occurring":
+            id_columns = ["ego"]
+        else:
+            id_columns = ["alter"]
+
+        params = []
+        r_where = self.__tie_filter(occurring, replacing, times, weight_cutoff, params)
+        # Ties of the tokens of ids, and all ties, each once per matched end
+        q_parts = []
+        for column in id_columns:
+            q_where = " AND" + self.__in_list("q.\"{}\"".format(column), ids, params) + self.__tie_conditions(
+                "q", None, weight_cutoff, params)
+            q_parts.append("SELECT q.run_index, q.pos, q.weight, q.\"{}\" AS token FROM edge q WHERE q.run_index IN "
+                           "(SELECT run_index FROM r) {}".format(column, q_where))
+        t_parts = ["SELECT t.run_index, t.pos, t.weight, t.\"{}\" AS token FROM edge t WHERE t.run_index IN "
+                   "(SELECT run_index FROM r)".format(x) for x in ["ego", "alter"]]
+        query = ''.join([
+            "WITH r AS (SELECT r.* FROM edge r ", r_where, "), ", self.__sequence_lengths(), ", ",
+            "q AS (", " UNION ALL ".join(q_parts), "), t AS (", " UNION ALL ".join(t_parts), ") ",
+            "SELECT r.run_index AS ridx, q.token AS sub, t.token AS occ, r.\"alter\" AS rep_dyad, ",
+            "r.ego AS occ_dyad, MIN(1.0, SUM(q.weight)) * MIN(1.0, SUM(t.weight)) * MAX(r.weight) AS weight, ",
+            "MAX(s.seq_length) AS seq_length, AVG(r.sentiment) AS sentiment, AVG(r.subjectivity) AS subjectivity ",
+            "FROM r JOIN q ON q.run_index = r.run_index AND q.pos <> r.pos ",
+            "JOIN t ON t.run_index = r.run_index AND t.pos <> q.pos JOIN s ON s.run_index = r.run_index ",
+            "WHERE q.token <> t.token AND q.token NOT IN (r.ego, r.\"alter\") AND t.token NOT IN (r.ego, r.\"alter\") ",
+            "GROUP BY r.run_index, q.token, t.token, r.\"alter\", r.ego"])
+        res = self.read_sql(query, params)
+        if normalize_seq_length:
+            res["weight"] = scale * res.weight / res.seq_length
+        return self.__dyadic_ties(res, times, return_sentiment, add_dyad)
+
+    @staticmethod
+    def __sequence_lengths():
+        """Common table s of the number of other positions in each sequence of the ties in table r"""
+        return ''.join(["s AS (SELECT run_index, COUNT(DISTINCT pos) - 1 AS seq_length FROM edge ",
+                        "WHERE run_index IN (SELECT run_index FROM r) GROUP BY run_index)"])
+
+    def __dyadic_ties(self, res, times, return_sentiment, add_dyad):
+        """Sums the per-sequence weights of dyadic context queries into ties"""
+        nw_time = self.network_time(times)
+        df = res.groupby(["sub", "occ"]).agg(weight=("weight", "sum"), sentiment=("sentiment", "mean"),
+                                             subjectivity=("subjectivity", "mean"),
+                                             rep_dyad=("rep_dyad", lambda x: sorted(set(x))),
+                                             occ_dyad=("occ_dyad", lambda x: sorted(set(x)))).reset_index()
+        df = df.sort_values("occ", kind="stable")
+        ties = []
+        for x in df.itertuples(index=False):
+            dyad = [x.rep_dyad, x.occ_dyad] if add_dyad else [0, 0]
+            attributes = {'weight': float(x.weight), 'dyad': str(dyad), 'time': nw_time['m'], 'start': nw_time['s'],
+                          'end': nw_time['e']}
+            if return_sentiment:
+                attributes.update({'sentiment': float(x.sentiment), 'subjectivity': float(x.subjectivity)})
+            ties.append((int(x.sub), int(x.occ), attributes))
+        return ties
+
+    def query_parts_of_speech(self):
+        return [x['part_of_speech'] for x in
+                self.receive_query("SELECT DISTINCT part_of_speech FROM edge ORDER BY part_of_speech")]
+
+    # %% Yearly aggregates
+    def build_year_aggregates(self, times=None):
+        """
+        Creates the yearly aggregate table year_edge, with one row per time, ego and alter.
+        Since the table is updated incrementally with ties inserted afterwards, all times are aggregated.
+        :param times: ignored
+        """
+        self.connection.execute("CREATE TABLE IF NOT EXISTS year_edge (time INTEGER, ego INTEGER, "
+                                "\"alter\" INTEGER, weight_sum REAL, count INTEGER, sentiment_sum REAL, "
+                                "subjectivity_sum REAL, PRIMARY KEY (\"alter\", time, ego))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS year_edge_state (id INTEGER PRIMARY KEY, "
+                                "last_rowid INTEGER)")
+        self.connection.execute("INSERT OR IGNORE INTO year_edge_state (id, last_rowid) VALUES (0, 0)")
+        self.connection.commit()
+        self.year_aggregates_built = True
+        self.update_year_aggregates()
+
+    def update_year_aggregates(self):
+        """
+        Adds the ties inserted since the last update to the yearly aggregates
+        """
+        self.write_queue()
+        last_rowid = self.connection.execute("SELECT last_rowid FROM year_edge_state").fetchone()[0]
+        max_rowid = self.connection.execute("SELECT COALESCE(MAX(rowid), 0) FROM edge").fetchone()[0]
+        if max_rowid > last_rowid:
+            logging.debug("Adding ties {} to {} to yearly aggregates".format(last_rowid, max_rowid))
+            with self.connection:
+                self.connection.execute(
+                    "INSERT INTO year_edge (time, ego, \"alter\", weight_sum, count, sentiment_sum, subjectivity_sum) "
+                    "SELECT time, ego, \"alter\", SUM(weight), COUNT(*), SUM(sentiment), SUM(subjectivity) FROM edge "
+                    "WHERE rowid > ? AND rowid <= ? GROUP BY time, ego, \"alter\" "
+                    "ON CONFLICT (\"alter\", time, ego) DO UPDATE SET "
+                    "weight_sum = weight_sum + excluded.weight_sum, count = count + excluded.count, "
+                    "sentiment_sum = sentiment_sum + excluded.sentiment_sum, "
+                    "subjectivity_sum = subjectivity_sum + excluded.subjectivity_sum", (last_rowid, max_rowid))
+                self.connection.execute("UPDATE year_edge_state SET last_rowid = ?", (max_rowid,))
+
+    def has_year_aggregates(self, times=None):
+        return self.year_aggregates_built and self.aggregate_operator in self.year_aggregate_operators and (
+                times is None or isinstance(times, (int, list)))
+
+    def query_year_aggregates(self, ids, times=None, return_sentiment=True):
+        """
+        Same as query_multiple_nodes without context, part of speech or weight cutoff,
+        but summing the yearly aggregates instead of the occurrence ties.
+
+        :param ids: list of id's
+        :param times: list of times or None for all
+        :param return_sentiment: Return sentiment and objectivity scores
+        :return: list of tuples (u,v,Time,{weight:x})
+        """
+        return self.columns_to_ties(self.query_year_aggregates_columns(ids, times=times,
+                                                                       return_sentiment=return_sentiment))
+
+    def query_year_aggregates_columns(self, ids, times=None, return_sentiment=True):
+        """
+        Same as query_year_aggregates, but returns the ties as columns, see query_multiple_nodes_columns
+        """
+        logging.debug("Querying {} nodes from yearly aggregates.".format(len(ids)))
+        self.update_year_aggregates()
+        if isinstance(times, int):
+            times = [times]
+
+        params = []
+        query = ''.join(["SELECT r.\"alter\" AS sender, r.ego AS receiver, SUM(r.weight_sum) AS weight_sum, ",
+                         "SUM(r.count) AS count, SUM(r.sentiment_sum) AS sentiment_sum, ",
+                         "SUM(r.subjectivity_sum) AS subjectivity_sum FROM year_edge r WHERE",
+                         self.__in_list("r.\"alter\"", ids, params), self.__tie_conditions("r", times, None, params),
+                         " GROUP BY r.\"alter\", r.ego ORDER BY receiver"])
+        res = self.read_columns(query, params, {'sender': np.int64, 'receiver': np.int64, 'weight_sum': np.float64,
+                                                'count': np.int64, 'sentiment_sum': np.float64,
+                                                'subjectivity_sum': np.float64})
+        columns = {'sender': res['sender'], 'receiver': res['receiver'],
+                   'weight': np.asarray(self.year_aggregate_weight(res['weight_sum'], res['count']), dtype=np.float64)}
+        if return_sentiment:
+            columns['sentiment'] = res['sentiment_sum'] / res['count']
+            columns['subjectivity'] = res['subjectivity_sum'] / res['count']
+        return self.tie_columns(columns, times)
+
+    # %% Insert functions
+    def insert_edges(self, ego, ties):
+        """
+        Queues ties in the format of nw_processor.get_weighted_edgelist
+        :param ego: ego token id
+        :param ties: list of (ego, alter, time, attribute dict) tuples
+        """
+        logging.debug("Insert {} ego nodes with {} ties".format(ego, len(ties)))
+        if len(ties) == 0:
+            return
+        attributes = [x[3] for x in ties]
+        batch = edge_batch(ego=[x[0] for x in ties], alter=[x[1] for x in ties], time=[x[2] for x in ties],
+                           weight=[x['weight'] for x in attributes], seq_id=[x['seq_id'] for x in attributes],
+                           pos=[x['pos'] for x in attributes], run_index=[x['run_index'] for x in attributes],
+                           sentiment=[x.get('sentiment', 0) for x in attributes],
+                           subjectivity=[x.get('subjectivity', 0) for x in attributes],
+                           part_of_speech=[x.get('part_of_speech', "0") for x in attributes],
+                           p1=[x.get('p1', "0") for x in attributes], p2=[x.get('p2', "0") for x in attributes],
+                           p3=[x.get('p3', "0") for x in attributes], p4=[x.get('p4', "0") for x in attributes])
+        self.insert_edge_batch(batch)
+
+    def insert_edge_batch(self, batch):
+        """
+        Queues an edge_batch, translating tokenizer ids to database ids
+        """
+        if len(batch) == 0:
+            return
+        columns = {name: getattr(batch, name) for name in edge_batch.columns}
+        columns['ego'] = self.translate_token_id_array(batch.ego)
+        columns['alter'] = self.translate_token_id_array(batch.alter)
+        columns.update({name: batch.get_values(name) for name in edge_batch.categorical_columns})
+        self.neo_queue.append(pd.DataFrame(columns)[self.edge_columns])
+        if sum([len(x) for x in self.neo_queue]) > self.queue_size:
+            self.write_queue()
+
+    # %% Database interaction
+    def write_queue(self):
+        """
+        If called will insert queued ties and empty the queue.
+        """
+        if len(self.neo_queue) > 0:
+            queue, self.neo_queue = self.neo_queue, []
+            insert = "INSERT INTO edge ({}) VALUES ({})".format(",".join(["\"{}\"".format(x) for x in self.edge_columns]),
+                                                                ",".join(["?"] * len(self.edge_columns)))
+            with self.connection:
+                for df in queue:
+                    self.connection.executemany(insert, df.itertuples(index=False, name=None))
+                self.increment_version()
+
+    def receive_query(self, query, params=None):
+        """
+        Runs a SQL query and returns the result as list of dicts
+        """
+        if self.write_before_query:
+            self.write_queue()
+        cursor = self.connection.execute(query, params if params is not None else [])
+        columns = [x[0] for x in cursor.description]
+        return [dict(zip(columns, x)) for x in cursor.fetchall()]
+
+    def close(self):
+        self.write_queue()
+        self.connection.close()
@@ -0,0 +1,353 @@
+import itertools
+import logging
+
+import numpy as np
+
+# Columns of queried ties, in the order in which queries return them
+TIE_COLUMNS = {'sender': np.int64, 'receiver': np.int64, 'weight': np.float64}
+SENTIMENT_COLUMNS = {'sentiment': np.float64, 'subjectivity': np.float64}
+
+
+def records_to_columns(records, dtypes, chunk_size=10000):
+    """
+    Reads query records into numpy columns, one chunk of records at a time, such that no list of
+    all records is created.
+
+    Parameters
+    ----------
+    records: iterable
+        Records, each a sequence of values in the order of dtypes. Missing values of float columns are NaN.
+    dtypes: dict
+        Name and dtype of each column
+    chunk_size: int
+        Number of records read into the columns at once
+
+    Returns
+    -------
+    dict of np.ndarray
+    """
+    chunks = {x: [] for x in dtypes}
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if len(chunk) == 0:
+            break
+        for (name, dtype), values in zip(dtypes.items(), zip(*chunk)):
+            column = np.empty(len(chunk), dtype=dtype)
+            column[:] = values
+            chunks[name].append(column)
+    return {x: np.concatenate(chunks[x]) if len(chunks[x]) > 0 else np.array([], dtype=dtype) for x, dtype in
+            dtypes.items()}
+
+
+class storage_backend():
+    """
+    Interface of the graph stores that hold the occurrence-level network.
+
+    Each occurrence tie is an edge record (ego, alter, time, weight, seq_id, pos, run_index, part_of_speech,
+    sentiment, subjectivity, p1-p4), where the ego is the occurring token and the alter the token that
+    could replace it. neo4j_network only interacts with the store through these methods, such that
+    networks can be conditioned from Neo4j (neo4j_database) or an embedded file (sqlite_database).
+    """
+
+    # Set by implementations
+    write_before_query = True
+
+    # %% Setup
+    def setup_neo_db(self, tokens, token_ids):
+        """
+        Creates tokens and token_ids in the store. Does not delete existing network!
+        :param tokens: list of tokens
+        :param token_ids: list of corresponding token IDs
+        :return: None
+        """
+        raise NotImplementedError
+
+    def init_tokens(self):
+        """
+        Gets all tokens and token_ids in the store
+        :return: ids,tokens
+        """
+        raise NotImplementedError
+
+    def prune_database(self):
+        raise NotImplementedError
+
+    def version_stamp(self):
+        """
+        Identifies the database and the state of its ties, such that the stamp changes whenever ties are
+        inserted or deleted. Used to invalidate cached conditioned graphs.
+        :return: tuple (database, version), or None if the state can not be determined
+        """
+        return None
+
+    # %% Query functions
+    def query_times(self):
+        """
+        :return: sorted list of distinct times of occurrence ties
+        """
+        raise NotImplementedError
+
+    def query_nr_sequences(self, times):
+        """
+        :param times: list of times
+        :return: number of distinct sequences with occurrence ties in times
+        """
+        raise NotImplementedError
+
+    def query_nr_occurrences(self, times):
+        """
+        :param times: list of times
+        :return: rounded sum of occurrence tie weights in times
+        """
+        raise NotImplementedError
+
+    def query_multiple_nodes(self, ids, times=None, weight_cutoff=None, context=None, pos=None, return_sentiment=True,
+                             context_mode="bidirectional", context_weight=True):
+        """
+        :return: list of tuples (sender, receiver, {weight:x, time:x, start:x, end:x, pos:x, ...})
+        """
+        raise NotImplementedError
+
+    def query_multiple_nodes_columns(self, ids, times=None, weight_cutoff=None, context=None, pos=None,
+                                     return_sentiment=True, context_mode="bidirectional", context_weight=True):
+        """
+        Same as query_multiple_nodes, but returns the ties as columns
+        :return: dict of arrays sender, receiver, weight (sentiment, subjectivity) and values time, start, end, pos
+        """
+        return self.ties_to_columns(
+            self.query_multiple_nodes(ids, times=times, weight_cutoff=weight_cutoff, context=context, pos=pos,
+                                      return_sentiment=return_sentiment, context_mode=context_mode,
+                                      context_weight=context_weight), times, pos, return_sentiment)
+
+    def query_occurrences(self, ids, times=None, weight_cutoff=None, context=None):
+        """
+        :return: list of tuples (u,occurrences)
+        """
+        raise NotImplementedError
+
+    def query_tie_context(self, occurring, replacing, times=None, pos=None, scale=40, tfidf=None,
+                          context_mode="bidirectional", return_sentiment=True, weight_cutoff=None):
+        """
+        :return: list of dicts {substitute:x, occurrence:x, idx:x, weight:x, pos:x, ...}
+        """
+        raise NotImplementedError
+
+    def query_context_of_node(self, ids, times=None, weight_cutoff=None, occurrence=False):
+        """
+        :return: list of tuples (u,v,{weight:x, time:x, start:x, end:x})
+        """
+        raise NotImplementedError
+
+    def query_substitution_in_dyadic_context(self, ids, occurring=None, replacing=None, times=None, scale=40,
+                                             context_mode="bidirectional", return_sentiment=True, weight_cutoff=None,
+                                             add_dyad=False, normalize_seq_length=False):
+        raise NotImplementedError
+
+    def query_context_in_dyadic_context(self, ids, occurring=None, replacing=None, times=None, scale=40,
+                                        context_mode="bidirectional", return_sentiment=True, weight_cutoff=None,
+                                        add_dyad=False, normalize_seq_length=False):
+        raise NotImplementedError
+
+    def query_parts_of_speech(self):
+        """
+        :return: list of the distinct parts of speech of the ties
+        """
+        raise NotImplementedError
+
+    def query_degrees(self, times=None):
+        """
+        Number of distinct receivers of the ties of each sender, as conditioned by query_multiple_nodes
+        without context, part of speech or weight cutoff. Used to plan conditioning.
+        :param times: list of times, None for all
+        :return: list of tuples (sender, degree), or None if degrees can not be queried cheaply
+        """
+        return None
+
+    # %% Yearly aggregates
+    # Aggregate operators that can be computed from the yearly sums and counts
+    year_aggregate_operators = ["SUM", "AVG", "COUNT"]
+
+    def build_year_aggregates(self, times=None):
+        """
+        Materializes, per time, the sum of weights, count, and sum of sentiment and subjectivity of
+        occurrence ties between each pair of tokens.
+        :param times: list of times to aggregate, None for all
+        """
+        raise NotImplementedError
+
+    def has_year_aggregates(self, times=None):
+        """
+        :param times: list of times, None for all
+        :return: True if query_year_aggregates can be used for these times
+        """
+        return False
+
+    def query_year_aggregates(self, ids, times=None, return_sentiment=True):
+        """
+        Same as query_multiple_nodes without context, part of speech or weight cutoff,
+        but summing the yearly aggregates instead of the occurrence ties.
+        :return: list of tuples (sender, receiver, {weight:x, time:x, start:x, end:x, pos:x, ...})
+        """
+        raise NotImplementedError
+
+    def query_year_aggregates_columns(self, ids, times=None, return_sentiment=True):
+        """
+        Same as query_year_aggregates, but returns the ties as columns, see query_multiple_nodes_columns
+        """
+        return self.ties_to_columns(self.query_year_aggregates(ids, times=times, return_sentiment=return_sentiment),
+                                    times, None, return_sentiment)
+
+    def year_aggregate_weight(self, weight_sum, count):
+        """Applies the aggregate operator to summed yearly aggregates"""
+        if self.aggregate_operator == "AVG":
+            return weight_sum / count
+        elif self.aggregate_operator == "COUNT":
+            return count
+        return weight_sum
+
+    # %% Insert functions
+    def insert_edges(self, ego, ties):
+        """
+        :param ego: ego token id
+        :param ties: list of (ego, alter, time, attribute dict) tuples
+        """
+        raise NotImplementedError
+
+    # %% Store interaction
+    def write_queue(self):
+        raise NotImplementedError
+
+    def open_session(self, fetch_size=50):
+        pass
+
+    def map_queries(self, function, arguments):
+        """
+        Calls function for each element of arguments and yields the results in the same order.
+        Implementations that can query concurrently run the calls in parallel.
+        :param function: callable taking one element of arguments, e.g. a batch of ids to query
+        :param arguments: list
+        :return: generator of results
+        """
+        for argument in arguments:
+            yield function(argument)
+
+    def close_session(self):
+        pass
+
+    def close(self):
+        pass
+
+    # %% Helpers shared by implementations
+    @staticmethod
+    def network_time(times):
+        """
+        Returns the time attributes that a query over times sets on the conditioned network
+
+        Parameters
+        ----------
+        times: int, dict or list
+
+        Returns
+        -------
+        dict {s: start, e: end, m: midpoint}
+        """
+        if isinstance(times, int):
+            return {"s": times, "e": times, "m": times}
+        elif isinstance(times, dict):
+            return {"s": times['start'], "e": times['end'], "m": int((times['end'] + times['start']) / 2)}
+        elif isinstance(times, list):
+            sort_times = np.sort(times)
+            return {"s": sort_times[0], "e": sort_times[-1], "m": int((sort_times[0] + sort_times[-1]) / 2)}
+        else:
+            return {"s": 0, "e": 0, "m": 0}
+
+    @classmethod
+    def tie_columns(cls, columns, times, pos=None):
+        """
+        Adds the time and part of speech attributes of ties queried over times to their columns
+        """
+        if isinstance(times, (np.ndarray, tuple)):
+            times = list(times)
+        nw_time = cls.network_time(times[0] if isinstance(times, list) and len(times) == 1 else times)
+        if pos is not None and not isinstance(pos, str):
+            pos = "-".join([str(x) for x in pos])
+        return dict(columns, time=nw_time['m'], start=nw_time['s'], end=nw_time['e'],
+                    pos=pos if pos is not None else "None")
+
+    @classmethod
+    def ties_to_columns(cls, ties, times, pos=None, return_sentiment=True):
+        """
+        Converts queried ties, tuples (sender, receiver, attribute dict), into columns
+        """
+        dtypes = dict(TIE_COLUMNS, **SENTIMENT_COLUMNS) if return_sentiment else TIE_COLUMNS
+        records = ((x[0], x[1]) + tuple(x[2].get(name, np.nan) for name in list(dtypes)[2:]) for x in ties)
+        return cls.tie_columns(records_to_columns(records, dtypes), times, pos)
+
+    @staticmethod
+    def iterate_ties(columns):
+        """
+        Generator of tuples (sender, receiver, attribute dict) from tie columns
+        """
+        attributes = {x: columns[x] for x in ['time', 'start', 'end', 'pos']}
+        names = [x for x in SENTIMENT_COLUMNS if x in columns]
+        values = zip(*[columns[x].tolist() for x in ['sender', 'receiver', 'weight'] + names])
+        return ((x[0], x[1], dict({'weight': x[2]}, **attributes, **dict(zip(names, x[3:])))) for x in values)
+
+    @classmethod
+    def columns_to_ties(cls, columns):
+        """
+        Converts tie columns into tuples (sender, receiver, attribute dict), as returned by query_multiple_nodes
+        """
+        return list(cls.iterate_ties(columns))
+
+    @staticmethod
+    def tfidf_tie_context(df, df_tfidf, pos, return_sentiment=True):
+        """
+        Reweighs the results of query_tie_context by the overall weight of each context word
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            Columns context, substitute, occurrence, weight (sentiment, subjectivity)
+        df_tfidf: pd.DataFrame
+            Columns context, tweight
+        pos: str
+            Part of speech label to return
+        return_sentiment: bool
+
+        Returns
+        -------
+        list of dicts
+        """
+        import pandas as pd
+        if len(df) == 0 or len(df_tfidf) == 0:
+            logging.warning("No context ties to weigh by tfidf")
+            return []
+        total_df = pd.merge(left=df, right=df_tfidf, how="inner", on="context", validate="one_to_one")
+        total_df.tweight = total_df.tweight / total_df.tweight.sum()
+        total_df["nweight"] = total_df.weight / total_df.weight.sum()
+        total_df["pmi"] = -np.log(total_df.tweight) + np.log(total_df.nweight)
+        total_df["cond_entropy"] = np.log(total_df.nweight / total_df.tweight)
+        total_df["cond_entropy_weight"] = total_df.nweight * np.log(total_df.nweight / total_df.tweight)
+        total_df["pmi_weight"] = total_df["weight"] * total_df["pmi"]
+        total_df["rel_weight"] = total_df.nweight / total_df.tweight
+        total_df["diff"] = np.abs(total_df.nweight - total_df.tweight)
+        total_df["diffw"] = total_df.nweight / np.exp(- np.square(total_df["diff"]))
+
+        if return_sentiment:
+            ret = [{'substitute': x['substitute'], 'occurrence': x['occurrence'], 'idx': x['context'],
+                    'weight': x['weight'], 'sentiment': x['sentiment'], 'subjectivity': x['subjectivity'],
+                    'pos': pos, 'reg_weight': x['weight'], 'nweight': x['nweight'], 'pmi': x['pmi'],
+                    'diff': x['diff'], 'diffw': x['diffw'], 'pmi_weight': x['pmi_weight'],
+                    'rel_weight': x['rel_weight'], 'cond_entropy': x['cond_entropy'],
+                    'cond_entropy_weight': x['cond_entropy_weight']}
+                   for index, x in total_df.iterrows()]
+        else:
+            ret = [{'substitute': x['substitute'], 'occurrence': x['occurrence'], 'idx': x['context'],
+                    'weight': x['weight'], 'pos': pos, 'reg_weight': x['weight'], 'nweight': x['nweight'],
+                    'diff': x['diff'], 'diffw': x['diffw'], 'pmi': x['pmi'], 'pmi_weight': x['pmi_weight'],
+                    'rel_weight': x['rel_weight'], 'cond_entropy': x['cond_entropy'],
+                    'cond_entropy_weight': x['cond_entropy_weight']}
+                   for index, x in total_df.iterrows()]
+        return ret
@@ -1,4 +1,6 @@
 
+import json
+
 import numpy as np
 import torch
 import tables
@@ -32,15 +34,294 @@ except:
     vader_analyzer = None
     vader_available=False
 
+from text2network.utils.hash_file import hash_string
 from text2network.utils.load_bert import get_full_vocabulary
+from text2network.utils.process_pool import map_ordered
+
+
+
+
+def tokenizer_hash(tokenizer):
+    """
+    Hash of the model, tokenizer class and vocabulary, such that cached token ids are invalidated when either changes.
+    """
+    vocab = sorted(tokenizer.get_vocab().items(), key=lambda x: x[1])
+    return hash_string(json.dumps([getattr(tokenizer, "name_or_path", ""), tokenizer.__class__.__name__, vocab]))
 
 
+def encode_batch(tokenizer, texts):
+    """
+    Token ids of texts, without special tokens, and the index of the word each token belongs to.
+
+    Fast tokenizers encode the whole batch at once and provide the alignment of tokens to words.
+    Other tokenizers encode text by text, and the word index is -1.
+
+    Returns
+    -------
+    List of token id lists, list of word index lists
+    """
+    if not texts:
+        return [], []
+    if getattr(tokenizer, "is_fast", False):
+        encoded = tokenizer(texts, add_special_tokens=False, return_attention_mask=False,
+                            return_token_type_ids=False)
+        word_ids = [[-1 if x is None else x for x in encoded.word_ids(i)] for i in range(len(texts))]
+        return encoded['input_ids'], word_ids
+    ids = [tokenizer.encode(x, add_special_tokens=False) for x in texts]
+    return ids, [[-1] * len(x) for x in ids]
+
+
+def build_token_cache(data_path, query, tokenizer, cache_file, chunk_size=10000):
+    """
+    Tokenizes the sentences of a query, chunk by chunk, and saves token ids and their word index as flat arrays
+    next to their offsets.
+
+    Rows are read by their coordinates, such that only one chunk of text is held in memory at a time.
+    Sentences shorter than three characters are dropped.
+
+    Parameters
+    ----------
+    data_path: str
+        HDF5 database file
+    query: str
+        Query on the database
+    tokenizer: PyTorch tokenizer
+    cache_file: str
+        Base name of the cache, creates cache_file.ids, cache_file.words and cache_file.npz
+    chunk_size: int
+        Number of rows read and tokenized at once
+
+    Returns
+    -------
+    dict of coordinates, offsets and counts of token ids
+    """
+    stat = os.stat(data_path)
+    counts = np.zeros(len(tokenizer), dtype=np.int64)
+    kept_coordinates = []
+    lengths = []
+    with tables.open_file(data_path, mode="r") as hdf, open(cache_file + ".ids.tmp", "wb") as f_ids, \
+            open(cache_file + ".words.tmp", "wb") as f_words:
+        data = hdf.root.textdata.table
+        coordinates = data.get_where_list(query)
+        for start in tqdm(range(0, len(coordinates), chunk_size), desc="Tokenizing {}".format(query),
+                          disable=len(coordinates) <= chunk_size):
+            chunk = coordinates[start:start + chunk_size]
+            texts = [x.decode("utf-8") for x in data.read_coordinates(chunk, field="text")]
+            # Delete very short sequences
+            index = np.array([len(x) >= 3 for x in texts], dtype=bool)
+            chunk_ids, chunk_words = encode_batch(tokenizer, [x for x, keep in zip(texts, index) if keep])
+            kept_coordinates.append(chunk[index])
+            lengths.extend(len(x) for x in chunk_ids)
+            chunk_ids = np.fromiter((x for ids in chunk_ids for x in ids), dtype=np.int32)
+            chunk_words = np.fromiter((x for words in chunk_words for x in words), dtype=np.int32)
+            counts += np.bincount(chunk_ids, minlength=len(counts))[:len(counts)]
+            f_ids.write(chunk_ids.tobytes())
+            f_words.write(chunk_words.tobytes())
+    os.replace(cache_file + ".ids.tmp", cache_file + ".ids")
+    os.replace(cache_file + ".words.tmp", cache_file + ".words")
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    cache = {'coordinates': np.concatenate([np.zeros(0, dtype=np.int64)] + kept_coordinates).astype(np.int64),
+             'offsets': offsets, 'counts': counts}
+    with open(cache_file + ".npz", "wb") as f:
+        np.savez(f, size=stat.st_size, mtime=stat.st_mtime_ns, **cache)
+    return cache
+
+
+def load_token_cache(data_path, query, tokenizer, cache_folder=None, chunk_size=10000):
+    """
+    build_token_cache, cached per query, model and tokenizer in cache_folder, or next to the database.
+
+    The cache is used if size and modification time of the database are unchanged.
+
+    Returns
+    -------
+    Base name of the cache and dict of coordinates, offsets and counts of token ids
+    """
+    if cache_folder is None:
+        cache_folder = os.path.dirname(os.path.abspath(data_path))
+    os.makedirs(cache_folder, exist_ok=True)
+    cache_file = os.path.join(cache_folder, "{}.tokens-{}".format(os.path.basename(data_path),
+                                                                  hash_string(json.dumps([query, tokenizer_hash(
+                                                                      tokenizer)]))[0:8]))
+    if all(os.path.exists(cache_file + x) for x in [".npz", ".ids", ".words"]):
+        stat = os.stat(data_path)
+        try:
+            with np.load(cache_file + ".npz", allow_pickle=False) as cache:
+                cache = {x: cache[x] for x in cache.files}
+            if cache['size'] == stat.st_size and cache['mtime'] == stat.st_mtime_ns:
+                return cache_file, cache
+        except (OSError, ValueError, KeyError):
+            logging.warning("Could not read cached token ids {}".format(cache_file))
+    logging.info("Tokenizing query {} from {}".format(query, data_path))
+    return cache_file, build_token_cache(data_path, query, tokenizer, cache_file, chunk_size=chunk_size)
+
+
+def annotate_tokens(token_lists, pos=True, sentiment=True):
+    """
+    Parts of speech of each token, and sentiment and subjectivity of each sequence of tokens.
+
+    This is a module-level function, such that it can run in worker processes.
+
+    Parameters
+    ----------
+    token_lists: list
+        Lists of tokens
+    pos: bool
+        Tag parts of speech, in the universal tag set
+    sentiment: bool
+        Calculate sentiment and subjectivity with TextBlob
+
+    Returns
+    -------
+    List of tag lists (empty if pos is False), arrays of sentiment and subjectivity (zero if sentiment is False)
+    """
+    tag_lists = []
+    polarity = np.zeros(len(token_lists), dtype=np.float32)
+    subjectivity = np.zeros(len(token_lists), dtype=np.float32)
+    for i, tokens in enumerate(token_lists):
+        if pos:
+            pos_tags = pos_tag(tokens)
+            if len(tokens) != len(pos_tags):
+                raise AssertionError("NLTK POS Tagger could not tag all tokens!")
+            # Use simplified Tag Set instead of Penn
+            pos_tags = [(word, map_tag('en-ptb', 'universal', tag)) for word, tag in pos_tags]
+            # Get rid of unknown stuff
+            tag_lists.append([x[1] if x[0] != x[1] else "UNKNOWN" for x in pos_tags])
+        if sentiment:
+            txtblb = TextBlob(" ".join(tokens))
+            polarity[i] = txtblb.sentiment.polarity
+            subjectivity[i] = txtblb.sentiment.subjectivity
+    return tag_lists, polarity, subjectivity
+
+
+def build_annotation_cache(dataset, annotation_file, pos=True, sentiment=True, workers=1, batch_size=1000):
+    """
+    Annotates the cached token sequences of a query_dataset, cut to its fixed sequence length.
+
+    Tags are saved as flat array of codes, aligned with the token ids of the dataset, and -1 for cut tokens.
+    Sentiment and subjectivity are saved per sequence.
+
+    Parameters
+    ----------
+    dataset: query_dataset
+    annotation_file: str
+        Base name of the cache, creates annotation_file.pos and annotation_file.npz
+    pos: bool
+        Tag parts of speech
+    sentiment: bool
+        Calculate sentiment and subjectivity
+    workers: int
+        Number of processes. None for the number of CPUs. The default is 1.
+    batch_size: int
+        Number of sequences annotated at once
+
+    Returns
+    -------
+    dict of tag names, sentiment and subjectivity
+    """
+    stat = os.stat(dataset.data_path)
+    ids = dataset.get_ids()
+    lengths = np.diff(dataset.offsets)
+    if dataset.fixed_seq_length is not None:
+        lengths = np.minimum(lengths, dataset.fixed_seq_length)
+
+    def token_batches():
+        for start in range(0, dataset.nitems, batch_size):
+            yield [dataset.tokenizer.convert_ids_to_tokens(ids[offset:offset + length].tolist()) for offset, length in
+                   zip(dataset.offsets[start:start + batch_size], lengths[start:start + batch_size])]
+
+    tag_codes = {}
+    polarity = [np.zeros(0, dtype=np.float32)]
+    subjectivity = [np.zeros(0, dtype=np.float32)]
+    start = 0
+    with open(annotation_file + ".pos.tmp", "wb") as f:
+        for tag_lists, batch_polarity, batch_subjectivity in tqdm(
+                map_ordered(annotate_tokens, token_batches(), workers=workers, pos=pos, sentiment=sentiment),
+                desc="Annotating {}".format(dataset.query), total=-(-dataset.nitems // batch_size)):
+            if pos:
+                offsets = dataset.offsets[start:start + len(batch_polarity) + 1]
+                codes = np.full(offsets[-1] - offsets[0], -1, dtype=np.int16)
+                for offset, tags in zip(offsets - offsets[0], tag_lists):
+                    codes[offset:offset + len(tags)] = [tag_codes.setdefault(x, len(tag_codes)) for x in tags]
+                f.write(codes.tobytes())
+            polarity.append(batch_polarity)
+            subjectivity.append(batch_subjectivity)
+            start += len(batch_polarity)
+    os.replace(annotation_file + ".pos.tmp", annotation_file + ".pos")
+
+    cache = {'pos_tags': np.array(list(tag_codes), dtype=str), 'polarity': np.concatenate(polarity),
+             'subjectivity': np.concatenate(subjectivity), 'has_pos': pos, 'has_sentiment': sentiment}
+    with open(annotation_file + ".npz", "wb") as f:
+        np.savez(f, size=stat.st_size, mtime=stat.st_mtime_ns, **cache)
+    return cache
+
+
+def load_annotations(dataset, pos=True, sentiment=True, workers=1, batch_size=1000):
+    """
+    build_annotation_cache, cached next to the token ids of the dataset and for its fixed sequence length.
+
+    The cache is used if size and modification time of the database are unchanged, and if it includes the
+    requested annotations.
+
+    Returns
+    -------
+    Base name of the cache and dict of tag names, sentiment and subjectivity
+    """
+    annotation_file = "{}.annotations-{}".format(dataset.cache_file, dataset.fixed_seq_length)
+    if os.path.exists(annotation_file + ".npz") and os.path.exists(annotation_file + ".pos"):
+        stat = os.stat(dataset.data_path)
+        try:
+            with np.load(annotation_file + ".npz", allow_pickle=False) as cache:
+                cache = {x: cache[x] for x in cache.files}
+            if cache['size'] == stat.st_size and cache['mtime'] == stat.st_mtime_ns and (
+                    cache['has_pos'] or not pos) and (cache['has_sentiment'] or not sentiment):
+                return annotation_file, cache
+        except (OSError, ValueError, KeyError):
+            logging.warning("Could not read cached annotations {}".format(annotation_file))
+    logging.info("Annotating query {} from {}".format(dataset.query, dataset.data_path))
+    return annotation_file, build_annotation_cache(dataset, annotation_file, pos=pos, sentiment=sentiment,
+                                                   workers=workers, batch_size=batch_size)
 
 
 class query_dataset(Dataset):
     def __init__(self, data_path, tokenizer=None, fixed_seq_length=None, maxn=None, query=None,
-                 logging_level=logging.DEBUG, pos=True, sentiment=True):
-        # TODO: Redo out of memory if necessary
+                 logging_level=logging.DEBUG, pos=True, sentiment=True, cache_folder=None, chunk_size=10000,
+                 annotation_workers=1, annotation_batch_size=1000):
+        """
+        Sentences of a query on the database, read by their coordinates when a batch is requested.
+
+        Token ids of the query are computed once, in batches if the tokenizer is fast, and cached as memory-mapped
+        file, such that DataLoader workers share them instead of holding a copy of the text.
+        Parts of speech, sentiment and subjectivity are likewise computed once, in a pool of processes, and cached
+        next to the token ids.
+
+        Parameters
+        ----------
+        data_path: str
+            HDF5 database file
+        tokenizer: PyTorch tokenizer
+        fixed_seq_length: int
+            Sequences are cut to this length
+        maxn: int
+            Not used
+        query: str
+            Query on the database
+        logging_level: logging.level
+        pos: bool
+            Tag parts of speech
+        sentiment: bool
+            Calculate sentiment and subjectivity
+        cache_folder: str, optional
+            Folder for cached token ids. The default is the folder of the database.
+        chunk_size: int
+            Number of rows tokenized at once
+        annotation_workers: int
+            Number of processes annotating parts of speech and sentiment. None for the number of CPUs.
+        annotation_batch_size: int
+            Number of sequences annotated at once
+        """
         # TODO: Add maxn option
         self.data_path = data_path
         self.tokenizer = tokenizer
@@ -48,52 +329,96 @@ class query_dataset(Dataset):
         self.query = query
         self.logging_level = logging_level
         self.pos=pos
-        self.sentiment=sentiment
+        self.sentiment=sentiment and textblob_available
         logging.disable(logging_level)
         logging.info("Creating features from database file at %s", self.data_path)
 
-        self.tables = tables.open_file(self.data_path, mode="r")
-        self.data = self.tables.root.textdata.table
-
-        items = self.data.read_where(self.query)
+        self.cache_file, cache = load_token_cache(self.data_path, self.query, tokenizer, cache_folder=cache_folder,
+                                                  chunk_size=chunk_size)
+        self.coordinates = cache['coordinates']
+        self.offsets = cache['offsets']
+        self.nitems = len(self.coordinates)
+        # Opened lazily in each process
+        self.tables = None
+        self.table_pid = None
+        self.ids = None
+        self.word_ids = None
+        self.pos_codes = None
+
+        # Special tokens before and after each sequence
+        special_ids = tokenizer.build_inputs_with_special_tokens([-1])
+        self.prefix_ids = special_ids[:special_ids.index(-1)]
+        self.suffix_ids = special_ids[special_ids.index(-1) + 1:]
 
-        # Get data
-        items_text = items['text']
-        items_year = items['year']
-        items_seqid = items['seq_id']  # ?
-        items_runindex = items['run_index']
-        items_p1 = items['p1']
-        items_p2 = items['p2']
-        items_p3 = items['p3']
-        items_p4 = items['p4']
+        # ID mask is 1 for tokens that do not appear in the text
+        logging.info("Setting up unique words")
+        self.id_mask = np.flatnonzero(cache['counts'] == 0)
+
+        # Annotations of the sequences
+        if self.pos or self.sentiment:
+            self.annotation_file, annotations = load_annotations(self, pos=self.pos, sentiment=self.sentiment,
+                                                                 workers=annotation_workers,
+                                                                 batch_size=annotation_batch_size)
+            self.pos_tags = annotations['pos_tags']
+            self.polarity = annotations['polarity']
+            self.subjectivity = annotations['subjectivity']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['tables'] = None
+        state['table_pid'] = None
+        state['ids'] = None
+        state['word_ids'] = None
+        state['pos_codes'] = None
+        return state
+
+    def get_table(self):
+        """
+        Table of the database, opened once per process
+        """
+        if self.tables is None or self.table_pid != os.getpid():
+            self.tables = tables.open_file(self.data_path, mode="r")
+            self.table_pid = os.getpid()
+        return self.tables.root.textdata.table
 
-        # Because of pyTables, we have to encode.
-        items_text = [x.decode("utf-8") for x in items_text]
-        items_p1 = [x.decode("utf-8") for x in items_p1]
-        items_p2 = [x.decode("utf-8") for x in items_p2]
-        items_p3 = [x.decode("utf-8") for x in items_p3]
-        items_p4 = [x.decode("utf-8") for x in items_p4]
-
-        self.data = pd.DataFrame(
-            {"year": items_year, "seq_id": items_seqid, "run_index": items_runindex, "text": items_text, "p1": items_p1, "p2": items_p2,
-             "p3": items_p3, "p4": items_p4})
-        self.tables.close()
+    def get_ids(self):
+        """
+        Memory-mapped token ids of all sentences, to be sliced by offsets
+        """
+        if self.ids is None:
+            self.ids = self.__memmap(".ids")
+        return self.ids
 
-        # Delete very short sequences
-        length = self.data.text.apply(len)
-        index=length >= 3
-        self.data=self.data.loc[index,:]
-        self.nitems = len(self.data.text)
+    def get_word_ids(self):
+        """
+        Memory-mapped index of the word in its sentence for each token, -1 if unknown, to be sliced by offsets
+        """
+        if self.word_ids is None:
+            self.word_ids = self.__memmap(".words")
+        return self.word_ids
 
-        # Setup unique words ID masking
-        logging.info("Setting up unique words")
-        all_tokens=[tokenizer.tokenize(x) for x in items_text]
-        all_ids=[tokenizer.convert_tokens_to_ids(x) for x in all_tokens]
-        all_ids=list(set(sum(all_ids,[])))
-        # ID mask is 1 for tokens that do not appear in the text
-        self.id_mask=torch.ones(len(tokenizer))
-        self.id_mask[all_ids]=0
-        self.id_mask=np.where(self.id_mask==1)[0]
+    def get_pos_codes(self):
+        """
+        Memory-mapped part of speech of each token, as index of pos_tags, to be sliced by offsets
+        """
+        if self.pos_codes is None:
+            self.pos_codes = self.__memmap(".pos", self.annotation_file, dtype=np.int16)
+        return self.pos_codes
+
+    def __memmap(self, suffix, cache_file=None, dtype=np.int32):
+        if cache_file is None:
+            cache_file = self.cache_file
+        if self.offsets[-1] > 0:
+            return np.memmap(cache_file + suffix, dtype=dtype, mode="r")
+        return np.zeros(0, dtype=dtype)
+
+    def close(self):
+        if self.tables is not None and self.table_pid == os.getpid():
+            self.tables.close()
+        self.tables = None
+        self.ids = None
+        self.word_ids = None
+        self.pos_codes = None
 
     def __getitem__(self, index):
         """
@@ -126,71 +451,51 @@ class query_dataset(Dataset):
         if type(index) is not list:
             index = [index]
 
-        item = self.data.iloc[index, :]
+        coordinates = self.coordinates[index]
+        item = self.get_table().read_coordinates(coordinates)
         # Get numpy or torch vectors (numpy for the strings)
-        texts = item['text'].to_numpy()
-        year_vec = torch.tensor(item['year'].to_numpy(dtype="int32"), requires_grad=False)
-        p1_vec = item['p1'].to_numpy()
-        p2_vec = item['p2'].to_numpy()
-        p3_vec = item['p3'].to_numpy()
-        p4_vec = item['p4'].to_numpy()
-        seq_vec = item['seq_id'].to_numpy(dtype="int32")
-        runindex_vec = item['run_index'].to_numpy(dtype="int32")
-
-        token_input_vec = []  # tensor of padded inputs with special tokens
-        token_id_vec = []  # List of token ids for each sequence, later transformed to 1-dim tensor over batch
-
-        pos_vec = []
-        sentiment_vec = []
-        subject_vec = []
-        for text in texts:
-
-            # Text tokenization
-            ##
-            indexed_tokens = self.tokenizer.encode(text, add_special_tokens=False)
-            # Need fixed size, so we need to cut and pad
-            indexed_tokens = indexed_tokens[:self.fixed_seq_length]
-            indexed_tokens = self.tokenizer.build_inputs_with_special_tokens(indexed_tokens)
-            inputs = torch.tensor([indexed_tokens], requires_grad=False)
-            inputs = inputs.squeeze(dim=0).squeeze()
-            token_input_vec.append(inputs)
-            # Also save list of tokens
-            token_id_vec.append(inputs[1:-1])
-
-            if self.pos:
-                reform_text = self.tokenizer.convert_ids_to_tokens(list(inputs[1:-1].numpy()))
-                pos_tags=pos_tag(reform_text)
-                if len(reform_text) != len(pos_tags):
-                    raise AssertionError("NLTK POS Tagger could not tag all tokens!")
-                # Use simplified Tag Set instead of Penn
-                pos_tags= [(word, map_tag('en-ptb', 'universal', tag)) for word, tag in pos_tags]
-                # Get rid of unknown stuff
-                pos = [x[1] if x[0]!=x[1] else "UNKNOWN" for x in pos_tags]
-                pos = np.array(pos)
-            else:
-                pos = np.zeros_like(inputs[1:-1].numpy())
-            pos_vec.append(pos)
-            # Sentiment analysis
-            if self.sentiment and textblob_available:
-                reform_text=self.tokenizer.convert_ids_to_tokens(list(inputs[1:-1].numpy()))
-                joined_text = " ".join(reform_text)
-                txtblb = TextBlob(joined_text)
-                sentiment= torch.tensor(txtblb.sentiment.polarity)
-                subject = torch.tensor(txtblb.sentiment.subjectivity)
-            else:
-                sentiment = torch.tensor(0)
-                subject = torch.tensor(0)
-            sentiment_vec.append(sentiment)
-            subject_vec.append(subject)
-
-        # Add padding sequence
-        token_input_vec.append(torch.zeros([self.fixed_seq_length + 2], dtype=torch.int))
-        token_input_vec = pad_sequence(token_input_vec, batch_first=True, padding_value=self.tokenizer.pad_token_id)
-        # Detele padding sequence
-        token_input_vec = token_input_vec[:-1, :]
+        year_vec = torch.tensor(item['year'].astype("int32"), requires_grad=False)
+        p1_vec = np.char.decode(item['p1'], "utf-8")
+        p2_vec = np.char.decode(item['p2'], "utf-8")
+        p3_vec = np.char.decode(item['p3'], "utf-8")
+        p4_vec = np.char.decode(item['p4'], "utf-8")
+        seq_vec = item['seq_id'].astype("int32")
+        runindex_vec = item['run_index'].astype("int32")
+        # Cached text tokenization, cut to fixed size
+        ids = self.get_ids()
+        starts = self.offsets[:-1][index]
+        lengths = self.offsets[1:][index] - starts
+        if self.fixed_seq_length is not None:
+            lengths = np.minimum(lengths, self.fixed_seq_length)
+        token_ids = [ids[start:start + length].astype(np.int64) for start, length in zip(starts, lengths)]
+
+        # Add special tokens and pad
+        seq_length = max([self.fixed_seq_length or 0] + lengths.tolist())
+        token_input_vec = np.full([len(token_ids), seq_length + len(self.prefix_ids) + len(self.suffix_ids)],
+                                  self.tokenizer.pad_token_id, dtype=np.int64)
+        token_input_vec[:, :len(self.prefix_ids)] = self.prefix_ids
+        for row, (sequence, length) in enumerate(zip(token_ids, lengths)):
+            token_input_vec[row, len(self.prefix_ids):len(self.prefix_ids) + length] = sequence
+            token_input_vec[row, len(self.prefix_ids) + length:len(self.prefix_ids) + length + len(
+                self.suffix_ids)] = self.suffix_ids
+        token_input_vec = torch.from_numpy(token_input_vec)
+
+        # Cached annotations
+        if self.pos:
+            pos_codes = self.get_pos_codes()
+            pos_vec = self.pos_tags[np.concatenate([np.zeros(0, dtype=np.int16)] + [
+                pos_codes[start:start + length] for start, length in zip(starts, lengths)])]
+        else:
+            pos_vec = np.zeros(lengths.sum(), dtype=np.int64)
+        if self.sentiment:
+            sentiment_vec = torch.from_numpy(self.polarity[index])
+            subject_vec = torch.from_numpy(self.subjectivity[index])
+        else:
+            sentiment_vec = torch.zeros(len(token_ids), dtype=torch.int64)
+            subject_vec = torch.zeros(len(token_ids), dtype=torch.int64)
 
         # Prepare index vector and sequence vector by using sequence IDs found in database
-        lengths = ([x.shape[0] for x in token_id_vec])
+        lengths = lengths.tolist()
         index_vec = torch.repeat_interleave(torch.as_tensor(index), torch.as_tensor(lengths))
         seq_vec = torch.repeat_interleave(torch.as_tensor(seq_vec), torch.as_tensor(lengths))
         runindex_vec = torch.repeat_interleave(torch.as_tensor(runindex_vec), torch.as_tensor(lengths))
@@ -203,13 +508,12 @@ class query_dataset(Dataset):
         p4_vec = p4_vec.repeat(lengths)
 
         # Cat token_id_vec list into a single tensor for the whole batch
-        token_id_vec = torch.cat([x for x in token_id_vec])
-        pos_vec= np.concatenate([x for x in pos_vec])
+        token_id_vec = torch.from_numpy(np.concatenate([np.zeros(0, dtype=np.int64)] + token_ids))
 
         return token_input_vec, token_id_vec, index_vec, seq_vec, runindex_vec, year_vec, p1_vec, p2_vec, p3_vec, p4_vec, pos_vec, sentiment_vec, subject_vec
 
     def __len__(self):
-        return len(self.data)
+        return self.nitems
 
 
 
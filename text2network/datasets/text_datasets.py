@@ -1,3 +1,4 @@
+import json
 import logging
 import numbers
 import os
@@ -26,6 +27,9 @@ from text2network.utils.logging_helpers import log, setup_logger
 # Setup logging
 logger = logging.getLogger("t2n")
 
+# Files written by the TextPreprocessor
+DATA_FILE_EXTENSIONS = (".json", ".jsonl.gz", ".parquet")
+
 
 class PreTrainDataSet(object):
     """
@@ -64,8 +68,7 @@ class PreTrainDataSet(object):
             for i, dir in enumerate(self.dirs):
                 dir_name = dir.split("/")[-1]
                 logger.debug("Loading data in directory: {}".format(dir_name))
-                json_files = [x[2] for x in os.walk(dir)][0]
-                json_files = [x for x in json_files if x.endswith(".json")]
+                json_files = self._data_files(dir)
                 if len(json_files) == 0:
                     logger.warning(f"No json files found in directory {dir_name}. Continuing.")
                     continue
@@ -79,8 +82,7 @@ class PreTrainDataSet(object):
         else:
             self.llms = [fixed_llm]
             dir = os.path.join(self.data_path, fixed_llm)
-            json_files = [x[2] for x in os.walk(dir)][0]
-            json_files = [x for x in json_files if x.endswith(".json")]
+            json_files = self._data_files(dir)
             if len(json_files) == 0:
                 logger.error(f"No json files found in directory {fixed_llm}.")
                 raise AttributeError
@@ -88,6 +90,20 @@ class PreTrainDataSet(object):
                 logger.debug("Found {} json files in directory.".format(len(json_files)))
                 self.json_folders[fixed_llm] = json_files
 
+    @staticmethod
+    def _data_files(dir: str) -> list[str]:
+        """
+        Data files written by the TextPreprocessor in a directory, in json, jsonl or parquet format.
+        If the directory has a manifest, these are exactly the shards it lists, in order.
+        """
+        manifest_path = os.path.join(dir, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            return [x["file"] for x in manifest["files"]]
+        files = [x[2] for x in os.walk(dir)][0]
+        return [x for x in files if x.endswith(DATA_FILE_EXTENSIONS)]
+
     @log()
     def make_dataset(self, llm: str, val_items=None, streaming=True) -> DatasetDict:
         """
@@ -111,16 +127,22 @@ class PreTrainDataSet(object):
             logger.error(f"Error reading json files for LLM: {llm}. Error: {e}")
             return None
         try:
-            # Try loading metadata picle from folder
-            metadata_path = os.path.join(self.data_path, llm, "metadata.pkl")
-            with open(metadata_path, "rb") as f:
-                metadata = pickle.load(f)
+            # Try loading the manifest, or the metadata pickle of older versions, from folder
+            manifest_path = os.path.join(self.data_path, llm, "manifest.json")
+            if os.path.exists(manifest_path):
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    metadata = json.load(f)
+            else:
+                metadata_path = os.path.join(self.data_path, llm, "metadata.pkl")
+                with open(metadata_path, "rb") as f:
+                    metadata = pickle.load(f)
             logger.debug("Loaded metadata for LLM: {}".format(llm))
         except Exception as e:
             logger.warning(f"Error loading metadata for LLM: {llm}. Error: {e}")
             metadata = None
+        builder = "parquet" if all(x.endswith(".parquet") for x in json_paths) else "json"
         dataset = load_dataset(
-            "json", data_files=json_paths, cache_dir=self.cache_dir, streaming=streaming
+            builder, data_files=json_paths, cache_dir=self.cache_dir, streaming=streaming
         )
         logger.debug("Loaded dataset for LLM: {}".format(llm))
 
@@ -4,13 +4,64 @@ Created on Thu Dec 17 01:45:25 2020
 
 @author: marquart
 """
+import inspect
+import logging
+
 import networkx as nx
 import numpy as np
 import scipy as sp
+import scipy.sparse
+import scipy.sparse.linalg
 from scipy.sparse.linalg import inv
 
+from text2network.classes.sparse_graph import sparse_graph
+
+
+def spectral_radius(G):
+    """
+    Largest absolute eigenvalue of a sparse matrix, from a single Arnoldi eigenvalue
+
+    Parameters
+    ----------
+    G : scipy sparse matrix
+
+    Returns
+    -------
+    float
+    """
+    n = G.shape[0]
+    if n == 0:
+        return 0.0
+    if n < 3:
+        # ARPACK requires k < n-1
+        return float(np.max(np.abs(np.linalg.eigvals(G.toarray()))))
+    eigenvalues = sp.sparse.linalg.eigs(G, k=1, which="LM", return_eigenvectors=False)
+    return float(np.max(np.abs(eigenvalues)))
+
+
+def top_k_rows(matrix, top_k):
+    """
+    Keeps the top_k largest entries in each row of a sparse matrix
+
+    Parameters
+    ----------
+    matrix : scipy sparse matrix
+    top_k : int
+
+    Returns
+    -------
+    CSR matrix
+    """
+    matrix = matrix.tocoo()
+    order = np.lexsort((-matrix.data, matrix.row))
+    rows = matrix.row[order]
+    row_start = np.searchsorted(rows, rows, side="left")
+    keep = order[np.arange(len(order)) - row_start < top_k]
+    return sp.sparse.csr_matrix((matrix.data[keep], (matrix.row[keep], matrix.col[keep])), shape=matrix.shape)
 
-def backout_measure(graph, nodelist=None, decay=None, method="invert", stopping=25):
+
+def backout_measure(graph, nodelist=None, decay=None, method="invert", stopping=25, rows=None, tol=1e-6,
+                    top_k=None, block_size=256):
     """
     If each node is defined by the ties to its neighbors, and neighbors
     are equally defined in this manner, what is the final composition
@@ -26,55 +77,137 @@ def backout_measure(graph, nodelist=None, decay=None, method="invert", stopping=
 
     Parameters
     ----------
-    graph : networkx graph
-        Supplied networkx graph.
+    graph : networkx graph or sparse_graph
+        Supplied graph.
     nodelist : list, array, optional
         List of nodes to subset graph.
     decay : float, optional
-        Decay parameter determining the weight of higher order ties. The default is None.
-    method : "invert" or "series", optional
+        Decay parameter determining the weight of higher order ties. The default is None,
+        which uses 1/(1.5*spectral radius).
+    method : "invert", "series", "gmres" or "bicgstab", optional
         "invert" tries to invert the adjacency matrix.
-        "series" uses a series computation. The default is "invert".
+        "series" accumulates the power series row by row, until terms are smaller than tol.
+        "gmres" and "bicgstab" solve for each requested row with the respective iterative solver,
+        without computing the inverse.
+        The default is "invert".
     stopping : int, optional
         Used if method is "series". Determines the maximum order of series computation. The default is 25.
+    rows : list, optional
+        Nodes for which the ties are computed. The default is None, for all nodes.
+    tol : float, optional
+        Relative tolerance of the iterative solvers and the series computation. The default is 1e-6.
+    top_k : int, optional
+        Keep only the top_k strongest ties of each node. The default is None.
+    block_size : int, optional
+        Used if method is "series". Number of rows whose series is computed at once. The default is 256.
     
     Returns
     -------
-    Graph with modified ties.
+    Graph with modified ties, of the same type as graph.
 
     """
     # Get Scipy sparse matrix
-    if nodelist is None:
-        G = nx.to_scipy_sparse_matrix(graph,   format="csc")
+    if isinstance(graph, sparse_graph):
+        G = graph.adjacency()
+        if nodelist is None:
+            nodelist = graph.node_ids
+        else:
+            positions = np.array([graph.index[int(x)] for x in nodelist], dtype=np.int64)
+            G = G[positions][:, positions]
+            nodelist = graph.node_ids[positions]
+        G = G.tocsc()
+        n = len(nodelist)
+    elif nodelist is None:
+        G = sp.sparse.csc_matrix(nx.to_scipy_sparse_array(graph, format="csc"))
         n = len(graph.nodes)
         nodelist=np.array(graph.nodes)
     else:
-        G = nx.to_scipy_sparse_matrix(graph, nodelist=nodelist,   format="csc")
+        G = sp.sparse.csc_matrix(nx.to_scipy_sparse_array(graph, nodelist=nodelist, format="csc"))
         n = len(nodelist)
 
+    if rows is None:
+        row_positions = np.arange(n)
+    else:
+        node_index = {x: i for i, x in enumerate(list(nodelist))}
+        row_positions = np.array([node_index[x] for x in rows], dtype=np.int64)
+    nr_rows = len(row_positions)
+
     if decay is None:
-        eigenvalues, eigenvectors = sp.sparse.linalg.eigs(G)
-        sp_rad = 1.5*np.max(np.abs(eigenvalues))
-        decay = 1/sp_rad
+        sp_rad = 1.5*spectral_radius(G)
+        decay = 1/sp_rad if sp_rad > 0 else 1.0
 
     if method == "invert":
         inv_ties = inv(sp.sparse.eye(n, n, format='csc')-decay*G)
-        inv_ties.setdiag(np.zeros(n))
-        inv_ties = inv_ties.tocsr()
+        inv_ties = inv_ties.tocsr()[row_positions]
     elif method =="series":
-        inv_ties=sp.sparse.csc_matrix((n,n))
-        for t in range(0,stopping):
-            inv_ties=inv_ties+np.power(decay,t)*G**t
-        inv_ties.setdiag(np.zeros(n))
+        # Accumulate decay^t G^t for blocks of rows, each term from the previous one
+        G = decay * G.tocsr()
+        solved_rows = []
+        for start in range(0, nr_rows, block_size):
+            block = row_positions[start:start + block_size]
+            term = sp.sparse.csr_matrix((np.ones(len(block)), (np.arange(len(block)), block)), shape=(len(block), n))
+            block_ties = term.copy()
+            for t in range(1,stopping):
+                term = term @ G
+                block_ties = block_ties + term
+                if term.nnz == 0 or np.max(np.abs(term.data)) <= tol * np.max(np.abs(block_ties.data)):
+                    logging.debug("Series converged after {} terms".format(t + 1))
+                    break
+            block_ties = block_ties.tocsr()
+            if top_k is not None:
+                block_ties[np.arange(len(block)), block] = 0
+                block_ties = top_k_rows(block_ties, top_k)
+            solved_rows.append(block_ties)
+        inv_ties = sp.sparse.vstack(solved_rows, format="csr") if nr_rows > 0 else sp.sparse.csr_matrix((0, n))
+    elif method in ["gmres", "bicgstab"]:
+        # Row i of the inverse of (I - decay*G) solves the transposed system for the unit vector e_i
+        def solve(solver_name, rhs):
+            solver = getattr(sp.sparse.linalg, solver_name)
+            tol_name = "rtol" if "rtol" in inspect.signature(solver).parameters else "tol"
+            return solver(system, rhs, **{tol_name: tol})
+
+        system = (sp.sparse.eye(n, n, format='csr') - decay * G).T.tocsr()
+        solved_rows = []
+        for position in row_positions:
+            unit = np.zeros(n)
+            unit[position] = 1
+            solution, info = solve(method, unit)
+            if info < 0 and method != "gmres":
+                # BiCGSTAB can break down, e.g. for nodes without ties
+                solution, info = solve("gmres", unit)
+            if info < 0:
+                msg = "Backout solver {} failed for node {}".format(method, nodelist[position])
+                logging.error(msg)
+                raise RuntimeError(msg)
+            elif info > 0:
+                logging.warning("Backout solver {} did not converge for node {}".format(method, nodelist[position]))
+            solution[position] = 0
+            solution = sp.sparse.csr_matrix(solution)
+            if top_k is not None:
+                solution = top_k_rows(solution, top_k)
+            solved_rows.append(solution)
+        inv_ties = sp.sparse.vstack(solved_rows, format="csr") if nr_rows > 0 else sp.sparse.csr_matrix((0, n))
     else:
-        raise NotImplementedError("Method is either invert or series.")
-        
-    inv_ties.eliminate_zeros()
-    new_graph = nx.from_scipy_sparse_matrix(inv_ties)
-    idx=list(new_graph.nodes)
-    idxdict=dict(zip(idx,nodelist))
-    new_graph = nx.relabel_nodes(new_graph, idxdict)
+        msg = "Method is either invert, series, gmres or bicgstab."
+        logging.error(msg)
+        raise NotImplementedError(msg)
+
+    # Remove ties of each node to itself, and place the computed rows in the full adjacency matrix
+    inv_ties = inv_ties.tocoo()
+    keep = (inv_ties.col != row_positions[inv_ties.row]) & (inv_ties.data != 0)
+    inv_ties = sp.sparse.csr_matrix((inv_ties.data[keep], (row_positions[inv_ties.row[keep]], inv_ties.col[keep])),
+                                    shape=(n, n))
+    if top_k is not None:
+        inv_ties = top_k_rows(inv_ties, top_k)
+
+    if isinstance(graph, sparse_graph):
+        return sparse_graph.from_arrays({'nodes': np.asarray(nodelist), 'indptr': inv_ties.indptr,
+                                         'indices': inv_ties.indices, 'edge_weight': inv_ties.data,
+                                         'directed': graph.directed})
+    new_graph = nx.DiGraph() if nx.is_directed(graph) else nx.Graph()
+    new_graph.add_nodes_from(nodelist)
+    inv_ties = inv_ties.tocoo()
+    new_graph.add_weighted_edges_from(zip(np.asarray(nodelist)[inv_ties.row].tolist(),
+                                          np.asarray(nodelist)[inv_ties.col].tolist(), inv_ties.data.tolist()))
     
     return new_graph
-    
-
@@ -6,11 +6,16 @@ Created on Fri Dec 18 21:16:52 2020
 """
 import itertools
 import logging
+import os
 from _collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional, Callable, Tuple, List, Dict, Union, Iterable, TypedDict
 import numpy as np
 import networkx as nx
+import scipy as sp
+import scipy.sparse
 from community import best_partition
+from text2network.classes.sparse_graph import sparse_graph
 from text2network.functions.network_tools import make_symmetric
 import pandas as pd
 
@@ -68,46 +73,153 @@ def distance_to_cluster():
     pass
 
 
-def cluster_distances(graph:nx.Graph, clusterdict:dict)->nx.Graph:
+def cluster_distances(graph:Union[nx.Graph, sparse_graph], clusterdict:dict, block_size:Optional[int]=256)->nx.Graph:
+    """
+    Ties between each pair of clusters, describing the ties from the nodes of one cluster to the nodes of the other
+    by their mean (weight), min, max, mean standard deviation over focal nodes (std0) and alter nodes (std1),
+    and the dyads with minimal and maximal tie weight (min_dyad, max_dyad). Missing ties count as zero.
+
+    All pairs are computed from one sparse adjacency matrix and a sparse cluster membership matrix.
+
+    Parameters
+    ----------
+    graph: networkx graph or sparse_graph
+    clusterdict: dict
+        {cluster_name: [list of nodes]}
+    block_size: int, optional
+        Number of focal clusters for which the dense cluster-by-cluster statistics are computed at once
+
+    Returns
+    -------
+    nx.DiGraph of clusters
+    """
 
     cl_names = list(clusterdict.keys())
+    nr_clusters = len(cl_names)
 
     clustergraph = nx.DiGraph()
     clustergraph.add_nodes_from(cl_names)
-
-    clustercombination = list(itertools.combinations(cl_names, 2))
-    logging.info("Finding cluster distances giving {} combinations".format(len(clustercombination)))
-    for focalcluster, altercluster in clustercombination:
-        focal_nodes = clusterdict[focalcluster]
-        alter_nodes = clusterdict[altercluster]
-        combination_nodes = focal_nodes + alter_nodes
-        combination_mat = nx.convert_matrix.to_pandas_adjacency(graph, nodelist=combination_nodes)
-
-        focal_mat = combination_mat.loc[focal_nodes,alter_nodes]
-        alter_mat = combination_mat.loc[alter_nodes, focal_nodes]
-
-        assert list(focal_mat.index) == list(alter_mat.columns)
-
-        focal_dict = {}
-        focal_dict["weight"] = focal_mat.mean().mean()
-        focal_dict["min"] = focal_mat.min().min()
-        focal_dict["max"] = focal_mat.max().max()
-        focal_dict["std0"] = focal_mat.std(axis=0).mean()
-        focal_dict["std1"] = focal_mat.std(axis=1).mean()
-        focal_dict["min_dyad"] = focal_mat.stack().idxmin()
-        focal_dict["max_dyad"] = focal_mat.stack().idxmax()
-        alter_dict = {}
-        alter_dict["weight"] = alter_mat.mean().mean()
-        alter_dict["min"] = alter_mat.min().min()
-        alter_dict["max"] = alter_mat.max().max()
-        alter_dict["std0"] = alter_mat.std(axis=0).mean()
-        alter_dict["std1"] = alter_mat.std(axis=1).mean()
-        alter_dict["min_dyad"] = alter_mat.stack().idxmin()
-        alter_dict["max_dyad"] = alter_mat.stack().idxmax()
-
-        clustergraph.add_edges_from([(focalcluster, altercluster, focal_dict)])
-        clustergraph.add_edges_from([(altercluster, focalcluster, alter_dict)])
-
+    logging.info("Finding cluster distances giving {} combinations".format(int(nr_clusters * (nr_clusters - 1) / 2)))
+    if nr_clusters < 2:
+        return clustergraph
+
+    if not isinstance(graph, sparse_graph):
+        graph = sparse_graph.from_networkx(graph)
+    adjacency = graph.adjacency().copy()
+    adjacency.eliminate_zeros()
+    squared = adjacency.multiply(adjacency).tocsr()
+    nr_nodes = adjacency.shape[0]
+
+    # Sparse membership matrix, and position of each node in its cluster's list
+    missing = [x for nodes in clusterdict.values() for x in nodes if x not in graph.index]
+    if len(missing) > 0:
+        msg = "Nodes {} of clusters are not in the graph".format(missing[0:10])
+        logging.error(msg)
+        raise ValueError(msg)
+    member_nodes = np.array([graph.index[x] for nodes in clusterdict.values() for x in nodes], dtype=np.int64)
+    sizes = np.array([len(clusterdict[x]) for x in cl_names], dtype=np.int64)
+    member_clusters = np.repeat(np.arange(nr_clusters), sizes)
+    member_ranks = np.arange(len(member_nodes)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    membership = sp.sparse.csr_matrix((np.ones(len(member_nodes)), (member_nodes, member_clusters)),
+                                      shape=(nr_nodes, nr_clusters))
+
+    # Sums of ties, and of squared ties, from each node to each cluster (row) and from each cluster to each node (col)
+    row_sums, row_squares = (adjacency @ membership).tocsr(), (squared @ membership).tocsr()
+    col_sums, col_squares = (membership.T @ adjacency).tocsr(), (membership.T @ squared).tocsr()
+    # Standard deviation of each node's ties to each cluster (std1), and of each cluster's ties to each node (std0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        row_std = row_squares - row_sums.multiply(row_sums) @ sp.sparse.diags(1 / sizes)
+        row_std = (row_std @ sp.sparse.diags(1 / np.maximum(sizes - 1, 1))).tocsr()
+        col_std = sp.sparse.diags(1 / sizes) @ col_sums.multiply(col_sums)
+        col_std = (sp.sparse.diags(1 / np.maximum(sizes - 1, 1)) @ (col_squares - col_std)).tocsr()
+    row_std.data = np.sqrt(np.maximum(row_std.data, 0))
+    col_std.data = np.sqrt(np.maximum(col_std.data, 0))
+    structure = adjacency.copy()
+    structure.data = np.ones_like(structure.data)
+
+    # Cluster pair statistics, blocked over focal clusters
+    if block_size is None:
+        block_size = nr_clusters
+    stats = {x: np.zeros((nr_clusters, nr_clusters)) for x in ["weight", "nr_ties", "std0", "std1"]}
+    for start in range(0, nr_clusters, block_size):
+        block = slice(start, min(start + block_size, nr_clusters))
+        block_membership = membership[:, block]
+        stats["weight"][block] = (block_membership.T @ row_sums).toarray()
+        stats["nr_ties"][block] = (block_membership.T @ structure @ membership).toarray()
+        stats["std1"][block] = (block_membership.T @ row_std).toarray()
+        stats["std0"][block] = (col_std[block] @ membership).toarray()
+    pair_sizes = np.outer(sizes, sizes)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats["weight"] = stats["weight"] / pair_sizes
+        stats["std1"] = np.where(sizes[None, :] > 1, stats["std1"] / sizes[:, None], np.nan)
+        stats["std0"] = np.where(sizes[:, None] > 1, stats["std0"] / sizes[None, :], np.nan)
+
+    # Expand ties to all pairs of clusters containing their sender and receiver
+    ties = adjacency.tocoo()
+    node_order = np.argsort(member_nodes, kind="stable")
+    node_ptr = np.concatenate([[0], np.cumsum(np.bincount(member_nodes, minlength=nr_nodes))])
+
+    def expand(tie_nodes):
+        counts = node_ptr[tie_nodes + 1] - node_ptr[tie_nodes]
+        ties_index = np.repeat(np.arange(len(tie_nodes)), counts)
+        offsets = np.arange(len(ties_index)) - np.repeat(np.cumsum(counts) - counts, counts)
+        members = node_order[node_ptr[tie_nodes[ties_index]] + offsets]
+        return ties_index, members
+
+    sender_index, sender_members = expand(ties.row)
+    receiver_index, receiver_members = expand(ties.col[sender_index])
+    sender_members = sender_members[receiver_index]
+    tie_weights = ties.data[sender_index[receiver_index]]
+    focal, alter = member_clusters[sender_members], member_clusters[receiver_members]
+    between = focal != alter
+    focal, alter, tie_weights = focal[between], alter[between], tie_weights[between]
+    # Row-major position of each tie in the focal x alter adjacency block
+    positions = member_ranks[sender_members[between]] * sizes[alter] + member_ranks[receiver_members[between]]
+    groups = focal * nr_clusters + alter
+
+    def first_in_groups(order):
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = groups[order][1:] != groups[order][:-1]
+        return groups[order][first], order[first]
+
+    min_groups, min_ties = first_in_groups(np.lexsort((positions, tie_weights, groups)))
+    max_groups, max_ties = first_in_groups(np.lexsort((positions, -tie_weights, groups)))
+    # First position without tie in each block
+    order = np.lexsort((positions, groups))
+    group_start = np.searchsorted(groups[order], groups[order], side="left")
+    gaps = positions[order] != np.arange(len(order)) - group_start
+    first_gap = np.full(nr_clusters * nr_clusters, -1, dtype=np.int64)
+    gap_groups = groups[order][gaps]
+    gap_positions = (np.arange(len(order)) - group_start)[gaps]
+    first_gap[gap_groups[::-1]] = gap_positions[::-1]
+    counts = np.bincount(groups, minlength=nr_clusters * nr_clusters)
+    first_gap = np.where(first_gap >= 0, first_gap, counts)
+
+    min_values, max_values = np.zeros(nr_clusters * nr_clusters), np.zeros(nr_clusters * nr_clusters)
+    min_positions, max_positions = first_gap.copy(), first_gap.copy()
+    full = (counts == pair_sizes.reshape(-1))
+    min_values[min_groups], max_values[max_groups] = tie_weights[min_ties], tie_weights[max_ties]
+    use_min = full[min_groups] | (tie_weights[min_ties] < 0)
+    use_max = full[max_groups] | (tie_weights[max_ties] > 0)
+    min_positions[min_groups[use_min]] = positions[min_ties[use_min]]
+    max_positions[max_groups[use_max]] = positions[max_ties[use_max]]
+    min_values[min_groups[~use_min]] = 0
+    max_values[max_groups[~use_max]] = 0
+
+    def dyad(group, position):
+        focal_cluster, alter_cluster = divmod(group, nr_clusters)
+        focal_rank, alter_rank = divmod(position, sizes[alter_cluster])
+        return (clusterdict[cl_names[focal_cluster]][focal_rank], clusterdict[cl_names[alter_cluster]][alter_rank])
+
+    def pair_dict(f, a):
+        group = f * nr_clusters + a
+        return {"weight": stats["weight"][f, a], "min": min_values[group], "max": max_values[group],
+                "std0": stats["std0"][f, a], "std1": stats["std1"][f, a],
+                "min_dyad": dyad(group, min_positions[group]), "max_dyad": dyad(group, max_positions[group])}
+
+    for f, a in itertools.combinations(range(nr_clusters), 2):
+        clustergraph.add_edges_from([(cl_names[f], cl_names[a], pair_dict(f, a))])
+        clustergraph.add_edges_from([(cl_names[a], cl_names[f], pair_dict(a, f))])
 
     return clustergraph # Use nx.convert_matrix.to_pandas_edgelist(clustergraph)
 
@@ -157,41 +269,71 @@ def louvain_cluster(graph):
     return [[k for k, v in clustering.items() if v == val] for val in list(set(clustering.values()))]
 
 
-def consensus_louvain(graph, iterations=4):
+def louvain_partition(graph, seed=None):
+    """Louvain partition of graph, {node: cluster}, with the given random seed. Used by worker processes."""
+    return best_partition(graph, random_state=seed)
+
+
+def consensus_louvain(graph, iterations=4, workers=1, seed=None):
+    """
+    Consensus clustering: Louvain clustering is run iterations times with different random seeds. Nodes
+    assigned to the same cluster in at least half of the runs are tied in a consensus graph, weighted by the
+    share of runs, which is then clustered again.
+
+    Parameters
+    ----------
+    graph: networkx graph
+    iterations: int
+        Number of Louvain runs
+    workers: int, optional
+        Number of worker processes for the runs. The default is 1, running them sequentially, since the
+        function is called for each cluster and level, and often within worker processes already.
+        None for one per run, up to the number of CPUs. To pass workers to functions taking a clustering
+        algorithm, use e.g. functools.partial(consensus_louvain, workers=4).
+    seed: int, optional
+        Seed to derive the seeds of the runs. If None, drawn from numpy's random state.
+
+    Returns
+    -------
+    list of lists of nodes
+    """
     if graph.is_directed():
         graph = make_symmetric(graph)
 
-    new_graph_list = []
+    nodes = list(graph.nodes)
+    index = {x: i for i, x in enumerate(nodes)}
+    n = len(nodes)
 
     # Run Clustering several times with different starting points
-    for i in range(0, iterations):
-        new_graph = nx.Graph()
-        new_graph.add_nodes_from(graph.nodes)
-        clustering = best_partition(graph, randomize=True)
-        clustering = [[k for k, v in clustering.items() if v == val] for val in list(set(clustering.values()))]
-        # Create ties for nodes that belong to the same cluster
-        for cluster in clustering:
-            pairs = itertools.combinations(cluster, r=2)
-            new_graph.add_edges_from(list(pairs))
-        new_graph_list.append(new_graph)
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=iterations).tolist()
+    if workers is None:
+        workers = min(iterations, os.cpu_count() or 1)
+    if workers > 1 and iterations > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            partitions = list(executor.map(louvain_partition, [graph] * iterations, seeds))
+    else:
+        partitions = [louvain_partition(graph, x) for x in seeds]
+
+    # Co-assignment counts of node pairs as sum of products of one-hot cluster matrices
+    # Only pairs that are in the same cluster in some run are created
+    coassignment = sp.sparse.csr_matrix((n, n))
+    for partition in partitions:
+        labels = np.zeros(n, dtype=np.int64)
+        labels[[index[x] for x in partition]] = list(partition.values())
+        one_hot = sp.sparse.csr_matrix((np.ones(n), (np.arange(n), labels)), shape=(n, labels.max(initial=0) + 1))
+        coassignment = coassignment + one_hot @ one_hot.T
+    coassignment = sp.sparse.triu(coassignment, k=1).tocoo()
 
     # Consensus clustering
+    # Normalize percentage and add if majority agrees on tie
+    weights = coassignment.data / iterations
+    majority = weights >= 0.5
     consensus_graph = nx.Graph()
-    consensus_graph.add_nodes_from(graph.nodes)
-    pairs = itertools.combinations(list(consensus_graph.nodes), r=2)
-    # Iterate over all pairs and add edges
-    for u, v in pairs:
-        weight = 0
-        # Add 1 for each tie in a cluster graph
-        for i, cluster_graph in enumerate(new_graph_list):
-            if cluster_graph.has_edge(u, v):
-                weight = weight + 1
-        # Normalize percentage
-        weight = weight / iterations
-        # Add if majority agrees on tie
-        if weight >= 0.5:
-            consensus_graph.add_edge(u, v, weight=weight)
-    del new_graph_list
+    consensus_graph.add_nodes_from(nodes)
+    consensus_graph.add_weighted_edges_from(
+        zip([nodes[x] for x in coassignment.row[majority]], [nodes[x] for x in coassignment.col[majority]],
+            weights[majority].tolist()))
+    del partitions
     # Now re-run clustering on consensus graph to get final clustering
     clustering = best_partition(consensus_graph)
     return [[k for k, v in clustering.items() if v == val] for val in list(set(clustering.values()))]
@@ -1,4 +1,3 @@
-import itertools
 from typing import Union
 
 import networkx as nx
@@ -6,6 +5,7 @@ import numpy as np
 import scipy as sp
 from tqdm import tqdm
 
+from text2network.classes.sparse_graph import sparse_graph, symmetric_weights
 from text2network.functions.rowvec_tools import cutoff_percentage
 
 
@@ -15,16 +15,18 @@ def make_reverse(graph):
 
     Parameters
     ----------
-    graph : networkx graph
+    graph : networkx graph or sparse_graph
         A directed, weighted graph.
 
     Returns
     -------
-    graph : networkx graph
+    graph : networkx graph or sparse_graph
         graph with modified edges.
 
     """
 
+    if isinstance(graph, sparse_graph):
+        return graph.reverse()
     if nx.is_directed(graph):
         return graph.reverse()
     else:
@@ -37,7 +39,7 @@ def make_symmetric(graph, technique="avg-sym"):
 
     Parameters
     ----------
-    graph : networkx graph
+    graph : networkx graph or sparse_graph
         A directed, weighted graph.
 
     technique : TYPE, optional
@@ -58,13 +60,16 @@ def make_symmetric(graph, technique="avg-sym"):
 
     Returns
     -------
-    graph : networkx graph
+    graph : networkx graph or sparse_graph
         graph with modified edges.
 
     """
     if technique is None:
         technique = "avg-sym"
 
+    if isinstance(graph, sparse_graph):
+        return graph.to_symmetric(technique)
+
     if technique == "transpose":
         M = nx.to_scipy_sparse_matrix(graph)
         nodes_list = list(graph.nodes)
@@ -72,68 +77,16 @@ def make_symmetric(graph, technique="avg-sym"):
         graph = nx.convert_matrix.from_scipy_sparse_matrix(M)
         mapping = dict(zip(range(0, len(nodes_list)), nodes_list))
         new_graph = nx.relabel_nodes(graph, mapping)
-    elif technique == "min-sym-avg":
-        new_graph = graph.to_undirected()
-        nodepairs = itertools.combinations(list(graph.nodes), r=2)
-        for u, v in nodepairs:
-            if graph.has_edge(u, v) and graph.has_edge(v, u):
-                avg_weight = (
-                                     graph.edges[u, v]['weight'] + graph.edges[v, u]['weight']) / 2
-                new_graph[u][v]['weight'] = avg_weight
-            else:
-                if graph.has_edge(u, v) or graph.has_edge(v, u):
-                    new_graph.remove_edge(u, v)
-    elif technique == "min-sym":
-        new_graph = graph.to_undirected()
-        nodepairs = itertools.combinations(list(graph.nodes), r=2)
-        for u, v in nodepairs:
-            if graph.has_edge(u, v) and graph.has_edge(v, u):
-                min_weight = min(
-                    graph.edges[u, v]['weight'], graph.edges[v, u]['weight'])
-                new_graph[u][v]['weight'] = min_weight
-            else:
-                if graph.has_edge(u, v) or graph.has_edge(v, u):
-                    new_graph.remove_edge(u, v)
-    elif technique == "max-sym":
-        new_graph = graph.to_undirected()
-        nodepairs = itertools.combinations(list(graph.nodes), r=2)
-        for u, v in nodepairs:
-            if graph.has_edge(u, v) and graph.has_edge(v, u):
-                max_weight = max(
-                    graph.edges[u, v]['weight'], graph.edges[v, u]['weight'])
-                new_graph[u][v]['weight'] = max_weight
-            else:
-                if graph.has_edge(u, v) or graph.has_edge(v, u):
-                    new_graph.remove_edge(u, v)
-    elif technique == "avg-sym":
-        new_graph = graph.to_undirected()
-        nodepairs = itertools.combinations(list(graph.nodes), r=2)
-        for u, v in nodepairs:
-            if graph.has_edge(u, v) or graph.has_edge(v, u):
-                wt = 0
-
-                if graph.has_edge(u, v):
-                    wt = wt + graph.edges[u, v]['weight']
-
-                if graph.has_edge(v, u):
-                    wt = wt + graph.edges[v, u]['weight']
-
-                wt = wt / 2
-                new_graph[u][v]['weight'] = wt
-    elif technique == "sum":
+    elif technique in ["min-sym-avg", "min-sym", "max-sym", "avg-sym", "sum"]:
+        # Edge attributes are retained as in to_undirected, only weights are set
         new_graph = graph.to_undirected()
-        nodepairs = itertools.combinations(list(graph.nodes), r=2)
-        for u, v in nodepairs:
-            if graph.has_edge(u, v) or graph.has_edge(v, u):
-                wt = 0
-
-                if graph.has_edge(u, v):
-                    wt = wt + graph.edges[u, v]['weight']
-
-                if graph.has_edge(v, u):
-                    wt = wt + graph.edges[v, u]['weight']
-
-                new_graph[u][v]['weight'] = wt
+        edges = [(u, v) for u, v in new_graph.edges if u != v]
+        weights = np.array([graph[u][v]['weight'] if graph.has_edge(u, v) else np.nan for u, v in edges])
+        reverse_weights = np.array([graph[v][u]['weight'] if graph.has_edge(v, u) else np.nan for u, v in edges])
+        weights, keep = symmetric_weights(weights, reverse_weights, technique)
+        for (u, v), wt in zip(edges, weights.tolist()):
+            new_graph[u][v]['weight'] = wt
+        new_graph.remove_edges_from([x for x, k in zip(edges, keep) if not k])
     else:
         raise AttributeError("Method parameter not recognized")
 
@@ -173,7 +126,7 @@ def merge_nodes(graph, u, v, method="sum"):
 
     return new_graph
 
-def inverse_weights(graph: Union[nx.DiGraph, nx.Graph], min: Union[float, int] = 0.00001):
+def inverse_weights(graph: Union[nx.DiGraph, nx.Graph, sparse_graph], min: Union[float, int] = 0.00001):
     """
 
     Returns w = 1/(w+min) for all ties
@@ -188,6 +141,10 @@ def inverse_weights(graph: Union[nx.DiGraph, nx.Graph], min: Union[float, int] =
     normed graph
     """
 
+    if isinstance(graph, sparse_graph):
+        graph.inverse_weights(min)
+        return graph
+
     for u, v, a in graph.edges(data=True):
 
         graph[u][v]['weight'] = 1 / (a['weight'] + min)
@@ -195,7 +152,7 @@ def inverse_weights(graph: Union[nx.DiGraph, nx.Graph], min: Union[float, int] =
     return graph
 
 
-def renorm_graph(graph: Union[nx.DiGraph, nx.Graph], norm: Union[float, int] = 1):
+def renorm_graph(graph: Union[nx.DiGraph, nx.Graph, sparse_graph], norm: Union[float, int] = 1):
     """
 
     Simply divides all ties in the graph by the given number
@@ -210,13 +167,17 @@ def renorm_graph(graph: Union[nx.DiGraph, nx.Graph], norm: Union[float, int] = 1
     normed graph
     """
 
+    if isinstance(graph, sparse_graph):
+        graph.renorm(norm)
+        return graph
+
     for u, v, a in graph.edges(data=True):
         graph[u][v]['weight'] = a['weight'] / norm
 
     return graph
 
 
-def sparsify_graph(graph: Union[nx.DiGraph, nx.Graph], percentage: int = 99):
+def sparsify_graph(graph: Union[nx.DiGraph, nx.Graph, sparse_graph], percentage: int = 99):
     """
     Sparsify graph as follows:
     For each node, keep *percentage* of aggregate tie weights of outgoing ties.
@@ -230,6 +191,10 @@ def sparsify_graph(graph: Union[nx.DiGraph, nx.Graph], percentage: int = 99):
     -------
     sparsified graph
     """
+    if isinstance(graph, sparse_graph):
+        graph.sparsify(percentage)
+        return graph
+
     for v in graph.nodes:
         peers = np.array([z[1] for z in graph.out_edges(v, data="weight")])
         weights = np.array([z[2] for z in graph.out_edges(v, data="weight")])
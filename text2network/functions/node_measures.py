@@ -2,6 +2,7 @@ import networkx as nx
 import logging
 import numpy as np
 
+from text2network.classes.sparse_graph import sparse_graph
 from text2network.functions.network_tools import inverse_weights, make_symmetric
 
 
@@ -11,7 +12,7 @@ def proximity(nw_graph, focal_tokens=None, alter_subset=None):
 
     Parameters
     ----------
-    nw_graph : networkx graph
+    nw_graph : networkx graph or sparse_graph
         semantic network to use.
     focal_tokens : list, str, optional
         List of tokens of interest. If not provided, proximity for all tokens will be returned.
@@ -25,6 +26,11 @@ def proximity(nw_graph, focal_tokens=None, alter_subset=None):
 
     """
 
+    if isinstance(nw_graph, sparse_graph):
+        if isinstance(alter_subset, int):
+            alter_subset = [alter_subset]
+        return {"proximity": nw_graph.proximities(focal_tokens=focal_tokens, alter_subset=alter_subset)}
+
     proximity_dict = {}
     if focal_tokens is None:
         focal_tokens=list(nw_graph.nodes)
@@ -113,6 +119,17 @@ def centrality(nw_graph, focal_tokens=None,  types=None):
 
 
 def compute_centrality(nw_graph, measure, focal_nodes=None):
+    if isinstance(nw_graph, sparse_graph):
+        if measure in ["PageRank", "normedPageRank", "local_clustering", "weighted_local_clustering"]:
+            centralities = compute_sparse_centrality(nw_graph, measure, focal_nodes)
+        elif measure in ["frequency", "freq", "frequencies"]:
+            values, mask = nw_graph.node_attributes.get('freq', (np.array([]), np.array([], dtype=bool)))
+            centralities = dict(zip(nw_graph.node_ids[mask].tolist(), values[mask].tolist()))
+        else:
+            logging.debug("Converting sparse graph to networkx to compute {}".format(measure))
+            centralities = compute_centrality(nw_graph.to_networkx(), measure, focal_nodes)
+        return centralities
+
     if measure == "PageRank":
         # PageRank centrality
         try:
@@ -180,3 +197,29 @@ def compute_centrality(nw_graph, measure, focal_nodes=None):
             "Centrality measure {} not found in list".format(measure))
 
     return centralities
+
+
+def compute_sparse_centrality(nw_graph, measure, focal_nodes=None):
+    """
+    Centralities computed on the matrix of a sparse_graph, with the same results as compute_centrality
+    """
+    if measure == "PageRank" or measure == "normedPageRank":
+        try:
+            centralities = nw_graph.pagerank()
+            logging.debug("Calculated {} PageRank centralities".format(len(centralities)))
+        except:
+            logging.error("Could not calculate Page Rank centralities")
+            raise
+        if measure == "normedPageRank":
+            centvec = np.array(list(centralities.values()))
+            centvec = (centvec / np.sum(centvec)) * len(centvec)
+            centralities = dict(zip(centralities.keys(), centvec))
+    elif measure == "local_clustering":
+        centralities = nw_graph.clustering(weighted=False, nodes=focal_nodes)
+    elif measure == "weighted_local_clustering":
+        centralities = nw_graph.clustering(weighted=True, nodes=focal_nodes)
+    else:
+        raise AttributeError(
+            "Centrality measure {} not found in list".format(measure))
+
+    return centralities
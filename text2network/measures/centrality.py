@@ -7,6 +7,7 @@ import numpy as np
 from text2network.functions.node_measures import centrality
 from text2network.utils.file_helpers import check_create_folder
 from text2network.utils.input_check import input_check
+from text2network.utils.year_pool import map_years
 
 
 def centralities(snw, focal_tokens=None, types=None) -> Dict:
@@ -67,7 +68,8 @@ def yearly_centralities(snw, year_list: list, focal_tokens: Optional[Union[list,
                         compositional: Optional[bool] = False, batch_size: Optional[int] = 10000,
                         reverse: Optional[bool] = False, normalization: Optional[str] = None,
                         prune_min_frequency: Optional[int] = None, moving_average:Optional[tuple] = None,
-                        path: Optional[bool] = None, return_sentiment: Optional[bool]=True,) -> Dict:
+                        path: Optional[bool] = None, return_sentiment: Optional[bool]=True,
+                        workers: Optional[int] = 1, sliding_window: Optional[bool] = False) -> Dict:
     """
     Compute directly year-by-year centralities for provided list.
 
@@ -139,6 +141,14 @@ def yearly_centralities(snw, year_list: list, focal_tokens: Optional[Union[list,
     return_sentiment: bool, optional
         Query sentiment and subjectivity for ties
 
+    workers: int, optional
+        Number of processes conditioning years in parallel, each with its own database connection.
+        None for the number of CPUs. The default is 1.
+
+    sliding_window: bool, optional
+        With moving_average, condition each year once and derive the windows by adding and subtracting years.
+        See semantic_network.condition_windows. Years are then processed in this process. The default is False.
+
     Returns
     -------
 
@@ -155,59 +165,91 @@ def yearly_centralities(snw, year_list: list, focal_tokens: Optional[Union[list,
     if not isinstance(year_list, list):
         raise AssertionError("Please provide list of years.")
 
-    for year in year_list:
-        snw.decondition()
-
-        if moving_average is not None:
-            start_year = max(year_list[0], year - moving_average[0])
-            end_year = min(year_list[-1], year + moving_average[1])
-            ma_years = list(np.arange(start_year, end_year + 1))
-            logging.info(
-                "Calculating proximities for fixed relevant clusters for year {} with moving average -{} to {} over {}".format(
-                    year,
-                    moving_average[
-                        0],
-                    moving_average[
-                        1], ma_years))
-        else:
-            ma_years = [year]
-        logging.info(
-            "Conditioning network on year {} with {} focal tokens and depth {}".format(ma_years, len(focal_tokens), depth))
-        starttime=timer()
-        snw.condition(tokens=focal_tokens, times=ma_years, depth=depth, context=context, weight_cutoff=weight_cutoff, max_degree=max_degree,prune_min_frequency=prune_min_frequency,
-                      batchsize=batch_size, return_sentiment=return_sentiment)
-        end = timer()
-        logging.info("Conditioning finishined after {} seconds".format(end - starttime))
-        if normalization == "sequences":
-            snw.norm_by_total_nr_sequences(times=ma_years)
-        elif normalization == "occurrences":
-            snw.norm_by_total_nr_occurrences(times=ma_years)
-        elif normalization is not None:
-            msg = "For yearly normalization, please either specify 'sequences' or 'occcurrences' or None"
-            logging.error(msg)
-            raise AttributeError(msg)
-        if reverse:
-            snw.to_reverse()
-        if compositional:
-            snw.to_compositional()
-        if symmetric:
-            snw.to_symmetric(technique=symmetric_method)
-        if "frequency" in types:
-            snw.add_frequencies(times=ma_years)
-        logging.debug("Computing centralities for year {}".format(ma_years))
-        cent_measures = snw.centralities(focal_tokens=focal_tokens, types=types)
+    measure_arguments = {'focal_tokens': focal_tokens, 'types': types, 'symmetric': symmetric,
+                         'symmetric_method': symmetric_method, 'compositional': compositional, 'reverse': reverse,
+                         'normalization': normalization, 'path': path}
+    if sliding_window and moving_average is not None:
+        yearly_results = ((year, _measure_centralities(snw, year, ma_years, **measure_arguments)) for year, ma_years in
+                          snw.condition_windows(year_list, moving_average, tokens=focal_tokens, depth=depth,
+                                                context=context, weight_cutoff=weight_cutoff, max_degree=max_degree,
+                                                prune_min_frequency=prune_min_frequency, batchsize=batch_size))
+    else:
+        yearly_results = map_years(snw, _year_centralities, year_list, workers=workers, year_list=year_list,
+                                   depth=depth, context=context, weight_cutoff=weight_cutoff, max_degree=max_degree,
+                                   batch_size=batch_size, prune_min_frequency=prune_min_frequency,
+                                   moving_average=moving_average, return_sentiment=return_sentiment,
+                                   **measure_arguments)
+    for year, cent_measures in yearly_results:
         cent_year.update({year: cent_measures})
 
         try:
             if path is not None:
-                logging.info("Saving graph for year {} to {}".format(year, path))
-                snw.export_gefx(path=path)
-
                 cent_df = snw.pd_format({'yearly_centrality': cent_year})[0]
                 ff=path+"/temp_df.xlsx"
                 cent_df.to_excel(ff, merge_cells=False)
                 logging.info("Saved temp DF to {}".format(ff))
         except:
-            logging.error("Failed to save graph for year {} \n as  {] \n Continuing analysis...".format(year, path))
+            logging.error("Failed to save graph for year {} \n as  {} \n Continuing analysis...".format(year, path))
 
     return {'yearly_centrality': cent_year}
+
+
+def _year_centralities(snw, year, year_list, focal_tokens, types, depth, context, weight_cutoff, max_degree,
+                       symmetric, symmetric_method, compositional, batch_size, reverse, normalization,
+                       prune_min_frequency, moving_average, path, return_sentiment) -> Dict:
+    """Conditions the network for one year of yearly_centralities and returns the centralities"""
+    if moving_average is not None:
+        start_year = max(year_list[0], year - moving_average[0])
+        end_year = min(year_list[-1], year + moving_average[1])
+        ma_years = list(np.arange(start_year, end_year + 1))
+        logging.info(
+            "Calculating proximities for fixed relevant clusters for year {} with moving average -{} to {} over {}".format(
+                year,
+                moving_average[
+                    0],
+                moving_average[
+                    1], ma_years))
+    else:
+        ma_years = [year]
+    logging.info(
+        "Conditioning network on year {} with {} focal tokens and depth {}".format(ma_years, len(focal_tokens), depth))
+    starttime=timer()
+    snw.condition(tokens=focal_tokens, times=ma_years, depth=depth, context=context, weight_cutoff=weight_cutoff, max_degree=max_degree,prune_min_frequency=prune_min_frequency,
+                  batchsize=batch_size, return_sentiment=return_sentiment)
+    end = timer()
+    logging.info("Conditioning finishined after {} seconds".format(end - starttime))
+    return _measure_centralities(snw, year, ma_years, focal_tokens=focal_tokens, types=types, symmetric=symmetric,
+                                 symmetric_method=symmetric_method, compositional=compositional, reverse=reverse,
+                                 normalization=normalization, path=path)
+
+
+def _measure_centralities(snw, year, ma_years, focal_tokens, types, symmetric, symmetric_method, compositional,
+                          reverse, normalization, path) -> Dict:
+    """Transforms the network conditioned on ma_years and returns the centralities"""
+    if normalization == "sequences":
+        snw.norm_by_total_nr_sequences(times=ma_years)
+    elif normalization == "occurrences":
+        snw.norm_by_total_nr_occurrences(times=ma_years)
+    elif normalization is not None:
+        msg = "For yearly normalization, please either specify 'sequences' or 'occcurrences' or None"
+        logging.error(msg)
+        raise AttributeError(msg)
+    if reverse:
+        snw.to_reverse()
+    if compositional:
+        snw.to_compositional()
+    if symmetric:
+        snw.to_symmetric(technique=symmetric_method)
+    if "frequency" in types:
+        snw.add_frequencies(times=ma_years)
+    logging.debug("Computing centralities for year {}".format(ma_years))
+    cent_measures = snw.centralities(focal_tokens=focal_tokens, types=types)
+
+    try:
+        if path is not None:
+            logging.info("Saving graph for year {} to {}".format(year, path))
+            snw.export_gefx(path=path)
+    except:
+        logging.error("Failed to save graph for year {} \n as  {} \n Continuing analysis...".format(year, path))
+
+    return cent_measures
@@ -116,8 +116,7 @@ def context_per_pos(snw: neo4j_network, focal_occurrences: Optional[Union[list,
 
     if pos_list is None:
         logging.info("Getting POS in Database")
-        res = snw.db.receive_query("MATCH (n:part_of_speech) RETURN DISTINCT n.part_of_speech as pos")
-        pos_list = [x['pos'] for x in res if x['pos'] != '.']
+        pos_list = [x for x in snw.db.query_parts_of_speech() if x != '.']
 
     if tfidf is False or tfidf is None:
         tf_list = ["weight"]
@@ -395,7 +394,7 @@ def context_cluster_all_pos(snw: neo4j_network, focal_substitutes: Union[list, s
         freq_df = freq_df.set_index(freq_df.token)
 
 
-        snwarr=nx.to_numpy_array(snw.graph).reshape(-1)
+        snwarr=nx.to_numpy_array(snw.get_networkx_graph()).reshape(-1)
         logging.info("{} of {} ties are nonzero ({} percent)".format(len(np.where(snwarr > 0)[0]),len(snwarr),100*len(np.where(snwarr > 0)[0])/len(snwarr)))
         clusters = snw.cluster(levels=level, interest_list=interest_list, algorithm=algorithm, to_measure=[proximity, centrality])
 
@@ -8,6 +8,7 @@ from scipy.spatial.distance import squareform, pdist
 from tqdm import tqdm
 
 from text2network.classes.neo4jnw import neo4j_network
+from text2network.utils.year_pool import map_years
 
 
 def extract_temporal_cosine_similarity(snw: neo4j_network, tokens: Union[list, str, int], depth: int = 0,
@@ -90,7 +91,8 @@ def extract_temporal_adjacency_matrices(snw: neo4j_network, tokens: Union[list,
                                         reverse: Optional[bool] = False, compositional: Optional[bool] = False,
                                         times: Optional[Union[list, int]] = None,
                                         symmetric_method: Optional[str] = None,
-                                        prune_min_frequency: Optional[int] = None) -> dict:
+                                        prune_min_frequency: Optional[int] = None,
+                                        workers: Optional[int] = 1) -> dict:
     """
 
     Extracts a network formed by the words in the tokens parameter for each time point (optionally given by times).
@@ -122,6 +124,10 @@ def extract_temporal_adjacency_matrices(snw: neo4j_network, tokens: Union[list,
     prune_min_frequency : int, optional
         Will remove nodes entirely which occur less than  prune_min_frequency+1 times
 
+    workers: int, optional
+        Number of processes conditioning years in parallel, each with its own database connection.
+        None for the number of CPUs. The default is 1.
+
     Returns
     -------
 
@@ -136,38 +142,45 @@ def extract_temporal_adjacency_matrices(snw: neo4j_network, tokens: Union[list,
 
     mat_dict = {}
 
-    pbar = tqdm(year_list, desc="Exctracting years")
-    for year in tqdm(year_list, desc="Extracting years"):
-        pbar.desc = "Extracting year: {}".format(year)
-        snw.decondition()
-        snw.condition(tokens=tokens, keep_only_tokens=True, times=year, batchsize=5000,
-                      prune_min_frequency=None)
+    for year, mat in tqdm(map_years(snw, _year_adjacency_matrix, year_list, workers=workers, tokens=tokens,
+                                    symmetric=symmetric, reverse=reverse, compositional=compositional,
+                                    symmetric_method=symmetric_method), total=len(year_list),
+                          desc="Extracting years"):
+        # Not all tokens will be in the network due to pruning. Keep tokens that are in all years so far.
+        tokens = [x for x in tokens if x in mat.columns]
+        mat_dict[year] = mat.loc[tokens, tokens].copy()
+
+    return mat_dict
 
-        if reverse:
-            snw.to_reverse()
-        if compositional:
-            snw.to_compositional(times=year)
-        if symmetric:
-            snw.to_symmetric(technique=symmetric_method)
 
+def _year_adjacency_matrix(snw: neo4j_network, year, tokens, symmetric, reverse, compositional,
+                           symmetric_method) -> pd.DataFrame:
+    """Conditions the network on tokens for one year and returns the adjacency matrix of tokens in the network"""
+    snw.condition(tokens=tokens, keep_only_tokens=True, times=year, batchsize=5000,
+                  prune_min_frequency=None)
 
-        # Not all tokens will be in the network due to pruning
-        tokens=np.array(tokens)[np.in1d(tokens, snw.ensure_tokens(list(snw.graph.nodes)))].tolist()
+    if reverse:
+        snw.to_reverse()
+    if compositional:
+        snw.to_compositional(times=year)
+    if symmetric:
+        snw.to_symmetric(technique=symmetric_method)
 
-        mat = nx.to_pandas_adjacency(snw.graph, nodelist=snw.ensure_ids(tokens))
-        rows = snw.ensure_tokens(list(mat.columns))
-        mat.columns = rows
-        mat = mat.set_axis(rows, axis='index')
-        mat_dict[year] = mat.copy()
+    # Not all tokens will be in the network due to pruning
+    tokens=np.array(tokens)[np.in1d(tokens, snw.ensure_tokens(list(snw.graph.nodes)))].tolist()
 
-    return mat_dict
+    mat = nx.to_pandas_adjacency(snw.get_networkx_graph(), nodelist=snw.ensure_ids(tokens))
+    rows = snw.ensure_tokens(list(mat.columns))
+    mat.columns = rows
+    mat = mat.set_axis(rows, axis='index')
+    return mat
 
 
 def extract_yearly_networks(snw: neo4j_network, folder: str, symmetric: Optional[bool] = False,
                             reverse_ties: Optional[bool] = False, compositional: Optional[bool] = False,
                             max_degree: Optional[int] = None, times: Optional[Union[list, int]] = None,
                             symmetric_method: Optional[str] = None,
-                            prune_min_frequency: Optional[int] = None):
+                            prune_min_frequency: Optional[int] = None, workers: Optional[int] = 1):
     """
 
     Conditions, for each year, a network. By default with ties giving the aggregate probability of substitute -> occurrence relations.
@@ -199,6 +212,10 @@ def extract_yearly_networks(snw: neo4j_network, folder: str, symmetric: Optional
     prune_min_frequency : int, optional
         Will remove nodes entirely which occur less than  prune_min_frequency+1 times
 
+    workers: int, optional
+        Number of processes conditioning years in parallel, each with its own database connection.
+        None for the number of CPUs. The default is 1.
+
 
     Returns
     -------
@@ -212,21 +229,12 @@ def extract_yearly_networks(snw: neo4j_network, folder: str, symmetric: Optional
         year_list = snw.get_times_list()
         year_list.append(None)
 
-    pbar = tqdm(year_list, desc="Exctracting years")
-    for year in tqdm(year_list, desc="Extracting years"):
-        pbar.desc = "Extracting year: {}".format(year)
-        snw.decondition()
-        snw.condition(times=year, max_degree=max_degree, batchsize=5000, prune_min_frequency=prune_min_frequency)
-
-        if reverse_ties:
-            snw.to_reverse()
-        if compositional:
-            snw.to_compositional(times=year)
-        if symmetric:
-            snw.to_symmetric(technique=symmetric_method)
-
-        snw.export_gefx(path=folder)
-        snw.export_edgelist(path=folder)
+    for year, _ in tqdm(map_years(snw, _export_year_network, year_list, workers=workers, folder=folder,
+                                  ego_token=None, depth=None, symmetric=symmetric, reverse_ties=reverse_ties,
+                                  compositional=compositional, max_degree=max_degree,
+                                  symmetric_method=symmetric_method, prune_min_frequency=prune_min_frequency),
+                        total=len(year_list), desc="Extracting years"):
+        pass
 
 
 def extract_yearly_ego_networks(snw: neo4j_network, folder: str, ego_token: Union[list, int, str],
@@ -234,7 +242,7 @@ def extract_yearly_ego_networks(snw: neo4j_network, folder: str, ego_token: Unio
                                 reverse_ties: Optional[bool] = False, compositional: Optional[bool] = False,
                                 max_degree: Optional[int] = None, times: Optional[Union[list, int]] = None,
                                 symmetric_method: Optional[str] = None,
-                                prune_min_frequency: Optional[int] = None):
+                                prune_min_frequency: Optional[int] = None, workers: Optional[int] = 1):
     """
 
     Conditions, for each year, an ego network. By default with ties giving the aggregate probability of substitute -> occurrence relations.
@@ -269,6 +277,10 @@ def extract_yearly_ego_networks(snw: neo4j_network, folder: str, ego_token: Unio
     prune_min_frequency : int, optional
         Will remove nodes entirely which occur less than  prune_min_frequency+1 times
 
+    workers: int, optional
+        Number of processes conditioning years in parallel, each with its own database connection.
+        None for the number of CPUs. The default is 1.
+
 
     Returns
     -------
@@ -282,19 +294,26 @@ def extract_yearly_ego_networks(snw: neo4j_network, folder: str, ego_token: Unio
         year_list = snw.get_times_list()
         year_list.append(None)
 
-    pbar = tqdm(year_list, desc="Extracting years")
-    for year in tqdm(year_list, desc="Extracting years"):
-        pbar.desc = "Extracting ego network year: {}".format(year)
-        snw.decondition()
-        snw.condition(times=year, tokens=ego_token, depth=1, max_degree=max_degree, batchsize=5000,
-                      prune_min_frequency=prune_min_frequency)
-
-        if reverse_ties:
-            snw.to_reverse()
-        if compositional:
-            snw.to_compositional(times=year)
-        if symmetric:
-            snw.to_symmetric(technique=symmetric_method)
-
-        snw.export_gefx(path=folder)
-        snw.export_edgelist(path=folder)
+    for year, _ in tqdm(map_years(snw, _export_year_network, year_list, workers=workers, folder=folder,
+                                  ego_token=ego_token, depth=1, symmetric=symmetric, reverse_ties=reverse_ties,
+                                  compositional=compositional, max_degree=max_degree,
+                                  symmetric_method=symmetric_method, prune_min_frequency=prune_min_frequency),
+                        total=len(year_list), desc="Extracting ego network years"):
+        pass
+
+
+def _export_year_network(snw: neo4j_network, year, folder, ego_token, depth, symmetric, reverse_ties,
+                         compositional, max_degree, symmetric_method, prune_min_frequency):
+    """Conditions the (ego) network for one year and exports it as gexf and edge-list"""
+    snw.condition(times=year, tokens=ego_token, depth=depth, max_degree=max_degree, batchsize=5000,
+                  prune_min_frequency=prune_min_frequency)
+
+    if reverse_ties:
+        snw.to_reverse()
+    if compositional:
+        snw.to_compositional(times=year)
+    if symmetric:
+        snw.to_symmetric(technique=symmetric_method)
+
+    snw.export_gefx(path=folder)
+    snw.export_edgelist(path=folder)
@@ -35,7 +35,7 @@ def average_cluster_proximities(focal_token: str, nw, levels: int,
                                 add_focal_to_clusters: Optional[bool] = False,
                                 mode: Optional[str] = "replacement", occurrence: Optional[bool] = False,
                                 batchsize: Optional[int] = 1000,
-                                seed: Optional[int] = None) -> pd.DataFrame:
+                                seed: Optional[int] = None, sliding_window: Optional[bool] = False) -> pd.DataFrame:
     """
     First, derives clusters from overall network (across all years), then creates year-by-year average proximities for these clusters
 
@@ -61,6 +61,9 @@ def average_cluster_proximities(focal_token: str, nw, levels: int,
         Calculate reverse proximities, note this needs to query the entire graph for each year.
     seed : int
         numpy random seed (e.g. for clustering)
+    sliding_window: bool
+        With moving_average, condition each year once and derive the windows by adding and subtracting years.
+        See semantic_network.condition_windows. Not used in context mode. Default is False.
     algorithm: callable
         Clustering algorithm (consensus_louvain by default)
     include_all_levels: bool
@@ -250,41 +253,24 @@ def average_cluster_proximities(focal_token: str, nw, levels: int,
         pickle.dump(cluster_dict, open(filename + "_CLdict.p", "wb"))
 
     if year_by_year:
-        for year in times:
-            nw.decondition()
-
-            if moving_average is not None:
-                start_year = max(times[0], year - moving_average[0])
-                end_year = min(times[-1], year + moving_average[1])
-                ma_years = list(np.arange(start_year, end_year + 1))
-                logging.info(
-                    "Calculating proximities for fixed relevant clusters for year {} with moving average -{} to {} over {}".format(
-                        year,
-                        moving_average[
-                            0],
-                        moving_average[
-                            1], ma_years))
-            else:
-                ma_years = [year]
-
-            if mode == "context":
-                nw.context_condition(tokens=focal_token, times=ma_years, depth=depth, weight_cutoff=weight_cutoff,
-                                     occurrence=occurrence, max_degree=max_degree)
-
-            else:
-
-
-                # Previously: Just find tokens
-                #nw.condition(tokens=focal_token, depth=depth, times=ma_years, weight_cutoff=weight_cutoff,
-                #             context=context, compositional=compositional, max_degree=max_degree, batchsize=batchsize)
-                # Fix: Try to condition specifically on tokens under consideration
-                check_tokens = all_tokens
-                if not isinstance(focal_token, list):
-                    check_tokens.append(focal_token)
-                else:
-                    check_tokens = check_tokens + focal_token
-                nw.condition(tokens=check_tokens, keep_only_tokens=True, depth=depth, times=ma_years, weight_cutoff=weight_cutoff,
-                             context=context, compositional=compositional, max_degree=None, batchsize=batchsize)
+        # Fix: Try to condition specifically on tokens under consideration
+        check_tokens = all_tokens
+        if not isinstance(focal_token, list):
+            check_tokens.append(focal_token)
+        else:
+            check_tokens = check_tokens + focal_token
+        if sliding_window and moving_average is not None and mode != "context":
+            yearly_windows = nw.condition_windows(list(times), moving_average, tokens=check_tokens,
+                                                  keep_only_tokens=True, depth=depth, weight_cutoff=weight_cutoff,
+                                                  context=context, compositional=compositional, max_degree=None,
+                                                  batchsize=batchsize)
+        else:
+            yearly_windows = _condition_yearly_windows(nw, times, moving_average, focal_token=focal_token,
+                                                       check_tokens=check_tokens, depth=depth,
+                                                       weight_cutoff=weight_cutoff, context=context,
+                                                       compositional=compositional, mode=mode, occurrence=occurrence,
+                                                       max_degree=max_degree, batchsize=batchsize)
+        for year, ma_years in yearly_windows:
             if to_back_out:
                 nw.to_backout()
             if symmetric:
@@ -369,6 +355,39 @@ def average_cluster_proximities(focal_token: str, nw, levels: int,
     return df
 
 
+def _condition_yearly_windows(nw, times, moving_average, focal_token, check_tokens, depth, weight_cutoff, context,
+                              compositional, mode, occurrence, max_degree, batchsize):
+    """Conditions the network on the window of each year of average_cluster_proximities, yielding (year, window)"""
+    for year in times:
+        nw.decondition()
+
+        if moving_average is not None:
+            start_year = max(times[0], year - moving_average[0])
+            end_year = min(times[-1], year + moving_average[1])
+            ma_years = list(np.arange(start_year, end_year + 1))
+            logging.info(
+                "Calculating proximities for fixed relevant clusters for year {} with moving average -{} to {} over {}".format(
+                    year,
+                    moving_average[
+                        0],
+                    moving_average[
+                        1], ma_years))
+        else:
+            ma_years = [year]
+
+        if mode == "context":
+            nw.context_condition(tokens=focal_token, times=ma_years, depth=depth, weight_cutoff=weight_cutoff,
+                                 occurrence=occurrence, max_degree=max_degree)
+
+        else:
+            # Previously: Just find tokens
+            #nw.condition(tokens=focal_token, depth=depth, times=ma_years, weight_cutoff=weight_cutoff,
+            #             context=context, compositional=compositional, max_degree=max_degree, batchsize=batchsize)
+            nw.condition(tokens=check_tokens, keep_only_tokens=True, depth=depth, times=ma_years, weight_cutoff=weight_cutoff,
+                         context=context, compositional=compositional, max_degree=None, batchsize=batchsize)
+        yield year, ma_years
+
+
 def extract_all_clusters(level: int, cutoff: float, focal_token: str,
                          snw, depth: Optional[int] = None, context: Optional[list] = None,
                          cluster_cutoff: Optional[float] = 0,
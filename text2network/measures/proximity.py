@@ -5,6 +5,7 @@ import numpy as np
 
 from text2network.functions.node_measures import proximity
 from text2network.utils.input_check import input_check
+from text2network.utils.year_pool import map_years
 
 
 def get_top_100(semantic_network, focal_tokens: Optional[Union[list,str,int]] = None, times: Optional[list] = None,
@@ -91,7 +92,8 @@ def yearly_proximities(snw, year_list: Union[list, int], focal_tokens: Optional[
                        moving_average: Optional[tuple] = None, symmetric: Optional[bool] = False,
                        compositional: Optional[bool] = False,
                        reverse: Optional[bool] = False, normalization: Optional[str] = None,
-                       symmetric_method: Optional[str] = None, prune_min_frequency: Optional[int] = None):
+                       symmetric_method: Optional[str] = None, prune_min_frequency: Optional[int] = None,
+                       workers: Optional[int] = 1, sliding_window: Optional[bool] = False):
     """
     Compute directly year-by-year centralities for provided list.
 
@@ -143,6 +145,14 @@ def yearly_proximities(snw, year_list: Union[list, int], focal_tokens: Optional[
     reverse: bool, optional
         Reverse ties. See semantic_network.to_reverse()
 
+    workers: int, optional
+        Number of processes conditioning years in parallel, each with its own database connection.
+        None for the number of CPUs. The default is 1.
+
+    sliding_window: bool, optional
+        With moving_average, condition each year once and derive the windows by adding and subtracting years.
+        See semantic_network.condition_windows. Years are then processed in this process. The default is False.
+
     Returns
     -------
 
@@ -170,46 +180,72 @@ def yearly_proximities(snw, year_list: Union[list, int], focal_tokens: Optional[
         # Set depth=0 to only get this network
         depth = 0
 
-    for year in year_list:
-        snw.decondition()
-        logging.info("Conditioning network on year {} with {} focal tokens".format(year, len(focal_tokens)))
-
-        if moving_average is not None:
-            start_year = max(year_list[0], year - moving_average[0])
-            end_year = min(year_list[-1], year + moving_average[1])
-            ma_years = np.arange(start_year, end_year + 1)
-            logging.info(
-                "Calculating proximities for fixed relevant clusters for year {} with moving average -{} to {} over {}".format(
-                    year,
-                    moving_average[
-                        0],
-                    moving_average[
-                        1], ma_years))
-        else:
-            ma_years = year
-
-        snw.condition(tokens=focal_tokens, times=ma_years, depth=depth, context=context, weight_cutoff=weight_cutoff,
-                      max_degree=max_degree, prune_min_frequency=prune_min_frequency)
-        if normalization == "sequences":
-            snw.norm_by_total_nr_sequences(times=ma_years)
-        elif normalization == "occurrences":
-            snw.norm_by_total_nr_occurrences(times=ma_years)
-        elif normalization is not None:
-            msg = "For yearly normalization, please either specify 'sequences' or 'occcurrences' or None"
-            logging.error(msg)
-            raise AttributeError(msg)
-        if reverse:
-            snw.to_reverse()
-        if compositional:
-            snw.to_compositional()
-        if symmetric:
-            snw.to_symmetric(technique=symmetric_method)
-        logging.debug("Computing proximities for year {}".format(year))
-        proximity_dict = {}
-        # Get proximities from conditioned network
-        tie_dict = snw.proximities(focal_tokens=orig_focal_tokens, alter_subset=alter_subset)
-        logging.info(
-            "Identified {} proximate tokens for year {}".format(len(list(tie_dict['proximity'].values())[0]), year))
+    measure_arguments = {'orig_focal_tokens': orig_focal_tokens, 'alter_subset': alter_subset,
+                         'symmetric': symmetric, 'compositional': compositional, 'reverse': reverse,
+                         'normalization': normalization, 'symmetric_method': symmetric_method}
+    if sliding_window and moving_average is not None:
+        yearly_results = ((year, _measure_proximities(snw, year, ma_years, **measure_arguments)) for year, ma_years in
+                          snw.condition_windows(year_list, moving_average, tokens=focal_tokens, depth=depth,
+                                                context=context, weight_cutoff=weight_cutoff, max_degree=max_degree,
+                                                prune_min_frequency=prune_min_frequency))
+    else:
+        yearly_results = map_years(snw, _year_proximities, year_list, workers=workers, year_list=year_list,
+                                   focal_tokens=focal_tokens, depth=depth, max_degree=max_degree, context=context,
+                                   weight_cutoff=weight_cutoff, moving_average=moving_average,
+                                   prune_min_frequency=prune_min_frequency, **measure_arguments)
+    for year, tie_dict in yearly_results:
         cent_year.update({year: tie_dict})
 
     return {'yearly_proximity': cent_year}
+
+
+def _year_proximities(snw, year, year_list, focal_tokens, orig_focal_tokens, alter_subset, depth, max_degree,
+                      context, weight_cutoff, moving_average, symmetric, compositional, reverse, normalization,
+                      symmetric_method, prune_min_frequency) -> Dict:
+    """Conditions the network for one year of yearly_proximities and returns the proximities"""
+    logging.info("Conditioning network on year {} with {} focal tokens".format(year, len(focal_tokens)))
+
+    if moving_average is not None:
+        start_year = max(year_list[0], year - moving_average[0])
+        end_year = min(year_list[-1], year + moving_average[1])
+        ma_years = np.arange(start_year, end_year + 1)
+        logging.info(
+            "Calculating proximities for fixed relevant clusters for year {} with moving average -{} to {} over {}".format(
+                year,
+                moving_average[
+                    0],
+                moving_average[
+                    1], ma_years))
+    else:
+        ma_years = year
+
+    snw.condition(tokens=focal_tokens, times=ma_years, depth=depth, context=context, weight_cutoff=weight_cutoff,
+                  max_degree=max_degree, prune_min_frequency=prune_min_frequency)
+    return _measure_proximities(snw, year, ma_years, orig_focal_tokens=orig_focal_tokens, alter_subset=alter_subset,
+                                symmetric=symmetric, compositional=compositional, reverse=reverse,
+                                normalization=normalization, symmetric_method=symmetric_method)
+
+
+def _measure_proximities(snw, year, ma_years, orig_focal_tokens, alter_subset, symmetric, compositional, reverse,
+                         normalization, symmetric_method) -> Dict:
+    """Transforms the network conditioned on ma_years and returns the proximities"""
+    if normalization == "sequences":
+        snw.norm_by_total_nr_sequences(times=ma_years)
+    elif normalization == "occurrences":
+        snw.norm_by_total_nr_occurrences(times=ma_years)
+    elif normalization is not None:
+        msg = "For yearly normalization, please either specify 'sequences' or 'occcurrences' or None"
+        logging.error(msg)
+        raise AttributeError(msg)
+    if reverse:
+        snw.to_reverse()
+    if compositional:
+        snw.to_compositional()
+    if symmetric:
+        snw.to_symmetric(technique=symmetric_method)
+    logging.debug("Computing proximities for year {}".format(year))
+    # Get proximities from conditioned network
+    tie_dict = snw.proximities(focal_tokens=orig_focal_tokens, alter_subset=alter_subset)
+    logging.info(
+        "Identified {} proximate tokens for year {}".format(len(list(tie_dict['proximity'].values())[0]), year))
+    return tie_dict
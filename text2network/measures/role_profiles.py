@@ -75,8 +75,7 @@ def create_YOY_role_profile(snw: neo4j_network, focal_token: Union[str, int], ro
 
     if pos_list is None:
         logging.info("Getting POS in Database")
-        res = snw.db.receive_query("MATCH (n:part_of_speech) RETURN DISTINCT n.part_of_speech as pos")
-        pos_list = [x['pos'] for x in res if x['pos'] != '.']
+        pos_list = [x for x in snw.db.query_parts_of_speech() if x != '.']
 
     df_list = []
     for year in tqdm(times, desc="Getting yearly profiles for {}".format(cluster_name)):
@@ -1,7 +1,7 @@
+import gzip
 import json
 import logging
 import os
-import pickle
 import re
 import unicodedata
 
@@ -11,6 +11,29 @@ from tqdm import tqdm
 
 from text2network.utils.file_helpers import check_create_folder
 from text2network.utils.logging_helpers import log, setup_logger
+from text2network.utils.process_pool import map_ordered
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    pyarrow_available = True
+    PARQUET_SCHEMA = pa.schema(
+        [
+            ("filename", pa.string()),
+            ("year", pa.string()),
+            ("parameters", pa.list_(pa.string())),
+            ("sentence", pa.string()),
+            ("index", pa.int64()),
+            ("year_index", pa.int64()),
+            ("file_index", pa.int64()),
+        ]
+    )
+except ImportError:
+    pa = None
+    pq = None
+    pyarrow_available = False
+    PARQUET_SCHEMA = None
 
 logger = logging.getLogger("t2n")
 
@@ -25,6 +48,8 @@ class TextPreprocessor:
         input_folder=None,
         output_folder=None,
         max_json_length=1000000,
+        workers=1,
+        output_format="json",
     ):
         self.maximum_sequence_length = maximum_sequence_length
         self.split_symbol = split_symbol
@@ -33,6 +58,8 @@ class TextPreprocessor:
         self.folder = input_folder
         self.output_folder = output_folder
         self.max_json_length = max_json_length
+        self.workers = workers
+        self.output_format = output_format
 
     def _split_sentence(self, sentence):
         if len(sentence) <= self.maximum_sequence_length:
@@ -72,6 +99,15 @@ class TextPreprocessor:
         text = self._remove_numerics(text)
         return text
 
+    def _preprocess_file(self, file_path):
+        """Reads and cleans a text file and returns its sentences, split to the maximum sequence length"""
+        with open(file_path, "r", encoding="utf-8") as f:
+            content = f.read()
+
+        processed_content = self._preprocess(content)
+        sentences = sent_tokenize(processed_content)
+        return [split_sentence for sentence in sentences for split_sentence in self._split_sentence(sentence)]
+
     @log()
     def preprocess(self, folder=None, output_folder=None):
         if not folder:
@@ -81,79 +117,121 @@ class TextPreprocessor:
         assert folder, "No folder specified"
         assert output_folder, "No output folder specified"
 
-        total_index = 0
-        for subdir, dirs, files in tqdm(os.walk(folder)):
-            year = os.path.basename(subdir)
-            processed_sentences = []
-            year_index = 0
-            json_length_counter = 0
-            json_file_counter = 1
+        # Files are processed in parallel, but sentences are numbered and written in the order of the walk
+        years = [(os.path.basename(subdir), subdir, [file for file in files if file.endswith(".txt")])
+                 for subdir, dirs, files in os.walk(folder)]
+        file_paths = (os.path.join(subdir, file) for year, subdir, files in years for file in files)
+        results = map_ordered(self._preprocess_file, file_paths, workers=self.workers)
 
+        try:
+            self._write_years(years, results, output_folder, folder)
+        finally:
+            results.close()
+
+    def _write_years(self, years, results, output_folder, folder):
+        total_index = 0
+        for year, subdir, files in tqdm(years):
             logger.debug(f"Processing year {year}")
+            writer = ShardWriter(os.path.join(output_folder, f"{year}/"), self.output_format, self.max_json_length)
+            year_index = 0
             for file in tqdm(files, desc="Iterating files in {} ".format(folder), leave=False):
                 logger.debug(f"Processing file {file}")
                 file_index = 0
-                if file.endswith(".txt"):
-                    file_path = os.path.join(subdir, file)
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-
-                    processed_content = self._preprocess(content)
-                    sentences = sent_tokenize(processed_content)
-
-                    for sentence in sentences:
-                        split_sentences = self._split_sentence(sentence)
-                        for split_sentence in split_sentences:
-                            metadata = {
-                                "filename": file,
-                                "year": year,
-                                "parameters": file.split(".txt")[0].split(self.split_symbol),
-                                "sentence": split_sentence,
-                                "index": total_index,
-                                "year_index": year_index,
-                                "file_index": file_index,
-                            }
-                            processed_sentences.append(metadata)
-                            total_index += 1
-                            year_index += 1
-                            file_index += 1
-                            json_length_counter += 1
-
-                            # Save the sentences in batches
-                            if json_length_counter >= self.max_json_length:
-                                output_file = os.path.join(output_folder, f"{year}/")
-                                output_file = check_create_folder(output_file, create_folder=True)
-                                output_file = os.path.join(output_file, f"{json_file_counter}.json")
-                                logger.debug(
-                                    f"Json length: {json_length_counter} reached, saving file to disk in {output_file}"
-                                )
-                                with open(output_file, "w", encoding="utf-8") as f:
-                                    json.dump(
-                                        processed_sentences,
-                                        f,
-                                        ensure_ascii=False,
-                                        indent=4,
-                                    )
-                                processed_sentences = []
-                                json_length_counter = 0
-                                json_file_counter += 1
-
-            # Save the last sentences
-            if len(processed_sentences) > 0:
-                output_file = os.path.join(output_folder, f"{year}/")
-                output_file = check_create_folder(output_file, create_folder=True)
-                output_file = os.path.join(output_file, f"{json_file_counter}.json")
-                logger.debug(
-                    f"Sentences remaining: {len(processed_sentences)}. Saving to disk in {output_file}"
-                )
-                with open(output_file, "w", encoding="utf-8") as f:
-                    json.dump(processed_sentences, f, ensure_ascii=False, indent=4)
+                for split_sentence in next(results):
+                    writer.write(
+                        {
+                            "filename": file,
+                            "year": year,
+                            "parameters": file.split(".txt")[0].split(self.split_symbol),
+                            "sentence": split_sentence,
+                            "index": total_index,
+                            "year_index": year_index,
+                            "file_index": file_index,
+                        }
+                    )
+                    total_index += 1
+                    year_index += 1
+                    file_index += 1
+            writer.close()
 
             # Create Metadata
-            metadata = {"year": year, "len_year": year_index, "json_files": json_file_counter}
-            # Pickle metadata
             if year_index > 0:
-                output_file = os.path.join(output_folder, f"{year}/metadata.pkl")
-                output_file = check_create_folder(output_file, create_folder=True)
-                with open(output_file, "wb") as f:
-                    pickle.dump(metadata, f)
+                writer.write_manifest({"year": year, "len_year": year_index})
+
+
+class ShardWriter:
+    """
+    Writes the sentences of a year to numbered shards of at most max_length rows, created when needed.
+
+    Formats are "json", a list of rows per file, "jsonl", gzip-compressed lines of rows, and "parquet".
+    Rows are streamed to jsonl and parquet shards, and written in row groups to the latter.
+    """
+
+    def __init__(self, folder, output_format="json", max_length=1000000, row_group_size=10000):
+        if output_format not in ["json", "jsonl", "parquet"]:
+            msg = "Output format must be json, jsonl or parquet, not {}".format(output_format)
+            logger.error(msg)
+            raise ValueError(msg)
+        if output_format == "parquet" and not pyarrow_available:
+            msg = "Writing parquet files requires pyarrow"
+            logger.error(msg)
+            raise ImportError(msg)
+        self.folder = folder
+        self.output_format = output_format
+        self.max_length = max_length
+        self.row_group_size = row_group_size
+        self.shards = []
+        self.rows = []
+        self.file = None
+        self.shard_length = 0
+
+    def write(self, row):
+        if self.shard_length == 0:
+            self._open_shard(row["index"])
+        self.rows.append(row)
+        self.shard_length += 1
+        if self.output_format == "jsonl":
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self.rows = []
+        elif self.output_format == "parquet" and len(self.rows) >= self.row_group_size:
+            self._write_row_group()
+        # Save the sentences in batches
+        if self.shard_length >= self.max_length:
+            logger.debug(f"Json length: {self.shard_length} reached, saving file to disk in {self.shards[-1]['file']}")
+            self.close()
+
+    def close(self):
+        """Writes and closes the current shard"""
+        if self.output_format == "json" and self.rows:
+            output_file = os.path.join(check_create_folder(self.folder, create_folder=True), self.shards[-1]["file"])
+            with open(output_file, "w", encoding="utf-8") as f:
+                json.dump(self.rows, f, ensure_ascii=False, indent=4)
+        elif self.output_format == "parquet" and self.rows:
+            self._write_row_group()
+        if self.file is not None:
+            self.file.close()
+        if self.shards:
+            self.shards[-1]["rows"] = self.shard_length
+        self.rows = []
+        self.file = None
+        self.shard_length = 0
+
+    def write_manifest(self, metadata):
+        """Writes a manifest of the year and its shards, which replaces metadata.pkl"""
+        metadata = {**metadata, "format": self.output_format, "json_files": len(self.shards), "files": self.shards}
+        output_file = check_create_folder(os.path.join(self.folder, "manifest.json"), create_folder=True)
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=4)
+
+    def _open_shard(self, first_index):
+        extension = {"json": "json", "jsonl": "jsonl.gz", "parquet": "parquet"}[self.output_format]
+        self.shards.append({"file": f"{len(self.shards) + 1}.{extension}", "first_index": first_index, "rows": 0})
+        output_file = os.path.join(check_create_folder(self.folder, create_folder=True), self.shards[-1]["file"])
+        if self.output_format == "jsonl":
+            self.file = gzip.open(output_file, "wt", encoding="utf-8")
+        elif self.output_format == "parquet":
+            self.file = pq.ParquetWriter(output_file, PARQUET_SCHEMA)
+
+    def _write_row_group(self):
+        self.file.write_table(pa.Table.from_pylist(self.rows, schema=PARQUET_SCHEMA))
+        self.rows = []
@@ -0,0 +1,284 @@
+import glob
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from text2network.processing.neo4j_insertion_interface import Neo4j_Insertion_Interface
+from text2network.utils.file_helpers import check_create_folder
+
+
+class bulk_import_writer():
+    # Header of each file group, see neo4j-admin database import
+    headers = {
+        'word': [':ID(word)', 'token_id:long', 'token'],
+        'edge': [':ID(edge)', 'weight:float', 'time:long', 'seq_id:long', 'pos:long', 'run_index:long',
+                 'part_of_speech', 'sentiment:float', 'subjectivity:float', 'p1', 'p2', 'p3', 'p4'],
+        'sequence': [':ID(sequence)', 'run_index:long', 'seq_id:long'],
+        'part_of_speech': [':ID(part_of_speech)', 'part_of_speech'],
+        'onto_ego': [':START_ID(word)', ':END_ID(edge)'],
+        'onto_alter': [':START_ID(edge)', ':END_ID(word)'],
+        'seq': [':START_ID(edge)', ':END_ID(sequence)'],
+        'pos': [':START_ID(edge)', ':END_ID(part_of_speech)'],
+    }
+    node_groups = {'word': 'word', 'edge': 'edge', 'sequence': 'sequence', 'part_of_speech': 'part_of_speech'}
+    relationship_groups = {'onto_ego': 'onto', 'onto_alter': 'onto', 'seq': 'seq', 'pos': 'pos'}
+
+    def __init__(self, folder, shard_size=5000000, compress=True):
+        """
+        Writes the network into node and relationship files for an offline neo4j-admin import,
+        instead of inserting it transactionally into a running Neo4j database.
+
+        Implements the parts of the Neo4j_Insertion_Interface used by nw_processor (setup_neo_db,
+        insert_edge_batch, write_queue), and keeps the same token id translation.
+        The graph has the same structure as one created by Neo4j_Insertion_Interface:
+        (word)-[:onto]->(edge)-[:onto]->(word), (edge)-[:seq]->(sequence) and (edge)-[:pos]->(part_of_speech).
+
+        Each file group has a header file and data shards of at most shard_size rows.
+        Writing can be resumed, since the writer state is kept in the folder: shards are only recorded in the
+        state at a checkpoint, after all of their rows are written, and shards not recorded in the state are
+        deleted when writing is resumed. Rows written after the last checkpoint are therefore never imported twice.
+
+        Parameters
+        ----------
+        folder: str
+            Output folder
+        shard_size: int
+            Maximum number of rows per data file
+        compress: bool
+            Write gzip compressed data files
+        """
+        self.folder = check_create_folder(folder, create_folder=True)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.shard_size = shard_size
+        self.compress = compress
+        self.state_file = os.path.join(self.folder, "import_state.json")
+
+        # Shard counters, committed and pending shards, rows in current shard, and number of edge nodes written
+        self.shards = {x: 0 for x in self.headers}
+        self.files = {x: [] for x in self.headers}
+        self.pending_files = {x: [] for x in self.headers}
+        self.shard_rows = {x: 0 for x in self.headers}
+        self.edge_count = 0
+        self.part_of_speech = set()
+        # Names of steps, e.g. queries, whose rows have been committed
+        self.steps = []
+        self.load_state()
+
+        for name, header in self.headers.items():
+            with open(os.path.join(self.folder, "{}_header.csv".format(name)), "w", encoding="utf-8") as f:
+                f.write(",".join(header) + "\n")
+
+        # Tokens and ids written so far
+        self.db_ids, self.db_tokens = self.get_written_tokens_and_ids()
+        self.db_id_dict = {}
+        self.translation_keys = np.array([], dtype=np.int64)
+        self.translation_values = np.array([], dtype=np.int64)
+        self.tokenizer_ids = []
+        self.tokens = []
+        self.queue = []
+
+    def load_state(self):
+        """
+        Loads the state of the last checkpoint and deletes shards written after it
+        """
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                state = json.load(f)
+            logging.info("Resuming bulk import files in {} after {} edges".format(self.folder, state['edge_count']))
+            self.shards.update(state['shards'])
+            self.files.update(state['files'])
+            self.edge_count = state['edge_count']
+            self.part_of_speech = set(state['part_of_speech'])
+            self.steps = state['steps']
+        for name in self.headers:
+            committed = set(self.files[name])
+            for filename in glob.glob(os.path.join(self.folder, "{}_part*.csv*".format(name))):
+                if os.path.basename(filename) not in committed:
+                    logging.warning("Deleting {}, which was written after the last checkpoint".format(filename))
+                    os.remove(filename)
+
+    def save_state(self):
+        state = {'shards': self.shards, 'files': self.files, 'edge_count': self.edge_count,
+                 'part_of_speech': sorted(self.part_of_speech), 'steps': self.steps}
+        with open(self.state_file + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+    def checkpoint(self, step=None):
+        """
+        Writes all queued edges and commits the shards written so far, such that they are kept if writing is
+        resumed. Later rows are written to new shards.
+
+        Parameters
+        ----------
+        step: str, optional
+            Name of the completed step, e.g. a query, see has_step
+        """
+        self.write_queue()
+        for name in self.headers:
+            self.files[name].extend(self.pending_files[name])
+            self.pending_files[name] = []
+            self.shard_rows[name] = 0
+        if step is not None and step not in self.steps:
+            self.steps.append(step)
+        self.save_state()
+
+    def has_step(self, step):
+        """
+        Returns True if the rows of a step were committed by a checkpoint
+        """
+        return step in self.steps
+
+    def get_written_tokens_and_ids(self):
+        """
+        Reads the tokens and ids from the word files written so far
+        :return: ids, tokens
+        """
+        files = self.get_data_files('word')
+        if len(files) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=str)
+        words = pd.concat([pd.read_csv(x, header=None, names=['id', 'token_id', 'token'], keep_default_na=False,
+                                       dtype={'token': str}) for x in files])
+        return words['token_id'].to_numpy(dtype=np.int64), words['token'].to_numpy(dtype=str)
+
+    def get_data_files(self, name):
+        return [os.path.join(self.folder, x) for x in self.files[name] + self.pending_files[name]]
+
+    def setup_neo_db(self, tokens, token_ids):
+        """
+        Assigns database ids to the tokenizer's tokens and writes word nodes for tokens not yet written.
+        :param tokens: list of tokens
+        :param token_ids: list of corresponding token IDs
+        :return: None
+        """
+        # Get rid of signs that can not be used, as in the database
+        tokens = [x.translate(x.maketrans({"\"": '#e1#', "'": '#e2#', "\\": '#e3#'})) for x in tokens]
+        self.tokenizer_ids = np.array(token_ids).copy()
+        self.tokens = np.array(tokens).copy()
+        db_id_dict, _, missing_tokens, missing_ids = Neo4j_Insertion_Interface.check_create_tokenid_dict(
+            tokenizer_tokens=tokens, tokenizer_ids=token_ids, db_ids=self.db_ids, db_tokens=self.db_tokens)
+        self.db_id_dict = db_id_dict
+        Neo4j_Insertion_Interface.update_translation_arrays(self)
+
+        if len(missing_tokens) > 0:
+            missing_ids = np.array(missing_ids, dtype=np.int64)
+            self.write_rows('word', pd.DataFrame({'id': missing_ids, 'token_id': missing_ids,
+                                                  'token': np.array(missing_tokens, dtype=str)}))
+            self.db_ids = np.concatenate([self.db_ids, missing_ids])
+            self.db_tokens = np.concatenate([self.db_tokens, np.array(missing_tokens, dtype=str)])
+
+    def translate_token_id_array(self, ids):
+        return Neo4j_Insertion_Interface.translate_token_id_array(self, ids)
+
+    def insert_edge_batch(self, batch):
+        """
+        Queues an edge_batch for writing
+        """
+        if len(batch) > 0:
+            self.queue.append(batch)
+
+    def write_queue(self):
+        """
+        Writes all queued batches to the data files
+        """
+        if len(self.queue) == 0:
+            return
+        batches, self.queue = self.queue, []
+        for batch in batches:
+            egos = self.translate_token_id_array(batch.ego)
+            alters = self.translate_token_id_array(batch.alter)
+            edge_ids = np.arange(self.edge_count, self.edge_count + len(batch), dtype=np.int64)
+            part_of_speech = batch.get_values('part_of_speech')
+
+            self.write_rows('edge', pd.DataFrame(
+                {'id': edge_ids, 'weight': batch.weight, 'time': batch.time, 'seq_id': batch.seq_id, 'pos': batch.pos,
+                 'run_index': batch.run_index, 'part_of_speech': part_of_speech, 'sentiment': batch.sentiment,
+                 'subjectivity': batch.subjectivity, 'p1': batch.get_values('p1'), 'p2': batch.get_values('p2'),
+                 'p3': batch.get_values('p3'), 'p4': batch.get_values('p4')}))
+            self.write_rows('onto_ego', pd.DataFrame({'start': egos, 'end': edge_ids}))
+            self.write_rows('onto_alter', pd.DataFrame({'start': edge_ids, 'end': alters}))
+            self.write_rows('seq', pd.DataFrame({'start': edge_ids, 'end': batch.run_index}))
+            self.write_rows('pos', pd.DataFrame({'start': edge_ids, 'end': part_of_speech}))
+
+            # Sentences never span batches, so each sequence is written exactly once
+            sequences = pd.DataFrame({'id': batch.run_index, 'run_index': batch.run_index,
+                                      'seq_id': batch.seq_id}).drop_duplicates('id')
+            self.write_rows('sequence', sequences)
+
+            new_pos = set(batch.get_categories('part_of_speech').tolist()) - self.part_of_speech
+            if len(new_pos) > 0:
+                new_pos = sorted(new_pos)
+                self.write_rows('part_of_speech', pd.DataFrame({'id': new_pos, 'part_of_speech': new_pos}))
+                self.part_of_speech.update(new_pos)
+
+            self.edge_count += len(batch)
+
+    def write_rows(self, name, df):
+        """
+        Appends rows to the current pending shard of a file group, starting new shards as needed
+        """
+        start = 0
+        while start < len(df):
+            if len(self.pending_files[name]) == 0 or self.shard_rows[name] >= self.shard_size:
+                self.pending_files[name].append("{}_part{:05d}.csv{}".format(name, self.shards[name],
+                                                                             ".gz" if self.compress else ""))
+                self.shards[name] += 1
+                self.shard_rows[name] = 0
+            nr_rows = min(len(df) - start, self.shard_size - self.shard_rows[name])
+            filename = os.path.join(self.folder, self.pending_files[name][-1])
+            df.iloc[start:start + nr_rows].to_csv(filename, mode="a", header=False, index=False,
+                                                  compression="gzip" if self.compress else None)
+            self.shard_rows[name] += nr_rows
+            start += nr_rows
+
+    def import_command(self, database="neo4j"):
+        """
+        Returns the neo4j-admin command to import the written files into a new database
+
+        Parameters
+        ----------
+        database: str
+            Name of the database to create
+        """
+        arguments = ["neo4j-admin database import full"]
+        for name, label in self.node_groups.items():
+            files = [os.path.join(self.folder, "{}_header.csv".format(name))] + self.get_data_files(name)
+            arguments.append("--nodes={}={}".format(label, ",".join(files)))
+        for name, rel_type in self.relationship_groups.items():
+            files = [os.path.join(self.folder, "{}_header.csv".format(name))] + self.get_data_files(name)
+            arguments.append("--relationships={}={}".format(rel_type, ",".join(files)))
+        arguments.append(database)
+        return " ".join(arguments)
+
+    @staticmethod
+    def post_import_statements():
+        """
+        Returns the Cypher statements creating constraints and indices after the import, in the syntax of
+        Neo4j 5, which the import command targets as well
+        """
+        statements = [
+            "CREATE CONSTRAINT id_con IF NOT EXISTS FOR (n:word) REQUIRE n.token_id IS UNIQUE;",
+            "CREATE CONSTRAINT tk_con IF NOT EXISTS FOR (n:word) REQUIRE n.token IS UNIQUE;",
+            "CREATE CONSTRAINT seq_runindex_con IF NOT EXISTS FOR (n:sequence) REQUIRE n.run_index IS UNIQUE;",
+            "CREATE CONSTRAINT pos_con IF NOT EXISTS FOR (n:part_of_speech) REQUIRE n.part_of_speech IS UNIQUE;",
+            "CREATE INDEX timeindex IF NOT EXISTS FOR (a:edge) ON (a.time);",
+            "CREATE INDEX runidxindex IF NOT EXISTS FOR (a:edge) ON (a.run_index);",
+            "CREATE INDEX posedgeindex IF NOT EXISTS FOR (a:edge) ON (a.pos);",
+        ]
+        return "\n".join(statements) + "\n"
+
+    def close(self):
+        """
+        Writes remaining edges and commits them, and writes the import command as well as the constraints and
+        indices that have to be created after the import
+        """
+        self.checkpoint()
+        with open(os.path.join(self.folder, "import_command.txt"), "w", encoding="utf-8") as f:
+            f.write(self.import_command() + "\n")
+        with open(os.path.join(self.folder, "post_import.cypher"), "w", encoding="utf-8") as f:
+            f.write(self.post_import_statements())
+        logging.info("Bulk import files written to {}. Import with: {}".format(self.folder, self.import_command()))
@@ -0,0 +1,167 @@
+import numpy as np
+
+
+def encode_categories(x):
+    """
+    Dictionary-encodes an array of strings
+
+    Parameters
+    ----------
+    x : array-like
+        Strings (or other values that are cast to string)
+
+    Returns
+    -------
+    categories, codes: np.ndarray
+        x == categories[codes]
+    """
+    x = np.asarray(x).astype(str)
+    if len(x) == 0:
+        return np.array([], dtype=str), np.array([], dtype=np.int32)
+    categories, codes = np.unique(x, return_inverse=True)
+    return categories, codes.astype(np.int32)
+
+
+class edge_batch():
+    # Numerical columns and their dtypes
+    columns = {'ego': np.int64, 'alter': np.int64, 'time': np.int64, 'weight': np.float32, 'seq_id': np.int64,
+               'pos': np.int64, 'run_index': np.int64, 'sentiment': np.float64, 'subjectivity': np.float64}
+    # Dictionary-encoded string columns
+    categorical_columns = ['part_of_speech', 'p1', 'p2', 'p3', 'p4']
+
+    def __init__(self, ego, alter, time, weight, seq_id, pos, run_index, sentiment=None, subjectivity=None,
+                 part_of_speech=None, p1=None, p2=None, p3=None, p4=None):
+        """
+        Array-backed batch of occurrence ties, used instead of lists of tuples with attribute dicts.
+
+        Each tie is a row across parallel numpy arrays. String attributes (part_of_speech, p1-p4) are
+        dictionary-encoded: for each of these, categories holds the distinct values and codes the index
+        of each tie's value in categories.
+
+        Parameters
+        ----------
+        ego, alter, time, weight, seq_id, pos, run_index, sentiment, subjectivity : array-like
+            One entry per tie
+        part_of_speech, p1, p2, p3, p4 : array-like or tuple
+            Either one string per tie, or a (categories, codes) tuple
+        """
+        self.ego = np.asarray(ego, dtype=self.columns['ego'])
+        nr_ties = len(self.ego)
+        self.alter = np.asarray(alter, dtype=self.columns['alter'])
+        self.time = np.asarray(time, dtype=self.columns['time'])
+        self.weight = np.asarray(weight, dtype=self.columns['weight'])
+        self.seq_id = np.asarray(seq_id, dtype=self.columns['seq_id'])
+        self.pos = np.asarray(pos, dtype=self.columns['pos'])
+        self.run_index = np.asarray(run_index, dtype=self.columns['run_index'])
+        self.sentiment = np.zeros(nr_ties) if sentiment is None else np.asarray(sentiment,
+                                                                                dtype=self.columns['sentiment'])
+        self.subjectivity = np.zeros(nr_ties) if subjectivity is None else np.asarray(
+            subjectivity, dtype=self.columns['subjectivity'])
+
+        self.categories = {}
+        self.codes = {}
+        for name, values in zip(self.categorical_columns, [part_of_speech, p1, p2, p3, p4]):
+            if values is None:
+                values = (np.array(["0"]), np.zeros(nr_ties, dtype=np.int32))
+            if isinstance(values, tuple):
+                categories, codes = values
+                categories = np.asarray(categories).astype(str)
+                codes = np.asarray(codes, dtype=np.int32)
+            else:
+                categories, codes = encode_categories(values)
+            self.categories[name] = categories
+            self.codes[name] = codes
+
+        lengths = {name: len(getattr(self, name)) for name in self.columns}
+        lengths.update({name: len(self.codes[name]) for name in self.categorical_columns})
+        for name, length in lengths.items():
+            if length != nr_ties:
+                raise AssertionError("Column {} of edge batch does not have {} entries".format(name, nr_ties))
+
+    @classmethod
+    def from_token_rows(cls, rows, alters, weights, token_ids, time_vec, seq_id_vec, pos_vec, runindex_vec,
+                        sentiment_vec, subject_vec, part_of_speech_vec, p1_vec, p2_vec, p3_vec, p4_vec):
+        """
+        Creates a batch from flat tie arrays, where rows index into per-token vectors of a processed batch.
+
+        Parameters
+        ----------
+        rows, alters, weights : np.ndarray
+            As returned by nw_processor.extract_ties_batch
+        token_ids, time_vec, seq_id_vec, pos_vec, runindex_vec, sentiment_vec, subject_vec, part_of_speech_vec, p1_vec, p2_vec, p3_vec, p4_vec
+            One entry per token in the processed batch
+
+        Returns
+        -------
+        edge_batch
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        categorical = []
+        for x in [part_of_speech_vec, p1_vec, p2_vec, p3_vec, p4_vec]:
+            categories, codes = encode_categories(x)
+            categorical.append((categories, codes[rows] if len(codes) > 0 else codes))
+        return cls(ego=np.asarray(token_ids)[rows], alter=alters, time=np.asarray(time_vec)[rows], weight=weights,
+                   seq_id=np.asarray(seq_id_vec)[rows], pos=np.asarray(pos_vec)[rows],
+                   run_index=np.asarray(runindex_vec)[rows],
+                   sentiment=np.round(np.asarray(sentiment_vec, dtype=np.float64), 4)[rows],
+                   subjectivity=np.round(np.asarray(subject_vec, dtype=np.float64), 4)[rows],
+                   part_of_speech=categorical[0], p1=categorical[1], p2=categorical[2], p3=categorical[3],
+                   p4=categorical[4])
+
+    @classmethod
+    def concatenate(cls, batches):
+        """
+        Concatenates a list of batches, merging the category dictionaries
+        """
+        batches = [x for x in batches if x is not None]
+        if len(batches) == 0:
+            return cls.empty()
+        numerical = {name: np.concatenate([getattr(x, name) for x in batches]) for name in cls.columns}
+        categorical = {}
+        for name in cls.categorical_columns:
+            categorical[name] = encode_categories(np.concatenate([x.get_values(name) for x in batches]))
+        return cls(**numerical, **categorical)
+
+    @classmethod
+    def empty(cls):
+        return cls(**{name: np.array([], dtype=dtype) for name, dtype in cls.columns.items()})
+
+    def __len__(self):
+        return len(self.ego)
+
+    def get_codes(self, name):
+        return self.codes[name]
+
+    def get_categories(self, name):
+        return self.categories[name]
+
+    def get_values(self, name):
+        """Decodes a dictionary-encoded column to one string per tie"""
+        if len(self.codes[name]) == 0:
+            return np.array([], dtype=str)
+        return self.categories[name][self.codes[name]]
+
+    def subset(self, index):
+        """
+        Returns a new batch with the ties selected by index (slice, boolean mask or integer array).
+        Category dictionaries are shared.
+        """
+        numerical = {name: getattr(self, name)[index] for name in self.columns}
+        categorical = {name: (self.categories[name], self.codes[name][index]) for name in self.categorical_columns}
+        return edge_batch(**numerical, **categorical)
+
+    def to_edgelist(self):
+        """
+        Returns ties in the format of nw_processor.get_weighted_edgelist
+
+        Returns
+        -------
+        List of (ego, alter, time, attribute dict) tuples
+        """
+        decoded = {name: self.get_values(name).tolist() for name in self.categorical_columns}
+        return [(int(self.ego[i]), int(self.alter[i]), int(self.time[i]),
+                 {'weight': float(self.weight[i]), 'run_index': int(self.run_index[i]), 'seq_id': int(self.seq_id[i]),
+                  'pos': int(self.pos[i]), 'part_of_speech': decoded['part_of_speech'][i],
+                  'sentiment': float(self.sentiment[i]), 'subjectivity': float(self.subjectivity[i]),
+                  'p1': decoded['p1'][i], 'p2': decoded['p2'][i], 'p3': decoded['p3'][i],
+                  'p4': decoded['p4'][i]}) for i in range(len(self))]
@@ -16,7 +16,7 @@ class Neo4j_Insertion_Interface():
     def __init__(self, config=None, neo4j_creds=None,  agg_operator="SUM",
                  write_before_query=True,
                  neo_batch_size=None, queue_size=100000,  tie_creation="UNSAFE",
-                 logging_level=None, connection_type=None, consume_type=None, seed=100):
+                 logging_level=None, connection_type=None, consume_type=None, seed=100, unwind_size=50000):
         # Fill parameters from configuration file
         if logging_level is not None:
             self.logging_level = logging_level
@@ -91,6 +91,7 @@ class Neo4j_Insertion_Interface():
         self.neo_queue = []
         self.neo_batch_size = neo_batch_size
         self.queue_size = queue_size
+        self.unwind_size = unwind_size
         self.aggregate_operator = agg_operator
 
         self.consume_type = consume_type
@@ -259,6 +260,7 @@ class Neo4j_Insertion_Interface():
         # Check if tokens are missing or if ids differ. Get new ids, create translation and get the missing tokens
         db_id_dict,token_ids, missing_tokens, missing_ids = self.check_create_tokenid_dict(tokenizer_tokens=tokens, tokenizer_ids=token_ids,db_ids=self.db_ids,db_tokens=self.db_tokens)
         self.db_id_dict=db_id_dict
+        self.update_translation_arrays()
         # Add the missing tokens with their new ids to the database
         if len(missing_tokens) > 0:
             queries = [''.join(["MERGE (n:word {token_id: ", str(id), ", token: '", tok, "'})"]) for tok, id in
@@ -334,6 +336,18 @@ class Neo4j_Insertion_Interface():
         This function resets this translation such that token ids correspond to the database.
         """
         self.db_id_dict = {x[0]: x[1] for x in zip(self.db_ids, self.db_ids)}
+        self.update_translation_arrays()
+
+    def update_translation_arrays(self):
+        """
+        Creates sorted arrays of the translation dictionary for vectorized lookups.
+        Needs to be called whenever db_id_dict changes.
+        """
+        keys = np.array(list(self.db_id_dict.keys()), dtype=np.int64)
+        values = np.array(list(self.db_id_dict.values()), dtype=np.int64)
+        order = np.argsort(keys)
+        self.translation_keys = keys[order]
+        self.translation_values = values[order]
 
     def translate_token_ids(self, ids):
         try:
@@ -344,6 +358,31 @@ class Neo4j_Insertion_Interface():
             raise ValueError(msg)
         return new_ids
 
+    def translate_token_id_array(self, ids):
+        """
+        Vectorized version of translate_token_ids
+
+        Parameters
+        ----------
+        ids: np.ndarray
+            tokenizer ids
+
+        Returns
+        -------
+        np.ndarray of database ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return ids
+        index = np.searchsorted(self.translation_keys, ids)
+        index[index >= len(self.translation_keys)] = 0
+        found = self.translation_keys[index] == ids if len(self.translation_keys) > 0 else np.zeros(len(ids), bool)
+        if not np.all(found):
+            msg = "Could not translate {} token ids: {}".format(np.sum(~found), ids[~found])
+            logging.error(msg)
+            raise ValueError(msg)
+        return self.translation_values[index]
+
     def get_token_from_tokenizer_id(self,idx:Union[int, np.integer]):
         """
         Given an ID from the tokenizer, return the corresponding token
@@ -542,6 +581,62 @@ class Neo4j_Insertion_Interface():
 
         self.add_query(query, params)
 
+    def insert_edge_batch(self, batch):
+        """
+        Inserts an edge_batch of ties, possibly of many egos.
+
+        Ties are sent as parallel parameter lists in a few UNWIND statements of at most unwind_size ties,
+        instead of one statement with a list of dicts per ego.
+        Part of speech and p1-p4 are sent as category lists plus codes.
+
+        Parameters
+        ----------
+        batch: edge_batch
+        """
+        if len(batch) == 0:
+            return
+        logging.debug("Insert {} ties of {} ego nodes".format(len(batch), len(np.unique(batch.ego))))
+        # Tie direction matters
+        # Ego by default is the focal token to be replaced. Normal insertion points the link accordingly.
+        # Hence, a->b is an instance of b replacing a!
+        # token translation
+        egos = self.translate_token_id_array(batch.ego)
+        alters = self.translate_token_id_array(batch.alter)
+
+        # Only add parameters p1-p4 if they carry information
+        parameter_string = ""
+        for name in ["p1", "p2", "p3", "p4"]:
+            categories = batch.get_categories(name)
+            if not all(categories == "0") and not all(categories == ''):
+                parameter_string = parameter_string + ", {0}:${0}_categories[${0}[i]]".format(name)
+
+        query = ''.join(
+            [
+                "UNWIND range(0, size($ego)-1) AS i MATCH (a:word {token_id: $ego[i]}) MATCH (b:word {token_id: $alter[i]}) ",
+                self.creation_statement,
+                " (b)<-[:onto]-(r:edge {weight:$weight[i], time:$time[i], seq_id:$seq_id[i], pos:$pos[i], run_index:$run_index[i], part_of_speech:$part_of_speech_categories[$part_of_speech[i]], sentiment:$sentiment[i], subjectivity:$subjectivity[i]",
+                parameter_string, "})<-[:onto]-(a) ",
+                " WITH r, i MERGE (h:sequence {run_index:$run_index[i], seq_id:$seq_id[i]}) WITH r, i, h CREATE (r)-[:seq]->(h) WITH r, i MERGE (f:part_of_speech {part_of_speech:$part_of_speech_categories[$part_of_speech[i]]}) WITH r, f CREATE (r)-[:pos]->(f)"])
+
+        categories = {"{}_categories".format(name): batch.get_categories(name).tolist() for name in
+                      batch.categorical_columns}
+        queries = []
+        params = []
+        for start in range(0, len(batch), self.unwind_size):
+            end = start + self.unwind_size
+            chunk_params = {"ego": egos[start:end].tolist(), "alter": alters[start:end].tolist(),
+                            "weight": batch.weight[start:end].tolist(), "time": batch.time[start:end].tolist(),
+                            "seq_id": batch.seq_id[start:end].tolist(), "pos": batch.pos[start:end].tolist(),
+                            "run_index": batch.run_index[start:end].tolist(),
+                            "sentiment": batch.sentiment[start:end].tolist(),
+                            "subjectivity": batch.subjectivity[start:end].tolist()}
+            chunk_params.update({name: batch.get_codes(name)[start:end].tolist() for name in batch.categorical_columns})
+            chunk_params.update(categories)
+            queries.append(query)
+            params.append(chunk_params)
+
+        self.add_queries(queries, params)
+
     # %% Neo4J interaction
     # All function that interact with neo are here, dispatched as needed from above
 
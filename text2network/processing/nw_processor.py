@@ -9,14 +9,20 @@ import json
 from text2network.utils.file_helpers import check_create_folder, check_folder
 from torch.utils.data import BatchSampler, SequentialSampler, DataLoader
 # from text2network.datasets.dataloaderX import DataLoaderX
-from text2network.datasets.text_dataset import query_dataset, text_dataset_collate_batchsample
+from text2network.datasets.text_dataset_old import query_dataset, text_dataset_collate_batchsample
 from text2network.utils.delwords import create_stopword_list
 from text2network.functions.rowvec_tools import simple_norm
 from text2network.utils.get_uniques import get_uniques, hdf_query_into_neo4j
 from text2network.utils.load_bert import get_bert_and_tokenizer, get_full_vocabulary
 from text2network.processing.neo4j_insertion_interface import Neo4j_Insertion_Interface
+from text2network.processing.edge_batch import edge_batch
+from text2network.classes.sqlitedb import sqlite_database
+from text2network.processing.bulk_import_writer import bulk_import_writer
 import gc
+import functools
+from contextlib import closing
 from text2network.utils.hash_file import hash_string, check_step, complete_step
+from text2network.utils.pipeline import run_pipeline
 
 
 class nw_processor():
@@ -39,16 +45,6 @@ class nw_processor():
         :param cutoff_percent: Amount of probability mass to use to create links. Smaller values, less ties.
         """
 
-        if neo_interface is None:
-            if config is not None:
-                self.neo_interface = Neo4j_Insertion_Interface(config)
-            else:
-                msg = "Please provide either a neo4j interface, or a valid configuration file."
-                logging.error(msg)
-                raise AttributeError(msg)
-        else:
-            self.neo_interface = neo_interface
-
         # Fill parameters from configuration file
         if logging_level is not None:
             self.logging_level = logging_level
@@ -119,6 +115,40 @@ class nw_processor():
         self.maxn = int(self.processing_options['maxn'])
         self.nr_workers = int(self.processing_options['nr_workers'])
         self.cutoff_prob = float(self.processing_options['cutoff_prob'])
+        self.inference_mode = str(self.processing_options.get('inference_mode', True)) in ['True', 'true', '1']
+        self.token_budget = int(self.processing_options.get('token_budget', 0))
+        self.topk_output = str(self.processing_options.get('topk_output', False)) in ['True', 'true', '1']
+        self.pipeline_queue_size = int(self.processing_options.get('pipeline_queue_size', 0))
+        self.annotation_workers = int(self.processing_options.get('annotation_workers', 1))
+
+        # Either insert into Neo4j, write files for an offline neo4j-admin import, or insert into an embedded database
+        self.output_mode = str(self.processing_options.get('output_mode', 'neo4j'))
+        if self.output_mode not in ['neo4j', 'bulk_import', 'sqlite']:
+            msg = "Processing option output_mode must be neo4j, bulk_import or sqlite, not {}".format(
+                self.output_mode)
+            logging.error(msg)
+            raise AttributeError(msg)
+        if neo_interface is None:
+            if self.output_mode == "bulk_import":
+                bulk_import_folder = self.processing_options.get('bulk_import_folder', None)
+                if bulk_import_folder is None:
+                    bulk_import_folder = ''.join([self.processing_cache, '/bulk_import'])
+                self.neo_interface = bulk_import_writer(bulk_import_folder)
+            elif self.output_mode == "sqlite":
+                if config is not None and config.has_option('Paths', 'sqlite_database'):
+                    self.neo_interface = sqlite_database(config['Paths']['sqlite_database'])
+                else:
+                    msg = "Please provide the path of the sqlite database as sqlite_database in the Paths configuration."
+                    logging.error(msg)
+                    raise AttributeError(msg)
+            elif config is not None:
+                self.neo_interface = Neo4j_Insertion_Interface(config)
+            else:
+                msg = "Please provide either a neo4j interface, or a valid configuration file."
+                logging.error(msg)
+                raise AttributeError(msg)
+        else:
+            self.neo_interface = neo_interface
 
         if MAX_SEQ_LENGTH is not None:
             self.MAX_SEQ_LENGTH = MAX_SEQ_LENGTH
@@ -183,6 +213,15 @@ class nw_processor():
         if split_hierarchy is not None:
             self.setup_uniques(split_hierarchy)
 
+        # Database maintenance is not possible when writing import files
+        if self.output_mode == "bulk_import":
+            delete_all = False
+            delete_incomplete_times = False
+            prune_database = False
+        # Incomplete times are found by Cypher queries
+        if self.output_mode == "sqlite":
+            delete_incomplete_times = False
+
         # Clean the database
         if delete_all:
             logging.warning("Cleaning Neo4j Database of all prior connections")
@@ -202,6 +241,8 @@ class nw_processor():
             hash = hash_string(processing_folder, hash_factory="md5")
             if (check_step(processing_folder, hash) and (self.processing_cache is not None)):
                 logging.info("Found processed cache for %s. Skipping", processing_folder)
+            elif self.output_mode == "bulk_import" and self.neo_interface.has_step(query):
+                logging.info("Found query %s in bulk import files. Skipping", query)
             else:
                 del_limit=10000
                 if delete_incomplete_times:
@@ -237,6 +278,9 @@ class nw_processor():
                 start_time = time.time()
                 self.process_query(query, fname)
                 logging.info("Processing Time: %s seconds", (time.time() - start_time))
+                # Import files are only kept for completely processed queries
+                if self.output_mode == "bulk_import":
+                    self.neo_interface.checkpoint(query)
                 if self.processing_cache is not None:
                     complete_step(processing_folder, hash)
 
@@ -245,7 +289,10 @@ class nw_processor():
             logging.info("Pruning Neo4j Database of all unused tokens")
             self.neo_interface.prune_database()
         # Add config
-        self.add_configuration_information_to_db()
+        if self.output_mode in ["bulk_import", "sqlite"]:
+            self.neo_interface.close()
+        else:
+            self.add_configuration_information_to_db()
 
     def process_query(self, query, fname, text_db=None, logging_level=None):
         """
@@ -287,8 +334,11 @@ class nw_processor():
         self.neo_interface.setup_neo_db(tokens, ids)
 
         # %% Initialize text dataset
+        # Token ids and annotations are cached per query and tokenizer, and shared between models
         dataset = query_dataset(self.text_db, self.tokenizer, self.MAX_SEQ_LENGTH, maxn=self.maxn, query=query,
-                                logging_level=self.logging_level)
+                                logging_level=self.logging_level, pos=self.pos_tagging, sentiment=self.sentiment,
+                                cache_folder=''.join([self.processing_cache, '/dataset_cache']),
+                                annotation_workers=self.annotation_workers)
         logging.info("Number of sentences found: %i", dataset.nitems)
         logging.info("Number of unique tokens in dataset: {}".format(self.tokenizer.vocab_size - len(dataset.id_mask)))
         logging.info("Number of tokens in tokenizer: {}".format(self.tokenizer.vocab_size))
@@ -315,162 +365,26 @@ class nw_processor():
 
         # Create Stopwords
         delwords = create_stopword_list(self.tokenizer)
-
-        # Counter for timing
-        # model_timings = []
-        # process_timings = []
-        # load_timings = []
-        # start_time = time.time()
-        for batch, token_ids, index_vec, seq_id_vec, runindex_vec, year_vec, p1_vec, p2_vec, p3_vec, p4_vec, pos_vec, sentiment_vec, subject_vec in tqdm.tqdm(
-                dataloader,
-                desc="Iteration"):
-
-            # batch, seq_ids, token_ids
-            # Data spent on loading batch
-            # load_time = time.time() - start_time
-            # load_timings.append(load_time)
-            # This seems to allow slightly higher batch sizes on my GPU
-            # torch.cuda.empty_cache()
-            # Run BERT and get predictions
-            predictions, attn = self.get_bert_tensor(0, self.bert, batch, self.tokenizer.pad_token_id,
-                                                     self.tokenizer.mask_token_id, device)
-
-            unknown_token = self.tokenizer.unk_token_id
-            # Deal with missing tokens due to elimination of word-pieces
-            not_missing = token_ids != unknown_token
-            missing=token_ids == unknown_token
-            org_token = token_ids.clone()
-            token_ids = token_ids[not_missing]
-            index_vec = index_vec[not_missing]
-            seq_id_vec = seq_id_vec[not_missing]
-            runindex_vec = runindex_vec[not_missing]
-            year_vec = year_vec[not_missing]
-            p1_vec = p1_vec[not_missing]
-            p2_vec = p2_vec[not_missing]
-            p3_vec = p3_vec[not_missing]
-            p4_vec = p4_vec[not_missing]
-            pos_vec = pos_vec[not_missing]
-            sentiment_vec = sentiment_vec[not_missing]
-            subject_vec = subject_vec[not_missing]
-            predictions = predictions[not_missing,...]
-
-            # %% Sequence Table
-            # Iterate over sequences
-            for run_index in np.unique(runindex_vec):
-                # Extract only current sequence
-                sequence_mask = runindex_vec == run_index
-                sequence_size = sum(sequence_mask)
-
-                # Get parameters
-                seq_year = year_vec[sequence_mask]
-                seq_ids = seq_id_vec[sequence_mask]
-                seq_p1 = p1_vec[sequence_mask]
-                seq_p2 = p2_vec[sequence_mask]
-                seq_p3 = p3_vec[sequence_mask]
-                seq_p4 = p4_vec[sequence_mask]
-                seq_pos = pos_vec[sequence_mask]
-                seq_sentiment = sentiment_vec[sequence_mask]
-                seq_subject = subject_vec[sequence_mask]
-
-                # Pad and add sequence of IDs
-                # TODO: Sanity check I don't need this anymore
-                # idx = torch.zeros([1, MAX_SEQ_LENGTH], requires_grad=False, dtype=torch.int32)
-                # idx[0, :sequence_size] = token_ids[sequence_mask]
-                # Pad and add distributions per token, we need to save to maximum sequence size
-                dists = torch.zeros([self.MAX_SEQ_LENGTH, self.DICT_SIZE], requires_grad=False)
-                if sequence_mask.shape[0] != predictions.shape[0]:
-                    print("Error!")
-                    print(f"{not_missing}")
-                    print(f"{predictions.shape}")
-                    print(f"{not_missing.shape}")
-                    print(f"{sequence_mask.shape}")
-                    print(f"{batch}")
-                    print(f"{token_ids}")
-                    print(f"{org_token}")
-                    print(f"{run_index}")
-                    
-                    print(f"{runindex_vec.shape}")
-                    print(f"{predictions[missing,...]}")
-
-                
-                
-                dists[:sequence_size, :] = predictions[sequence_mask, :]
-                
-                #dists = predictions
-
-                # Context element selection matrix
-                seq_ce = torch.ones([sequence_size, sequence_size])
-                # Delete position of focal token
-                seq_ce[torch.eye(sequence_size).bool()] = 0
-                # Context distributions
-                context_index = np.zeros([self.MAX_SEQ_LENGTH], dtype=np.bool)
-                # Index words that are in the sentence
-                context_index[:sequence_size] = True
-                # Populate distribution with distributions
-                # context_dist = dists[context_index, :]
-
-                # TODO: This should probably not be a loop
-                # but done smartly with matrices and so forth
-                for pos, token in enumerate(token_ids[sequence_mask]):
-                    # Should all be np
-                    token = token.item()
-                    # Extract parameters for token
-                    year = seq_year[pos]
-                    sequence_id = seq_ids[pos]
-                    p1 = seq_p1[pos]
-                    p2 = seq_p2[pos]
-                    p3 = seq_p3[pos]
-                    p4 = seq_p4[pos]
-                    sentiment = round(float(seq_sentiment[pos].numpy()),4)
-                    subjectivity = round(float(seq_subject[pos].numpy()),4)
-                    part_of_speech = str(seq_pos[pos])
-
-                    # Ignore stopwords for network creation
-                    if token not in delwords:
-
-                        # %% Replacement distribution
-                        replacement = dists[pos, :]
-                        # Flatten, since it is one row each
-                        replacement = replacement.numpy().flatten()
-                        # Sparsify
-                        if not self.own_tie:
-                            replacement[token] = 0
-                        replacement[replacement == np.min(replacement)] = 0
-                        # Get rid of delnorm links
-                        replacement[delwords] = 0
-                        # Get rid of tokens not in text
-                        if self.prune_missing_tokens:
-                            replacement[dataset.id_mask] = 0
-                        # We norm the distributions here
-                        if self.normalize_ties:
-                            replacement = self.norm(replacement, min_zero=False)
-
-                        # Add values to network
-                        # Replacement ties
-                        cutoff_number, cutoff_probability = self.calculate_cutoffs(replacement, method="percent",
-                                                                                   percent=self.cutoff_percent,
-                                                                                   max_degree=self.max_degree)
-                        ties = self.get_weighted_edgelist(token, replacement, year, cutoff_number, cutoff_probability,
-                                                          sequence_id, pos, p1=p1, p2=p2, p3=p3,
-                                                          p4=p4, run_index=run_index,
-                                                          max_degree=self.max_degree,
-                                                          part_of_speech=part_of_speech,
-                                                          sentiment=sentiment,
-                                                          subjectivity=subjectivity,
-                                                          min_probability=self.cutoff_prob)
-
-                        if (ties is not None):
-                            self.neo_interface.insert_edges(token, ties)
-
-                del dists
-
-            del predictions, attn
-            # compute processing time
-            # process_timings.append(time.time() - start_time - prepare_time - load_time)
-            self.neo_interface.write_queue()
-            # New start time
-
-            # start_time = time.time()
+        # Tokens that can never be replacements, excluded on the device in top-k mode
+        if self.prune_missing_tokens:
+            exclude_ids = np.union1d(delwords, dataset.id_mask).astype(np.int64)
+        else:
+            exclude_ids = np.array(delwords, dtype=np.int64)
+
+        run_model = functools.partial(self.__run_model_on_batch, device=device, exclude_ids=exclude_ids)
+        insert_ties = functools.partial(self.__insert_batch_ties, delwords=delwords,
+                                        id_mask=dataset.id_mask if self.prune_missing_tokens else None)
+        if self.pipeline_queue_size > 0:
+            # Loading, BERT and database writes run concurrently, connected by bounded queues
+            with closing(run_pipeline(dataloader, [run_model], queue_size=self.pipeline_queue_size)) as pipeline:
+                for predictions, batch_data in tqdm.tqdm(pipeline, desc="Iteration", total=len(dataloader)):
+                    insert_ties(predictions, batch_data)
+                    del predictions, batch_data
+        else:
+            for batch_data in tqdm.tqdm(dataloader, desc="Iteration"):
+                predictions, batch_data = run_model(batch_data)
+                insert_ties(predictions, batch_data)
+                del predictions, batch_data
 
         # Write remaining
         self.neo_interface.write_queue()
@@ -481,6 +395,7 @@ class nw_processor():
             logging.info("Resetting original batch size")
             self.batch_size = original_batch_size
 
+        dataset.close()
         del dataloader, dataset, batch_sampler
         # logging.debug("Average Load Time: %s seconds" % (np.mean(load_timings)))
         # logging.debug("Average Model Time: %s seconds" % (np.mean(model_timings)))
@@ -488,8 +403,99 @@ class nw_processor():
         # logging.debug(
         #    "Ratio Load/Operations: %s seconds" % (np.mean(load_timings) / np.mean(process_timings + model_timings)))
 
+    def __run_model_on_batch(self, batch_data, device, exclude_ids):
+        """
+        Runs BERT on a batch from query_dataset and drops tokens that are unknown to the tokenizer.
+
+        Parameters
+        ----------
+        batch_data
+            Tuple as returned by query_dataset
+        device
+            CPU or CUDA device
+        exclude_ids
+            Token ids excluded from replacements in top-k mode
+
+        Returns
+        -------
+        predictions, batch_data
+            predictions as returned by get_bert_tensor or get_bert_tensor_topk, and the remaining batch vectors
+        """
+        batch, token_ids, index_vec, seq_id_vec, runindex_vec, year_vec, p1_vec, p2_vec, p3_vec, p4_vec, pos_vec, sentiment_vec, subject_vec = batch_data
+
+        # Run BERT and get predictions
+        if self.topk_output:
+            predictions = self.get_bert_tensor_topk(self.bert, batch, self.tokenizer.pad_token_id,
+                                                    self.tokenizer.mask_token_id, device, k=self.max_degree,
+                                                    exclude_ids=exclude_ids, own_tie=self.own_tie,
+                                                    token_budget=self.token_budget)
+        else:
+            predictions, attn = self.get_bert_tensor(0, self.bert, batch, self.tokenizer.pad_token_id,
+                                                     self.tokenizer.mask_token_id, device,
+                                                     inference_mode=self.inference_mode,
+                                                     token_budget=self.token_budget)
+            del attn
+
+        unknown_token = self.tokenizer.unk_token_id
+        # Deal with missing tokens due to elimination of word-pieces
+        not_missing = token_ids != unknown_token
+        if self.topk_output:
+            predictions = tuple(x[not_missing, ...] for x in predictions)
+        else:
+            predictions = predictions[not_missing, ...]
+        batch_data = tuple(x[not_missing] for x in
+                           [token_ids, index_vec, seq_id_vec, runindex_vec, year_vec, p1_vec, p2_vec, p3_vec, p4_vec,
+                            pos_vec, sentiment_vec, subject_vec])
+        return predictions, batch_data
+
+    def __insert_batch_ties(self, predictions, batch_data, delwords, id_mask=None):
+        """
+        Extracts the ties of a batch and writes them to the database.
+
+        Parameters
+        ----------
+        predictions
+            As returned by __run_model_on_batch
+        batch_data
+            Batch vectors as returned by __run_model_on_batch
+        delwords
+            Stopword ids
+        id_mask
+            Ids of tokens not in the text, if these are to be pruned
+        """
+        token_ids, index_vec, seq_id_vec, runindex_vec, year_vec, p1_vec, p2_vec, p3_vec, p4_vec, pos_vec, sentiment_vec, subject_vec = batch_data
+
+        # Position of each token within its sequence
+        runindex_np = np.asarray(runindex_vec)
+        _, first_index, run_inverse = np.unique(runindex_np, return_index=True, return_inverse=True)
+        seq_pos_vec = np.arange(len(runindex_np)) - first_index[run_inverse]
+
+        # Extract ties for all tokens in the batch at once
+        if self.topk_output:
+            edge_rows, edge_alters, edge_weights = self.extract_ties_topk(*predictions, token_ids, delwords,
+                                                                          normalize_ties=self.normalize_ties,
+                                                                          percent=self.cutoff_percent,
+                                                                          max_degree=self.max_degree,
+                                                                          min_probability=self.cutoff_prob)
+        else:
+            edge_rows, edge_alters, edge_weights = self.extract_ties_batch(predictions, token_ids, delwords,
+                                                                           id_mask=id_mask,
+                                                                           own_tie=self.own_tie,
+                                                                           normalize_ties=self.normalize_ties,
+                                                                           percent=self.cutoff_percent,
+                                                                           max_degree=self.max_degree,
+                                                                           min_probability=self.cutoff_prob)
+
+        # Array-backed ties, no per-edge Python objects
+        ties = edge_batch.from_token_rows(edge_rows, edge_alters, edge_weights, token_ids, year_vec, seq_id_vec,
+                                          seq_pos_vec, runindex_np, sentiment_vec, subject_vec, pos_vec, p1_vec,
+                                          p2_vec, p3_vec, p4_vec)
+        self.neo_interface.insert_edge_batch(ties)
+        self.neo_interface.write_queue()
+
     @staticmethod
-    def get_bert_tensor(args, bert, tokens, pad_token_id, mask_token_id, device=torch.device("cpu")):
+    def get_bert_tensor(args, bert, tokens, pad_token_id, mask_token_id, device=torch.device("cpu"),
+                        inference_mode=False, token_budget=0):
         """
         Extracts tensors of probability distributions for each word in sentence from BERT.
         This is done by running BERT separately for each token, masking the focal token.
@@ -501,8 +507,13 @@ class nw_processor():
         :param mask_token_id: Token id's from tokenizer
         :param device: CPU or CUDA device
         :param return_max: only returns ID of most likely token
+        :param inference_mode: If True, masked copies are bucketed by sequence length and no labels or attentions are computed. attn is returned as None.
+        :param token_budget: Only used in inference mode. Maximal number of tokens per forward pass, 0 runs each length bucket at once.
         :return: predictions: Tensor of logits for each token (dimension: sum(k_i)*vocab-length); attn: Attention weights for each token
         """
+        if inference_mode:
+            return nw_processor.get_bert_tensor_bucketed(bert, tokens, pad_token_id, mask_token_id, device,
+                                                         token_budget=token_budget), None
 
         # We use lists of tensors first
         list_tokens = []
@@ -591,7 +602,317 @@ class nw_processor():
         # because we added <SEP> and <CLS> tokens
         return predictions.cpu(), attn.cpu()
 
+    @staticmethod
+    def get_bert_tensor_bucketed(bert, tokens, pad_token_id, mask_token_id, device=torch.device("cpu"),
+                                 token_budget=0):
+        """
+        Extracts tensors of probability distributions for each word in sentence from BERT.
+
+        Masked copies of each sentence are grouped into buckets of equal sequence length, such that
+        no padding is run through the model. Forward passes skip the loss and attention outputs and are
+        split such that each pass holds at most token_budget tokens.
+
+        Parameters
+        ----------
+        bert
+            BERT model
+        tokens
+            tensor of sequences, padded with pad_token_id
+        pad_token_id
+        mask_token_id
+        device
+            CPU or CUDA device
+        token_budget: int
+            Maximal number of tokens per forward pass. 0 runs each length bucket in one pass.
+
+        Returns
+        -------
+        predictions: Tensor of probabilities for each token (dimension: sum(k_i)*vocab-length), ordered as in get_bert_tensor
+        """
+        seq_lengths = torch.sum(tokens != pad_token_id, dim=1)
+        # -2 because we do not run BERT for <CLS> and <SEP>
+        nr_masked = torch.clamp(seq_lengths - 2, min=0)
+        offsets = torch.cumsum(nr_masked, dim=0) - nr_masked
+
+        bert.eval()
+        predictions = None
+        with torch.inference_mode():
+            for seq_length in torch.unique(seq_lengths).tolist():
+                if seq_length <= 2:
+                    continue
+                sentences = torch.nonzero(seq_lengths == seq_length).flatten()
+                nr_mask_tokens = seq_length - 2
+                # We repeat each text for each actual word in sentence and mask the diagonal
+                inputs = tokens[sentences, :seq_length].repeat_interleave(nr_mask_tokens, dim=0)
+                mask_positions = torch.arange(1, seq_length - 1).repeat(len(sentences))
+                inputs[torch.arange(inputs.shape[0]), mask_positions] = mask_token_id
+                # Row in the output of each masked copy
+                out_index = offsets[sentences].repeat_interleave(nr_mask_tokens) + mask_positions - 1
+
+                if token_budget > 0:
+                    chunk_size = max(1, token_budget // seq_length)
+                else:
+                    chunk_size = inputs.shape[0]
+                for start in range(0, inputs.shape[0], chunk_size):
+                    chunk = inputs[start:start + chunk_size].to(device)
+                    chunk_positions = mask_positions[start:start + chunk_size].to(device)
+                    logits = bert(chunk, token_type_ids=torch.zeros_like(chunk), output_attentions=False)[0]
+                    # Only keep predictions of masked words and softmax them
+                    logits = logits[torch.arange(chunk.shape[0], device=device), chunk_positions, :]
+                    probabilities = torch.softmax(logits, dim=-1).cpu()
+                    if predictions is None:
+                        predictions = torch.zeros([int(torch.sum(nr_masked)), probabilities.shape[1]],
+                                                  dtype=probabilities.dtype)
+                    predictions[out_index[start:start + chunk_size], :] = probabilities
+                    del chunk, logits
+
+        if predictions is None:
+            predictions = torch.zeros([0, bert.config.vocab_size])
+        return predictions
+
+    @staticmethod
+    def get_bert_tensor_topk(bert, tokens, pad_token_id, mask_token_id, device=torch.device("cpu"), k=100,
+                             exclude_ids=None, own_tie=True, token_budget=0):
+        """
+        Like get_bert_tensor_bucketed, but the prediction head is only run on the masked positions, and only
+        the k most likely replacements per token are returned instead of the full vocabulary distribution.
+
+        Parameters
+        ----------
+        bert
+            BERT model
+        tokens
+            tensor of sequences, padded with pad_token_id
+        pad_token_id
+        mask_token_id
+        device
+            CPU or CUDA device
+        k: int
+            Number of replacements to return, usually max_degree
+        exclude_ids: list
+            Token ids that can not be replacements, e.g. stopwords. These are excluded before the top-k selection
+            and from the log-normalizer.
+        own_tie: bool
+            If False, the masked token can not be its own replacement
+        token_budget: int
+            Maximal number of tokens per forward pass. 0 runs each length bucket in one pass.
+
+        Returns
+        -------
+        probabilities: (sum(k_i), k) softmax probabilities of the top-k admissible replacements, sorted
+        alters: (sum(k_i), k) corresponding token ids
+        log_normalizer: (sum(k_i)) log of the probability mass of all admissible replacements
+        """
+        seq_lengths = torch.sum(tokens != pad_token_id, dim=1)
+        # -2 because we do not run BERT for <CLS> and <SEP>
+        nr_masked = torch.clamp(seq_lengths - 2, min=0)
+        offsets = torch.cumsum(nr_masked, dim=0) - nr_masked
+        nr_rows = int(torch.sum(nr_masked))
+        k = min(k, bert.config.vocab_size)
+
+        probabilities = torch.zeros([nr_rows, k])
+        alters = torch.zeros([nr_rows, k], dtype=torch.long)
+        log_normalizer = torch.zeros([nr_rows])
+        if exclude_ids is not None and len(exclude_ids) > 0:
+            exclude_ids = torch.as_tensor(exclude_ids, dtype=torch.long, device=device)
+        else:
+            exclude_ids = None
+
+        bert.eval()
+        with torch.inference_mode():
+            for seq_length in torch.unique(seq_lengths).tolist():
+                if seq_length <= 2:
+                    continue
+                sentences = torch.nonzero(seq_lengths == seq_length).flatten()
+                nr_mask_tokens = seq_length - 2
+                # We repeat each text for each actual word in sentence and mask the diagonal
+                inputs = tokens[sentences, :seq_length].repeat_interleave(nr_mask_tokens, dim=0)
+                mask_positions = torch.arange(1, seq_length - 1).repeat(len(sentences))
+                masked_tokens = inputs[torch.arange(inputs.shape[0]), mask_positions].clone()
+                inputs[torch.arange(inputs.shape[0]), mask_positions] = mask_token_id
+                # Row in the output of each masked copy
+                out_index = offsets[sentences].repeat_interleave(nr_mask_tokens) + mask_positions - 1
+
+                if token_budget > 0:
+                    chunk_size = max(1, token_budget // seq_length)
+                else:
+                    chunk_size = inputs.shape[0]
+                for start in range(0, inputs.shape[0], chunk_size):
+                    chunk = inputs[start:start + chunk_size].to(device)
+                    chunk_positions = mask_positions[start:start + chunk_size].to(device)
+                    hidden = bert.bert(chunk, token_type_ids=torch.zeros_like(chunk), output_attentions=False)[0]
+                    # Run the prediction head only on the masked positions
+                    hidden = hidden[torch.arange(chunk.shape[0], device=device), chunk_positions, :]
+                    logits = bert.cls(hidden).float()
+                    log_total = torch.logsumexp(logits, dim=-1, keepdim=True)
+                    if exclude_ids is not None:
+                        logits[:, exclude_ids] = -float("inf")
+                    if not own_tie:
+                        own_tokens = masked_tokens[start:start + chunk_size].to(device)
+                        logits[torch.arange(chunk.shape[0], device=device), own_tokens] = -float("inf")
+                    top_logits, top_ids = torch.topk(logits, k, dim=-1, sorted=True)
+                    chunk_index = out_index[start:start + chunk_size]
+                    probabilities[chunk_index, :] = torch.exp(top_logits - log_total).cpu()
+                    alters[chunk_index, :] = top_ids.cpu()
+                    log_normalizer[chunk_index] = (torch.logsumexp(logits, dim=-1) - log_total.squeeze(1)).cpu()
+                    del chunk, hidden, logits
+
+        return probabilities, alters, log_normalizer
+
     # %% Utilities
+    @staticmethod
+    def extract_ties_batch(predictions, token_ids, delwords, id_mask=None, own_tie=True, normalize_ties=True,
+                           percent=100, max_degree=100, min_probability=0):
+        """
+        Extracts replacement ties for all tokens of a batch in a single tensor pass.
+
+        Applies the same masking, normalization and cutoffs as calculate_cutoffs and get_weighted_edgelist,
+        but uses a partial top-k selection over the whole prediction matrix instead of sorting each row.
+
+        Parameters
+        ----------
+        predictions : torch.Tensor
+            Probability distributions of dimension (nr_tokens, vocab_size)
+        token_ids : torch.Tensor
+            Token id of each row in predictions
+        delwords : list
+            Stopword ids. These are neither egos nor alters.
+        id_mask : np.ndarray, optional
+            Ids of tokens that do not appear in the text. These are not used as alters.
+        own_tie : bool
+            If False, a token can not be its own replacement
+        normalize_ties : bool
+            Norm distributions and retained ties to sum to one
+        percent : int
+            Retain ties that explain this percentage of the probability mass
+        max_degree : int
+            Maximum number of ties per token
+        min_probability : float
+            Drop ties with a (normed) weight below this value
+
+        Returns
+        -------
+        rows, alters, weights: np.ndarray
+            Flat edge arrays, where rows indexes the ego token in predictions. Sorted by rows.
+        """
+        predictions = torch.as_tensor(predictions)
+        token_ids = torch.as_tensor(token_ids, dtype=torch.long)
+        delwords = torch.as_tensor(delwords, dtype=torch.long)
+
+        # Ignore stopwords for network creation
+        rows = torch.nonzero(~torch.isin(token_ids, delwords)).flatten()
+        if rows.shape[0] == 0 or max_degree <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        x = predictions[rows, :].float()
+
+        # Sparsify
+        if not own_tie:
+            x[torch.arange(rows.shape[0]), token_ids[rows]] = 0
+        x[x == torch.min(x, dim=1, keepdim=True)[0]] = 0
+        # Get rid of delnorm links
+        x[:, delwords] = 0
+        # Get rid of tokens not in text
+        if id_mask is not None and len(id_mask) > 0:
+            x[:, torch.as_tensor(id_mask, dtype=torch.long)] = 0
+        # We norm the distributions here
+        row_sum = torch.sum(x, dim=1, keepdim=True)
+        if normalize_ties:
+            x = torch.where(row_sum > 0, x / row_sum, x)
+            row_sum = torch.sum(x, dim=1, keepdim=True)
+
+        # Only the largest max_degree entries can be retained
+        values, alters = torch.topk(x, min(max_degree, x.shape[1]), dim=1, sorted=True)
+        del x
+        return nw_processor.cut_ties(rows, values, alters, row_sum, normalize_ties=normalize_ties, percent=percent,
+                                     min_probability=min_probability)
+
+    @staticmethod
+    def extract_ties_topk(probabilities, alters, log_normalizer, token_ids, delwords, normalize_ties=True,
+                          percent=100, max_degree=100, min_probability=0):
+        """
+        Extracts replacement ties from the output of get_bert_tensor_topk.
+
+        Since excluded tokens are never selected into the top-k and the log-normalizer holds the mass of all
+        admissible tokens, this gives the same ties as extract_ties_batch on the full distribution, except
+        that the single least likely token is not zeroed out before normalization.
+
+        Parameters
+        ----------
+        probabilities : torch.Tensor
+            (nr_tokens, k) softmax probabilities of the k most likely admissible replacements, sorted
+        alters : torch.Tensor
+            (nr_tokens, k) token ids corresponding to probabilities
+        log_normalizer : torch.Tensor
+            (nr_tokens) log of the probability mass of all admissible replacements
+        token_ids : torch.Tensor
+            Token id of each row
+        delwords : list
+            Stopword ids. These are not used as egos.
+        normalize_ties, percent, max_degree, min_probability
+            See extract_ties_batch
+
+        Returns
+        -------
+        rows, alters, weights: np.ndarray
+            Flat edge arrays, where rows indexes the ego token. Sorted by rows.
+        """
+        token_ids = torch.as_tensor(token_ids, dtype=torch.long)
+        delwords = torch.as_tensor(delwords, dtype=torch.long)
+
+        # Ignore stopwords for network creation
+        rows = torch.nonzero(~torch.isin(token_ids, delwords)).flatten()
+        if rows.shape[0] == 0 or max_degree <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        degree = min(max_degree, probabilities.shape[1])
+        values = probabilities[rows, :degree].float()
+        alters = alters[rows, :degree]
+        row_sum = torch.exp(log_normalizer[rows].float()).unsqueeze(1)
+        # We norm the distributions here
+        if normalize_ties:
+            values = torch.where(row_sum > 0, values / row_sum, values)
+            row_sum = torch.where(row_sum > 0, torch.ones_like(row_sum), row_sum)
+
+        return nw_processor.cut_ties(rows, values, alters, row_sum, normalize_ties=normalize_ties, percent=percent,
+                                     min_probability=min_probability)
+
+    @staticmethod
+    def cut_ties(rows, values, alters, row_sum, normalize_ties=True, percent=100, min_probability=0):
+        """
+        Applies the percent-mass and minimum probability cutoffs to the sorted top-k entries of each row.
+
+        Parameters
+        ----------
+        rows : torch.Tensor
+            Row index of the ego of each row
+        values : torch.Tensor
+            (nr_rows, k) largest weights per row, sorted in descending order
+        alters : torch.Tensor
+            (nr_rows, k) token ids corresponding to values
+        row_sum : torch.Tensor
+            (nr_rows, 1) total mass of each row, of which percent are to be retained
+
+        Returns
+        -------
+        rows, alters, weights: np.ndarray
+            Flat edge arrays, sorted by rows.
+        """
+        # Number of ties needed to explain percent of the mass, capped by max_degree
+        cum_sum = torch.cumsum(values, dim=1)
+        cutoff_degree = torch.sum(cum_sum < row_sum * percent / 100, dim=1, keepdim=True) + 1
+        keep = (torch.arange(values.shape[1]).unsqueeze(0) < cutoff_degree) & (values > 0)
+
+        # Norm retained ties, since we want to represent the distribution
+        if normalize_ties:
+            values = values * keep
+            tie_sum = torch.sum(values, dim=1, keepdim=True)
+            values = torch.where(tie_sum > 0, values / tie_sum, values)
+        # Now in addition, we will artificially cut off below a threshold, no renormalization
+        if min_probability > 0:
+            keep = keep & (values >= min_probability)
+
+        edge_rows, edge_cols = torch.nonzero(keep, as_tuple=True)
+        return rows[edge_rows].numpy(), alters[edge_rows, edge_cols].numpy(), values[edge_rows, edge_cols].numpy()
+
     @staticmethod
     def calculate_cutoffs(x, method="percent", percent=100, max_degree=100, min_cut=0.001):
         """
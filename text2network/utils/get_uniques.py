@@ -1,5 +1,12 @@
+import json
+import logging
+import os
+
+import numpy as np
 import tables
 
+from text2network.utils.hash_file import hash_string
+
 
 def hdf_query_into_neo4j(query):
     """
@@ -12,7 +19,64 @@ def hdf_query_into_neo4j(query):
     return query
 
 
-def get_uniques(split_hierarchy, db_folder):
+def read_split_index(split_hierarchy, db_folder, chunk_size=1000000):
+    """
+    Distinct combinations of the split hierarchy columns in the database.
+    Only these columns are read, chunk by chunk, and reduced with numpy unique on structured arrays.
+
+    Parameters
+    ----------
+    split_hierarchy: list
+        Table columns
+    db_folder: str
+        HDF5 database file
+    chunk_size: int
+        Number of rows read at once
+
+    Returns
+    -------
+    Sorted structured array with one field per column of the split hierarchy
+    """
+    with tables.open_file(db_folder, mode="r") as hdf:
+        data = hdf.root.textdata.table
+        dtype = np.dtype([(param, data.coldtypes[param]) for param in split_hierarchy])
+        combinations = [np.empty(0, dtype=dtype)]
+        for start in range(0, data.nrows, chunk_size):
+            stop = min(start + chunk_size, data.nrows)
+            chunk = np.empty(stop - start, dtype=dtype)
+            for param in split_hierarchy:
+                chunk[param] = data.read(start, stop, field=param)
+            combinations.append(np.unique(chunk))
+    return np.unique(np.concatenate(combinations))
+
+
+def load_split_index(split_hierarchy, db_folder, chunk_size=1000000):
+    """
+    read_split_index, cached next to the database.
+
+    The cache is used if size and modification time of the database are unchanged. Reading the split columns
+    is cheaper than hashing the database, so a database that was only touched is read again.
+    """
+    cache_file = "{}.uniques-{}.npz".format(db_folder, hash_string(json.dumps(split_hierarchy))[0:8])
+    stat = os.stat(db_folder)
+    if os.path.exists(cache_file):
+        try:
+            with np.load(cache_file, allow_pickle=False) as cache:
+                if cache['size'] == stat.st_size and cache['mtime'] == stat.st_mtime_ns:
+                    return cache['values']
+        except (OSError, ValueError, KeyError):
+            logging.warning("Could not read cached split hierarchy {}".format(cache_file))
+    logging.info("Reading split hierarchy {} from {}".format(split_hierarchy, db_folder))
+    values = read_split_index(split_hierarchy, db_folder, chunk_size=chunk_size)
+    try:
+        with open(cache_file, "wb") as f:
+            np.savez(f, values=values, size=stat.st_size, mtime=stat.st_mtime_ns)
+    except OSError:
+        logging.warning("Could not cache split hierarchy in {}".format(cache_file))
+    return values
+
+
+def get_uniques(split_hierarchy, db_folder, chunk_size=1000000):
     """
     Queries database to get unique values according to hierarchy provided.
     Determines how many models we would like to train.
@@ -22,38 +86,27 @@ def get_uniques(split_hierarchy, db_folder):
     Parameters
     ----------
     db_folder
+    chunk_size
     """
-    # Create hierarchy splits
-    hdf = tables.open_file(db_folder, mode="r")
-    data = hdf.root.textdata.table
+    combinations = load_split_index(split_hierarchy, db_folder, chunk_size=chunk_size)
+
     # Create dict sets
     uniques = {}
     for param in split_hierarchy:
-        uniques[param] = []
-    uniques["query"] = []
-    uniques["file"] = []
-    uniques["query_filename"] = []
+        uniques[param] = np.unique(combinations[param]).tolist()
 
-    # Iterate to get unqiue values and create query strings and file-names
-    for row in data.iterrows():
+    # Create query strings and file-names
+    uniques["query_filename"] = []
+    for combination in combinations.tolist():
         query = []
         filename = []
-
-        for param in split_hierarchy:
-            val = row[param]
-            uniques[param].append(val)
-            uniques[param] = list(set(uniques[param]))
+        for param, val in zip(split_hierarchy, combination):
             # Create query string
             query.append("(%s == %s)" % (param, val))
             if type(val) is bytes:
                 val = val.decode("utf-8")
             filename.append("%s" % (val))
-
-        # Add (uniquely) query strings and file-names
-        query = " & ".join(query)
-        filename = "-".join(filename)
-        uniques["query_filename"].append((query, filename))
-        uniques["query_filename"] = list(set(uniques["query_filename"]))
+        uniques["query_filename"].append((" & ".join(query), "-".join(filename)))
 
     # Split up tuple to get single instances
     uniques["query"] = [x[0] for x in uniques['query_filename']]
@@ -0,0 +1,259 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from text2network.classes.sparse_graph import sparse_graph, attributes_to_arrays, arrays_to_attributes
+from text2network.utils.file_helpers import check_create_folder
+from text2network.utils.hash_file import hash_string
+
+try:
+    import networkx as nx
+except:
+    nx = None
+
+
+def graph_to_arrays(graph):
+    """
+    Converts a graph into CSR arrays with a node id map and parallel attribute arrays.
+
+    Parameters
+    ----------
+    graph: nx.DiGraph or nx.Graph
+
+    Returns
+    -------
+    dict of np.ndarray
+        nodes: node ids, indptr and indices: CSR structure over node positions,
+        edge_<key> and node_<key>: attribute values, has_edge_<key> and has_node_<key>: whether set,
+        directed: whether the graph is directed
+    """
+    nodes = np.array(list(graph.nodes), dtype=np.int64)
+    index = {x: i for i, x in enumerate(nodes.tolist())}
+    edges = list(graph.edges(data=True))
+    rows = np.array([index[x[0]] for x in edges], dtype=np.int64)
+    cols = np.array([index[x[1]] for x in edges], dtype=np.int64)
+    order = np.lexsort((cols, rows))
+    edges = [edges[i] for i in order]
+
+    arrays = {'nodes': nodes, 'indices': cols[order],
+              'indptr': np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(nodes)))]).astype(np.int64),
+              'directed': np.array(nx.is_directed(graph))}
+    arrays.update(attributes_to_arrays([x[2] for x in edges], "edge_"))
+    arrays.update(attributes_to_arrays([graph.nodes[x] for x in nodes.tolist()], "node_"))
+    return arrays
+
+
+def arrays_to_graph(arrays):
+    """
+    Inverse of graph_to_arrays
+
+    Returns
+    -------
+    nx.DiGraph, or nx.Graph if not directed
+    """
+    nodes = arrays['nodes']
+    indptr = arrays['indptr']
+    rows = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+    cols = arrays['indices']
+
+    graph = nx.DiGraph() if bool(arrays.get('directed', True)) else nx.Graph()
+    node_attributes = arrays_to_attributes(arrays, "node_", len(nodes))
+    graph.add_nodes_from(zip(nodes.tolist(), node_attributes))
+    edge_attributes = arrays_to_attributes(arrays, "edge_", len(cols))
+    graph.add_edges_from(zip(nodes[rows].tolist(), nodes[cols].tolist(), edge_attributes))
+    return graph
+
+
+class graph_cache():
+    def __init__(self, folder, max_size=2 * 1024 ** 3):
+        """
+        On-disk cache of conditioned graphs.
+
+        Each graph, networkx or sparse_graph, is stored as compressed CSR arrays with its node ids and attributes, together with
+        metadata such as the conditioning dictionary. Entries are keyed by a hash of the conditioning
+        arguments and the version stamp of the database, such that graphs conditioned before new ties
+        were inserted are never returned. Such outdated entries are deleted when a graph of a newer
+        version of the same database is added.
+        If the cache exceeds max_size bytes, the least recently used entries are deleted.
+
+        The database and version of each entry are kept in a small file next to the graph, and the index is
+        read from these files. Files are only ever replaced atomically, such that several processes
+        can share a cache folder.
+
+        Parameters
+        ----------
+        folder: str
+            Cache folder
+        max_size: int
+            Maximum size of the cache in bytes
+        """
+        self.folder = check_create_folder(folder, create_folder=True)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.max_size = max_size
+
+    @staticmethod
+    def make_key(arguments, version):
+        """
+        Stable hash of conditioning arguments and database version
+
+        Parameters
+        ----------
+        arguments: dict
+            JSON serializable (after conversion to str) description of the conditioning
+        version: tuple
+            (database, version) as returned by the version_stamp of the database
+        """
+        text = json.dumps({'arguments': arguments, 'version': list(version)}, sort_keys=True, default=str)
+        return hash_string(text, hash_factory="blake2")[0:32]
+
+    def filename(self, key):
+        return os.path.join(self.folder, "{}.npz".format(key))
+
+    def index_filename(self, key):
+        return os.path.join(self.folder, "{}.json".format(key))
+
+    def load_index(self):
+        """
+        Reads the database and version of all entries whose graph exists
+
+        Returns
+        -------
+        dict {key: {database: x, version: x}}
+        """
+        index = {}
+        for filename in glob.glob(os.path.join(self.folder, "*.json")):
+            key = os.path.splitext(os.path.basename(filename))[0]
+            if not os.path.exists(self.filename(key)):
+                continue
+            try:
+                with open(filename, "r") as f:
+                    index[key] = json.load(f)
+            except (ValueError, OSError):
+                # Removed by another process
+                logging.debug("Could not read graph cache index entry {}".format(filename))
+        return index
+
+    def __replace_file(self, filename, write):
+        """
+        Writes a file under a temporary name unique to the writer, and then moves it into place, such that
+        readers never see partial files
+
+        Parameters
+        ----------
+        filename: str
+        write: function
+            Writes the content to an open binary file
+        """
+        fd, tmp_filename = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+
+    def get(self, key):
+        """
+        Returns the cached graph and its metadata, or None if not cached
+
+        Returns
+        -------
+        (nx.DiGraph or sparse_graph, dict) or None
+        """
+        filename = self.filename(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with np.load(filename, allow_pickle=False) as data:
+                arrays = {x: data[x] for x in data.files}
+        except (ValueError, OSError, KeyError):
+            logging.warning("Could not read cached graph {}, removing".format(filename))
+            self.remove(key)
+            return None
+        # Mark as recently used
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        metadata = json.loads(str(arrays.pop('metadata')))
+        logging.info("Loaded conditioned graph from cache {}".format(filename))
+        if str(arrays.get('graph_type', "networkx")) == "sparse":
+            return sparse_graph.from_arrays(arrays), metadata
+        return arrays_to_graph(arrays), metadata
+
+    def put(self, key, graph, version, metadata=None):
+        """
+        Adds a graph to the cache
+
+        Parameters
+        ----------
+        key: str
+            As returned by make_key
+        graph: nx.DiGraph or sparse_graph
+        version: tuple
+            (database, version), used to delete outdated entries of the same database
+        metadata: dict
+            JSON serializable information to return with the graph
+        """
+        if isinstance(graph, sparse_graph):
+            arrays = graph.to_arrays()
+        else:
+            arrays = graph_to_arrays(graph)
+        arrays['metadata'] = np.array(json.dumps(metadata if metadata is not None else {}, default=str))
+        database, db_version = [str(x) for x in version]
+        # Index entry first, such that every graph in the folder can be found in the index
+        entry = json.dumps({'database': database, 'version': db_version}).encode("utf-8")
+        self.__replace_file(self.index_filename(key), lambda f: f.write(entry))
+        self.__replace_file(self.filename(key), lambda f: np.savez_compressed(f, **arrays))
+
+        index = self.load_index()
+        outdated = [k for k, v in index.items() if v['database'] == database and v['version'] != db_version]
+        for k in outdated:
+            logging.debug("Removing outdated cached graph {}".format(k))
+            self.remove(k)
+        self.evict(keep=key)
+
+    def remove(self, key):
+        for filename in [self.filename(key), self.index_filename(key)]:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                # Removed by another process
+                pass
+
+    def evict(self, keep=None):
+        """
+        Deletes least recently used entries until the cache is smaller than max_size
+
+        Parameters
+        ----------
+        keep: str
+            Key of an entry that is not deleted, usually the one just added
+        """
+        files = []
+        for filename in glob.glob(os.path.join(self.folder, "*.npz")):
+            try:
+                files.append((os.path.getmtime(filename), os.path.getsize(filename), filename))
+            except OSError:
+                # Removed by another process
+                pass
+        files = sorted(files)
+        total = sum([x[1] for x in files])
+        files = [x for x in files if x[2] != self.filename(keep)] if keep is not None else files[:-1]
+        while total > self.max_size and len(files) > 0:
+            _, size, filename = files.pop(0)
+            logging.debug("Evicting cached graph {}".format(filename))
+            self.remove(os.path.splitext(os.path.basename(filename))[0])
+            total -= size
+
+    def clear(self):
+        for filename in glob.glob(os.path.join(self.folder, "*.npz")) + glob.glob(
+                os.path.join(self.folder, "*.json")):
+            os.remove(filename)
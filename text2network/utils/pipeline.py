@@ -0,0 +1,103 @@
+import logging
+import queue
+import threading
+
+# Marks the end of a stream in the queues
+_END = object()
+
+
+def _put(q, item, stop_event, timeout=0.1):
+    """Blocking put that gives up once the pipeline is stopped"""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop_event, timeout=0.1):
+    """Blocking get that returns the end marker once the pipeline is stopped"""
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=timeout)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def run_pipeline(source, stages, queue_size=2):
+    """
+    Runs the items of an iterable through a chain of stages, each in its own thread.
+
+    Stages are connected by bounded queues, such that a slow stage holds back the stages before it.
+    The results of the last stage are yielded in order to the calling thread, which therefore acts as
+    the final stage of the pipeline.
+    If any stage raises, all threads are stopped and the exception is re-raised in the calling thread.
+    Close the generator (e.g. with contextlib.closing) if the caller stops iterating early.
+
+    Parameters
+    ----------
+    source: iterable
+        Items to process, e.g. a DataLoader. Iterated in its own thread.
+    stages: list
+        List of functions, each taking the output of the previous one
+    queue_size: int
+        Maximum number of items waiting between two stages
+
+    Returns
+    -------
+    Generator of the outputs of the last stage
+    """
+    stop_event = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+
+    def produce():
+        try:
+            for item in source:
+                if not _put(queues[0], item, stop_event):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            _put(queues[0], _END, stop_event)
+
+    def work(stage, q_in, q_out):
+        try:
+            while True:
+                item = _get(q_in, stop_event)
+                if item is _END:
+                    break
+                if not _put(q_out, stage(item), stop_event):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            _put(q_out, _END, stop_event)
+
+    threads = [threading.Thread(target=produce, name="pipeline-source", daemon=True)]
+    threads.extend([threading.Thread(target=work, args=(stage, queues[i], queues[i + 1]),
+                                     name="pipeline-stage-{}".format(i), daemon=True)
+                    for i, stage in enumerate(stages)])
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = _get(queues[-1], stop_event)
+            if item is _END:
+                break
+            yield item
+    finally:
+        # Also reached if the caller closes the generator
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+    if len(errors) > 0:
+        logging.error("Pipeline stopped due to error: {}".format(errors[0]))
+        raise errors[0]
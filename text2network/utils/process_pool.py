@@ -0,0 +1,43 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def map_ordered(function, items, workers=1, **kwargs):
+    """
+    Yields function(item, **kwargs) for each item, in the order of items.
+
+    With more than one worker, items are processed in a pool of processes, with at most twice as many items
+    submitted as there are workers, such that items are only created, and results only held, when needed.
+    Otherwise, items are processed one after the other in the calling process.
+
+    Parameters
+    ----------
+    function: callable
+        Module-level function, or method of a picklable object
+    items: iterable
+        Arguments to pass to function, may be a generator
+    workers: int, optional
+        Number of processes. None for the number of CPUs. The default is 1.
+    kwargs:
+        Passed to function
+
+    Returns
+    -------
+    Generator of results
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    if workers <= 1:
+        for item in items:
+            yield function(item, **kwargs)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(function, item, **kwargs))
+            if len(futures) >= 2 * workers:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
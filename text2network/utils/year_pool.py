@@ -0,0 +1,65 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Network of the current worker process, created once by _init_worker
+_worker_network = None
+
+
+def _init_worker(network_class, arguments):
+    global _worker_network
+    _worker_network = network_class(**arguments)
+
+
+def _run_year(function, year, kwargs):
+    _worker_network.decondition()
+    return function(_worker_network, year, **kwargs)
+
+
+def map_years(snw, function, years, workers=1, **kwargs):
+    """
+    Runs function(network, year, **kwargs) for each year, where each call conditions the network anew.
+
+    With more than one worker, years are processed in a pool of processes, each of which creates its own
+    network, and therefore database connection, from the arguments snw was created with.
+    The number of workers thus also limits the number of concurrent connections to the database.
+    Otherwise, years are processed one after the other on snw.
+
+    Results are yielded in the order of years, independent of the order in which workers finish.
+
+    Parameters
+    ----------
+    snw: semantic network
+    function: callable
+        Module-level function taking a deconditioned network and a year (or window), such that it can be pickled
+    years: list
+        Years, or other arguments, to pass to function
+    workers: int, optional
+        Number of processes. None for the number of CPUs. The default is 1.
+    kwargs:
+        Passed to function
+
+    Returns
+    -------
+    Generator of tuples (year, result)
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, len(years)))
+    arguments = getattr(snw, "init_arguments", None)
+    if workers > 1 and (arguments is None or not isinstance(arguments.get('backend'), (str, type(None)))):
+        logging.warning("Network can not be recreated in worker processes, processing years sequentially")
+        workers = 1
+
+    if workers == 1:
+        for year in years:
+            snw.decondition()
+            yield year, function(snw, year, **kwargs)
+        return
+
+    logging.info("Processing {} years in {} processes".format(len(years), workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(snw.__class__, arguments)) as executor:
+        futures = [executor.submit(_run_year, function, year, kwargs) for year in years]
+        for year, future in zip(years, futures):
+            yield year, future.result()